@@ -1,166 +1,101 @@
 #!/usr/bin/env python3
 """
-Extract missing branches (ID > 3812) from MySQL dump and prepare for Firebase import
+Extract branches missing from Firebase out of a MySQL dump and prepare them for import.
+
+By default the missing IDs are found by listing tbl_branchinfo document IDs
+from Firestore (keys only) and comparing them with the dump; --min-id N
+restores the old offline cut-off (every branch with ID > N).
 """
 
-import re
+import argparse
 import json
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "tools"))
+
+from marga_tools.firestore import iter_document_ids, parse_firebase_config  # noqa: E402
+from marga_tools.gaps import IdSet, compare, in_ranges  # noqa: E402
+from marga_tools.geoindex import GridIndex, branch_points  # noqa: E402
+from marga_tools.metrics import METRICS  # noqa: E402
+from marga_tools.mysqldump import iter_typed_rows  # noqa: E402
+from marga_tools.neardup import find_duplicates, print_summary  # noqa: E402
 
 # Configuration
 SQL_FILE = "/Users/mike/Downloads/Dump20251229 (2) (1).sql"
 OUTPUT_FILE = "/Volumes/Wotg Drive Mike/GitHub/Marga-App/missing_branches.json"
-MIN_BRANCH_ID = 3812  # Branches above this ID are missing from Firebase
+FIREBASE_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shared", "js", "firebase-config.js")
+
+def extract_branchinfo_from_sql(sql_file, keep=None):
+    """Extract tbl_branchinfo rows from SQL dump (only IDs where keep(id) is true, if given)
 
-def extract_branchinfo_from_sql(sql_file):
-    """Extract tbl_branchinfo INSERT statements from SQL dump"""
+    Column names and types come from the dump's CREATE TABLE, so every
+    column is kept and DECIMAL/DATE values decode by type, not by guessing.
+    """
     
     print(f"Reading SQL file: {sql_file}")
     
-    with open(sql_file, 'r', encoding='utf-8', errors='ignore') as f:
-        content = f.read()
-    
-    # Find the INSERT INTO tbl_branchinfo statement
-    pattern = r"INSERT INTO `tbl_branchinfo` VALUES (.+?);"
-    matches = re.findall(pattern, content, re.DOTALL)
-    
-    if not matches:
-        print("No INSERT INTO tbl_branchinfo found!")
-        return []
-    
-    print(f"Found {len(matches)} INSERT statement(s)")
-    
     all_branches = []
+    for _, branch in iter_typed_rows(sql_file, ["tbl_branchinfo"]):
+        if keep is None or keep(branch.get('id') or 0):
+            all_branches.append(branch)
     
-    for match in matches:
-        # Parse the VALUES - each record is in parentheses
-        # Values format: (id,company_id,'branchname','street','bldg','floor','landmark','room','city',area_id,'email',...)
-        
-        # Split by "),(" but be careful with strings containing these characters
-        records_str = match
-        
-        # Use regex to find each record
-        record_pattern = r'\((\d+),(\d+),([^)]+)\)'
-        
-        # Actually, let's parse more carefully
-        # The values are comma-separated, but strings can contain commas
-        # Let's extract each tuple
-        
-        current_pos = 0
-        while current_pos < len(records_str):
-            # Find the start of a record
-            if records_str[current_pos] == '(':
-                # Find matching closing parenthesis
-                depth = 1
-                start = current_pos + 1
-                pos = start
-                in_string = False
-                escape_next = False
-                
-                while pos < len(records_str) and depth > 0:
-                    char = records_str[pos]
-                    
-                    if escape_next:
-                        escape_next = False
-                    elif char == '\\':
-                        escape_next = True
-                    elif char == "'" and not escape_next:
-                        in_string = not in_string
-                    elif not in_string:
-                        if char == '(':
-                            depth += 1
-                        elif char == ')':
-                            depth -= 1
-                    
-                    pos += 1
-                
-                record_str = records_str[start:pos-1]
-                
-                # Parse this record
-                branch = parse_branch_record(record_str)
-                if branch and branch.get('id', 0) > MIN_BRANCH_ID:
-                    all_branches.append(branch)
-                
-                current_pos = pos
-            else:
-                current_pos += 1
+    if not all_branches and keep is None:
+        print("No INSERT INTO tbl_branchinfo found!")
     
     return all_branches
 
-def parse_branch_record(record_str):
-    """Parse a single branch record string into a dictionary"""
-    
-    # Fields based on typical tbl_branchinfo structure:
-    # id, company_id, branchname, street, bldg, floor, landmark, room, brgy, city, area_id, 
-    # email, latitude, longitude, intrvl, no_netcon_spoilage, inactive, earliest, 
-    # address_type, code, isurgent, signatory, designation, branch_address, city_id
-    
-    values = []
-    current_value = ''
-    in_string = False
-    escape_next = False
-    
-    for char in record_str:
-        if escape_next:
-            current_value += char
-            escape_next = False
-        elif char == '\\':
-            escape_next = True
-            current_value += char
-        elif char == "'" :
-            if in_string:
-                in_string = False
-            else:
-                in_string = True
-        elif char == ',' and not in_string:
-            values.append(current_value.strip())
-            current_value = ''
-        else:
-            current_value += char
-    
-    # Don't forget the last value
-    values.append(current_value.strip())
-    
-    # Clean up values
-    cleaned = []
-    for v in values:
-        v = v.strip()
-        if v == 'NULL':
-            cleaned.append(None)
-        elif v.startswith("'") and v.endswith("'"):
-            cleaned.append(v[1:-1].replace("\\'", "'").replace("\\\\", "\\"))
-        else:
-            try:
-                if '.' in v:
-                    cleaned.append(float(v))
-                else:
-                    cleaned.append(int(v))
-            except:
-                cleaned.append(v)
-    
-    # Map to field names (adjust based on actual table structure)
-    field_names = [
-        'id', 'company_id', 'branchname', 'street', 'bldg', 'floor', 'landmark', 
-        'room', 'brgy', 'city', 'area_id', 'email', 'latitude', 'longitude', 
-        'intrvl', 'no_netcon_spoilage', 'inactive', 'earliest', 'address_type',
-        'code', 'isurgent', 'signatory', 'designation', 'branch_address', 'city_id'
-    ]
-    
-    branch = {}
-    for i, name in enumerate(field_names):
-        if i < len(cleaned):
-            branch[name] = cleaned[i]
-    
-    return branch
-
 def main():
+    parser = argparse.ArgumentParser(description="Extract missing tbl_branchinfo rows from a MySQL dump")
+    parser.add_argument("--sql", default=SQL_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--min-id", type=int, default=None, help="Skip the Firestore check and take every branch with ID above this")
+    parser.add_argument("--collection", default="tbl_branchinfo", help="Firestore collection to compare against")
+    parser.add_argument("--geo-index", default="", help="Also save a spatial grid index of every dump branch with coordinates here (see marga_tools.geoindex)")
+    parser.add_argument("--dedup-report", default="", help="Also write a near-duplicate branch report over the whole dump here (see marga_tools.neardup)")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
+    args = parser.parse_args()
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
+
     print("=" * 60)
     print("Extracting Missing Branches from MySQL Dump")
     print("=" * 60)
     
-    branches = extract_branchinfo_from_sql(SQL_FILE)
+    METRICS.start_phase("extract")
+    whole_dump = args.geo_index or args.dedup_report
+    if args.min_id is not None and not whole_dump:
+        branches = extract_branchinfo_from_sql(args.sql, keep=lambda branch_id: branch_id > args.min_id)
+    else:
+        branches = extract_branchinfo_from_sql(args.sql)
+    if args.geo_index:
+        # Indexed over the whole dump, not just the missing branches.
+        METRICS.start_phase("geo index")
+        index = GridIndex.build(branch_points(branches))
+        index.save(args.geo_index)
+        print(f"Spatial index of {len(index)} branches ({len(index.keys)} cells) saved to: {args.geo_index}")
+    if args.dedup_report:
+        METRICS.start_phase("dedup")
+        dedup = find_duplicates(branches)
+        print_summary(dedup)
+        with open(args.dedup_report, 'w', encoding='utf-8') as f:
+            json.dump(dedup, f, indent=2, ensure_ascii=False, default=str)
+        print(f"Near-duplicate report saved to: {args.dedup_report}")
+    if args.min_id is not None:
+        branches = [b for b in branches if (b.get('id') or 0) > args.min_id]
+        label = f"with ID > {args.min_id}"
+    else:
+        METRICS.start_phase("firestore ids")
+        api_key, base_url = parse_firebase_config(FIREBASE_CONFIG)
+        report = compare("tbl_branchinfo", args.collection, IdSet(b.get('id') for b in branches), IdSet(iter_document_ids(base_url, api_key, args.collection)))
+        missing = in_ranges(report.missing)
+        branches = [b for b in branches if isinstance(b.get('id'), int) and missing(b['id'])]
+        label = f"missing from {args.collection} ({len(report.missing)} ID ranges, {report.extra_count} docs not in the dump)"
+    METRICS.start_phase("write")
     
-    print(f"\nFound {len(branches)} branches with ID > {MIN_BRANCH_ID}")
+    print(f"\nFound {len(branches)} branches {label}")
     
     if branches:
         # Sort by ID
@@ -177,10 +112,10 @@ def main():
             print(f"  ID {b.get('id')}: {b.get('branchname')} (Company: {b.get('company_id')})")
         
         # Save to JSON
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+        with open(args.output, 'w', encoding='utf-8') as f:
             json.dump(branches, f, indent=2, ensure_ascii=False)
         
-        print(f"\nSaved to: {OUTPUT_FILE}")
+        print(f"\nSaved to: {args.output}")
         print(f"Total branches to import: {len(branches)}")
     else:
         print("No missing branches found!")
@@ -10,12 +10,10 @@ from __future__ import annotations
 import argparse
 import datetime as dt
 import json
-import math
 import re
 import sys
 import unicodedata
 import urllib.parse
-import urllib.request
 import zipfile
 import xml.etree.ElementTree as ET
 from pathlib import Path
@@ -25,6 +23,12 @@ try:
 except ModuleNotFoundError:  # pragma: no cover - local fallback path
     load_workbook = None
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "tools"))
+
+from marga_tools import codec, firestore  # noqa: E402
+from marga_tools.metrics import METRICS  # noqa: E402
+from marga_tools.synchash import is_current, stamp  # noqa: E402
+
 
 DEFAULT_API = "http://127.0.0.1:9100/margabase-api/v1/projects/sah-spiritual-journal/databases/(default)/documents"
 DEFAULT_KEY = "margabase-local"
@@ -42,77 +46,27 @@ ALIASES = {
     "john bonifacio iballo": ["rod ryan entereso", "john bonifacio iballo"],
 }
 
+# The patch covers only payroll fields, so its stamp lives beside the
+# whole-document one (`_sync_payroll_hash`) instead of replacing it.
+SYNC_SCOPE = "payroll"
+VOLATILE_FIELDS = ("payroll_rate_updated_at",)
+
 PREFERRED_DOC_IDS = {
     "pineda irene": "268",
     "toledo jemuel": "274",
 }
 
 
-def decode_value(value):
-    if not isinstance(value, dict):
-        return None
-    if "stringValue" in value:
-        return value["stringValue"]
-    if "integerValue" in value:
-        return int(value["integerValue"])
-    if "doubleValue" in value:
-        return float(value["doubleValue"])
-    if "booleanValue" in value:
-        return bool(value["booleanValue"])
-    if "nullValue" in value:
-        return None
-    if "arrayValue" in value:
-        return [decode_value(item) for item in value.get("arrayValue", {}).get("values", [])]
-    if "mapValue" in value:
-        return {key: decode_value(item) for key, item in value.get("mapValue", {}).get("fields", {}).items()}
-    return value
-
-
 def encode_value(value):
-    if value is None:
-        return {"nullValue": None}
-    if isinstance(value, bool):
-        return {"booleanValue": value}
-    if isinstance(value, int):
-        return {"integerValue": str(value)}
-    if isinstance(value, float):
-        if not math.isfinite(value):
-            return {"nullValue": None}
-        if value.is_integer():
-            return {"integerValue": str(int(value))}
-        return {"doubleValue": value}
-    return {"stringValue": str(value)}
+    return codec.encode_value(value, coerce_integral_floats=True)
 
 
 def request_json(url, method="GET", body=None):
-    payload = None
-    headers = {}
-    if body is not None:
-        payload = json.dumps(body).encode("utf-8")
-        headers["Content-Type"] = "application/json"
-    req = urllib.request.Request(url, data=payload, headers=headers, method=method)
-    with urllib.request.urlopen(req, timeout=30) as response:
-        if response.status == 204:
-            return {}
-        return json.load(response)
+    return firestore.request_json(url, method=method, payload=body, timeout=30)
 
 
 def fetch_collection(api_base, key, collection):
-    rows = []
-    token = ""
-    while True:
-        params = {"pageSize": "1000", "key": key}
-        if token:
-            params["pageToken"] = token
-        url = f"{api_base.rstrip('/')}/{collection}?{urllib.parse.urlencode(params)}"
-        data = request_json(url)
-        for document in data.get("documents", []):
-            row = {name: decode_value(value) for name, value in document.get("fields", {}).items()}
-            row["_docId"] = document["name"].split("/")[-1]
-            rows.append(row)
-        token = data.get("nextPageToken") or ""
-        if not token:
-            return rows
+    return firestore.fetch_collection(api_base.rstrip("/"), key, collection)
 
 
 def employee_name(employee):
@@ -371,10 +325,18 @@ def main():
     parser.add_argument("--source-label", default=SOURCE_LABEL)
     parser.add_argument("--effective-cutoff", default=EFFECTIVE_CUTOFF)
     parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings and request metrics here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
     args = parser.parse_args()
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
 
+    METRICS.start_phase("read workbook")
     workbook_rows = read_workbook_rows(args.workbook)
+    METRICS.start_phase("fetch tbl_employee")
     employees = fetch_collection(args.api_base, args.api_key, "tbl_employee")
+    METRICS.start_phase("match and patch")
     employees_by_name = {}
     for employee in employees:
         employees_by_name.setdefault(normalize_name(employee_name(employee)), []).append(employee)
@@ -387,7 +349,7 @@ def main():
         "effective_cutoff": args.effective_cutoff,
         "updated_at": updated_at,
         "rows": [],
-        "summary": {"workbook_rows": len(workbook_rows), "matched": 0, "updated": 0, "missing": 0},
+        "summary": {"workbook_rows": len(workbook_rows), "matched": 0, "updated": 0, "unchanged": 0, "missing": 0},
     }
 
     for row in workbook_rows:
@@ -441,12 +403,17 @@ def main():
             if row.get(optional_key) is not None:
                 patch_fields[optional_key] = row[optional_key]
         entry["patch_fields"] = patch_fields
-        if not args.dry_run:
+        if is_current(employee, patch_fields, exclude=VOLATILE_FIELDS, scope=SYNC_SCOPE):
+            report["summary"]["unchanged"] += 1
+            entry["status"] = "unchanged"
+        elif not args.dry_run:
+            stamp(patch_fields, f"payroll:{args.source_label}", exclude=VOLATILE_FIELDS, scope=SYNC_SCOPE)
             patch_employee(args.api_base, args.api_key, employee["_docId"], patch_fields)
             report["summary"]["updated"] += 1
             entry["status"] = "updated"
         report["rows"].append(entry)
 
+    METRICS.start_phase("write report")
     report_path = Path(args.report)
     report_path.parent.mkdir(parents=True, exist_ok=True)
     report_path.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
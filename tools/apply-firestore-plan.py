@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Apply a change plan written by a tools/ script's --plan mode.
+
+The plan is streamed through the batched, concurrent writer, so nothing is
+re-fetched, re-matched or re-hashed. Updates go first. Deletes follow in a
+second pass, and only once every update in the plan has been applied, so a
+legacy doc is never deleted while the write replacing it is missing.
+Deletes that Firestore forbids fall back to the plan's retire fields.
+
+The plan's predicted writes, deletes and bytes are printed first. Its
+actual spend is printed at the end. --max-writes caps the ops applied (see
+marga_tools.cost for the ranking); with --journal, a later --resume run
+continues with the deferred ops.
+
+Usage:
+  python3 tools/reconcile-employees-single-source.py --plan /tmp/reconcile.plan.ndjson
+  python3 tools/apply-firestore-plan.py /tmp/reconcile.plan.ndjson
+  python3 tools/apply-firestore-plan.py /tmp/reconcile.plan.ndjson --journal /tmp/reconcile.apply.ndjson --resume
+  python3 tools/apply-firestore-plan.py /tmp/reconcile.plan.ndjson --journal /tmp/reconcile.apply.ndjson --max-writes 15000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+from typing import Any
+
+from marga_tools import firestore
+from marga_tools.changeset import PlanError, iter_plan, read_plan_header, verify_plan
+from marga_tools.cost import plan_cost, select_ops, spent
+from marga_tools.firestore import CODE_FAILED_PRECONDITION, CODE_PERMISSION_DENIED, BulkWriter, WriteResult, parse_firebase_config
+from marga_tools.journal import JournalMismatch, RunJournal
+from marga_tools.metrics import METRICS
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Apply a serialized Firestore change plan")
+    parser.add_argument("plan", help="Plan NDJSON written by --plan")
+    parser.add_argument("--batch-size", type=int, default=200, help="Writes per :batchWrite call (max 500)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent :batchWrite calls")
+    parser.add_argument("--journal", default="", help="Record applied ops here so a failed apply can --resume")
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument("--dry-run", action="store_true", help="Verify and summarize the plan without writing")
+    parser.add_argument("--max-writes", type=int, default=None, help="Apply at most this many ops (deletes included), highest-ranked first")
+    parser.add_argument("--insecure", action="store_true")
+    parser.add_argument("--gzip-requests", action="store_true", help="Gzip large request bodies (Firestore accepts them; some proxies do not)")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings and request metrics here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
+    args = parser.parse_args()
+    firestore.INSECURE_TLS = args.insecure
+    firestore.GZIP_REQUEST_BODIES = args.gzip_requests
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
+
+    try:
+        header = read_plan_header(args.plan)
+        end = verify_plan(args.plan)
+    except PlanError as err:
+        print(str(err), file=sys.stderr)
+        return 2
+    print(f"Plan from {header.get('source')} ({header.get('created_at')}): {end['ops']} ops, digest {end['digest'][:16]}")
+    print(plan_cost(iter_plan(args.plan)).line("Predicted"))
+    if args.dry_run:
+        counts: dict[str, int] = {}
+        for op in iter_plan(args.plan):
+            key = f"{op['op']} {op['collection']}"
+            counts[key] = counts.get(key, 0) + 1
+        for key, count in sorted(counts.items()):
+            print(f"- {key}: {count}")
+        if args.max_writes is not None:
+            _, kept, deferred = select_ops(iter_plan(args.plan), args.max_writes)
+            print(f"With --max-writes {args.max_writes}: {kept.operations} ops applied, {deferred.operations} deferred")
+        return 0
+
+    api_key, base_url = parse_firebase_config("shared/js/firebase-config.js")
+    try:
+        journal = RunJournal(args.journal, meta={"plan": args.plan, "digest": end["digest"]}, resume=args.resume, inputs=("digest",)) if args.journal else None
+    except JournalMismatch:
+        print(f"Journal {args.journal} belongs to a different plan", file=sys.stderr)
+        return 2
+
+    fallbacks: list[tuple[dict[str, Any], dict[str, Any]]] = []
+    retired = 0
+
+    def on_result(result: WriteResult) -> None:
+        op = result.tag
+        if result.ok:
+            if journal:
+                journal.record(op["collection"], op["id"], op["hash"])
+        elif result.code == CODE_PERMISSION_DENIED and op.get("fallback"):
+            fallbacks.append((op, op["fallback"]))
+
+    def applied(op: dict[str, Any]) -> bool:
+        return journal is not None and journal.is_applied(op["collection"], op["id"], op["hash"])
+
+    selected, _, deferred = select_ops(iter_plan(args.plan), args.max_writes, skip=applied)
+    if deferred.operations:
+        print(f"--max-writes {args.max_writes}: deferring {deferred.operations} lower-ranked ops" + (" (--resume with this journal to apply them later)" if journal else ""))
+
+    METRICS.start_phase("apply updates")
+    skipped = 0
+    deletes: set[int] = set()
+    updates_left = 0
+    with BulkWriter(base_url, api_key, batch_size=args.batch_size, workers=args.workers, on_result=on_result) as writer:
+        for index, op in enumerate(iter_plan(args.plan)):
+            if applied(op):
+                skipped += 1
+                continue
+            if selected is not None and index not in selected:
+                updates_left += op["op"] != "delete"
+                continue
+            if op["op"] == "delete":
+                deletes.add(index)
+            else:
+                writer.update(op["collection"], op["id"], op["fields"], mask=op.get("mask"), precondition=op.get("precondition"), encoded=True, tag=op)
+        writer.wait()
+        # Deletes retire what the updates replace (marga_users by
+        # tbl_employee), so they go only once every update has landed.
+        updates_left += len(writer.failures)
+        if deletes and not updates_left:
+            METRICS.start_phase("apply deletes")
+            for index, op in enumerate(iter_plan(args.plan)):
+                if index in deletes:
+                    writer.delete(op["collection"], op["id"], precondition=op.get("precondition"), tag=op)
+    held = len(deletes) if updates_left else 0
+
+    if fallbacks:
+        with BulkWriter(base_url, api_key, batch_size=args.batch_size, workers=args.workers, on_result=on_result) as fallback_writer:
+            for op, fallback in fallbacks:
+                fallback_writer.update(op["collection"], op["id"], fallback["fields"], mask=fallback.get("mask"), encoded=True, tag={**op, "fallback": None})
+                retired += 1
+        writer.failures = [failure for failure in writer.failures if failure.code != CODE_PERMISSION_DENIED or not failure.tag.get("fallback")]
+        writer.failures += fallback_writer.failures
+        writer.written += fallback_writer.written
+
+    if journal:
+        journal.close()
+    conflicts = [failure for failure in writer.failures if failure.code == CODE_FAILED_PRECONDITION]
+    print(f"Applied {writer.written} writes ({skipped} already applied, {retired} deletes retired instead" + (f", {deferred.operations} deferred by --max-writes" if deferred.operations else "") + ").")
+    if held:
+        print(f"Held back {held} deletes: {updates_left} updates failed or were deferred. Apply them (--resume with a journal) before the deletes go.")
+    print(spent().line("Actual"))
+    if conflicts:
+        print(f"{len(conflicts)} docs changed since the plan was made; re-plan to pick up their current state:")
+        for failure in conflicts[:20]:
+            print(f"- {failure.collection}/{failure.doc_id}")
+    others = [failure for failure in writer.failures if failure.code != CODE_FAILED_PRECONDITION]
+    for failure in others[:20]:
+        print(f"- {failure.op} {failure.collection}/{failure.doc_id} failed (code {failure.code}): {failure.message}")
+    return 1 if writer.failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,7 @@
+"""Shared helpers for the MARGA Python sync tools in tools/ and scripts/.
+
+The hyphenated scripts stay runnable on their own (`python3 tools/<name>.py`);
+anything two or more of them need lives here instead of being copied.
+`python3 -m marga_tools` runs any of them, chained, in one process (see
+marga_tools.cli).
+"""
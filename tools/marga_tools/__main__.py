@@ -0,0 +1,5 @@
+"""`python3 -m marga_tools`: the unified command line (see marga_tools.cli)."""
+
+from marga_tools.cli import main
+
+raise SystemExit(main())
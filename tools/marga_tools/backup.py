@@ -0,0 +1,383 @@
+"""Streaming, compressed collection backups and a deduplicating backup store.
+
+A backup is NDJSON compressed with gzip (`.ndjson.gz`) or, when the
+`zstandard` package is installed, zstd (`.ndjson.zst`). The first line is a
+`{"type": "backup", ...}` header and every following line is one document
+exactly as Firestore returned it:
+
+  {"collection": "tbl_employee", "id": "12", "updateTime": "...", "fields": {...}}
+
+Documents are written as pages arrive, so a backup never holds a whole
+collection (or a giant JSON string of it) in memory. A closing
+`{"type": "end", "documents": N, ...}` line is written only when the run
+finished. Readers raise BackupError on a backup without it, so a run that
+died mid-fetch can never be restored as if it were complete; such a run is
+left renamed to `*.partial.ndjson.*`.
+"""
+
+from __future__ import annotations
+
+import gzip
+import io
+import itertools
+import json
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Iterator, TextIO
+
+try:
+    import zstandard
+except ModuleNotFoundError:  # pragma: no cover - zstd is optional
+    zstandard = None
+
+from marga_tools.firestore import fs_fields
+from marga_tools.journal import content_hash
+
+
+class BackupError(RuntimeError):
+    pass
+
+
+_PACK_DONE = object()
+
+
+def _open_text(path: Path, mode: str) -> TextIO:
+    """Open for reading ("r"), writing ("w") or writing a file that must not exist yet ("x")."""
+    if path.suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError("zstd backups need the 'zstandard' package; use a .gz path instead")
+        if mode == "r":
+            raw = zstandard.ZstdDecompressor().stream_reader(path.open("rb"))
+        else:
+            raw = zstandard.ZstdCompressor(level=10).stream_writer(path.open(mode + "b"))
+        return io.TextIOWrapper(raw, encoding="utf-8")
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8") if mode == "r" else gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6)
+    return path.open(mode, encoding="utf-8")
+
+
+class BackupWriter:
+    def __init__(self, path: str | Path, **meta: Any) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.counts: dict[str, int] = {}
+        self._fh = _open_text(self.path, "w")
+        self._fh.write(json.dumps({"type": "backup", "version": 1, **meta}, ensure_ascii=False) + "\n")
+
+    def add(self, collection: str, raw_doc: dict[str, Any]) -> None:
+        """Append one raw Firestore REST document (`name`, `fields`, `updateTime`)."""
+        entry = {
+            "collection": collection,
+            "id": str(raw_doc.get("name", "")).split("/")[-1],
+            "updateTime": raw_doc.get("updateTime"),
+            "fields": raw_doc.get("fields") or {},
+        }
+        self._fh.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.counts[collection] = self.counts.get(collection, 0) + 1
+
+    def sink(self, collection: str):
+        return lambda raw_doc: self.add(collection, raw_doc)
+
+    def close(self) -> None:
+        """Finish the backup: its end record marks it complete."""
+        if not self._fh.closed:
+            self._fh.write(json.dumps(_end_record(self.counts)) + "\n")
+            self._fh.close()
+
+    def abort(self) -> None:
+        """Close an unfinished backup without an end record, renamed to `*.partial.ndjson.*`."""
+        if self._fh.closed:
+            return
+        self._fh.close()
+        partial = self.path.with_name(self.path.name.replace(".ndjson", ".partial.ndjson", 1))
+        os.replace(self.path, partial)
+        self.path = partial
+
+    def __enter__(self) -> "BackupWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _records(path: Path) -> Iterator[dict[str, Any]]:
+    """Parsed lines of an NDJSON file; BackupError if it is cut short."""
+    try:
+        with _open_text(path, "r") as fh:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+    except (EOFError, json.JSONDecodeError) as err:
+        raise BackupError(f"{path} is truncated or corrupt: {err}") from err
+
+
+def _end_record(counts: dict[str, int]) -> dict[str, Any]:
+    return {"type": "end", "documents": sum(counts.values()), "counts": counts}
+
+
+def _check_end(path: Path, end: dict[str, Any] | None, documents: int) -> None:
+    if end is None:
+        raise BackupError(f"{path} has no end record; the backup run did not finish")
+    if end.get("documents") != documents:
+        raise BackupError(f"{path} holds {documents} documents but its end record says {end.get('documents')}")
+
+
+def iter_backup(path: str | Path) -> Iterator[dict[str, Any]]:
+    """Yield backup entries with Firestore-encoded `fields`.
+
+    Also reads the older single-file `firebase-user-migration-backup-*.json`
+    layout, whose documents hold decoded values. Raises BackupError at the
+    end of a backup that has no end record; `verify_backup` checks first.
+    """
+    path = Path(path)
+    if path.suffix == ".json":
+        legacy = json.loads(path.read_text(encoding="utf-8"))
+        for collection, docs in legacy.items():
+            if not isinstance(docs, list):
+                continue
+            for doc in docs:
+                fields = {key: value for key, value in doc.items() if key != "_docId"}
+                yield {"collection": collection, "id": str(doc.get("_docId") or ""), "updateTime": None, "fields": fs_fields(fields)}
+        return
+    end = None
+    documents = 0
+    for entry in _records(path):
+        if entry.get("type") == "backup":
+            continue
+        if entry.get("type") == "end":
+            end = entry
+            continue
+        documents += 1
+        yield entry
+    _check_end(path, end, documents)
+
+
+class BackupStore:
+    """Content-addressed backup store shared by every run.
+
+    Layout under `root`:
+      packs/<run>.ndjson.gz      document versions first seen in that run, `{"hash", "fields"}`
+      index.ndjson               `{"hash", "pack"}` for every stored version
+      manifests/<run>.ndjson.gz  the run's point-in-time view, `{"collection", "id", "updateTime", "hash"}`
+
+    A document version is stored once no matter how many runs see it, so a
+    run costs a manifest line per document plus only the versions that changed.
+    """
+
+    def __init__(self, root: str | Path) -> None:
+        self.root = Path(root)
+        self.index_path = self.root / "index.ndjson"
+        self.pack_of: dict[str, str] = {}
+        if self.index_path.exists():
+            with self.index_path.open("r", encoding="utf-8") as fh:
+                for line in fh:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.pack_of[entry["hash"]] = entry["pack"]
+
+    def manifest_path(self, run_id: str) -> Path:
+        return self.root / "manifests" / f"{run_id}.ndjson.gz"
+
+    def pack_path(self, run_id: str) -> Path:
+        return self.root / "packs" / f"{run_id}.ndjson.gz"
+
+    def open_run(self, run_id: str, **meta: Any) -> "StoreRun":
+        """Start a run as `run_id`, or `run_id-2`, `-3`, ... if that id was used before.
+
+        An existing run is never reopened: its pack may hold objects the
+        index already points at, and rewriting it would lose them.
+        """
+        used = set(self.pack_of.values())
+        candidate, n = run_id, 1
+        while candidate in used or self.pack_path(candidate).exists() or self.manifest_path(candidate).exists():
+            n += 1
+            candidate = f"{run_id}-{n}"
+        return StoreRun(self, candidate, meta)
+
+    def manifests(self) -> list[Path]:
+        return sorted((self.root / "manifests").glob("*.ndjson.gz"))
+
+    def read_pack(self, pack: str, wanted: set[str]) -> Iterator[tuple[str, dict[str, Any]]]:
+        """Yield (hash, fields) for the `wanted` objects; BackupError if the pack lacks any."""
+        missing = set(wanted)
+        for entry in _records(self.pack_path(pack)):
+            if entry["hash"] in missing:
+                missing.discard(entry["hash"])
+                yield entry["hash"], entry["fields"]
+        if missing:
+            raise BackupError(f"Backup store pack {pack} is missing {len(missing)} indexed objects, e.g. {min(missing)}")
+
+
+class StoreRun:
+    """One run's writer into a BackupStore; duck-types with BackupWriter."""
+
+    def __init__(self, store: BackupStore, run_id: str, meta: dict[str, Any]) -> None:
+        self.store = store
+        self.run_id = run_id
+        self.path = store.manifest_path(run_id)
+        self.counts: dict[str, int] = {}
+        self.new_objects = 0
+        self.reused_objects = 0
+        self._new_hashes: list[str] = []
+        (store.root / "packs").mkdir(parents=True, exist_ok=True)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._pack_path = store.pack_path(run_id)
+        self._pack = _open_text(self._pack_path, "x")
+        self._manifest = _open_text(self.path, "x")
+        self._manifest.write(json.dumps({"type": "manifest", "version": 1, "run": run_id, **meta}, ensure_ascii=False) + "\n")
+
+    def add(self, collection: str, raw_doc: dict[str, Any]) -> None:
+        fields = raw_doc.get("fields") or {}
+        digest = content_hash(fields)
+        if digest in self.store.pack_of:
+            self.reused_objects += 1
+        else:
+            self._pack.write(json.dumps({"hash": digest, "fields": fields}, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self.store.pack_of[digest] = self.run_id
+            self._new_hashes.append(digest)
+            self.new_objects += 1
+        entry = {
+            "collection": collection,
+            "id": str(raw_doc.get("name", "")).split("/")[-1],
+            "updateTime": raw_doc.get("updateTime"),
+            "hash": digest,
+        }
+        self._manifest.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self.counts[collection] = self.counts.get(collection, 0) + 1
+
+    def sink(self, collection: str):
+        return lambda raw_doc: self.add(collection, raw_doc)
+
+    def close(self) -> None:
+        """Finish the run: index its new objects and end the manifest."""
+        if self._pack.closed:
+            return
+        # Pack first, then index, then manifest: a crash part-way leaves
+        # orphaned pack data at worst, never a manifest pointing at nothing.
+        self._pack.close()
+        with self.store.index_path.open("a", encoding="utf-8") as fh:
+            for digest in self._new_hashes:
+                fh.write(json.dumps({"hash": digest, "pack": self.run_id}) + "\n")
+        self._manifest.write(json.dumps(_end_record(self.counts)) + "\n")
+        self._manifest.close()
+
+    def abort(self) -> None:
+        """Discard an unfinished run: its pack and manifest are deleted and nothing is indexed."""
+        if self._pack.closed:
+            return
+        self._pack.close()
+        self._manifest.close()
+        for digest in self._new_hashes:
+            self.store.pack_of.pop(digest, None)
+        self._pack_path.unlink(missing_ok=True)
+        self.path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "StoreRun":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def iter_manifest(path: str | Path) -> Iterator[dict[str, Any]]:
+    """Yield a manifest's entries; BackupError at the end of one with no end record."""
+    path = Path(path)
+    end = None
+    documents = 0
+    for entry in _records(path):
+        if entry.get("type") == "manifest":
+            continue
+        if entry.get("type") == "end":
+            end = entry
+            continue
+        documents += 1
+        yield entry
+    _check_end(path, end, documents)
+
+
+def is_manifest(path: str | Path) -> bool:
+    path = Path(path)
+    if path.suffix == ".json":
+        return False
+    with _open_text(path, "r") as fh:
+        return json.loads(fh.readline() or "{}").get("type") == "manifest"
+
+
+def verify_backup(path: str | Path) -> int:
+    """Read a backup or manifest through and return its document count; BackupError if it is incomplete."""
+    entries = iter_manifest(path) if is_manifest(path) else iter_backup(path)
+    return sum(1 for _ in entries)
+
+
+def iter_manifest_documents(manifest: str | Path, workers: int = 4, buffer: int = 256) -> Iterator[dict[str, Any]]:
+    """Yield a manifest's documents as backup entries, reading packs in parallel.
+
+    Each pack is streamed by its own reader thread into a queue of at most
+    `buffer` objects, and at most `workers` packs are open at once, so
+    memory is bounded by `workers * buffer` documents however large a pack
+    grows.
+    """
+    manifest = Path(manifest)
+    store = BackupStore(manifest.parent.parent)
+    wanted: dict[str, list[dict[str, Any]]] = {}
+    for entry in iter_manifest(manifest):
+        wanted.setdefault(entry["hash"], []).append(entry)
+    by_pack: dict[str, set[str]] = {}
+    for digest in wanted:
+        pack = store.pack_of.get(digest)
+        if pack is None:
+            raise BackupError(f"Backup store {store.root} is missing object {digest}")
+        by_pack.setdefault(pack, set()).add(digest)
+
+    stop = threading.Event()
+
+    def offer(out: queue.Queue, item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def stream(pack: str, out: queue.Queue) -> None:
+        try:
+            for item in store.read_pack(pack, by_pack[pack]):
+                if not offer(out, item):
+                    return
+        finally:
+            offer(out, _PACK_DONE)
+
+    workers = max(1, workers)
+    packs = iter(sorted(by_pack))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pack-reader") as pool:
+
+        def start(pack: str) -> tuple[Future, queue.Queue]:
+            out: queue.Queue = queue.Queue(max(1, buffer))
+            return pool.submit(stream, pack, out), out
+
+        in_flight = deque(start(pack) for pack in itertools.islice(packs, workers))
+        try:
+            while in_flight:
+                reader, out = in_flight[0]
+                while (item := out.get()) is not _PACK_DONE:
+                    digest, fields = item
+                    for entry in wanted[digest]:
+                        yield {"collection": entry["collection"], "id": entry["id"], "updateTime": entry.get("updateTime"), "fields": fields}
+                # Re-raises a reader's BackupError.
+                reader.result()
+                in_flight.popleft()
+                in_flight.extend(start(pack) for pack in itertools.islice(packs, 1))
+        finally:
+            # A consumer that stops early releases any reader blocked on a full queue.
+            stop.set()
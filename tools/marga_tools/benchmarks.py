@@ -0,0 +1,410 @@
+"""Benchmarks for the shared tool helpers and the scripts' import paths.
+
+`codec` encodes and decodes tbl_employee-sized documents with
+marga_tools.codec and with the old if-chain functions (`--sizes 100000`
+for the full comparison). `bulk_writes` pushes synthetic employees through
+BulkWriter into the local Firestore stand-in (marga_tools.standin) with
+injected latency and 429s, at several worker counts. `geoindex` times
+k-nearest and radius queries on the branch grid index against a
+brute-force haversine scan. `import_paths` generates synthetic dumps and
+workbooks (see marga_tools.synthetic) and times each script's parsers and
+matching step on them. `--save` stores the results as a JSON baseline;
+`--baseline` compares a run against one and exits 1 when any timing
+regresses past `--threshold`.
+
+Usage (from tools/):
+  python3 -m marga_tools.benchmarks usernames
+  python3 -m marga_tools.benchmarks import_paths --sizes 1000,4000 --save /tmp/bench-baseline.json
+  python3 -m marga_tools.benchmarks import_paths --sizes 1000,4000 --baseline /tmp/bench-baseline.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable
+
+from marga_tools import geoindex
+from marga_tools.codec import decode_documents, encode_documents, gc_paused
+from marga_tools.firestore import BulkWriter
+from marga_tools.geoindex import GridIndex, branch_points
+from marga_tools.scripts import load_script
+from marga_tools.standin import DocumentStore, Faults, start_server
+from marga_tools.synthetic import synthetic_branches, synthetic_employees, write_fixtures
+from marga_tools.usernames import UsernameAllocator, build_username_candidates, sanitize_username
+
+
+def probing_pick_username(record: dict[str, Any], emp_id: int, used_usernames: set[str]) -> str:
+    """The old `pick_username` loop, kept as the comparison baseline."""
+    for raw in build_username_candidates(record, emp_id):
+        base = sanitize_username(raw)
+        if not base:
+            continue
+        candidate = base
+        suffix = 2
+        while candidate in used_usernames:
+            candidate = f"{base}{suffix}"
+            suffix += 1
+        used_usernames.add(candidate)
+        return candidate
+    fallback = f"emp{emp_id}"
+    used_usernames.add(fallback)
+    return fallback
+
+
+def colliding_roster(size: int, distinct_names: int = 8) -> list[tuple[dict[str, Any], int, str]]:
+    """A roster where nearly everyone shares one of a handful of first names."""
+    firsts = ["Juan", "Maria", "Jose", "Ana", "Mark", "John", "Michael", "Grace"][:distinct_names]
+    return [({"firstname": firsts[i % len(firsts)]}, i + 1, "") for i in range(size)]
+
+
+def bench_usernames(sizes: list[int]) -> list[dict[str, Any]]:
+    results = []
+    for size in sizes:
+        roster = colliding_roster(size)
+
+        started = time.perf_counter()
+        used: set[str] = set()
+        for record, emp_id, _ in roster:
+            probing_pick_username(record, emp_id, used)
+        probing = time.perf_counter() - started
+
+        started = time.perf_counter()
+        UsernameAllocator().allocate_many(roster)
+        allocator = time.perf_counter() - started
+
+        results.append({
+            "size": size,
+            "probing_s": round(probing, 6),
+            "allocator_s": round(allocator, 6),
+            "allocator_us_per_name": round(allocator / size * 1e6, 3),
+            "speedup": round(probing / allocator, 1) if allocator else None,
+        })
+    return results
+
+
+def legacy_fs_parse_value(value: dict[str, Any]) -> Any:
+    """The old `fs_parse_value` if-chain, kept as the comparison baseline."""
+    if "stringValue" in value:
+        return value["stringValue"]
+    if "integerValue" in value:
+        return int(value["integerValue"])
+    if "doubleValue" in value:
+        return float(value["doubleValue"])
+    if "booleanValue" in value:
+        return bool(value["booleanValue"])
+    if "timestampValue" in value:
+        return value["timestampValue"]
+    if "arrayValue" in value:
+        return [legacy_fs_parse_value(item) for item in value.get("arrayValue", {}).get("values", [])]
+    if "mapValue" in value:
+        return {key: legacy_fs_parse_value(item) for key, item in value.get("mapValue", {}).get("fields", {}).items()}
+    return None
+
+
+def legacy_fs_field(value: Any) -> dict[str, Any]:
+    """The old `fs_field` if-chain, kept as the comparison baseline."""
+    if value is None:
+        return {"nullValue": None}
+    if isinstance(value, bool):
+        return {"booleanValue": value}
+    if isinstance(value, int):
+        return {"integerValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, list):
+        return {"arrayValue": {"values": [legacy_fs_field(item) for item in value]}}
+    if isinstance(value, dict):
+        return {"mapValue": {"fields": {key: legacy_fs_field(item) for key, item in value.items()}}}
+    return {"stringValue": str(value)}
+
+
+def employee_documents(size: int) -> list[dict[str, Any]]:
+    """Synthetic employees padded out to the shape of a migrated tbl_employee doc."""
+    modules = ["dashboard", "customers", "billing", "collections", "service", "inventory", "hr", "settings"]
+    docs = []
+    for employee in synthetic_employees(size):
+        emp_id = employee["id"]
+        docs.append({
+            **employee,
+            "username": f"{str(employee['firstname']).lower()}{emp_id}",
+            "marga_role": "technician",
+            "marga_allowed_modules": modules[: emp_id % len(modules) + 1],
+            "marga_active": emp_id % 3 != 0,
+            "marga_account_active": emp_id % 3 != 0,
+            "allowed_modules_configured": False,
+            "password_hash": "q3M2eHh0b2tlbnBsYWNlaG9sZGVyaGFzaHZhbHVlMDA=",
+            "password_salt": "c2FsdHNhbHRzYWx0c2FsdA==",
+            "password_iterations": 120000,
+            "password_algo": "PBKDF2-SHA256",
+            "semi_monthly_rate": round(employee["rate"] / 2, 2),
+            "monthly_salary": employee["rate"],
+            "daily_rate": round(employee["rate"] / 26, 2),
+            "allowance": 500.0,
+            "payroll_sss_amount": 581.3,
+            "payroll_phic_amount": None,
+            "source_updated_at": "2026-02-18T08:00:00+00:00",
+            "marga_profile": {"contact": employee["contact_number"], "branch": employee["branch_id"], "tags": ["field", "north"]},
+        })
+    return docs
+
+
+def _legacy_encode_documents(docs: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    with gc_paused():
+        return [{key: legacy_fs_field(value) for key, value in doc.items()} for doc in docs]
+
+
+def _legacy_decode_documents(raws: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    with gc_paused():
+        decoded = []
+        for raw in raws:
+            parsed = {key: legacy_fs_parse_value(value) for key, value in raw["fields"].items()}
+            parsed["_docId"] = raw["name"].split("/")[-1]
+            decoded.append(parsed)
+        return decoded
+
+
+def _fastest(repeat: int, func: Callable[[], Any]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def bench_codec(sizes: list[int], page_size: int = 1000, repeat: int = 3) -> list[dict[str, Any]]:
+    """Both sides run page by page, as fetch_collection and the writers do, each
+    with the cyclic GC paused per page; fastest of `repeat` runs."""
+    results = []
+    for size in sizes:
+        docs = employee_documents(size)
+        pages = [docs[start:start + page_size] for start in range(0, size, page_size)]
+        encoded_pages = [encode_documents(page) for page in pages]
+        raw_pages = [[{"name": f"tbl_employee/{doc['id']}", "fields": fields} for doc, fields in zip(page, encoded)] for page, encoded in zip(pages, encoded_pages)]
+
+        legacy_encode = _fastest(repeat, lambda: [_legacy_encode_documents(page) for page in pages])
+        codec_encode = _fastest(repeat, lambda: [encode_documents(page) for page in pages])
+        legacy_decode = _fastest(repeat, lambda: [_legacy_decode_documents(page) for page in raw_pages])
+        codec_decode = _fastest(repeat, lambda: [decode_documents(page) for page in raw_pages])
+
+        decoded = [parsed for page in raw_pages for parsed in decode_documents(page)]
+        if [{key: value for key, value in doc.items() if key != "_docId"} for doc in decoded] != docs:
+            raise AssertionError("codec round trip changed a document")
+        results.append({
+            "size": size,
+            "fields_per_doc": len(docs[0]) if docs else 0,
+            "legacy_encode_s": round(legacy_encode, 6),
+            "codec_encode_s": round(codec_encode, 6),
+            "encode_speedup": round(legacy_encode / codec_encode, 2) if codec_encode else None,
+            "legacy_decode_s": round(legacy_decode, 6),
+            "codec_decode_s": round(codec_decode, 6),
+            "decode_speedup": round(legacy_decode / codec_decode, 2) if codec_decode else None,
+            "codec_round_trip_us_per_doc": round((codec_encode + codec_decode) / size * 1e6, 3),
+        })
+    return results
+
+
+def best_of(repeat: int, func: Callable[[], Any]) -> tuple[float, Any]:
+    """Fastest of `repeat` runs; the scripts' own progress output is discarded."""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            result = func()
+            best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def bench_import_paths(sizes: list[int], repeat: int = 3) -> list[dict[str, Any]]:
+    results = []
+    for size in sizes:
+        row: dict[str, Any] = {"size": size}
+        with tempfile.TemporaryDirectory(prefix="marga-bench-") as tmp:
+            fixtures = write_fixtures(tmp, employees=size, branches=size * 2, roster=size * 4 // 5)
+
+            def step(name: str, script: str, func: Callable[[ModuleType], Any]) -> Any:
+                try:
+                    module = load_script(script)
+                except ModuleNotFoundError as err:
+                    row[f"{name}_skipped"] = f"{script}: {err}"
+                    return None
+                seconds, value = best_of(repeat, lambda: func(module))
+                row[f"{name}_s"] = round(seconds, 6)
+                row[f"{name}_rows"] = len(value) if hasattr(value, "__len__") else None
+                return value
+
+            step("extract_branchinfo_from_sql", "extract_branches.py", lambda m: m.extract_branchinfo_from_sql(str(fixtures["dump"])))
+            dumped = step(
+                "extract_tbl_employee_from_dump",
+                "tools/reconcile-employees-single-source.py",
+                lambda m: m.extract_tbl_employee_from_dump(str(fixtures["dump"]))[1],
+            )
+            roster = step("parse_xlsx", "tools/promote-final-users-to-tbl-employee.py", lambda m: m.parse_xlsx(str(fixtures["final_users"])))
+            payroll_rows = step("read_workbook_rows", "scripts/update-employee-payroll-rates-from-xlsx.py", lambda m: m.read_workbook_rows(str(fixtures["payroll"])))
+
+            employees = dumped
+            if employees is None:
+                employees = synthetic_employees(size)
+
+            def match_roster(module: ModuleType) -> list[int | None]:
+                by_email: dict[str, list[int]] = {}
+                for employee in employees:
+                    email = str(employee.get("email") or "").strip().lower()
+                    if email:
+                        by_email.setdefault(email, []).append(int(employee["id"]))
+                matched: set[int] = set()
+                out = []
+                for record in roster or []:
+                    emp_id = module.match_employee_id(record, by_email, matched)
+                    if emp_id is not None:
+                        matched.add(emp_id)
+                    out.append(emp_id)
+                return out
+
+            def match_payroll(module: ModuleType) -> list[Any]:
+                by_name: dict[str, list[dict[str, Any]]] = {}
+                for employee in employees:
+                    doc = {**employee, "_docId": str(employee["id"])}
+                    by_name.setdefault(module.normalize_name(module.employee_name(doc)), []).append(doc)
+                return [module.choose_employee(payroll_row, by_name)[0] for payroll_row in payroll_rows or []]
+
+            step("match_roster", "tools/promote-final-users-to-tbl-employee.py", match_roster)
+            step("match_payroll", "scripts/update-employee-payroll-rates-from-xlsx.py", match_payroll)
+        results.append(row)
+    return results
+
+
+def bench_bulk_writes(sizes: list[int], workers: tuple[int, ...] = (1, 4, 8)) -> list[dict[str, Any]]:
+    results = []
+    for size in sizes:
+        row: dict[str, Any] = {"size": size}
+        employees = synthetic_employees(size)
+        for count in workers:
+            server = start_server(DocumentStore(), Faults(latency_ms=10, jitter_ms=5, throttle_rate=0.02, seed=count))
+            try:
+                started = time.perf_counter()
+                with BulkWriter(server.base_url, "bench", batch_size=100, workers=count) as writer:
+                    for employee in employees:
+                        writer.update("tbl_employee", str(employee["id"]), employee)
+                seconds = time.perf_counter() - started
+            finally:
+                server.shutdown()
+                server.server_close()
+            row[f"workers{count}_s"] = round(seconds, 6)
+            row[f"workers{count}_docs_per_s"] = round(size / seconds, 1)
+            row[f"workers{count}_throttled"] = server.stats.get("status 429", 0)
+            row[f"workers{count}_failed"] = len(writer.failures)
+        results.append(row)
+    return results
+
+
+def bench_geoindex(sizes: list[int], queries: int = 200, k: int = 10, km: float = 1.0) -> list[dict[str, Any]]:
+    """Per-query cost of the grid index vs a full haversine scan (NumPy-vectorized when installed)."""
+    results = []
+    for size in sizes:
+        branches = synthetic_branches(size)
+        started = time.perf_counter()
+        index = GridIndex.build(branch_points(branches))
+        row: dict[str, Any] = {"size": size, "build_s": round(time.perf_counter() - started, 6), "cells": len(index.keys)}
+        probes = [(branch["latitude"], branch["longitude"]) for branch in branches[:: max(1, size // queries)]][:queries]
+
+        def per_query(func: Callable[[float, float], Any]) -> tuple[float, list[Any]]:
+            started = time.perf_counter()
+            answers = [func(lat, lon) for lat, lon in probes]
+            return (time.perf_counter() - started) / len(probes), answers
+
+        knn_s, knn = per_query(lambda lat, lon: index.nearest(lat, lon, k))
+        within_s, within = per_query(lambda lat, lon: index.within(lat, lon, km))
+        brute_knn_s, brute_knn = per_query(lambda lat, lon: sorted(index.brute_force(lat, lon))[:k])
+        brute_within_s, brute_within = per_query(lambda lat, lon: sorted(hit for hit in index.brute_force(lat, lon) if hit[0] <= km))
+        row.update({
+            "knn_s": round(knn_s, 6),
+            "within_s": round(within_s, 6),
+            "brute_knn_s": round(brute_knn_s, 6),
+            "brute_within_s": round(brute_within_s, 6),
+            "knn_us_per_query": round(knn_s * 1e6, 1),
+            "within_us_per_query": round(within_s * 1e6, 1),
+            "knn_speedup": round(brute_knn_s / knn_s, 1),
+            "within_speedup": round(brute_within_s / within_s, 1),
+            "brute_force": "numpy" if geoindex.numpy is not None else "python",
+            "matches": [[hit[1] for hit in hits] for hits in knn] == [[hit[1] for hit in hits] for hits in brute_knn]
+            and [[hit[1] for hit in hits] for hits in within] == [[hit[1] for hit in hits] for hits in brute_within],
+        })
+        results.append(row)
+    return results
+
+
+BENCHMARKS: dict[str, Callable[[list[int]], list[dict[str, Any]]]] = {
+    "bulk_writes": bench_bulk_writes,
+    "codec": bench_codec,
+    "geoindex": bench_geoindex,
+    "import_paths": bench_import_paths,
+    "usernames": bench_usernames,
+}
+
+
+def compare_to_baseline(current: dict[str, list[dict[str, Any]]], baseline: dict[str, list[dict[str, Any]]], threshold: float) -> list[str]:
+    """Timings (`*_s`) more than `threshold` slower than the baseline at the same size."""
+    regressions = []
+    for name, rows in current.items():
+        previous = {row["size"]: row for row in baseline.get(name, [])}
+        for row in rows:
+            before = previous.get(row["size"])
+            if before is None:
+                continue
+            for key, seconds in row.items():
+                old = before.get(key)
+                if not key.endswith("_s") or not isinstance(seconds, (int, float)) or not old:
+                    continue
+                change = seconds / old - 1
+                marker = "REGRESSED" if change > threshold else "ok"
+                line = f"{name} size={row['size']} {key}: {old:.4f}s -> {seconds:.4f}s ({change:+.0%}) {marker}"
+                print(line)
+                if change > threshold:
+                    regressions.append(line)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run marga_tools micro-benchmarks")
+    parser.add_argument("names", nargs="*", default=sorted(BENCHMARKS), help=f"Benchmarks to run ({', '.join(sorted(BENCHMARKS))})")
+    parser.add_argument("--sizes", default="1000,4000,16000", help="Comma-separated input sizes")
+    parser.add_argument("--save", default="", help="Write the results here as a JSON baseline")
+    parser.add_argument("--baseline", default="", help="Compare against a baseline written by --save")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown vs the baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+    sizes = [int(value) for value in args.sizes.split(",") if value.strip()]
+
+    results: dict[str, list[dict[str, Any]]] = {}
+    for name in args.names:
+        rows = results[name] = BENCHMARKS[name](sizes)
+        print(json.dumps({"benchmark": name, "results": rows}, indent=2))
+        per_item = [row.get("allocator_us_per_name") for row in rows if row.get("allocator_us_per_name")]
+        if len(per_item) > 1:
+            # Linear allocation keeps the per-name cost flat as the roster grows.
+            print(f"{name}: per-item cost grew {per_item[-1] / per_item[0]:.2f}x over a {sizes[-1] // sizes[0]}x larger input")
+
+    if args.save:
+        Path(args.save).write_text(json.dumps({"python": sys.version.split()[0], "benchmarks": results}, indent=2) + "\n", encoding="utf-8")
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare_to_baseline(results, baseline.get("benchmarks", {}), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} timing(s) regressed more than {args.threshold:.0%} against {args.baseline}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
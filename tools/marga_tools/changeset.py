@@ -0,0 +1,165 @@
+"""Serialized change sets: compute a plan once, review it, apply it later.
+
+A plan is NDJSON. The first line is a `{"type": "plan", ...}` header, then
+one line per write:
+
+  {"op": "update", "collection": "tbl_employee", "id": "12",
+   "mask": ["marga_active", ...] | null, "fields": {<Firestore values>},
+   "precondition": {"updateTime": "..."} | {"exists": false} | null,
+   "hash": "<content hash of collection/id/mask/fields>"}
+  {"op": "delete", "collection": "marga_users", "id": "a@b.c",
+   "precondition": ..., "fallback": {"mask": ..., "fields": ...} | null, "hash": ...}
+
+and a closing `{"type": "end", "ops": N, "digest": "..."}` line. The digest
+covers every op line, so `apply` can refuse a truncated or edited plan, and
+the per-op hash lets a journal recognise writes that were already applied.
+"""
+
+from __future__ import annotations
+
+import datetime as dt
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Iterator
+
+from marga_tools.firestore import fs_fields
+from marga_tools.journal import content_hash
+
+
+class PlanError(RuntimeError):
+    pass
+
+
+def _dumps(entry: dict[str, Any]) -> str:
+    return json.dumps(entry, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+class PlanWriter:
+    def __init__(self, path: str | Path, source: str, **meta: Any) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.count = 0
+        self.counts: dict[str, int] = {}
+        self._digest = hashlib.sha256()
+        self._fh = self.path.open("w", encoding="utf-8")
+        created_at = dt.datetime.now(dt.timezone.utc).isoformat()
+        self._fh.write(_dumps({"type": "plan", "version": 1, "source": source, "created_at": created_at, **meta}) + "\n")
+
+    def _write(self, entry: dict[str, Any]) -> None:
+        entry["hash"] = content_hash({key: entry.get(key) for key in ("op", "collection", "id", "mask", "fields")})
+        line = _dumps(entry)
+        self._digest.update(line.encode("utf-8"))
+        self._fh.write(line + "\n")
+        self.count += 1
+        key = f"{entry['op']}:{entry['collection']}"
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def update(
+        self,
+        collection: str,
+        doc_id: Any,
+        fields: dict[str, Any],
+        mask: list[str] | None = None,
+        precondition: dict[str, Any] | None = None,
+        encoded: bool = False,
+    ) -> None:
+        self._write({
+            "op": "update",
+            "collection": collection,
+            "id": str(doc_id),
+            "mask": mask,
+            "fields": fields if encoded else fs_fields(fields),
+            "precondition": precondition,
+        })
+
+    def delete(
+        self,
+        collection: str,
+        doc_id: Any,
+        precondition: dict[str, Any] | None = None,
+        fallback_fields: dict[str, Any] | None = None,
+    ) -> None:
+        """Plan a delete; `fallback_fields` are written instead if DELETE is forbidden."""
+        self._write({
+            "op": "delete",
+            "collection": collection,
+            "id": str(doc_id),
+            "mask": None,
+            "fields": None,
+            "precondition": precondition,
+            "fallback": {"mask": None, "fields": fs_fields(fallback_fields)} if fallback_fields is not None else None,
+        })
+
+    @property
+    def digest(self) -> str:
+        return self._digest.hexdigest()
+
+    def close(self) -> str:
+        if not self._fh.closed:
+            self._fh.write(_dumps({"type": "end", "ops": self.count, "digest": self.digest}) + "\n")
+            self._fh.close()
+        return self.digest
+
+    def __enter__(self) -> "PlanWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc: Any) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave no end marker so a half-written plan can never be applied.
+            self._fh.close()
+
+
+def precondition_for(update_times: dict[str, str], doc_id: Any, expect_new: bool = False) -> dict[str, Any] | None:
+    if expect_new:
+        return {"exists": False}
+    update_time = update_times.get(str(doc_id))
+    return {"updateTime": update_time} if update_time else None
+
+
+def read_plan_header(path: str | Path) -> dict[str, Any]:
+    with Path(path).open("r", encoding="utf-8") as fh:
+        header = json.loads(fh.readline() or "{}")
+    if header.get("type") != "plan":
+        raise PlanError(f"{path} is not a change plan")
+    return header
+
+
+def verify_plan(path: str | Path) -> dict[str, Any]:
+    """Stream the plan once and check its end marker and digest."""
+    digest = hashlib.sha256()
+    count = 0
+    end: dict[str, Any] | None = None
+    with Path(path).open("r", encoding="utf-8") as fh:
+        fh.readline()
+        for line in fh:
+            line = line.rstrip("\n")
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as err:
+                raise PlanError(f"{path} has a malformed line after op {count}; the plan is truncated or edited") from err
+            if entry.get("type") == "end":
+                end = entry
+                break
+            digest.update(line.encode("utf-8"))
+            count += 1
+    if end is None:
+        raise PlanError(f"{path} has no end marker; the plan run did not finish")
+    if end.get("ops") != count or end.get("digest") != digest.hexdigest():
+        raise PlanError(f"{path} does not match its digest; refusing to apply")
+    return end
+
+
+def iter_plan(path: str | Path) -> Iterator[dict[str, Any]]:
+    with Path(path).open("r", encoding="utf-8") as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("type") in ("plan", "end"):
+                continue
+            yield entry
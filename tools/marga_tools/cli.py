@@ -0,0 +1,158 @@
+"""One entry point for the sync scripts and tool modules, with a session shared between commands.
+
+  python3 -m marga_tools [--no-snapshots] COMMAND [ARGS...] [+ COMMAND [ARGS...] ...]
+  python3 -m marga_tools --list
+
+Each command runs an existing script's or module's `main()` in this process,
+with ARGS as its own command line. For example,
+`python3 -m marga_tools reconcile --help` shows the reconcile script's
+options. Commands joined with `+` run in order and share one session:
+
+- whole-collection reads (`firestore.SNAPSHOTS`): a collection fetched by
+  one command is replayed to the next without another read, until a command
+  writes to it;
+- parsed dumps and workbooks (`scripts.PARSERS`), while the file is
+  unchanged;
+- the imported scripts, the TLS context and the Firebase config.
+
+Each command's metrics (its "Actual" line, its own --metrics-json) cover
+only that command; the session's --metrics-json lists them all. The chain
+stops at the first command that exits non-zero. Edits made in the
+app to a collection already read are not seen by later commands in the
+chain. Use --no-snapshots when that matters.
+
+Run it from the repo root, where the scripts expect to be:
+  PYTHONPATH=tools python3 -m marga_tools reconcile --dump Dump.sql --xlsx Users.xlsx --plan /tmp/reconcile.plan.ndjson + apply-plan /tmp/reconcile.plan.ndjson
+  PYTHONPATH=tools python3 -m marga_tools extract-branches --sql Dump.sql --geo-index branches.grid + near-dup --dump Dump.sql -o duplicates.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import sys
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import Any, TextIO
+
+from marga_tools import firestore
+from marga_tools.metrics import METRICS
+from marga_tools.scripts import REPO_ROOT, as_script, warm_script
+
+CHAIN = "+"
+# Command -> (hyphenated script under the repo root, or marga_tools module; summary)
+COMMANDS = {
+    "sync-users": ("tools/sync-final-marga-users.py", "Sync the Final Marga Users roster into marga_users"),
+    "reconcile": ("tools/reconcile-employees-single-source.py", "Rebuild tbl_employee from a dump and the final user roster"),
+    "promote": ("tools/promote-final-users-to-tbl-employee.py", "Promote the final roster into tbl_employee and retire marga_users"),
+    "payroll-rates": ("scripts/update-employee-payroll-rates-from-xlsx.py", "Update tbl_employee payroll rates from a payroll workbook"),
+    "extract-branches": ("extract_branches.py", "List dump branches missing from Firestore"),
+    "apply-plan": ("tools/apply-firestore-plan.py", "Apply a reviewed NDJSON change plan"),
+    "restore-backup": ("tools/restore-firestore-backup.py", "Restore collections from a promote backup"),
+    "import-tables": ("marga_tools.tableimport", "Import configured dump tables into Firestore"),
+    "parity": ("marga_tools.parity", "Checksum a dump table against its collection"),
+    "gaps": ("marga_tools.gaps", "Find dump ids missing from a collection"),
+    "dump-diff": ("marga_tools.dumpdiff", "Diff two dumps as NDJSON row deltas"),
+    "dump-db": ("marga_tools.dumpdb", "Load a dump into SQLite for ad-hoc queries"),
+    "geo-index": ("marga_tools.geoindex", "Build or query the branch spatial index"),
+    "near-dup": ("marga_tools.neardup", "Report near-duplicate branches"),
+    "watch": ("marga_tools.watch", "Process dumps and workbooks dropped into a folder"),
+}
+
+
+def split_chain(argv: list[str]) -> list[list[str]]:
+    """`a x + b y` -> [[a, x], [b, y]]; empty segments are dropped."""
+    chain: list[list[str]] = [[]]
+    for arg in argv:
+        if arg == CHAIN:
+            chain.append([])
+        else:
+            chain[-1].append(arg)
+    return [segment for segment in chain if segment]
+
+
+def load_command(name: str) -> ModuleType:
+    target, _ = COMMANDS[name]
+    return warm_script(target) if target.endswith(".py") else importlib.import_module(target)
+
+
+def run_command(name: str, argv: list[str]) -> int:
+    """Run one command's `main()` with `argv`; its exit status (argparse exits included).
+
+    METRICS is reset before the command and finished after it, so its
+    figures are the command's own.
+    """
+    target, _ = COMMANDS[name]
+    try:
+        module = load_command(name)
+    except ModuleNotFoundError as err:
+        print(f"{name}: {target} needs {err.name}, which is not installed", file=sys.stderr)
+        return 1
+    try:
+        with as_script(str(REPO_ROOT / target) if target.endswith(".py") else target, argv):
+            METRICS.reset()
+            try:
+                code = module.main()
+            finally:
+                METRICS.finish_run()
+    except SystemExit as exc:
+        code = exc.code
+    if isinstance(code, str):
+        print(code, file=sys.stderr)
+        return 1
+    return int(code or 0)
+
+
+def print_commands(file: TextIO = sys.stdout) -> None:
+    width = max(len(name) for name in COMMANDS)
+    for name, (target, summary) in COMMANDS.items():
+        print(f"  {name:<{width}}  {summary} ({target})", file=file)
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    # Options before the first command are the session's own.
+    first = next((index for index, arg in enumerate(argv) if arg in COMMANDS), len(argv))
+    parser = argparse.ArgumentParser(
+        prog="python3 -m marga_tools",
+        usage="%(prog)s [options] COMMAND [ARGS...] [+ COMMAND [ARGS...] ...]",
+        description="Run MARGA sync commands in one process, sharing fetched collections and parsed files.",
+    )
+    parser.add_argument("--list", action="store_true", help="List the commands")
+    parser.add_argument("--no-snapshots", action="store_true", help="Re-read collections in every command instead of sharing them")
+    parser.add_argument("--metrics-json", default="", help="Write each command's phase timings and request metrics here")
+    args, unparsed = parser.parse_known_args(argv[:first])
+    if args.list:
+        print_commands()
+        return 0
+    chain = split_chain(argv[first:])
+    unknown = unparsed[:1] + [segment[0] for segment in chain if segment[0] not in COMMANDS]
+    if not chain or unknown:
+        parser.print_usage(sys.stderr)
+        print(f"unknown command: {unknown[0]}" if unknown else "no command given", file=sys.stderr)
+        print("commands:", file=sys.stderr)
+        print_commands(sys.stderr)
+        return 2
+    if not args.no_snapshots:
+        firestore.SNAPSHOTS = firestore.Snapshots()
+
+    code = 0
+    summaries: list[dict[str, Any]] = []
+    metrics_path = Path(args.metrics_json).resolve() if args.metrics_json else None
+    try:
+        for name, *command_argv in chain:
+            started = time.perf_counter()
+            code = run_command(name, command_argv)
+            summaries.append({"command": name, "exit": code, **(METRICS.final or {})})
+            if len(chain) > 1:
+                reused = METRICS.counters.get("snapshot_hits", 0) + METRICS.counters.get("parse_cache_hits", 0)
+                print(f"[{name}] exit {code} in {time.perf_counter() - started:.1f}s, {reused:g} cached reads and parses reused", file=sys.stderr)
+            if code:
+                break
+    finally:
+        if metrics_path is not None:
+            metrics_path.parent.mkdir(parents=True, exist_ok=True)
+            metrics_path.write_text(json.dumps({"commands": summaries}, indent=2) + "\n", encoding="utf-8")
+    return code
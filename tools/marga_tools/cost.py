@@ -0,0 +1,170 @@
+"""Firestore operation costs: predict a run's, enforce a budget, report what was spent.
+
+Firestore bills per document:
+
+- one read per document returned by a get, list, query or `:batchGet`
+  (an empty result still costs one);
+- one read per started 1000 index entries an aggregation counts;
+- one write per document set or updated;
+- one delete per document deleted.
+
+`FREE_TIER_DAILY` is what the project gets free each day.
+
+- `predict_reads` prices a fetch before it starts, with one COUNT
+  aggregation per collection plus a small sample page for the average doc
+  size. Those queries are billed too (a few reads per collection), so the
+  prediction includes them, and so does the `--max-reads` check. A refused
+  run has still spent them.
+- `plan_cost` prices a change plan's writes and deletes and their encoded
+  bytes.
+- `select_ops` ranks the ops and keeps those that fit a `--max-writes`
+  budget.
+- `spent` reads the counters marga_tools.firestore keeps, for the actual
+  figures at the end of a run.
+
+A budget counts deletes as writes, since both are document operations
+against the same day's quota.
+
+Ops are ranked deterministically: new documents first, then updates, then
+deletes; within each, by collection and then numeric id. A truncated plan
+applies the same ops on every run. With apply-firestore-plan.py's
+`--journal --resume`, the next run picks up where the budget stopped.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Iterable
+
+from marga_tools.firestore import DELETES_COUNTER, READS_COUNTER, WRITES_COUNTER, fs_fields, run_aggregation, run_query
+from marga_tools.metrics import METRICS
+
+FREE_TIER_DAILY = {"reads": 50_000, "writes": 20_000, "deletes": 20_000}
+SAMPLE_DOCS = 10
+
+
+@dataclass
+class Cost:
+    reads: int = 0
+    writes: int = 0
+    deletes: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+
+    def __add__(self, other: "Cost") -> "Cost":
+        return Cost(*(left + right for left, right in zip(asdict(self).values(), asdict(other).values())))
+
+    def __sub__(self, other: "Cost") -> "Cost":
+        return Cost(*(left - right for left, right in zip(asdict(self).values(), asdict(other).values())))
+
+    @property
+    def operations(self) -> int:
+        return self.writes + self.deletes
+
+    def free_tier_share(self) -> float:
+        """The largest fraction of any daily free-tier quota this uses."""
+        return max(self.reads / FREE_TIER_DAILY["reads"], self.writes / FREE_TIER_DAILY["writes"], self.deletes / FREE_TIER_DAILY["deletes"])
+
+    def line(self, label: str) -> str:
+        return (
+            f"{label}: {self.reads} reads, {self.writes} writes, {self.deletes} deletes "
+            f"({self.read_bytes / 1024:.1f} KB read, {self.write_bytes / 1024:.1f} KB written); "
+            f"{self.free_tier_share():.1%} of the daily free tier"
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**asdict(self), "free_tier_share": round(self.free_tier_share(), 4)}
+
+
+def encoded_bytes(fields: dict[str, Any], encoded: bool = False) -> int:
+    """Size of a document's fields as sent to Firestore (REST JSON)."""
+    return len(json.dumps(fields if encoded else fs_fields(fields), separators=(",", ":"), default=str).encode("utf-8"))
+
+
+def spent() -> Cost:
+    """What this process has spent so far, from the counters kept by marga_tools.firestore."""
+    counters = METRICS.counters
+    totals = METRICS.totals()
+    return Cost(
+        int(counters.get(READS_COUNTER, 0)),
+        int(counters.get(WRITES_COUNTER, 0)),
+        int(counters.get(DELETES_COUNTER, 0)),
+        totals.body_bytes_in,
+        totals.body_bytes_out,
+    )
+
+
+def predict_reads(base_url: str, api_key: str, collections: Iterable[str], sample: int = SAMPLE_DOCS) -> Cost:
+    """Reads (and roughly bytes) to fetch whole `collections`, from a COUNT and a sample page each.
+
+    The reads those pricing queries were billed are included.
+    """
+    cost = Cost()
+    before = int(METRICS.counters.get(READS_COUNTER, 0))
+    for collection in collections:
+        count = int(run_aggregation(base_url, api_key, {"from": [{"collectionId": collection}]}, [{"alias": "n", "count": {}}]).get("n") or 0)
+        sizes = []
+        if count and sample:
+            for doc in run_query(base_url, api_key, {"from": [{"collectionId": collection}], "limit": sample}):
+                sizes.append(encoded_bytes({key: value for key, value in doc.items() if key != "_docId"}))
+        # Listing bills one read per doc, and an empty collection still one.
+        cost.reads += max(1, count)
+        cost.read_bytes += count * sum(sizes) // len(sizes) if sizes else 0
+    cost.reads += int(METRICS.counters.get(READS_COUNTER, 0)) - before
+    return cost
+
+
+def check_reads(predicted: Cost, max_reads: int | None) -> str:
+    """An error message when `predicted` exceeds `max_reads`, else ""."""
+    if max_reads is None or predicted.reads <= max_reads:
+        return ""
+    return f"Predicted {predicted.reads} reads exceed --max-reads {max_reads}; nothing was fetched beyond the pricing queries"
+
+
+def op_rank(op: dict[str, Any]) -> tuple[Any, ...]:
+    """Creates first, then updates, then deletes; by collection and numeric id within each."""
+    if op["op"] == "delete":
+        kind = 2
+    else:
+        kind = 0 if (op.get("precondition") or {}).get("exists") is False else 1
+    doc_id = str(op["id"])
+    numeric = doc_id.isdigit()
+    return kind, op["collection"], not numeric, int(doc_id) if numeric else 0, doc_id
+
+
+def op_cost(op: dict[str, Any]) -> Cost:
+    """One plan op's cost (plan fields are already encoded)."""
+    if op["op"] == "delete":
+        return Cost(deletes=1)
+    return Cost(writes=1, write_bytes=encoded_bytes(op.get("fields") or {}, encoded=True))
+
+
+def plan_cost(ops: Iterable[dict[str, Any]]) -> Cost:
+    total = Cost()
+    for op in ops:
+        total += op_cost(op)
+    return total
+
+
+def select_ops(
+    ops: Iterable[dict[str, Any]],
+    max_writes: int | None,
+    skip: Callable[[dict[str, Any]], bool] | None = None,
+) -> tuple[set[int] | None, Cost, Cost]:
+    """Plan-order indexes of the ops within `max_writes` after ranking (None: all), and the (kept, deferred) cost.
+
+    Ops for which `skip` is true (e.g. already journaled) take no budget and are not selected.
+    """
+    ranked = []
+    for index, op in enumerate(ops):
+        if skip is None or not skip(op):
+            ranked.append((op_rank(op), index, op_cost(op)))
+    ranked.sort(key=lambda entry: entry[:2])
+    limit = len(ranked) if max_writes is None else max(0, max_writes)
+    kept, deferred = Cost(), Cost()
+    for _, _, cost in ranked[:limit]:
+        kept += cost
+    for _, _, cost in ranked[limit:]:
+        deferred += cost
+    return (None if max_writes is None else {index for _, index, _ in ranked[:limit]}), kept, deferred
@@ -0,0 +1,191 @@
+"""Load a mysqldump into an indexed SQLite file for ad-hoc diagnostic queries.
+
+The dump is streamed once with the typed INSERT parser
+(`mysqldump.iter_typed_inserts`). Rows go in through `executemany`, and a
+transaction is committed every `COMMIT_ROWS` rows. WAL is on and
+`synchronous=OFF` during the load, because a crashed load is simply
+re-run. Indexes are built after the data is in: on each table's primary
+key, on every `*_id` column, and on any `--index table.column`.
+
+Column affinity follows the dump's types (INTEGER, REAL, TEXT), so
+comparisons and joins behave as they do in MySQL. Tables being loaded are
+dropped first; other tables in the file are kept. `_dump_tables` records
+what was loaded from which dump.
+
+  python3 -m marga_tools.dumpdb Dump20260218.sql -o /tmp/marga.sqlite
+  python3 -m marga_tools.dumpdb --db /tmp/marga.sqlite --query branches-without-company
+  python3 -m marga_tools.dumpdb --db /tmp/marga.sqlite --query "SELECT city, count(*) FROM tbl_branchinfo GROUP BY city"
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import datetime as dt
+import os
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import Any, Iterable
+
+from marga_tools.metrics import METRICS
+from marga_tools.mysqldump import FLOAT_TYPES, INTEGER_TYPES, TableSchema, iter_typed_inserts
+
+COMMIT_ROWS = 200_000
+
+# Named diagnostics for --query; anything else is run as SQL.
+QUERIES = {
+    "branches-without-company": (
+        "SELECT b.id, b.branchname, b.company_id FROM tbl_branchinfo b "
+        "LEFT JOIN tbl_companylist c ON c.id = b.company_id WHERE c.id IS NULL ORDER BY b.id"
+    ),
+    "duplicate-employee-names": (
+        "SELECT lower(trim(firstname)) || ' ' || lower(trim(lastname)) AS name, count(*) AS copies, group_concat(id) AS ids "
+        "FROM tbl_employee GROUP BY name HAVING count(*) > 1 ORDER BY copies DESC, name"
+    ),
+    "tables": "SELECT name, rows, dump, loaded_at FROM _dump_tables ORDER BY name",
+}
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _affinity(sql_type: str) -> str:
+    if sql_type in INTEGER_TYPES or sql_type == "bit":
+        return "INTEGER"
+    if sql_type in FLOAT_TYPES:
+        return "REAL"
+    return "TEXT" if sql_type else ""
+
+
+def _create_table(conn: sqlite3.Connection, schema: TableSchema) -> str:
+    """(Re)create `schema`'s table; returns its INSERT statement."""
+    types = schema.types if len(schema.types) == len(schema.columns) else [""] * len(schema.columns)
+    columns = ", ".join(f"{_quote(name)} {_affinity(sql_type)}".rstrip() for name, sql_type in zip(schema.columns, types))
+    conn.execute(f"DROP TABLE IF EXISTS {_quote(schema.name)}")
+    conn.execute(f"CREATE TABLE {_quote(schema.name)} ({columns})")
+    return f"INSERT INTO {_quote(schema.name)} VALUES ({', '.join('?' * len(schema.columns))})"
+
+
+def _index_columns(schema: TableSchema, extra: Iterable[str]) -> list[list[str]]:
+    indexes = [schema.key_columns()] if schema.columns else []
+    indexes += [[name] for name in schema.columns if name.endswith("_id") and [name] not in indexes]
+    indexes += [[name] for name in extra if name in schema.columns and [name] not in indexes]
+    return indexes
+
+
+def connect(db_path: str | Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(db_path))
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def load_dump(
+    dump: str | Path,
+    db_path: str | Path,
+    tables: Iterable[str] | None = None,
+    indexes: dict[str, list[str]] | None = None,
+    commit_rows: int = COMMIT_ROWS,
+) -> dict[str, int]:
+    """Load `tables` (default: all) from `dump` into `db_path`; returns rows per table."""
+    conn = connect(db_path)
+    conn.isolation_level = None  # transactions are managed explicitly below
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-262144")
+    counts: dict[str, int] = {}
+    schemas: dict[str, TableSchema] = {}
+    inserts: dict[str, str] = {}
+    pending = 0
+    try:
+        with METRICS.phase("load rows"):
+            conn.execute("BEGIN")
+            for schema, rows in iter_typed_inserts(dump, tables):
+                insert = inserts.get(schema.name)
+                if insert is None:
+                    insert = inserts[schema.name] = _create_table(conn, schema)
+                    schemas[schema.name] = schema
+                    counts[schema.name] = 0
+                conn.executemany(insert, rows)
+                counts[schema.name] += len(rows)
+                pending += len(rows)
+                if pending >= commit_rows:
+                    conn.execute("COMMIT")
+                    conn.execute("BEGIN")
+                    pending = 0
+            conn.execute("COMMIT")
+        METRICS.count("dumpdb_rows", sum(counts.values()))
+
+        with METRICS.phase("build indexes"):
+            for name, schema in schemas.items():
+                for columns in _index_columns(schema, (indexes or {}).get(name, ())):
+                    index_name = _quote(f"ix_{name}_{'_'.join(columns)}")
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {_quote(name)} ({', '.join(map(_quote, columns))})")
+            conn.execute("CREATE TABLE IF NOT EXISTS _dump_tables (name TEXT PRIMARY KEY, rows INTEGER, dump TEXT, dump_bytes INTEGER, loaded_at TEXT)")
+            loaded_at = dt.datetime.now(dt.timezone.utc).isoformat()
+            conn.executemany(
+                "INSERT OR REPLACE INTO _dump_tables VALUES (?, ?, ?, ?, ?)",
+                [(name, count, str(dump), os.path.getsize(dump), loaded_at) for name, count in counts.items()],
+            )
+            conn.execute("ANALYZE")
+    finally:
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.close()
+    return counts
+
+
+def run_query(db_path: str | Path, query: str) -> tuple[list[str], list[tuple[Any, ...]]]:
+    """(column names, rows) for SQL or one of the named `QUERIES`."""
+    conn = connect(db_path)
+    try:
+        cursor = conn.execute(QUERIES.get(query, query))
+        return [column[0] for column in cursor.description or ()], cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load a MySQL dump into SQLite and query it")
+    parser.add_argument("dump", nargs="?", help="Dump to load (omit to only --query an existing --db)")
+    parser.add_argument("-o", "--db", required=True, help="SQLite file to load into / query")
+    parser.add_argument("--table", action="append", default=None, help="Only load this table (repeatable)")
+    parser.add_argument("--index", action="append", default=[], help="Extra index as table.column (repeatable)")
+    parser.add_argument("--query", action="append", default=[], help=f"SQL, or one of: {', '.join(QUERIES)} (repeatable; printed as TSV)")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
+    args = parser.parse_args()
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
+    if not args.dump and not args.query:
+        parser.error("give a dump to load, --query, or both")
+
+    if args.dump:
+        indexes: dict[str, list[str]] = {}
+        for spec in args.index:
+            table, _, column = spec.partition(".")
+            if not column:
+                parser.error(f"--index {spec!r} must be table.column")
+            indexes.setdefault(table, []).append(column)
+        started = time.perf_counter()
+        counts = load_dump(args.dump, args.db, args.table, indexes)
+        print(f"Loaded {sum(counts.values())} rows from {len(counts)} tables into {args.db} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    writer = csv.writer(sys.stdout, delimiter="\t", lineterminator="\n")
+    for query in args.query:
+        started = time.perf_counter()
+        try:
+            columns, rows = run_query(args.db, query)
+        except sqlite3.Error as err:
+            print(f"{query}: {err}", file=sys.stderr)
+            return 2
+        writer.writerow(columns)
+        writer.writerows(rows)
+        print(f"{len(rows)} rows in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
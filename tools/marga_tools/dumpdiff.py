@@ -0,0 +1,163 @@
+"""Row-level diff of two mysqldump files, written as NDJSON.
+
+Each row is keyed by (table, primary key) and fingerprinted with
+`content_hash`. To keep memory bounded, each dump is streamed once into
+hash-partitioned spill files, with rows routed by a CRC of their key. The
+old and new halves of a partition then hold the same keys, so one
+partition at a time is compared in memory. Peak memory is about one old
+partition, kept as raw JSON text; a row is only decoded when it is
+inserted or its digest changed.
+
+Output (one JSON object per line):
+
+  {"type": "dumpdiff", "version": 1, "old": "...", "new": "...", "partitions": 8}
+  {"op": "insert", "table": "tbl_branchinfo", "key": 3813, "row": {...}}
+  {"op": "update", "table": "tbl_branchinfo", "key": 12, "row": {...}, "changed": ["city", "email"]}
+  {"op": "delete", "table": "tbl_branchinfo", "key": 7}
+  {"type": "end", "counts": {"tbl_branchinfo": {"insert": 1, "update": 1, "delete": 1, "unchanged": 4990}}}
+
+Rows come out grouped by partition, not in key order. Composite primary
+keys are written as lists.
+
+  python3 -m marga_tools.dumpdiff Dump20251229.sql Dump20260218.sql -o delta.ndjson --table tbl_branchinfo
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Any, Iterable, Iterator, TextIO
+
+from marga_tools.journal import content_hash
+from marga_tools.metrics import METRICS
+from marga_tools.mysqldump import iter_rows, row_key
+
+# Old-dump bytes per partition. A partition's old rows are held in memory
+# as spill lines, which take roughly as much space as the dump text.
+PARTITION_BYTES = 32 * 1024 * 1024
+MAX_PARTITIONS = 256
+
+
+def partition_count(old_path: str | Path, partition_bytes: int = PARTITION_BYTES) -> int:
+    return max(1, min(MAX_PARTITIONS, math.ceil(os.path.getsize(old_path) / partition_bytes)))
+
+
+def _spill(dump: str | Path, tables: Iterable[str] | None, out_dir: Path, prefix: str, partitions: int) -> int:
+    """Route every row of `dump` into `<prefix>-<n>.ndjson` by key; returns the row count."""
+    files = [(out_dir / f"{prefix}-{index}.ndjson").open("w", encoding="utf-8") for index in range(partitions)]
+    count = 0
+    try:
+        for schema, row in iter_rows(dump, tables):
+            # JSON escapes tabs and newlines, so `digest<TAB>key<TAB>row` splits cleanly.
+            key = json.dumps([schema.name, row_key(schema, row)], ensure_ascii=False, separators=(",", ":"), default=str)
+            body = json.dumps(row, ensure_ascii=False, separators=(",", ":"), default=str)
+            files[zlib.crc32(key.encode("utf-8")) % partitions].write(f"{content_hash(row)}\t{key}\t{body}\n")
+            count += 1
+    finally:
+        for fh in files:
+            fh.close()
+    return count
+
+
+def _compare_partition(old_file: Path, new_file: Path) -> Iterator[dict[str, Any]]:
+    old: dict[str, tuple[str, str]] = {}
+    with old_file.open("r", encoding="utf-8") as fh:
+        for line in fh:
+            digest, key, body = line.split("\t", 2)
+            old[key] = (digest, body)
+    with new_file.open("r", encoding="utf-8") as fh:
+        for line in fh:
+            digest, key, body = line.split("\t", 2)
+            table, pk = json.loads(key)
+            previous = old.pop(key, None)
+            if previous is None:
+                yield {"op": "insert", "table": table, "key": pk, "row": json.loads(body)}
+            elif previous[0] != digest:
+                row = json.loads(body)
+                before = json.loads(previous[1])
+                changed = sorted(name for name in row.keys() | before.keys() if row.get(name) != before.get(name))
+                yield {"op": "update", "table": table, "key": pk, "row": row, "changed": changed}
+            else:
+                yield {"op": "unchanged", "table": table, "key": pk}
+    for key in old:
+        table, pk = json.loads(key)
+        yield {"op": "delete", "table": table, "key": pk}
+
+
+def iter_diff(
+    old_dump: str | Path,
+    new_dump: str | Path,
+    tables: Iterable[str] | None = None,
+    partitions: int | None = None,
+    spill_dir: str | Path | None = None,
+) -> Iterator[dict[str, Any]]:
+    """Yield insert/update/delete/unchanged entries for every row in either dump."""
+    tables = list(tables) if tables is not None else None
+    partitions = partitions or partition_count(old_dump)
+    with tempfile.TemporaryDirectory(prefix="dumpdiff-", dir=spill_dir) as tmp:
+        work = Path(tmp)
+        with METRICS.phase("spill old"):
+            METRICS.count("dumpdiff_old_rows", _spill(old_dump, tables, work, "old", partitions))
+        with METRICS.phase("spill new"):
+            METRICS.count("dumpdiff_new_rows", _spill(new_dump, tables, work, "new", partitions))
+        with METRICS.phase("compare"):
+            for index in range(partitions):
+                yield from _compare_partition(work / f"old-{index}.ndjson", work / f"new-{index}.ndjson")
+
+
+def write_diff(
+    old_dump: str | Path,
+    new_dump: str | Path,
+    out: TextIO,
+    tables: Iterable[str] | None = None,
+    partitions: int | None = None,
+    spill_dir: str | Path | None = None,
+) -> dict[str, Counter]:
+    """Write the NDJSON diff to `out`; returns per-table op counts."""
+    partitions = partitions or partition_count(old_dump)
+    counts: dict[str, Counter] = {}
+    out.write(json.dumps({"type": "dumpdiff", "version": 1, "old": str(old_dump), "new": str(new_dump), "partitions": partitions}) + "\n")
+    for entry in iter_diff(old_dump, new_dump, tables, partitions, spill_dir):
+        counts.setdefault(entry["table"], Counter())[entry["op"]] += 1
+        if entry["op"] != "unchanged":
+            out.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+    out.write(json.dumps({"type": "end", "counts": {table: dict(ops) for table, ops in sorted(counts.items())}}) + "\n")
+    return counts
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Diff two MySQL dumps row by row into NDJSON inserts/updates/deletes")
+    parser.add_argument("old_dump")
+    parser.add_argument("new_dump")
+    parser.add_argument("-o", "--output", required=True, help="NDJSON diff path ('-' for stdout)")
+    parser.add_argument("--table", action="append", default=None, help="Only diff this table (repeatable)")
+    parser.add_argument("--partitions", type=int, default=0, help="Spill partitions (default: one per 32 MB of the old dump)")
+    parser.add_argument("--spill-dir", default=None, help="Directory for temporary spill files (default: system temp)")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
+    args = parser.parse_args()
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
+
+    if args.output == "-":
+        counts = write_diff(args.old_dump, args.new_dump, sys.stdout, args.table, args.partitions or None, args.spill_dir)
+    else:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as out:
+            counts = write_diff(args.old_dump, args.new_dump, out, args.table, args.partitions or None, args.spill_dir)
+    for table, ops in sorted(counts.items()):
+        summary = ", ".join(f"{op} {ops[op]}" for op in ("insert", "update", "delete", "unchanged"))
+        print(f"{table}: {summary}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
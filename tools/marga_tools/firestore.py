@@ -0,0 +1,703 @@
+"""Firestore REST helpers shared by the tools/ sync scripts.
+
+Covers the pieces every script used to carry its own copy of: config parsing,
+JSON requests with retry, the value codec (re-exported from marga_tools.codec),
+streamed collection reads, single document writes, and a batched, concurrent
+writer built on `:batchWrite`. Whole-collection reads can be shared within a
+process through `SNAPSHOTS` (see marga_tools.cli).
+"""
+
+from __future__ import annotations
+
+import codecs
+import functools
+import gzip
+import http.client
+import json
+import os
+import random
+import re
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+from marga_tools.codec import decode_document as fs_parse_doc, decode_value as fs_parse_value, encode_fields as fs_fields, encode_value as fs_field, gc_paused  # noqa: F401
+from marga_tools.metrics import METRICS
+
+INSECURE_TLS = False
+# Responses are always requested gzipped. Request bodies are only gzipped
+# when a script opts in (--gzip-requests): Google's front ends accept
+# `Content-Encoding: gzip`, but a local proxy may not. A 415 reply turns it
+# back off for the rest of the run.
+ACCEPT_GZIP = True
+GZIP_REQUEST_BODIES = False
+GZIP_MIN_BYTES = 8 * 1024
+GZIP_LEVEL = 6
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_ATTEMPTS = 5
+BATCH_WRITE_LIMIT = 500
+
+# google.rpc.Code values returned per write by :batchWrite.
+CODE_OK = 0
+CODE_NOT_FOUND = 5
+CODE_PERMISSION_DENIED = 7
+CODE_FAILED_PRECONDITION = 9
+
+# Billed operations are counted into METRICS under these names (see marga_tools.cost).
+READS_COUNTER = "firestore_reads"
+WRITES_COUNTER = "firestore_writes"
+DELETES_COUNTER = "firestore_deletes"
+
+# Set by marga_tools.cli so chained commands share whole-collection reads.
+SNAPSHOTS: "Snapshots | None" = None
+
+# The REST list call has no keys-only switch; masking to a field that no
+# document has returns just names and update times.
+KEYS_ONLY_MASK = ("_keys_only",)
+
+_SIMPLE_FIELD_PATH = re.compile(r"^[A-Za-z_][A-Za-z_0-9]*$")
+
+
+def parse_firebase_config(path: str) -> tuple[str, str]:
+    """(api key, base URL); MARGA_FIRESTORE_BASE_URL / MARGA_FIRESTORE_API_KEY override the file."""
+    override_url = os.environ.get("MARGA_FIRESTORE_BASE_URL", "").rstrip("/")
+    if override_url:
+        return os.environ.get("MARGA_FIRESTORE_API_KEY", "local"), override_url
+    return _read_firebase_config(str(Path(path).resolve()))
+
+
+@functools.lru_cache(maxsize=None)
+def _read_firebase_config(path: str) -> tuple[str, str]:
+    text = Path(path).read_text(encoding="utf-8")
+    api_key = re.search(r"apiKey:\s*'([^']+)'", text)
+    base_url = re.search(r"baseUrl:\s*'([^']+)'", text)
+    if not api_key or not base_url:
+        raise RuntimeError("Unable to parse shared/js/firebase-config.js")
+    return api_key.group(1), base_url.group(1)
+
+
+_SSL_CONTEXTS: dict[bool, ssl.SSLContext] = {}
+
+
+def _ssl_context() -> ssl.SSLContext:
+    """One context per process; urllib would otherwise load the CA bundle (~30 ms) for every connection."""
+    context = _SSL_CONTEXTS.get(INSECURE_TLS)
+    if context is None:
+        context = ssl._create_unverified_context() if INSECURE_TLS else ssl.create_default_context()
+        _SSL_CONTEXTS[INSECURE_TLS] = context
+    return context
+
+
+def _backoff(attempt: int) -> None:
+    time.sleep(min(8.0, 0.25 * (2 ** attempt)) * (0.5 + random.random() / 2))
+
+
+def _encode_body(data: bytes | None, headers: dict[str, str]) -> tuple[bytes | None, dict[str, str]]:
+    """Gzip a large request body when GZIP_REQUEST_BODIES is on."""
+    if data is None or not GZIP_REQUEST_BODIES or len(data) < GZIP_MIN_BYTES:
+        return data, headers
+    started = time.perf_counter()
+    compressed = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    METRICS.count("gzip_compress_s", time.perf_counter() - started)
+    return compressed, {**headers, "Content-Encoding": "gzip"}
+
+
+def _read_body(resp: Any) -> tuple[bytes, int]:
+    """(decoded body, bytes on the wire)."""
+    body = resp.read()
+    if resp.headers.get("Content-Encoding") != "gzip":
+        return body, len(body)
+    started = time.perf_counter()
+    decoded = gzip.decompress(body)
+    METRICS.count("gzip_decompress_s", time.perf_counter() - started)
+    return decoded, len(body)
+
+
+def _refused_gzip(err: urllib.error.HTTPError, headers: dict[str, str]) -> bool:
+    """True (and gzip bodies switched off) when the endpoint rejects them."""
+    global GZIP_REQUEST_BODIES
+    if err.code == 415 and headers.get("Content-Encoding") == "gzip":
+        GZIP_REQUEST_BODIES = False
+        return True
+    return False
+
+
+def request_json(url: str, method: str = "GET", payload: dict[str, Any] | None = None, timeout: float = 60) -> Any:
+    """Send a JSON request, retrying throttling, 5xx and connection errors."""
+    raw = None
+    headers = {"Accept-Encoding": "gzip"} if ACCEPT_GZIP else {}
+    if payload is not None:
+        raw = json.dumps(payload).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    data, headers = _encode_body(raw, headers)
+    raw_out = len(raw or b"")
+    if SNAPSHOTS is not None and method in ("PATCH", "DELETE"):
+        SNAPSHOTS.invalidate_url(url)
+    started = time.perf_counter()
+    for attempt in range(MAX_ATTEMPTS):
+        req = urllib.request.Request(url, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout, context=_ssl_context()) as resp:
+                body, wire_in = _read_body(resp)
+            METRICS.record_request(method, url, time.perf_counter() - started, wire_in, len(data or b""), True, attempt, len(body), raw_out)
+            text = body.decode("utf-8")
+            return json.loads(text) if text else {}
+        except urllib.error.HTTPError as err:
+            if _refused_gzip(err, headers):
+                headers = {key: value for key, value in headers.items() if key != "Content-Encoding"}
+                data = raw
+                continue
+            if err.code not in RETRY_STATUSES or attempt == MAX_ATTEMPTS - 1:
+                METRICS.record_request(method, url, time.perf_counter() - started, 0, len(data or b""), False, attempt)
+                raise
+        except urllib.error.URLError:
+            if attempt == MAX_ATTEMPTS - 1:
+                METRICS.record_request(method, url, time.perf_counter() - started, 0, len(data or b""), False, attempt)
+                raise
+        _backoff(attempt)
+    raise AssertionError("unreachable")
+
+
+def request_empty(url: str, method: str) -> None:
+    request_json(url, method=method)
+
+
+def quote_field_path(name: str) -> str:
+    if _SIMPLE_FIELD_PATH.match(name):
+        return name
+    return "`" + name.replace("\\", "\\\\").replace("`", "\\`") + "`"
+
+
+def document_url(base_url: str, api_key: str, collection: str, doc_id: str) -> str:
+    return f"{base_url}/{collection}/{urllib.parse.quote(str(doc_id), safe='')}?key={api_key}"
+
+
+def document_name(base_url: str, collection: str, doc_id: str) -> str:
+    """Full resource name (`projects/.../documents/<collection>/<id>`) for batch writes."""
+    path = urllib.parse.urlsplit(base_url).path
+    root = path.split("/v1/", 1)[1] if "/v1/" in path else path.lstrip("/")
+    return f"{root}/{collection}/{doc_id}"
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_JSON = json.JSONDecoder()
+
+
+class PageStream:
+    """Incremental parser for one `{"documents": [...], "nextPageToken": ...}` page.
+
+    Iterating yields the elements of the `key` array as each one is complete
+    in the byte stream, so only the current document (plus one read chunk)
+    is held as text. Every other top-level member is collected into `meta`
+    once iteration finishes.
+    """
+
+    def __init__(self, read: Callable[[int], bytes], key: str = "documents", chunk_size: int = 1 << 16) -> None:
+        self._read = read
+        self.key = key
+        self.chunk_size = chunk_size
+        self.meta: dict[str, Any] = {}
+        self.bytes_read = 0
+        self._text = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> None:
+        if self._eof:
+            return
+        chunk = self._read(self.chunk_size)
+        if self._pos > self.chunk_size:
+            self._buf, self._pos = self._buf[self._pos:], 0
+        if not chunk:
+            self._eof = True
+            self._buf += self._text.decode(b"", final=True)
+            return
+        self.bytes_read += len(chunk)
+        self._buf += self._text.decode(chunk)
+
+    def _peek(self) -> str:
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if self._eof:
+                raise json.JSONDecodeError("Unexpected end of page", self._buf, self._pos)
+            self._fill()
+
+    def _take(self, allowed: str) -> str:
+        char = self._peek()
+        if char not in allowed:
+            raise json.JSONDecodeError(f"Expecting one of {allowed!r}", self._buf, self._pos)
+        self._pos += 1
+        return char
+
+    def _value(self) -> Any:
+        self._peek()
+        while True:
+            pending = len(self._buf) - self._pos
+            try:
+                value, end = _JSON.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            else:
+                # A value that ends exactly at the buffer edge may be a cut-off number.
+                if end < len(self._buf) or self._eof:
+                    self._pos = end
+                    return value
+            # Grow the unparsed tail geometrically so a huge document is
+            # re-scanned O(log n) times, not once per chunk.
+            while not self._eof and len(self._buf) - self._pos < max(2 * pending, pending + self.chunk_size):
+                self._fill()
+
+    def __iter__(self) -> Iterator[Any]:
+        self._take("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            name = self._value()
+            self._take(":")
+            if name == self.key:
+                self._take("[")
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._take(",]") == "]":
+                            break
+            else:
+                self.meta[name] = self._value()
+            if self._take(",}") == "}":
+                return
+
+
+class GunzipReader:
+    """`read(n)` over a gzip-encoded response, decompressing as it goes."""
+
+    def __init__(self, read: Callable[[int], bytes]) -> None:
+        self._read = read
+        self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.wire_bytes = 0
+        self.seconds = 0.0
+
+    def read(self, size: int) -> bytes:
+        while True:
+            chunk = self._read(size)
+            if not chunk:
+                return self._inflate.flush()
+            self.wire_bytes += len(chunk)
+            started = time.perf_counter()
+            out = self._inflate.decompress(chunk)
+            self.seconds += time.perf_counter() - started
+            if out:
+                return out
+
+
+def stream_documents(url: str, meta: dict[str, Any], key: str = "documents", timeout: float = 60) -> Iterator[dict[str, Any]]:
+    """GET a page and yield its `key` array elements while the body downloads.
+
+    Retries like `request_json`. If the connection drops mid-page, the page
+    is requested again and the elements already yielded are skipped.
+    """
+    headers = {"Accept-Encoding": "gzip"} if ACCEPT_GZIP else {}
+    yielded = 0
+    started = time.perf_counter()
+    for attempt in range(MAX_ATTEMPTS):
+        stream: PageStream | None = None
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers, method="GET"), timeout=timeout, context=_ssl_context()) as resp:
+                gunzip = GunzipReader(resp.read) if resp.headers.get("Content-Encoding") == "gzip" else None
+                stream = PageStream(gunzip.read if gunzip else resp.read, key)
+                for index, item in enumerate(stream):
+                    if index >= yielded:
+                        yielded += 1
+                        yield item
+            meta.update(stream.meta)
+            if gunzip is not None:
+                METRICS.count("gzip_decompress_s", gunzip.seconds)
+            wire_in = gunzip.wire_bytes if gunzip else stream.bytes_read
+            METRICS.record_request("GET", url, time.perf_counter() - started, wire_in, 0, True, attempt, stream.bytes_read)
+            return
+        except urllib.error.HTTPError as err:
+            if err.code not in RETRY_STATUSES or attempt == MAX_ATTEMPTS - 1:
+                METRICS.record_request("GET", url, time.perf_counter() - started, 0, 0, False, attempt)
+                raise
+        except (urllib.error.URLError, ConnectionError, TimeoutError, http.client.HTTPException, zlib.error):
+            if attempt == MAX_ATTEMPTS - 1:
+                METRICS.record_request("GET", url, time.perf_counter() - started, stream.bytes_read if stream else 0, 0, False, attempt)
+                raise
+        _backoff(attempt)
+    raise AssertionError("unreachable")
+
+
+def iter_collection(
+    base_url: str,
+    api_key: str,
+    collection: str,
+    page_size: int = 1000,
+    update_times: dict[str, str] | None = None,
+    on_raw: Callable[[dict[str, Any]], None] | None = None,
+    mask: Iterable[str] | None = None,
+) -> Iterator[dict[str, Any]]:
+    """Yield a collection's documents, decoded, as they stream in.
+
+    Doc update times go into `update_times` when given, and `on_raw` sees each
+    document as Firestore returned it (used to stream backups while paging).
+    `mask` limits the fields returned.
+    """
+    token = ""
+    mask_params = [("mask.fieldPaths", quote_field_path(path)) for path in mask or ()]
+    while True:
+        params = [("pageSize", str(page_size)), ("key", api_key), *([("pageToken", token)] if token else []), *mask_params]
+        query = urllib.parse.urlencode(params)
+        meta: dict[str, Any] = {}
+        returned = 0
+        for doc in stream_documents(f"{base_url}/{collection}?{query}", meta):
+            returned += 1
+            if on_raw is not None:
+                on_raw(doc)
+            parsed = fs_parse_doc(doc)
+            if update_times is not None and doc.get("updateTime"):
+                update_times[parsed["_docId"]] = doc["updateTime"]
+            yield parsed
+        # An empty page is still billed as one read.
+        METRICS.count(READS_COUNTER, max(1, returned))
+        token = meta.get("nextPageToken") or ""
+        if not token:
+            return
+
+
+def iter_document_ids(base_url: str, api_key: str, collection: str, page_size: int = 1000) -> Iterator[str]:
+    """Yield a collection's document ids without downloading their fields."""
+    for doc in iter_collection(base_url, api_key, collection, page_size, mask=KEYS_ONLY_MASK):
+        yield doc["_docId"]
+
+
+def fetch_collection(
+    base_url: str,
+    api_key: str,
+    collection: str,
+    page_size: int = 1000,
+    update_times: dict[str, str] | None = None,
+    on_raw: Callable[[dict[str, Any]], None] | None = None,
+) -> list[dict[str, Any]]:
+    """Read a whole collection into a list (see `iter_collection`), or replay it from `SNAPSHOTS`."""
+    snapshots = SNAPSHOTS
+    raw = snapshots.get(base_url, collection) if snapshots is not None else None
+    # Decoded documents are acyclic; collecting while they pile up only
+    # re-scans them (see marga_tools.codec).
+    with gc_paused():
+        if raw is not None:
+            METRICS.count("snapshot_hits")
+            return list(_replay(raw, update_times, on_raw))
+        if snapshots is None:
+            return list(iter_collection(base_url, api_key, collection, page_size, update_times, on_raw))
+        raw = []
+
+        def keep(doc: dict[str, Any]) -> None:
+            raw.append(doc)
+            if on_raw is not None:
+                on_raw(doc)
+
+        docs = list(iter_collection(base_url, api_key, collection, page_size, update_times, keep))
+    snapshots.put(base_url, collection, raw)
+    return docs
+
+
+def _replay(raw: list[dict[str, Any]], update_times: dict[str, str] | None, on_raw: Callable[[dict[str, Any]], None] | None) -> Iterator[dict[str, Any]]:
+    for doc in raw:
+        if on_raw is not None:
+            on_raw(doc)
+        parsed = fs_parse_doc(doc)
+        if update_times is not None and doc.get("updateTime"):
+            update_times[parsed["_docId"]] = doc["updateTime"]
+        yield parsed
+
+
+class Snapshots:
+    """Whole collections as first read, for `fetch_collection` to replay within one process.
+
+    The raw REST documents are kept and decoded afresh for every reader, so
+    one command's edits to its docs never reach the next. A collection is
+    dropped as soon as this process writes to it (PATCH, DELETE or
+    `BulkWriter`). Edits made elsewhere after the first read are not seen.
+    """
+
+    def __init__(self) -> None:
+        self._raw: dict[tuple[str, str], list[dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, base_url: str, collection: str) -> list[dict[str, Any]] | None:
+        with self._lock:
+            return self._raw.get((base_url.rstrip("/"), collection))
+
+    def put(self, base_url: str, collection: str, raw: list[dict[str, Any]]) -> None:
+        with self._lock:
+            self._raw[(base_url.rstrip("/"), collection)] = raw
+
+    def invalidate(self, collection: str) -> None:
+        with self._lock:
+            for key in [key for key in self._raw if key[1] == collection]:
+                del self._raw[key]
+
+    def invalidate_url(self, url: str) -> None:
+        """Drop the collection a document URL points into."""
+        path = urllib.parse.urlsplit(url).path
+        if "/documents/" in path:
+            self.invalidate(urllib.parse.unquote(path.split("/documents/", 1)[1].split("/", 1)[0]))
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+
+def run_query(base_url: str, api_key: str, structured_query: dict[str, Any]) -> list[dict[str, Any]]:
+    """Decoded documents matching a `:runQuery` structured query."""
+    rows = request_json(f"{base_url}:runQuery?key={api_key}", method="POST", payload={"structuredQuery": structured_query})
+    docs = [fs_parse_doc(row["document"]) for row in rows or [] if row.get("document")]
+    METRICS.count(READS_COUNTER, max(1, len(docs)))
+    return docs
+
+
+def run_aggregation(base_url: str, api_key: str, structured_query: dict[str, Any], aggregations: list[dict[str, Any]]) -> dict[str, Any]:
+    """Decoded aggregate values by alias, e.g. `[{"alias": "n", "count": {}}]` -> `{"n": 12}`."""
+    payload = {"structuredAggregationQuery": {"structuredQuery": structured_query, "aggregations": aggregations}}
+    rows = request_json(f"{base_url}:runAggregationQuery?key={api_key}", method="POST", payload=payload)
+    fields = ((rows or [{}])[0].get("result") or {}).get("aggregateFields") or {}
+    values = {alias: fs_parse_value(value) for alias, value in fields.items()}
+    # Billed one read per (started) 1000 index entries scanned.
+    counted = max((values.get(spec.get("alias")) or 0 for spec in aggregations if "count" in spec), default=0)
+    METRICS.count(READS_COUNTER, 1 + max(0, int(counted) - 1) // 1000)
+    return values
+
+
+class PreconditionFailed(RuntimeError):
+    """A write's `currentDocument` precondition no longer held: the doc changed, appeared or vanished."""
+
+
+# REST statuses for a precondition that no longer holds (updateTime, exists=true, exists=false).
+_PRECONDITION_STATUSES = ("FAILED_PRECONDITION", "NOT_FOUND", "ALREADY_EXISTS")
+
+
+def _error_status(err: urllib.error.HTTPError) -> str:
+    try:
+        return str((json.loads(_read_body(err)[0] or b"{}").get("error") or {}).get("status") or "")
+    except (ValueError, AttributeError, OSError, EOFError):
+        return ""
+
+
+def error_message(err: urllib.error.HTTPError) -> str:
+    """The `error.message` of a REST error response, gzipped or not; a non-JSON body's text; else `str(err)`."""
+    try:
+        text = _read_body(err)[0].decode("utf-8", errors="replace")
+    except (OSError, EOFError):
+        return str(err)
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        return text or str(err)
+    error = parsed.get("error") if isinstance(parsed, dict) else None
+    return str((error.get("message") if isinstance(error, dict) else None) or err)
+
+
+def _precondition_params(precondition: dict[str, Any] | None) -> str:
+    if not precondition:
+        return ""
+    if "exists" in precondition:
+        return "&currentDocument.exists=" + ("true" if precondition["exists"] else "false")
+    return "&" + urllib.parse.urlencode({"currentDocument.updateTime": precondition["updateTime"]})
+
+
+def set_document(
+    base_url: str,
+    api_key: str,
+    collection: str,
+    doc_id: str,
+    fields: dict[str, Any],
+    precondition: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    """Replace a document; returns it as written (with its new `updateTime`).
+
+    With a `precondition` (see changeset.precondition_for), a document that
+    no longer matches raises PreconditionFailed instead of being overwritten.
+    """
+    url = document_url(base_url, api_key, collection, doc_id) + _precondition_params(precondition)
+    try:
+        written = request_json(url, method="PATCH", payload={"fields": fs_fields(fields)})
+    except urllib.error.HTTPError as err:
+        if precondition and err.code in (400, 404, 409, 412) and _error_status(err) in _PRECONDITION_STATUSES:
+            raise PreconditionFailed(f"{collection}/{doc_id} changed since it was read") from err
+        raise
+    METRICS.count(WRITES_COUNTER)
+    return written
+
+
+def batch_get(
+    base_url: str,
+    api_key: str,
+    collection: str,
+    doc_ids: Iterable[str],
+    update_times: dict[str, str] | None = None,
+    chunk_size: int = 100,
+) -> dict[str, dict[str, Any] | None]:
+    """Decoded documents by id through `:batchGet`; missing ones map to None."""
+    ids = [str(doc_id) for doc_id in doc_ids]
+    out: dict[str, dict[str, Any] | None] = {}
+    for start in range(0, len(ids), chunk_size):
+        names = [document_name(base_url, collection, doc_id) for doc_id in ids[start:start + chunk_size]]
+        rows = request_json(f"{base_url}:batchGet?key={api_key}", method="POST", payload={"documents": names}) or []
+        METRICS.count(READS_COUNTER, len(rows))
+        for row in rows:
+            if row.get("found"):
+                parsed = fs_parse_doc(row["found"])
+                out[parsed["_docId"]] = parsed
+                if update_times is not None and row["found"].get("updateTime"):
+                    update_times[parsed["_docId"]] = row["found"]["updateTime"]
+            elif row.get("missing"):
+                out[str(row["missing"]).rsplit("/", 1)[-1]] = None
+    return out
+
+
+def delete_document(base_url: str, api_key: str, collection: str, doc_id: str) -> None:
+    request_empty(document_url(base_url, api_key, collection, doc_id), method="DELETE")
+    METRICS.count(DELETES_COUNTER)
+
+
+@dataclass
+class WriteResult:
+    op: str
+    collection: str
+    doc_id: str
+    code: int
+    message: str = ""
+    tag: Any = None
+
+    @property
+    def ok(self) -> bool:
+        return self.code == CODE_OK
+
+
+class BulkWriter:
+    """Groups writes into `:batchWrite` calls and sends several batches at once.
+
+    `:batchWrite` is not atomic: each write gets its own status, which is
+    reported through `on_result` (called under a lock, so callers can append
+    to a journal without their own locking) and collected in `failures`.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        batch_size: int = 200,
+        workers: int = 4,
+        on_result: Callable[[WriteResult], None] | None = None,
+    ) -> None:
+        self.base_url = base_url
+        self.api_key = api_key
+        self.batch_size = max(1, min(batch_size, BATCH_WRITE_LIMIT))
+        self.on_result = on_result
+        self.failures: list[WriteResult] = []
+        self.written = 0
+        self._pending: list[tuple[dict[str, Any], WriteResult]] = []
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._slots = threading.BoundedSemaphore(max(1, workers) * 2)
+        self._lock = threading.Lock()
+        self._futures: list[Future] = []
+
+    def update(
+        self,
+        collection: str,
+        doc_id: str,
+        fields: dict[str, Any],
+        mask: list[str] | None = None,
+        precondition: dict[str, Any] | None = None,
+        encoded: bool = False,
+        tag: Any = None,
+    ) -> None:
+        write: dict[str, Any] = {
+            "update": {
+                "name": document_name(self.base_url, collection, doc_id),
+                "fields": fields if encoded else fs_fields(fields),
+            }
+        }
+        if mask is not None:
+            write["updateMask"] = {"fieldPaths": [quote_field_path(name) for name in mask]}
+        if precondition:
+            write["currentDocument"] = precondition
+        self._add(write, WriteResult("update", collection, str(doc_id), CODE_OK, tag=tag))
+
+    def delete(self, collection: str, doc_id: str, precondition: dict[str, Any] | None = None, tag: Any = None) -> None:
+        write: dict[str, Any] = {"delete": document_name(self.base_url, collection, doc_id)}
+        if precondition:
+            write["currentDocument"] = precondition
+        self._add(write, WriteResult("delete", collection, str(doc_id), CODE_OK, tag=tag))
+
+    def _add(self, write: dict[str, Any], result: WriteResult) -> None:
+        if SNAPSHOTS is not None:
+            SNAPSHOTS.invalidate(result.collection)
+        self._pending.append((write, result))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        # Bound the number of batches in flight so a long plan cannot queue
+        # every encoded write in memory at once.
+        self._slots.acquire()
+        future = self._pool.submit(self._send, batch)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _send(self, batch: list[tuple[dict[str, Any], WriteResult]]) -> None:
+        url = f"{self.base_url}:batchWrite?key={self.api_key}"
+        try:
+            response = request_json(url, method="POST", payload={"writes": [write for write, _ in batch]})
+            statuses = response.get("status") or []
+        except urllib.error.HTTPError as err:
+            statuses = [{"code": _http_to_rpc_code(err.code), "message": str(err)}] * len(batch)
+        with self._lock:
+            for index, (_, result) in enumerate(batch):
+                status = statuses[index] if index < len(statuses) else {}
+                result.code = int(status.get("code") or CODE_OK)
+                result.message = str(status.get("message") or "")
+                if result.ok:
+                    self.written += 1
+                    METRICS.count(DELETES_COUNTER if result.op == "delete" else WRITES_COUNTER)
+                else:
+                    self.failures.append(result)
+                if self.on_result:
+                    self.on_result(result)
+
+    def wait(self) -> None:
+        """Send what is pending and wait until every batch in flight has reported."""
+        self.flush()
+        for future in self._futures:
+            future.result()
+        self._futures.clear()
+
+    def close(self) -> None:
+        self.wait()
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self) -> "BulkWriter":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+def _http_to_rpc_code(status: int) -> int:
+    return {400: 3, 403: CODE_PERMISSION_DENIED, 404: CODE_NOT_FOUND, 409: 10, 412: CODE_FAILED_PRECONDITION}.get(status, 13)
@@ -0,0 +1,248 @@
+"""Find which dump rows are missing from Firestore, and which docs have no row.
+
+Primary keys are streamed out of the dump (only the key column is kept)
+and Firestore ids are listed keys-only, so neither side's fields are ever
+held. Numeric ids are collected into `array('q')` (8 bytes each) and
+compared as bitmaps over their span: one bit per possible id, then AND-NOT
+on the two bitmaps as Python ints. A million-row table takes a few
+hundred KB of bitmap plus the two arrays. If the ids are too sparse for a
+bitmap, the comparison falls back to merging the sorted arrays. Any
+non-numeric ids are compared as plain sets.
+
+Results are inclusive id ranges:
+
+  {"table": "tbl_branchinfo", "collection": "tbl_branchinfo",
+   "dump_count": 5300, "firestore_count": 3812,
+   "missing": [[3813, 5300]], "extra": [], "missing_other": [], "extra_other": []}
+
+  python3 -m marga_tools.gaps --dump Dump20260218.sql --table tbl_branchinfo
+"""
+
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import re
+import sys
+from array import array
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+from marga_tools.firestore import iter_document_ids, parse_firebase_config
+from marga_tools.metrics import METRICS
+from marga_tools.mysqldump import iter_inserts
+
+# Use a bitmap while it costs at most this many bits per id (or is small anyway).
+BITMAP_BITS_PER_ID = 64
+BITMAP_MIN_BITS = 1 << 24
+
+_NONZERO = re.compile(rb"[^\x00]+")
+
+
+class IdSet:
+    """Ids split into canonical integers (`"12"`, not `"012"`) and everything else."""
+
+    def __init__(self, ids: Iterable[Any] = ()) -> None:
+        self.numbers = array("q")
+        self.other: set[str] = set()
+        for value in ids:
+            self.add(value)
+
+    def add(self, value: Any) -> None:
+        if isinstance(value, int) and not isinstance(value, bool):
+            self.numbers.append(value)
+            return
+        text = str(value)
+        if text.isdigit() and str(int(text)) == text:
+            self.numbers.append(int(text))
+        else:
+            self.other.add(text)
+
+    def __len__(self) -> int:
+        return len(self.numbers) + len(self.other)
+
+
+def _bitmap(numbers: array, low: int, size: int) -> int:
+    bits = bytearray((size + 7) // 8)
+    for number in numbers:
+        offset = number - low
+        bits[offset >> 3] |= 1 << (offset & 7)
+    return int.from_bytes(bits, "little")
+
+
+def _bitmap_ranges(bits: int, low: int, size: int) -> list[list[int]]:
+    ranges: list[list[int]] = []
+    data = bits.to_bytes((size + 7) // 8, "little")
+    # Walk only the non-zero stretches; whole 0xFF bytes extend a range by 8.
+    for stretch in _NONZERO.finditer(data):
+        for index in range(stretch.start(), stretch.end()):
+            byte = data[index]
+            base = low + index * 8
+            if byte == 0xFF:
+                _extend(ranges, base, base + 7)
+                continue
+            for bit in range(8):
+                if byte >> bit & 1:
+                    _extend(ranges, base + bit, base + bit)
+    return ranges
+
+
+def _extend(ranges: list[list[int]], start: int, end: int) -> None:
+    if ranges and ranges[-1][1] == start - 1:
+        ranges[-1][1] = end
+    else:
+        ranges.append([start, end])
+
+
+def to_ranges(values: Iterable[int]) -> list[list[int]]:
+    """Inclusive ranges covering ascending `values`."""
+    ranges: list[list[int]] = []
+    for value in values:
+        _extend(ranges, value, value)
+    return ranges
+
+
+def _merge_ranges(left: list[int], right: list[int]) -> tuple[list[list[int]], list[list[int]]]:
+    only_left: list[list[int]] = []
+    only_right: list[list[int]] = []
+    i = j = 0
+    while i < len(left) or j < len(right):
+        if j == len(right) or (i < len(left) and left[i] < right[j]):
+            _extend(only_left, left[i], left[i])
+            i += 1
+        elif i == len(left) or right[j] < left[i]:
+            _extend(only_right, right[j], right[j])
+            j += 1
+        else:
+            i += 1
+            j += 1
+    return only_left, only_right
+
+
+def compare_numbers(left: array, right: array) -> tuple[list[list[int]], list[list[int]]]:
+    """(ranges only in `left`, ranges only in `right`); duplicates are ignored."""
+    if not left and not right:
+        return [], []
+    bounds = [edge(side) for side in (left, right) if side for edge in (min, max)]
+    low, high = min(bounds), max(bounds)
+    size = high - low + 1
+    if size > max(BITMAP_MIN_BITS, BITMAP_BITS_PER_ID * (len(left) + len(right))):
+        return _merge_ranges(sorted(set(left)), sorted(set(right)))
+    a = _bitmap(left, low, size)
+    b = _bitmap(right, low, size)
+    return _bitmap_ranges(a & ~b, low, size), _bitmap_ranges(b & ~a, low, size)
+
+
+def range_count(ranges: Iterable[list[int]]) -> int:
+    return sum(end - start + 1 for start, end in ranges)
+
+
+def in_ranges(ranges: list[list[int]]) -> Callable[[int], bool]:
+    """Membership test over sorted inclusive ranges."""
+    starts = [start for start, _ in ranges]
+
+    def contains(value: int) -> bool:
+        index = bisect.bisect_right(starts, value) - 1
+        return index >= 0 and value <= ranges[index][1]
+
+    return contains
+
+
+def dump_ids(path: str | Path, table: str) -> IdSet:
+    ids = IdSet()
+    for schema, rows in iter_inserts(path, [table]):
+        key = schema.key_columns()
+        if len(key) != 1:
+            raise ValueError(f"{table} has a composite primary key; gap detection needs a single id column")
+        index = schema.columns.index(key[0])
+        for values in rows:
+            ids.add(values[index])
+    return ids
+
+
+def firestore_ids(base_url: str, api_key: str, collection: str, page_size: int = 1000) -> IdSet:
+    return IdSet(iter_document_ids(base_url, api_key, collection, page_size))
+
+
+@dataclass
+class GapReport:
+    table: str
+    collection: str
+    dump_count: int
+    firestore_count: int
+    missing: list[list[int]] = field(default_factory=list)
+    extra: list[list[int]] = field(default_factory=list)
+    missing_other: list[str] = field(default_factory=list)
+    extra_other: list[str] = field(default_factory=list)
+
+    @property
+    def missing_count(self) -> int:
+        return range_count(self.missing) + len(self.missing_other)
+
+    @property
+    def extra_count(self) -> int:
+        return range_count(self.extra) + len(self.extra_other)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**asdict(self), "missing_count": self.missing_count, "extra_count": self.extra_count}
+
+
+def compare(table: str, collection: str, source: IdSet, target: IdSet) -> GapReport:
+    missing, extra = compare_numbers(source.numbers, target.numbers)
+    return GapReport(
+        table,
+        collection,
+        len(source),
+        len(target),
+        missing,
+        extra,
+        sorted(source.other - target.other),
+        sorted(target.other - source.other),
+    )
+
+
+def find_gaps(dump_path: str | Path, table: str, base_url: str, api_key: str, collection: str | None = None) -> GapReport:
+    collection = collection or table
+    with METRICS.phase("dump ids"):
+        source = dump_ids(dump_path, table)
+    with METRICS.phase("firestore ids"):
+        target = firestore_ids(base_url, api_key, collection)
+    with METRICS.phase("compare"):
+        return compare(table, collection, source, target)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Report dump rows missing from Firestore (and docs with no dump row) as id ranges")
+    parser.add_argument("--dump", required=True)
+    parser.add_argument("--table", action="append", required=True, help="Dump table to check (repeatable)")
+    parser.add_argument("--collection", action="append", default=None, help="Firestore collection for each --table (default: same name)")
+    parser.add_argument("--output", default="", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings and request metrics here at exit")
+    args = parser.parse_args()
+    METRICS.write_at_exit(args.metrics_json)
+    if args.collection and len(args.collection) != len(args.table):
+        parser.error("--collection must be given once per --table")
+
+    api_key, base_url = parse_firebase_config("shared/js/firebase-config.js")
+    reports = []
+    for index, table in enumerate(args.table):
+        collection = args.collection[index] if args.collection else table
+        report = find_gaps(args.dump, table, base_url, api_key, collection)
+        print(
+            f"{table} -> {collection}: {report.dump_count} in dump, {report.firestore_count} in Firestore, "
+            f"{report.missing_count} missing in {len(report.missing)} ranges, {report.extra_count} extra",
+            file=sys.stderr,
+        )
+        reports.append(report.to_dict())
+    text = json.dumps(reports if len(reports) > 1 else reports[0], indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
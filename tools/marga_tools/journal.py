@@ -0,0 +1,132 @@
+"""Append-only journal of applied writes so an interrupted run can resume.
+
+Each completed write appends one NDJSON line `{"phase", "id", "hash"}`. The
+first line and any later `"type": "meta"` lines hold run metadata such as the
+stamp and backup path. A resumed run reuses them so its recomputed documents
+hash the same as the original run's.
+
+A resume is refused when the journal was written for different inputs (the
+`inputs` meta keys differ). A fresh run never truncates an earlier journal:
+it is moved aside to `<name>.<n>` first.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Iterable
+
+
+def content_hash(fields: dict[str, Any], exclude: Iterable[str] = ()) -> str:
+    """Stable digest of a document's fields, ignoring keys in `exclude`."""
+    skipped = set(exclude)
+    canonical = json.dumps(
+        {key: value for key, value in fields.items() if key not in skipped},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+class JournalMismatch(RuntimeError):
+    pass
+
+
+def rotate(path: Path) -> Path | None:
+    """Move a non-empty `path` aside to the first free `<name>.<n>`; where it went."""
+    if not path.exists() or not path.stat().st_size:
+        return None
+    n = 1
+    while path.with_name(f"{path.name}.{n}").exists():
+        n += 1
+    target = path.with_name(f"{path.name}.{n}")
+    os.replace(path, target)
+    return target
+
+
+class RunJournal:
+    def __init__(
+        self,
+        path: str | Path,
+        meta: dict[str, Any] | None = None,
+        resume: bool = False,
+        inputs: Iterable[str] = (),
+    ) -> None:
+        """Open `path` for a new run, or with `resume`, continue the one recorded there.
+
+        Raises JournalMismatch when resuming a journal whose `inputs` meta
+        values (say the dump and roster paths) differ from `meta`'s.
+        """
+        self.path = Path(path)
+        self.meta: dict[str, Any] = {}
+        self.applied: dict[tuple[str, str], str] = {}
+        self.rotated: Path | None = None
+        if resume and self.path.exists():
+            self._load()
+            wanted = meta or {}
+            for key in inputs:
+                if self.meta.get(key) != wanted.get(key):
+                    raise JournalMismatch(f"Journal {self.path} was written for {key} {self.meta.get(key)!r}, not {wanted.get(key)!r}; refusing to resume")
+            self._fh = self.path.open("a", encoding="utf-8")
+            if self.path.stat().st_size and not self.path.read_bytes().endswith(b"\n"):
+                self._fh.write("\n")
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.rotated = rotate(self.path)
+            self.meta = dict(meta or {})
+            self._fh = self.path.open("w", encoding="utf-8")
+            self._append({"type": "run", **self.meta})
+        self.resumed = bool(resume and self.applied)
+
+    def _load(self) -> None:
+        with self.path.open("r", encoding="utf-8") as fh:
+            for line in fh:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write leaves at most one torn line at the end.
+                    continue
+                if entry.get("type") in ("run", "meta"):
+                    self.meta.update((key, value) for key, value in entry.items() if key != "type")
+                    continue
+                self.applied[(entry["phase"], str(entry["id"]))] = entry.get("hash", "")
+
+    def _append(self, entry: dict[str, Any]) -> None:
+        self._fh.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def set_meta(self, **values: Any) -> None:
+        self.meta.update(values)
+        self._append({"type": "meta", **values})
+
+    def is_applied(self, phase: str, doc_id: Any, digest: str | None = None) -> bool:
+        """True when `doc_id` was written in `phase` (with the same digest, if given)."""
+        recorded = self.applied.get((phase, str(doc_id)))
+        if recorded is None:
+            return False
+        return digest is None or recorded == digest
+
+    def record(self, phase: str, doc_id: Any, digest: str = "") -> None:
+        self.applied[(phase, str(doc_id))] = digest
+        self._append({"phase": phase, "id": str(doc_id), "hash": digest})
+
+    def count(self, phase: str) -> int:
+        return sum(1 for recorded_phase, _ in self.applied if recorded_phase == phase)
+
+    def close(self) -> None:
+        if not self._fh.closed:
+            self._fh.close()
+
+    def __enter__(self) -> "RunJournal":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
@@ -0,0 +1,383 @@
+"""Phase timing and HTTP request instrumentation for the tools scripts.
+
+Every script shares the module-level `METRICS` recorder. Phases are timed
+either as blocks (`with METRICS.phase("fetch tbl_employee"):`) or, for the
+straight-line `main()` functions, with `METRICS.start_phase("match")`, which
+closes the previous sequential phase. The shared Firestore
+request layer records each HTTP call. `--metrics-json PATH` on a script
+calls `write_at_exit(PATH)` so the summary is written even when a run fails.
+A runner that calls several scripts' `main()` in one process (marga_tools.cli)
+calls `finish_run()` after each, which writes that script's summary then,
+and `reset()` before the next, so each one reports only its own figures.
+
+Byte counts are as sent on the wire; `body_bytes_*` are the uncompressed
+sizes, and a `compression` section reports the gzip ratio and an estimate
+of the transfer time it saved.
+
+Latency histograms use fixed millisecond bucket bounds, so summaries from
+different runs can be compared bucket by bucket.
+
+`--profile-memory` calls `METRICS.profile_memory()`, which starts tracemalloc
+and adds a per-phase `memory` section to the same summary: the phase's own
+peak of traced (Python-allocated) memory, top allocation sites, live object
+counts, and the process's peak RSS so far. The OS only reports a lifetime
+RSS peak, so that figure repeats across phases once the largest one is
+past; the traced peak is the per-phase measure.
+"""
+
+from __future__ import annotations
+
+import atexit
+import gc
+import json
+import sys
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows has no resource module
+    resource = None
+
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class RequestStats:
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.body_bytes_in = 0
+        self.body_bytes_out = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, elapsed_ms: float, bytes_in: int, bytes_out: int, ok: bool, retries: int, body_in: int, body_out: int) -> None:
+        self.count += 1
+        self.errors += 0 if ok else 1
+        self.retries += retries
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.body_bytes_in += body_in
+        self.body_bytes_out += body_out
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for index, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[index] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bucket bound holding the q-th request (an upper estimate)."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return float(LATENCY_BUCKETS_MS[index]) if index < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "body_bytes_in": self.body_bytes_in,
+            "body_bytes_out": self.body_bytes_out,
+            "total_ms": round(self.total_ms, 1),
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else None,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "max_ms": round(self.max_ms, 1),
+            "histogram_ms": {
+                **{f"<={bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)},
+                f">{LATENCY_BUCKETS_MS[-1]}": self.buckets[-1],
+            },
+        }
+
+
+def process_peak_rss_bytes() -> int | None:
+    """The process's peak RSS since it started (not per phase); None where unsupported."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryProfiler:
+    """tracemalloc snapshots at phase boundaries.
+
+    The traced peak is reset when each phase starts. A nested phase resets
+    it too, so the peak seen so far is first folded into every enclosing
+    phase's running peak.
+    """
+
+    def __init__(self, top: int = 10, frames: int = 1) -> None:
+        self.top = top
+        self.phases: list[dict[str, Any]] = []
+        self._starts: dict[str, tracemalloc.Snapshot] = {}
+        self._peaks: dict[str, int] = {}
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    def _fold_peak(self) -> int:
+        """Carry the traced peak since the last reset into every open phase."""
+        peak = tracemalloc.get_traced_memory()[1]
+        for open_path in self._peaks:
+            self._peaks[open_path] = max(self._peaks[open_path], peak)
+        return peak
+
+    def phase_started(self, path: str) -> None:
+        self._fold_peak()
+        tracemalloc.reset_peak()
+        self._peaks[path] = 0
+        self._starts[path] = self._snapshot()
+
+    def phase_ended(self, path: str) -> None:
+        current = tracemalloc.get_traced_memory()[0]
+        self._fold_peak()
+        peak = self._peaks.pop(path, 0)
+        snapshot = self._snapshot()
+        start = self._starts.pop(path, None)
+        grown = snapshot.compare_to(start, "lineno") if start is not None else []
+        grown = [stat for stat in grown if stat.size_diff > 0]
+        grown.sort(key=lambda stat: stat.size_diff, reverse=True)
+        self.phases.append({
+            "phase": path,
+            "traced_current_bytes": current,
+            "traced_peak_bytes": peak,
+            "process_peak_rss_bytes": process_peak_rss_bytes(),
+            "top_growth": [
+                {"site": str(stat.traceback), "size_diff_bytes": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in grown[: self.top]
+            ],
+            "top_sites": [
+                {"site": str(stat.traceback), "size_bytes": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[: self.top]
+            ],
+            "object_counts": dict(Counter(type(obj).__name__ for obj in gc.get_objects()).most_common(self.top)),
+        })
+
+    def report_lines(self) -> list[str]:
+        lines = []
+        for entry in self.phases:
+            rss = entry["process_peak_rss_bytes"]
+            lines.append(f"{entry['phase']}: peak traced {entry['traced_peak_bytes'] / 1e6:.1f} MB" + (f", process peak RSS so far {rss / 1e6:.1f} MB" if rss is not None else ""))
+            for site in entry["top_growth"][:3]:
+                lines.append(f"  +{site['size_diff_bytes'] / 1e6:.1f} MB at {site['site']}")
+        return lines
+
+
+class Metrics:
+    def __init__(self) -> None:
+        self._exit_paths: list[Path] = []
+        self._exit_registered = False
+        self.memory: MemoryProfiler | None = None
+        self.reset()
+
+    def reset(self) -> None:
+        """Start over: no phases, requests, counters or memory profile."""
+        if self.memory is not None and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.final: dict[str, Any] | None = None
+        self.started = time.perf_counter()
+        self.script = Path(sys.argv[0]).name if sys.argv and sys.argv[0] else ""
+        self.phases: list[dict[str, Any]] = []
+        self.requests: dict[tuple[str, str], RequestStats] = {}
+        self.counters: dict[str, float] = {}
+        self.extra: dict[str, Any] = {}
+        self._stack: list[str] = []
+        self._open: tuple[str, float] | None = None
+        self.memory = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        path = "/".join([*self._stack, name])
+        self._stack.append(name)
+        started = self._begin(path)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            self._finish(path, started)
+
+    def _begin(self, path: str) -> float:
+        if self.memory is not None:
+            self.memory.phase_started(path)
+        return time.perf_counter()
+
+    def _finish(self, path: str, started: float) -> None:
+        self.phases.append({"phase": path, "start_s": round(started - self.started, 3), "seconds": round(time.perf_counter() - started, 3)})
+        if self.memory is not None:
+            self.memory.phase_ended(path)
+
+    def start_phase(self, name: str) -> None:
+        """End the current sequential phase (if any) and start `name`."""
+        self.end_phase()
+        self._open = (name, self._begin(name))
+
+    def end_phase(self) -> None:
+        if self._open is not None:
+            self._finish(*self._open)
+            self._open = None
+
+    def record_request(
+        self,
+        method: str,
+        url: str,
+        elapsed_s: float,
+        bytes_in: int,
+        bytes_out: int,
+        ok: bool,
+        retries: int = 0,
+        body_in: int | None = None,
+        body_out: int | None = None,
+    ) -> None:
+        """`bytes_*` are on the wire; `body_*` are the uncompressed sizes (default: the same)."""
+        key = (method.upper(), collection_from_url(url))
+        with self._lock:
+            stats = self.requests.get(key)
+            if stats is None:
+                stats = self.requests[key] = RequestStats()
+            stats.add(elapsed_s * 1000, bytes_in, bytes_out, ok, retries, bytes_in if body_in is None else body_in, bytes_out if body_out is None else body_out)
+
+    def count(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Accumulate time for a hot inner step (e.g. PBKDF2) into counters."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.count(f"{name}_s", time.perf_counter() - started)
+            self.count(name)
+
+    def totals(self) -> RequestStats:
+        """All requests so far, summed."""
+        with self._lock:
+            totals = RequestStats()
+            for stats in self.requests.values():
+                totals.count += stats.count
+                totals.errors += stats.errors
+                totals.retries += stats.retries
+                totals.bytes_in += stats.bytes_in
+                totals.bytes_out += stats.bytes_out
+                totals.body_bytes_in += stats.body_bytes_in
+                totals.body_bytes_out += stats.body_bytes_out
+                totals.total_ms += stats.total_ms
+            return totals
+
+    def summary(self) -> dict[str, Any]:
+        self.end_phase()
+        totals = self.totals()
+        with self._lock:
+            requests = {f"{method} {collection}": stats.to_dict() for (method, collection), stats in sorted(self.requests.items())}
+            counters = dict(self.counters)
+        compression = compression_summary(totals, counters)
+        return {
+            "script": self.script,
+            "argv": sys.argv[1:],
+            "wall_s": round(time.perf_counter() - self.started, 3),
+            "phases": list(self.phases),
+            "requests": requests,
+            "request_totals": {key: value for key, value in totals.to_dict().items() if key in ("count", "errors", "retries", "bytes_in", "bytes_out", "body_bytes_in", "body_bytes_out", "total_ms")},
+            **({"compression": compression} if compression else {}),
+            "counters": counters,
+            **({"memory": {"process_peak_rss_bytes": process_peak_rss_bytes(), "phases": list(self.memory.phases)}} if self.memory else {}),
+            **self.extra,
+        }
+
+    def write_json(self, path: str | Path) -> None:
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(json.dumps(self.final or self.summary(), indent=2) + "\n", encoding="utf-8")
+
+    def write_at_exit(self, path: str | Path | None) -> None:
+        """Write the summary to `path` when the run finishes (at exit, or at `finish_run()`)."""
+        if path:
+            self._exit_paths.append(Path(path))
+            self._register_exit()
+
+    def profile_memory(self, top: int = 10) -> None:
+        """Track memory per phase; a short report is printed to stderr when the run finishes."""
+        self.memory = MemoryProfiler(top=top)
+        self._register_exit()
+
+    def _register_exit(self) -> None:
+        if not self._exit_registered:
+            atexit.register(self.finish_run)
+            self._exit_registered = True
+
+    def finish_run(self) -> None:
+        """Print the memory report and write the summaries requested with `write_at_exit`; once per run.
+
+        The summary as of then is kept in `final`.
+        """
+        if self.final is not None:
+            return
+        self.end_phase()
+        if self.memory is not None:
+            for line in self.memory.report_lines():
+                print(line, file=sys.stderr)
+        self.final = self.summary()
+        paths, self._exit_paths = self._exit_paths, []
+        for path in paths:
+            self.write_json(path)
+
+
+def compression_summary(totals: RequestStats, counters: dict[str, float]) -> dict[str, Any] | None:
+    """Ratios and an estimate of transfer time saved by gzip, or None if nothing was compressed.
+
+    The estimate assumes the requests were bandwidth-bound: bytes saved at the
+    run's observed wire throughput, minus the time spent compressing.
+    """
+    saved = (totals.body_bytes_in - totals.bytes_in) + (totals.body_bytes_out - totals.bytes_out)
+    if saved <= 0:
+        return None
+    wire = totals.bytes_in + totals.bytes_out
+    throughput = wire / (totals.total_ms / 1000) if totals.total_ms else 0.0
+    cpu_s = counters.get("gzip_compress_s", 0.0) + counters.get("gzip_decompress_s", 0.0)
+    return {
+        "ratio_in": round(totals.body_bytes_in / totals.bytes_in, 2) if totals.bytes_in else None,
+        "ratio_out": round(totals.body_bytes_out / totals.bytes_out, 2) if totals.bytes_out else None,
+        "bytes_saved": saved,
+        "gzip_cpu_s": round(cpu_s, 3),
+        "est_time_saved_s": round(saved / throughput - cpu_s, 3) if throughput else None,
+    }
+
+
+def collection_from_url(url: str) -> str:
+    """`.../documents/tbl_employee/12?key=...` -> `tbl_employee`; `.../documents:batchWrite` -> `:batchWrite`."""
+    path = urllib.parse.unquote(urllib.parse.urlsplit(url).path)
+    if "/documents/" in path:
+        return path.split("/documents/", 1)[1].split("/", 1)[0].split(":", 1)[0]
+    if "/documents:" in path:
+        return ":" + path.rsplit(":", 1)[1]
+    return path.rsplit("/", 1)[-1] or "/"
+
+
+METRICS = Metrics()
@@ -0,0 +1,268 @@
+"""Streaming reader for mysqldump `.sql` files.
+
+The dump is read line by line. `CREATE TABLE` blocks give each table's
+column names and primary key, and every `INSERT INTO ... VALUES` line is
+parsed into rows as it is reached, so memory stays at one INSERT
+statement no matter how large the dump is.
+
+Values come back as Python scalars: NULL -> None, integers -> int,
+decimals -> float, quoted strings unescaped to str. Anything else
+(hex literals, `_binary '...'`) is returned as its raw text.
+
+`iter_typed_rows` decodes by the column types from `CREATE TABLE` instead
+of guessing from each token. Every column gets one decoder, chosen once
+per table (see `column_decoder`). DECIMAL and FLOAT become float, the
+integer types int, BIT int, and DATE/DATETIME/TIMESTAMP/TIME stay their
+dump text (or become Firestore timestamps with `dates="timestamp"`).
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator, Mapping
+
+from marga_tools.codec import Timestamp
+
+_CREATE = re.compile(r"CREATE TABLE `([^`]+)`")
+_COLUMN = re.compile(r"\s*`([^`]+)`(?:\s+(\w+))?")
+_PRIMARY_KEY = re.compile(r"\s*PRIMARY KEY \(([^)]*)\)")
+_INSERT = re.compile(r"INSERT INTO `([^`]+)`(?: \(([^)]*)\))? VALUES ")
+_ROW_START = re.compile(r"\s*,?\s*\(")
+# One value: any run of unquoted characters and quoted strings, then the
+# delimiter that ends it.
+_VALUE = re.compile(r"((?:[^,()']|'[^'\\]*(?:\\.[^'\\]*)*')*)([,)])", re.S)
+_INTEGER = re.compile(r"-?\d+")
+_DECIMAL = re.compile(r"-?\d+\.\d+")
+_ESCAPE = re.compile(r"\\(.)", re.S)
+_UNESCAPED = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a", "%": "\\%", "_": "\\_"}
+
+
+@dataclass
+class TableSchema:
+    name: str
+    columns: list[str] = field(default_factory=list)
+    primary_key: list[str] = field(default_factory=list)
+    # Lower-case base SQL type per column ("int", "decimal", "varchar"), "" if unknown.
+    types: list[str] = field(default_factory=list)
+
+    def key_columns(self) -> list[str]:
+        """The primary key, or the first column for tables declared without one."""
+        return self.primary_key or self.columns[:1]
+
+
+def parse_mysql_string(raw: str) -> str:
+    """Unquote a quoted dump string, undoing every escape in one pass.
+
+    A backslash before `%` or `_` is kept, as MySQL does outside LIKE patterns.
+    """
+    return _ESCAPE.sub(lambda match: _UNESCAPED.get(match.group(1), match.group(1)), raw[1:-1])
+
+
+def sql_token_to_value(token: str) -> Any:
+    t = token.strip()
+    if t.upper() == "NULL":
+        return None
+    if len(t) >= 2 and t[0] == "'" and t[-1] == "'":
+        return parse_mysql_string(t)
+    if _INTEGER.fullmatch(t):
+        return int(t)
+    if _DECIMAL.fullmatch(t):
+        return float(t)
+    return t
+
+
+def iter_insert_tokens(values: str) -> Iterator[list[str]]:
+    """Each row's raw value tokens from the part of an INSERT after `VALUES `."""
+    pos = 0
+    while True:
+        start = _ROW_START.match(values, pos)
+        if start is None:
+            return
+        pos = start.end()
+        row: list[str] = []
+        while True:
+            match = _VALUE.match(values, pos)
+            if match is None:
+                raise ValueError(f"Malformed INSERT values near offset {pos}")
+            row.append(match.group(1))
+            pos = match.end()
+            if match.group(2) == ")":
+                break
+        yield row
+
+
+def parse_insert_values(values: str) -> list[list[Any]]:
+    """Rows from the part of an INSERT after `VALUES `."""
+    return [[sql_token_to_value(token) for token in row] for row in iter_insert_tokens(values)]
+
+
+INTEGER_TYPES = frozenset(("tinyint", "smallint", "mediumint", "int", "integer", "bigint", "year"))
+FLOAT_TYPES = frozenset(("decimal", "numeric", "float", "double", "real"))
+STRING_TYPES = frozenset(("char", "varchar", "tinytext", "text", "mediumtext", "longtext", "enum", "set", "json"))
+DATE_TYPES = frozenset(("date", "datetime", "timestamp", "time"))
+DATE_MODES = ("text", "timestamp")
+# DATETIME columns carry no zone; the office server keeps Manila time (no DST).
+DUMP_UTC_OFFSET = "+08:00"
+
+
+def _string(token: str) -> Any:
+    if token == "NULL":
+        return None
+    if "\\" not in token:
+        return token[1:-1]
+    return parse_mysql_string(token)
+
+
+def _integer(token: str) -> Any:
+    return None if token == "NULL" else int(token)
+
+
+def _float(token: str) -> Any:
+    return None if token == "NULL" else float(token)
+
+
+def _bit(token: str) -> Any:
+    if token == "NULL":
+        return None
+    if token[:2] == "b'":
+        return int(token[2:-1] or "0", 2)
+    return sql_token_to_value(token)
+
+
+def _timestamp(token: str) -> Any:
+    if token == "NULL" or token[1:5] == "0000":
+        return None
+    text = token[1:-1]
+    if len(text) == 10:
+        return Timestamp(f"{text}T00:00:00{DUMP_UTC_OFFSET}")
+    if len(text) >= 19 and text[10] == " ":
+        return Timestamp(f"{text[:10]}T{text[11:]}{DUMP_UTC_OFFSET}")
+    return text
+
+
+def column_decoder(sql_type: str, dates: str = "text") -> Callable[[str], Any]:
+    """The decoder for one column's raw tokens."""
+    if sql_type in INTEGER_TYPES:
+        return _integer
+    if sql_type in FLOAT_TYPES:
+        return _float
+    if sql_type in STRING_TYPES:
+        return _string
+    if sql_type in DATE_TYPES:
+        # TIME values are durations, not instants; they always stay text.
+        return _timestamp if dates == "timestamp" and sql_type != "time" else _string
+    if sql_type == "bit":
+        return _bit
+    return sql_token_to_value
+
+
+def _column_names(text: str) -> list[str]:
+    return [name.strip().strip("`") for name in text.split(",") if name.strip()]
+
+
+def iter_insert_statements(path: str | Path, tables: Iterable[str] | None = None) -> Iterator[tuple[TableSchema, str]]:
+    """(schema, text after `VALUES `) for each INSERT statement, optionally only for `tables`."""
+    wanted = set(tables) if tables is not None else None
+    schemas: dict[str, TableSchema] = {}
+    creating: TableSchema | None = None
+    with open(path, "r", encoding="utf-8", errors="ignore") as fh:
+        for line in fh:
+            if creating is not None:
+                column = _COLUMN.match(line)
+                if column:
+                    creating.columns.append(column.group(1))
+                    creating.types.append((column.group(2) or "").lower())
+                    continue
+                key = _PRIMARY_KEY.match(line)
+                if key:
+                    creating.primary_key = _column_names(key.group(1))
+                    continue
+                if line.startswith(")"):
+                    creating = None
+                continue
+            if line.startswith("CREATE TABLE"):
+                match = _CREATE.match(line)
+                if match:
+                    creating = schemas[match.group(1)] = TableSchema(match.group(1))
+                continue
+            if not line.startswith("INSERT INTO"):
+                continue
+            match = _INSERT.match(line)
+            if match is None or (wanted is not None and match.group(1) not in wanted):
+                continue
+            schema = schemas.setdefault(match.group(1), TableSchema(match.group(1)))
+            if match.group(2) and not schema.columns:
+                schema.columns = _column_names(match.group(2))
+            yield schema, line[match.end():]
+
+
+def iter_inserts(path: str | Path, tables: Iterable[str] | None = None) -> Iterator[tuple[TableSchema, list[list[Any]]]]:
+    """(schema, rows) for each INSERT statement, optionally only for `tables`."""
+    for schema, values in iter_insert_statements(path, tables):
+        yield schema, parse_insert_values(values)
+
+
+def iter_rows(path: str | Path, tables: Iterable[str] | None = None) -> Iterator[tuple[TableSchema, dict[str, Any]]]:
+    """(schema, row dict) for every row; missing trailing values are None."""
+    for schema, rows in iter_inserts(path, tables):
+        columns = schema.columns
+        for values in rows:
+            yield schema, {name: values[index] if index < len(values) else None for index, name in enumerate(columns)}
+
+
+def iter_typed_inserts(
+    path: str | Path,
+    tables: Iterable[str] | None = None,
+    dates: str | Mapping[str, str] = "text",
+) -> Iterator[tuple[TableSchema, list[tuple[Any, ...]]]]:
+    """(schema, rows) per INSERT, each row a tuple decoded by column type and padded to the schema.
+
+    `dates` is a `DATE_MODES` entry, or a mapping of table -> mode.
+    """
+    decoders: dict[str, list[Callable[[str], Any]]] = {}
+    for schema, values in iter_insert_statements(path, tables):
+        columns = schema.columns
+        row_decoders = decoders.get(schema.name)
+        if row_decoders is None or len(row_decoders) != len(columns):
+            types = schema.types if len(schema.types) == len(columns) else [""] * len(columns)
+            mode = dates if isinstance(dates, str) else dates.get(schema.name, "text")
+            row_decoders = decoders[schema.name] = [column_decoder(sql_type, mode) for sql_type in types]
+        width = len(columns)
+        rows = []
+        for tokens in iter_insert_tokens(values):
+            row = tuple([decode(token) for decode, token in zip(row_decoders, tokens)])
+            if len(row) < width:
+                row += (None,) * (width - len(row))
+            rows.append(row)
+        yield schema, rows
+
+
+def iter_typed_rows(
+    path: str | Path,
+    tables: Iterable[str] | None = None,
+    dates: str | Mapping[str, str] = "text",
+) -> Iterator[tuple[TableSchema, dict[str, Any]]]:
+    """Like `iter_rows`, but each column is decoded by its declared type (see `iter_typed_inserts`)."""
+    for schema, rows in iter_typed_inserts(path, tables, dates):
+        columns = schema.columns
+        for row in rows:
+            yield schema, dict(zip(columns, row))
+
+
+def extract_table(path: str | Path, table: str) -> tuple[list[str], list[dict[str, Any]]]:
+    """(column names, rows) for one table."""
+    schema: TableSchema | None = None
+    rows: list[dict[str, Any]] = []
+    for schema, row in iter_rows(path, [table]):
+        rows.append(row)
+    return (schema.columns if schema else []), rows
+
+
+def row_key(schema: TableSchema, row: dict[str, Any]) -> Any:
+    """The row's primary key: a scalar for single-column keys, else a list."""
+    columns = schema.key_columns()
+    if len(columns) == 1:
+        return row.get(columns[0])
+    return [row.get(name) for name in columns]
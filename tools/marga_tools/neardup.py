@@ -0,0 +1,318 @@
+"""Near-duplicate branch detection with MinHash signatures and LSH banding.
+
+Each branch's `branchname`, `street`, `bldg`, `brgy` and `city` are
+normalized: lowercased, accents and punctuation stripped, common
+abbreviations expanded ("St." -> "street", "Bldg" -> "building"). They are
+then cut into character `shingle`-grams. A record's shingle set is summed
+up by a MinHash signature of `bands * rows` values. Two signatures agree at
+a position with probability equal to the records' Jaccard similarity.
+
+Signatures use one-permutation hashing: each shingle is hashed once and
+the hash picks both a bin and a value. Empty bins are filled by optimal
+densification: each copies a pseudo-random filled bin. Signing therefore
+costs one hash per shingle instead of one per shingle per permutation.
+
+LSH banding hashes each band of `rows` values into a bucket, and records
+that share any bucket become candidate pairs. A pair with similarity s is
+proposed with probability 1 - (1 - s**rows) ** bands. More bands or fewer
+rows raise recall; the reverse raises precision. Candidates are kept when
+their estimated similarity reaches `threshold`, and kept pairs are joined
+into clusters. Shingles found in more than `common` of the records
+("street", "barangay", the city names) are dropped first, like stop words,
+so similarity comes from the distinctive parts. Buckets larger than
+`max_bucket` (e.g. rows that are all blank) are skipped and counted rather
+than compared pairwise.
+
+  python3 -m marga_tools.neardup --dump Dump20260218.sql -o branch-duplicates.json
+  python3 -m marga_tools.neardup --dump Dump20260218.sql --threshold 0.6 --bands 64 --rows 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import sys
+import unicodedata
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Any, Iterable, Sequence
+
+from marga_tools.metrics import METRICS
+
+BRANCH_FIELDS = ("branchname", "street", "bldg", "brgy", "city")
+REPORT_FIELDS = ("id", "company_id") + BRANCH_FIELDS
+DEFAULT_BANDS = 32
+DEFAULT_ROWS = 8
+DEFAULT_SHINGLE = 3
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_COMMON = 0.2
+# Below this many records shingle frequencies say little, so nothing is pruned.
+MIN_RECORDS_TO_PRUNE = 100
+MAX_BUCKET = 200
+
+ABBREVIATIONS = {
+    "st": "street",
+    "str": "street",
+    "ave": "avenue",
+    "av": "avenue",
+    "rd": "road",
+    "blvd": "boulevard",
+    "hwy": "highway",
+    "bldg": "building",
+    "bldng": "building",
+    "flr": "floor",
+    "fl": "floor",
+    "brgy": "barangay",
+    "bgy": "barangay",
+    "bo": "barangay",
+    "cor": "corner",
+    "ext": "extension",
+    "subd": "subdivision",
+    "corp": "corporation",
+    "co": "company",
+    "inc": "incorporated",
+    "mla": "manila",
+    "qc": "quezon city",
+}
+
+_MASK64 = (1 << 64) - 1
+_MIX = 0x9E3779B97F4A7C15
+_WORD = re.compile(r"[a-z0-9]+")
+PROBES = 32
+_PROBES: dict[int, list[list[int]]] = {}
+
+
+def normalize(text: Any) -> str:
+    if text is None:
+        return ""
+    folded = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(ABBREVIATIONS.get(word, word) for word in _WORD.findall(folded))
+
+
+def record_text(record: dict[str, Any], fields: Sequence[str] = BRANCH_FIELDS) -> str:
+    return " ".join(part for part in (normalize(record.get(name)) for name in fields) if part)
+
+
+def shingles(text: str, size: int = DEFAULT_SHINGLE) -> set[int]:
+    """64-bit hashes of the text's character `size`-grams (the whole text if shorter)."""
+    data = text.encode("utf-8")
+    if len(data) <= size:
+        return {(zlib.crc32(data) * _MIX) & _MASK64} if data else set()
+    return {(zlib.crc32(data[start:start + size]) * _MIX) & _MASK64 for start in range(len(data) - size + 1)}
+
+
+def _probe_table(length: int) -> list[list[int]]:
+    table = _PROBES.get(length)
+    if table is None:
+        table = _PROBES[length] = [
+            [(((((slot << 32) | attempt) * _MIX) & _MASK64) >> 32) % length for attempt in range(1, PROBES + 1)] for slot in range(length)
+        ]
+    return table
+
+
+def signature(hashes: Iterable[int], length: int) -> tuple[int, ...] | None:
+    """One-permutation MinHash of `length` bins (a power of two); None for an empty set."""
+    shift = 64 - (length.bit_length() - 1)
+    low = (1 << shift) - 1
+    bins = [low + 1] * length
+    for value in hashes:
+        slot = value >> shift
+        rest = value & low
+        if rest < bins[slot]:
+            bins[slot] = rest
+    filled = [slot for slot, value in enumerate(bins) if value <= low]
+    if not filled:
+        return None
+    if len(filled) < length:
+        # Densify: an empty bin copies the first filled bin on its own fixed
+        # pseudo-random probe sequence. Neighbouring bins borrow from unrelated
+        # places, so a band of mostly-empty bins stays as selective as a full one.
+        out = list(bins)
+        for slot, probes in enumerate(_probe_table(length)):
+            if bins[slot] > low:
+                for probe in probes:
+                    if bins[probe] <= low:
+                        out[slot] = bins[probe]
+                        break
+                else:
+                    out[slot] = next(bins[(slot + step) % length] for step in range(1, length) if bins[(slot + step) % length] <= low)
+        bins = out
+    return tuple(bins)
+
+
+def similarity(left: Sequence[int], right: Sequence[int]) -> float:
+    """Estimated Jaccard similarity: the share of signature positions that agree."""
+    return sum(1 for a, b in zip(left, right) if a == b) / len(left)
+
+
+def detection_probability(similarity_value: float, bands: int, rows: int) -> float:
+    return 1 - (1 - similarity_value ** rows) ** bands
+
+
+class _Clusters:
+    """Union-find over record positions."""
+
+    def __init__(self) -> None:
+        self.parent: dict[int, int] = {}
+
+    def find(self, item: int) -> int:
+        parent = self.parent.setdefault(item, item)
+        while parent != item:
+            grand = self.parent.setdefault(parent, parent)
+            self.parent[item] = grand
+            item, parent = parent, grand
+        return item
+
+    def union(self, left: int, right: int) -> None:
+        a, b = self.find(left), self.find(right)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+    def groups(self) -> list[list[int]]:
+        out: dict[int, list[int]] = {}
+        for item in self.parent:
+            out.setdefault(self.find(item), []).append(item)
+        return [sorted(members) for members in out.values() if len(members) > 1]
+
+
+def find_duplicates(
+    records: Sequence[dict[str, Any]],
+    fields: Sequence[str] = BRANCH_FIELDS,
+    bands: int = DEFAULT_BANDS,
+    rows: int = DEFAULT_ROWS,
+    shingle: int = DEFAULT_SHINGLE,
+    threshold: float = DEFAULT_THRESHOLD,
+    max_bucket: int = MAX_BUCKET,
+    common: float = DEFAULT_COMMON,
+) -> dict[str, Any]:
+    """Cluster near-duplicate `records`; returns the report dict."""
+    length = bands * rows
+    if length & (length - 1):
+        raise ValueError(f"bands * rows must be a power of two, not {length}")
+
+    with METRICS.phase("signatures"):
+        texts = [record_text(record, fields) for record in records]
+        frequent: set[int] = set()
+        if len(texts) >= MIN_RECORDS_TO_PRUNE and common < 1:
+            seen: Counter[int] = Counter()
+            for text in texts:
+                seen.update(shingles(text, shingle))
+            frequent = {value for value, count in seen.items() if count > common * len(texts)}
+        signatures = [signature((value for value in shingles(text, shingle) if value not in frequent), length) for text in texts]
+    METRICS.count("neardup_records", len(records))
+
+    with METRICS.phase("lsh"):
+        buckets: dict[tuple[int, tuple[int, ...]], list[int]] = {}
+        for position, sig in enumerate(signatures):
+            if sig is None:
+                continue
+            for band in range(bands):
+                buckets.setdefault((band, sig[band * rows:(band + 1) * rows]), []).append(position)
+        candidates: set[tuple[int, int]] = set()
+        skipped_buckets = 0
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            if len(members) > max_bucket:
+                skipped_buckets += 1
+                continue
+            for index, left in enumerate(members):
+                for right in members[index + 1:]:
+                    candidates.add((left, right))
+    METRICS.count("neardup_candidates", len(candidates))
+
+    with METRICS.phase("verify"):
+        clusters = _Clusters()
+        scores: dict[tuple[int, int], float] = {}
+        for left, right in candidates:
+            score = similarity(signatures[left], signatures[right])
+            if score >= threshold:
+                scores[(left, right)] = score
+                clusters.union(left, right)
+
+    cluster_scores: dict[int, list[float]] = {}
+    for (left, _), score in scores.items():
+        cluster_scores.setdefault(clusters.find(left), []).append(score)
+    report_clusters = []
+    for members in clusters.groups():
+        pair_scores = cluster_scores[clusters.find(members[0])]
+        branches = [{name: records[position].get(name) for name in REPORT_FIELDS} for position in members]
+        report_clusters.append({
+            "size": len(members),
+            "min_similarity": round(min(pair_scores), 3),
+            "max_similarity": round(max(pair_scores), 3),
+            "company_ids": sorted({branch["company_id"] for branch in branches if branch["company_id"] is not None}),
+            "branches": branches,
+        })
+    report_clusters.sort(key=lambda cluster: (-cluster["size"], -cluster["max_similarity"], str(cluster["branches"][0]["id"])))
+    return {
+        "records": len(records),
+        "fields": list(fields),
+        "shingle": shingle,
+        "bands": bands,
+        "rows": rows,
+        "threshold": threshold,
+        "common": common,
+        "pruned_shingles": len(frequent),
+        # Similarity at which a pair is proposed half the time, and recall at the threshold.
+        "lsh_knee": round((1 / bands) ** (1 / rows), 3),
+        "recall_at_threshold": round(detection_probability(threshold, bands, rows), 4),
+        "blank_records": sum(1 for sig in signatures if sig is None),
+        "candidate_pairs": len(candidates),
+        "duplicate_pairs": len(scores),
+        "skipped_buckets": skipped_buckets,
+        "clusters": report_clusters,
+    }
+
+
+def print_summary(report: dict[str, Any]) -> None:
+    clusters = report["clusters"]
+    cross_company = sum(1 for cluster in clusters if len(cluster["company_ids"]) > 1)
+    print(
+        f"{report['records']} branches: {len(clusters)} duplicate clusters ({cross_company} across companies), "
+        f"{report['duplicate_pairs']} of {report['candidate_pairs']} candidate pairs at similarity >= {report['threshold']} "
+        f"(recall ~{report['recall_at_threshold']:.1%}, {report['skipped_buckets']} oversized buckets skipped)",
+        file=sys.stderr,
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Report near-duplicate tbl_branchinfo rows (MinHash + LSH over normalized addresses)")
+    parser.add_argument("--dump", required=True)
+    parser.add_argument("-o", "--output", default="", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--field", action="append", default=None, help=f"Field to compare (repeatable; default: {', '.join(BRANCH_FIELDS)})")
+    parser.add_argument("--bands", type=int, default=DEFAULT_BANDS, help="LSH bands; more bands raise recall")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="Signature values per band; more rows raise precision (bands * rows must be a power of two)")
+    parser.add_argument("--shingle", type=int, default=DEFAULT_SHINGLE, help="Characters per shingle")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Minimum estimated similarity to report a pair")
+    parser.add_argument("--max-bucket", type=int, default=MAX_BUCKET, help="Skip LSH buckets larger than this")
+    parser.add_argument("--common", type=float, default=DEFAULT_COMMON, help="Ignore shingles found in more than this fraction of records (1 keeps all)")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
+    args = parser.parse_args()
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
+
+    from marga_tools.mysqldump import iter_typed_rows
+
+    with METRICS.phase("read dump"):
+        branches = [row for _, row in iter_typed_rows(args.dump, ["tbl_branchinfo"])]
+    try:
+        report = find_duplicates(branches, args.field or BRANCH_FIELDS, args.bands, args.rows, args.shingle, args.threshold, args.max_bucket, args.common)
+    except ValueError as err:
+        print(str(err), file=sys.stderr)
+        return 2
+    print_summary(report)
+    text = json.dumps(report, indent=2, ensure_ascii=False, default=str)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
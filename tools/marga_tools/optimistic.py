@@ -0,0 +1,163 @@
+"""Optimistic-concurrency document writes for the fetch-compute-write scripts.
+
+A script fetches a collection with its update times, spends minutes
+computing, and then writes. `OptimisticWriter.write` sends every doc with
+a `currentDocument` precondition taken from that fetch: the `updateTime`
+read, or `exists: false` for a doc that was not there. An edit made in the
+web app in the meantime then fails the write instead of being silently
+overwritten. The failed doc is set aside.
+
+`retry` then deals with just those docs:
+
+1. re-read them with one `:batchGet` per 100 ids;
+2. three-way merge: the script's changes, relative to the version it
+   fetched, are applied on top of the current version, and fields only the
+   app changed keep the app's values;
+3. pass each merged doc back through the script's `finish` step (password
+   hash, sync stamp);
+4. write it against the new `updateTime`.
+
+Docs that keep changing are retried for `MAX_ROUNDS` rounds and then
+reported. Docs deleted in the meantime stay deleted. Fields that both
+sides changed take the script's value and are reported as overridden.
+"""
+
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Mapping
+
+from marga_tools.changeset import precondition_for
+from marga_tools.firestore import PreconditionFailed, batch_get, set_document
+from marga_tools.metrics import METRICS
+
+MAX_ROUNDS = 3
+
+
+def three_way_merge(base: Mapping[str, Any], ours: Mapping[str, Any], theirs: Mapping[str, Any]) -> tuple[dict[str, Any], list[str]]:
+    """`ours`' changes relative to `base` applied over `theirs`; returns (merged, fields both sides changed)."""
+    merged = dict(theirs)
+    clashes = []
+    for key in sorted(ours.keys() | base.keys()):
+        if key in ours and key in base and ours[key] == base[key]:
+            continue
+        changed_by_them = theirs.get(key) != base.get(key) or (key in theirs) != (key in base)
+        if key in ours:
+            if changed_by_them and theirs.get(key) != ours[key]:
+                clashes.append(key)
+            merged[key] = ours[key]
+        elif key in theirs and not changed_by_them:
+            del merged[key]
+    return merged, clashes
+
+
+@dataclass
+class ConflictReport:
+    conflicts: int = 0
+    rewritten: list[str] = field(default_factory=list)
+    already_current: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+    unresolved: list[str] = field(default_factory=list)
+    overridden: dict[str, list[str]] = field(default_factory=dict)
+
+    def summary(self) -> str:
+        if not self.conflicts:
+            return "no write conflicts"
+        parts = [f"{self.conflicts} docs changed during the run", f"{len(self.rewritten)} re-merged and rewritten"]
+        if self.already_current:
+            parts.append(f"{len(self.already_current)} already current after merging")
+        if self.deleted:
+            parts.append(f"{len(self.deleted)} deleted meanwhile (left deleted)")
+        if self.overridden:
+            parts.append(f"{len(self.overridden)} with app edits overridden")
+        if self.unresolved:
+            parts.append(f"{len(self.unresolved)} still changing after {MAX_ROUNDS} rounds")
+        return ", ".join(parts)
+
+
+class OptimisticWriter:
+    """Precondition-guarded single-document writes into one collection (thread-safe)."""
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        collection: str,
+        update_times: dict[str, str],
+        bases: Mapping[Any, dict[str, Any]],
+    ) -> None:
+        """`update_times` and `bases` (doc id -> doc as fetched) come from the script's fetch."""
+        self.base_url = base_url
+        self.api_key = api_key
+        self.collection = collection
+        self.update_times = update_times
+        self.bases = bases
+        self._conflicts: dict[str, tuple[Any, dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def _write(self, doc_id: str, fields: dict[str, Any], precondition: dict[str, Any] | None) -> None:
+        written = set_document(self.base_url, self.api_key, self.collection, doc_id, fields, precondition=precondition)
+        if written.get("updateTime"):
+            with self._lock:
+                self.update_times[doc_id] = written["updateTime"]
+
+    def write(self, doc_id: Any, fields: dict[str, Any]) -> bool:
+        """Write against the fetched version; False (and kept for `retry`) if it changed since."""
+        key = str(doc_id)
+        with self._lock:
+            precondition = precondition_for(self.update_times, key, expect_new=key not in self.update_times)
+        try:
+            self._write(key, fields, precondition)
+        except PreconditionFailed:
+            METRICS.count("write_conflicts")
+            with self._lock:
+                self._conflicts[key] = (doc_id, fields)
+            return False
+        return True
+
+    def retry(
+        self,
+        finish: Callable[[Any, dict[str, Any], dict[str, Any]], dict[str, Any] | None],
+        on_written: Callable[[Any, dict[str, Any]], None] | None = None,
+        rounds: int = MAX_ROUNDS,
+    ) -> ConflictReport:
+        """Re-read, merge and rewrite the docs whose write conflicted.
+
+        `finish(doc_id, merged, current)` redoes the script's last step on a
+        merged doc and returns the fields to write, or None when `current`
+        already has them. `on_written(doc_id, fields)` sees each doc once it
+        is written, with the fields written (e.g. to journal them).
+        """
+        report = ConflictReport(conflicts=len(self._conflicts))
+        pending = {key: (doc_id, self.bases.get(doc_id) or {}, fields) for key, (doc_id, fields) in self._conflicts.items()}
+        self._conflicts.clear()
+        for _ in range(rounds):
+            if not pending:
+                break
+            current = batch_get(self.base_url, self.api_key, self.collection, list(pending), update_times=self.update_times)
+            still: dict[str, tuple[Any, dict[str, Any], dict[str, Any]]] = {}
+            for key, (doc_id, base, ours) in pending.items():
+                theirs = current.get(key)
+                if theirs is None:
+                    report.deleted.append(key)
+                    continue
+                merged, clashes = three_way_merge(base, ours, theirs)
+                fields = finish(doc_id, merged, theirs)
+                if fields is None:
+                    report.already_current.append(key)
+                    continue
+                try:
+                    self._write(key, fields, {"updateTime": self.update_times[key]})
+                except PreconditionFailed:
+                    # Changed again: next round merges over the newer version.
+                    still[key] = (doc_id, theirs, fields)
+                    continue
+                if clashes:
+                    report.overridden[key] = clashes
+                report.rewritten.append(key)
+                if on_written is not None:
+                    on_written(doc_id, fields)
+            pending = still
+        report.unresolved = sorted(pending)
+        return report
@@ -0,0 +1,281 @@
+"""Bucketed checksum parity between a dump table and its Firestore collection.
+
+Document ids are split into ranges over the numeric `id` field. For each
+range the dump side computes (row count, sum of `sync_hash(row)`). The
+Firestore side gets the same pair from one `:runAggregationQuery`
+(COUNT and SUM of the stamped `_sync_hash`), so an in-sync table costs one
+small aggregation response per bucket instead of a collection download.
+
+Only ranges whose pair differs are drilled into. A mismatched range is
+split `FANOUT` ways and re-checked until it holds at most `DRILL_ROWS`
+documents. Then just those docs are fetched, with a select of `id` and
+`_sync_hash`, and compared one by one. With `verify_fields` the drill
+fetches whole documents and recomputes the hash from the fields that are
+dump columns. That covers docs written before hashes were stamped, or
+edited since.
+
+Documents whose `id` field is missing or non-numeric are outside every
+range, so no bucket sees them. One COUNT over the whole collection gives
+`firestore_docs`, and whatever the buckets did not account for is
+reported as `unranged_docs`.
+
+  python3 -m marga_tools.parity --dump Dump20260218.sql --table tbl_branchinfo
+"""
+
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import sys
+from array import array
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from marga_tools.firestore import parse_firebase_config, run_aggregation, run_query
+from marga_tools.gaps import to_ranges
+from marga_tools.metrics import METRICS
+from marga_tools.mysqldump import iter_rows
+from marga_tools.synchash import SYNC_HASH_FIELD, sync_hash
+
+DEFAULT_BUCKETS = 64
+DRILL_ROWS = 500
+FANOUT = 8
+
+
+class DumpSide:
+    """Sorted ids and hashes from one dump table, with prefix sums for range checksums."""
+
+    def __init__(self, ids: array, hashes: array, columns: list[str]) -> None:
+        self.ids = ids
+        self.hashes = hashes
+        self.columns = columns
+        self._prefix = array("q", [0])
+        total = 0
+        for value in hashes:
+            total += value
+            self._prefix.append(total)
+
+    @classmethod
+    def from_dump(cls, path: str | Path, table: str, id_column: str = "id") -> "DumpSide":
+        pairs: list[tuple[int, int]] = []
+        columns: list[str] = []
+        for schema, row in iter_rows(path, [table]):
+            columns = schema.columns
+            pairs.append((int(row[id_column]), sync_hash(row)))
+        pairs.sort()
+        return cls(array("q", (pair[0] for pair in pairs)), array("q", (pair[1] for pair in pairs)), columns)
+
+    def span(self, low: int, high: int) -> tuple[int, int]:
+        return bisect.bisect_left(self.ids, low), bisect.bisect_left(self.ids, high)
+
+    def summary(self, low: int, high: int) -> tuple[int, int]:
+        start, end = self.span(low, high)
+        return end - start, self._prefix[end] - self._prefix[start]
+
+    def hashes_in(self, low: int, high: int) -> dict[int, int]:
+        start, end = self.span(low, high)
+        return dict(zip(self.ids[start:end], self.hashes[start:end]))
+
+
+def _range_filter(id_field: str, low: int | None, high: int | None) -> dict[str, Any]:
+    filters = []
+    if low is not None:
+        filters.append({"fieldFilter": {"field": {"fieldPath": id_field}, "op": "GREATER_THAN_OR_EQUAL", "value": {"integerValue": str(low)}}})
+    if high is not None:
+        filters.append({"fieldFilter": {"field": {"fieldPath": id_field}, "op": "LESS_THAN", "value": {"integerValue": str(high)}}})
+    return filters[0] if len(filters) == 1 else {"compositeFilter": {"op": "AND", "filters": filters}}
+
+
+@dataclass
+class ParityReport:
+    table: str
+    collection: str
+    buckets: int
+    dump_rows: int
+    firestore_docs: int = 0
+    unranged_docs: int = 0
+    aggregations: int = 0
+    drilled_ranges: int = 0
+    fetched_docs: int = 0
+    missing: list[int] = field(default_factory=list)
+    extra: list[int] = field(default_factory=list)
+    different: list[int] = field(default_factory=list)
+    unstamped: list[int] = field(default_factory=list)
+
+    @property
+    def in_sync(self) -> bool:
+        return not (self.missing or self.extra or self.different or self.unstamped or self.unranged_docs)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "table": self.table,
+            "collection": self.collection,
+            "in_sync": self.in_sync,
+            "buckets": self.buckets,
+            "dump_rows": self.dump_rows,
+            "firestore_docs": self.firestore_docs,
+            "unranged_docs": self.unranged_docs,
+            "aggregations": self.aggregations,
+            "drilled_ranges": self.drilled_ranges,
+            "fetched_docs": self.fetched_docs,
+            **{name: to_ranges(sorted(getattr(self, name))) for name in ("missing", "extra", "different", "unstamped")},
+        }
+
+
+class ParityChecker:
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        collection: str,
+        dump: DumpSide,
+        id_field: str = "id",
+        verify_fields: bool = False,
+        drill_rows: int = DRILL_ROWS,
+    ) -> None:
+        self.base_url = base_url
+        self.api_key = api_key
+        self.collection = collection
+        self.dump = dump
+        self.id_field = id_field
+        self.verify_fields = verify_fields
+        self.drill_rows = max(1, drill_rows)
+
+    def _query(self, low: int | None, high: int | None) -> dict[str, Any]:
+        query: dict[str, Any] = {"from": [{"collectionId": self.collection}]}
+        if low is not None or high is not None:
+            query["where"] = _range_filter(self.id_field, low, high)
+        return query
+
+    def remote_count(self, report: ParityReport) -> int:
+        """Every document in the collection, whatever its id field holds."""
+        report.aggregations += 1
+        values = run_aggregation(self.base_url, self.api_key, self._query(None, None), [{"alias": "n", "count": {}}])
+        return int(values.get("n") or 0)
+
+    def remote_summary(self, report: ParityReport, low: int | None, high: int | None) -> tuple[int, int]:
+        report.aggregations += 1
+        values = run_aggregation(
+            self.base_url,
+            self.api_key,
+            self._query(low, high),
+            [{"alias": "n", "count": {}}, {"alias": "h", "sum": {"field": {"fieldPath": SYNC_HASH_FIELD}}}],
+        )
+        # A double sum (overflow, or a non-integer stamp) cannot match and forces a drill.
+        total = values.get("h") or 0
+        return int(values.get("n") or 0), total if isinstance(total, int) else -1
+
+    def remote_hashes(self, report: ParityReport, low: int | None, high: int | None) -> dict[int, int | None]:
+        query = self._query(low, high)
+        if not self.verify_fields:
+            query["select"] = {"fields": [{"fieldPath": self.id_field}, {"fieldPath": SYNC_HASH_FIELD}]}
+        docs = run_query(self.base_url, self.api_key, query)
+        report.fetched_docs += len(docs)
+        columns = self.dump.columns
+        out: dict[int, int | None] = {}
+        for doc in docs:
+            doc_id = doc.get(self.id_field)
+            if not isinstance(doc_id, int):
+                continue
+            if self.verify_fields:
+                out[doc_id] = sync_hash({name: doc.get(name) for name in columns})
+            else:
+                stamped = doc.get(SYNC_HASH_FIELD)
+                out[doc_id] = stamped if isinstance(stamped, int) else None
+        return out
+
+    def _drill(self, report: ParityReport, low: int | None, high: int | None) -> None:
+        report.drilled_ranges += 1
+        local = self.dump.hashes_in(low if low is not None else -(2 ** 63), high if high is not None else 2 ** 63 - 1)
+        remote = self.remote_hashes(report, low, high)
+        for doc_id, digest in local.items():
+            if doc_id not in remote:
+                report.missing.append(doc_id)
+            elif remote[doc_id] is None:
+                report.unstamped.append(doc_id)
+            elif remote[doc_id] != digest:
+                report.different.append(doc_id)
+        report.extra.extend(doc_id for doc_id in remote if doc_id not in local)
+
+    def _check(self, report: ParityReport, low: int, high: int) -> None:
+        if self.verify_fields:
+            # Stamps are not trusted, so the checksums prove nothing; read the bucket.
+            self._drill(report, low, high)
+            return
+        local = self.dump.summary(low, high)
+        remote = self.remote_summary(report, low, high)
+        if local == remote:
+            return
+        if max(local[0], remote[0]) <= self.drill_rows or high - low <= FANOUT:
+            self._drill(report, low, high)
+            return
+        step = -(-(high - low) // FANOUT)
+        for start in range(low, high, step):
+            self._check(report, start, min(high, start + step))
+
+    def run(self, table: str, buckets: int = DEFAULT_BUCKETS) -> ParityReport:
+        ids = self.dump.ids
+        report = ParityReport(table, self.collection, buckets, len(ids))
+        if ids:
+            low, high = ids[0], ids[-1] + 1
+            step = -(-(high - low) // max(1, buckets))
+            for start in range(low, high, step):
+                end = min(high, start + step)
+                self._check(report, start, end)
+        else:
+            low = high = 0
+        # Documents outside the dump's id span are extra by definition.
+        for outside in ((None, low), (high, None)):
+            count, _ = self.remote_summary(report, *outside)
+            if count:
+                self._drill(report, *outside)
+        report.firestore_docs = self.remote_count(report)
+        report.unranged_docs = report.firestore_docs - (report.dump_rows - len(report.missing) + len(report.extra))
+        return report
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check a dump table against its Firestore collection with bucketed checksums")
+    parser.add_argument("--dump", required=True)
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--collection", default="", help="Firestore collection (default: same as --table)")
+    parser.add_argument("--id-field", default="id", help="Numeric id field present in both the dump and the docs")
+    parser.add_argument("--buckets", type=int, default=DEFAULT_BUCKETS)
+    parser.add_argument("--drill-rows", type=int, default=DRILL_ROWS, help="Fetch a mismatched range's docs once it holds at most this many")
+    parser.add_argument("--verify-fields", action="store_true", help="Recompute hashes from document fields instead of trusting _sync_hash stamps (reads every doc)")
+    parser.add_argument("--output", default="", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings and request metrics here at exit")
+    args = parser.parse_args()
+    METRICS.write_at_exit(args.metrics_json)
+
+    api_key, base_url = parse_firebase_config("shared/js/firebase-config.js")
+    collection = args.collection or args.table
+    METRICS.start_phase("hash dump")
+    dump = DumpSide.from_dump(args.dump, args.table, args.id_field)
+    METRICS.start_phase("check")
+    checker = ParityChecker(base_url, api_key, collection, dump, args.id_field, args.verify_fields, args.drill_rows)
+    report = checker.run(args.table, args.buckets)
+    METRICS.end_phase()
+
+    totals = METRICS.summary()["request_totals"]
+    status = "in sync" if report.in_sync else (
+        f"{len(report.missing)} missing, {len(report.extra)} extra, {len(report.different)} different, {len(report.unstamped)} unstamped, "
+        f"{report.unranged_docs} without a numeric {args.id_field}"
+    )
+    print(
+        f"{args.table} -> {collection}: {status}; {report.aggregations} aggregations, {report.drilled_ranges} ranges drilled, "
+        f"{report.fetched_docs} docs fetched, {totals['bytes_in'] / 1024:.1f} KB read",
+        file=sys.stderr,
+    )
+    text = json.dumps(report.to_dict(), indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    return 0 if report.in_sync else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
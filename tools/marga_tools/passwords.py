@@ -0,0 +1,54 @@
+"""PBKDF2 password fields written by the user import scripts.
+
+`rehash_password` keeps a document's salt only while the password is
+unchanged: the new password must verify against the stored hash (with
+the same algorithm and iteration count). It then hashes to the same
+fields, and the document's sync hash (see marga_tools.synchash) does not
+move between runs. A changed password, and a new document, gets a fresh
+random salt.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+import hmac
+import secrets
+from typing import Any
+
+PASSWORD_ALGO = "PBKDF2-SHA256"
+PASSWORD_ITERATIONS = 120000
+PASSWORD_HASH_FIELDS = ("password_hash", "password_salt", "password_iterations", "password_algo")
+
+
+def stored_salt(doc: dict[str, Any] | None) -> bytes | None:
+    """The salt `doc` was hashed with, if it can be reused for a new hash."""
+    if not doc or doc.get("password_algo") != PASSWORD_ALGO or doc.get("password_iterations") != PASSWORD_ITERATIONS:
+        return None
+    try:
+        salt = base64.b64decode(str(doc.get("password_salt") or ""), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return salt if len(salt) >= 16 else None
+
+
+def hash_password(password: str, salt: bytes | None = None) -> dict[str, Any]:
+    salt = salt or secrets.token_bytes(16)
+    derived = hashlib.pbkdf2_hmac("sha256", str(password or "").encode("utf-8"), salt, PASSWORD_ITERATIONS, dklen=32)
+    return {
+        "password_hash": base64.b64encode(derived).decode("ascii"),
+        "password_salt": base64.b64encode(salt).decode("ascii"),
+        "password_iterations": PASSWORD_ITERATIONS,
+        "password_algo": PASSWORD_ALGO,
+    }
+
+
+def rehash_password(password: str, doc: dict[str, Any] | None) -> dict[str, Any]:
+    """`hash_password`, reusing `doc`'s salt when `password` verifies against its stored hash."""
+    salt = stored_salt(doc)
+    if salt is not None:
+        fields = hash_password(password, salt)
+        if hmac.compare_digest(fields["password_hash"], str(doc.get("password_hash") or "")):
+            return fields
+    return hash_password(password)
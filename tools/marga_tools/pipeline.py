@@ -0,0 +1,154 @@
+"""Run a script's per-document work as overlapping stages.
+
+The scripts used to hash every password, then write every document, so the
+network sat idle while PBKDF2 ran and the CPU sat idle while requests were
+in flight. A `Pipeline` gives each stage its own worker threads and joins
+neighbouring stages with bounded queues:
+
+    Pipeline(ids, name="write")
+        .stage("hash", hash_one, workers=2)
+        .stage("write", write_one, workers=4)
+        .run(record_one)
+
+Items flow through while the source is still producing, so wall time
+tends towards the slowest stage instead of the sum of all of them. The
+queue bound keeps a fast stage from running far ahead of a slow one.
+PBKDF2 (`hashlib.pbkdf2_hmac`) and socket I/O both release the GIL, so
+threads are enough here.
+
+A stage function returns the item to pass on, or None to drop it. The sink
+runs on the calling thread, so it can touch a journal or counters without
+locking. Order is kept only through single-worker stages. The first
+exception in any stage stops the pipeline and is re-raised from `run()`.
+Each stage's busy time goes into METRICS counters as `pipeline <name>/<stage>_s`.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable
+
+from marga_tools.metrics import METRICS
+
+_DONE = object()
+_POLL_S = 0.1
+
+
+@dataclass
+class _Stage:
+    name: str
+    func: Callable[[Any], Any]
+    workers: int
+
+
+class Pipeline:
+    def __init__(self, source: Iterable[Any], maxsize: int = 64, name: str = "pipeline") -> None:
+        self.source = source
+        self.maxsize = max(1, maxsize)
+        self.name = name
+        self.stages: list[_Stage] = []
+        self._stop = threading.Event()
+        self._error: BaseException | None = None
+        self._error_lock = threading.Lock()
+
+    def stage(self, name: str, func: Callable[[Any], Any], workers: int = 1) -> "Pipeline":
+        self.stages.append(_Stage(name, func, max(1, workers)))
+        return self
+
+    def _fail(self, err: BaseException) -> None:
+        with self._error_lock:
+            if self._error is None:
+                self._error = err
+        self._stop.set()
+
+    def _put(self, out: queue.Queue, item: Any) -> bool:
+        """Block until `item` is queued; False once the pipeline is stopping."""
+        while not self._stop.is_set():
+            try:
+                out.put(item, timeout=_POLL_S)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, inbox: queue.Queue) -> Any:
+        while not self._stop.is_set():
+            try:
+                return inbox.get(timeout=_POLL_S)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _feed(self, out: queue.Queue) -> None:
+        try:
+            for item in self.source:
+                if not self._put(out, item):
+                    return
+        except BaseException as err:
+            self._fail(err)
+        finally:
+            self._put(out, _DONE)
+
+    def _work(self, stage: _Stage, inbox: queue.Queue, out: queue.Queue, remaining: list[int], lock: threading.Lock) -> None:
+        busy = 0.0
+        try:
+            while True:
+                item = self._get(inbox)
+                if item is _DONE:
+                    # Let this stage's other workers see the end too.
+                    self._put(inbox, _DONE)
+                    break
+                started = time.perf_counter()
+                result = stage.func(item)
+                busy += time.perf_counter() - started
+                if result is not None and not self._put(out, result):
+                    break
+        except BaseException as err:
+            self._fail(err)
+        finally:
+            METRICS.count(f"pipeline {self.name}/{stage.name}_s", busy)
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                self._put(out, _DONE)
+
+    def run(self, sink: Callable[[Any], None] | None = None) -> int:
+        """Drive every stage to completion; returns the number of items that reached the sink."""
+        inbox: queue.Queue = queue.Queue(self.maxsize)
+        threads = [threading.Thread(target=self._feed, args=(inbox,), name=f"{self.name}-source", daemon=True)]
+        for stage in self.stages:
+            out: queue.Queue = queue.Queue(self.maxsize)
+            remaining, lock = [stage.workers], threading.Lock()
+            threads += [
+                threading.Thread(target=self._work, args=(stage, inbox, out, remaining, lock), name=f"{self.name}-{stage.name}-{index}", daemon=True)
+                for index in range(stage.workers)
+            ]
+            inbox = out
+        for thread in threads:
+            thread.start()
+
+        delivered = 0
+        busy = 0.0
+        try:
+            while True:
+                item = self._get(inbox)
+                if item is _DONE:
+                    break
+                if sink is not None:
+                    started = time.perf_counter()
+                    sink(item)
+                    busy += time.perf_counter() - started
+                delivered += 1
+        except BaseException as err:
+            self._fail(err)
+        finally:
+            for thread in threads:
+                thread.join()
+            METRICS.count(f"pipeline {self.name}/sink_s", busy)
+        if self._error is not None:
+            raise self._error
+        return delivered
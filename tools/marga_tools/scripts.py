@@ -0,0 +1,82 @@
+"""Load the hyphenated tools/ and scripts/ files as modules.
+
+The benchmarks time their parsers. The watcher (marga_tools.watch) and the
+unified CLI (marga_tools.cli) run their `main()` in-process, so each script
+is imported once per process. `warm_script` also makes the script's dump and
+workbook parsers (`PARSERS`) return their last result while the input file
+is unchanged. Those parsers' results are only read by the scripts, never
+modified.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import importlib.util
+import os
+import sys
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Iterator
+
+from marga_tools.metrics import METRICS
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+PARSERS = {
+    "extract_branches.py": ("extract_branchinfo_from_sql",),
+    "tools/reconcile-employees-single-source.py": ("extract_tbl_employee_from_dump", "parse_final_users_xlsx"),
+    "tools/promote-final-users-to-tbl-employee.py": ("parse_xlsx",),
+    "scripts/update-employee-payroll-rates-from-xlsx.py": ("read_workbook_rows",),
+}
+_SCRIPTS: dict[str, ModuleType] = {}
+
+
+def load_script(relative_path: str) -> ModuleType:
+    """Import a (hyphenated) script by path without running its main()."""
+    if relative_path not in _SCRIPTS:
+        path = REPO_ROOT / relative_path
+        spec = importlib.util.spec_from_file_location(path.stem.replace("-", "_"), path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _SCRIPTS[relative_path] = module
+    return _SCRIPTS[relative_path]
+
+
+class FileMemo:
+    """Wraps `func(path, ...)` to return its last result while that file is unchanged."""
+
+    def __init__(self, func: Callable[..., Any]) -> None:
+        self.func = func
+        self._key: tuple[Any, ...] | None = None
+        self._value: Any = None
+
+    def __call__(self, path: str, *args: Any, **kwargs: Any) -> Any:
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, args, sorted(kwargs.items()))
+        if key == self._key:
+            METRICS.count("parse_cache_hits")
+            return self._value
+        self._value = self.func(path, *args, **kwargs)
+        self._key = key
+        return self._value
+
+
+def warm_script(relative_path: str) -> ModuleType:
+    """`load_script`, with the script's `PARSERS` wrapped in a `FileMemo`."""
+    module = load_script(relative_path)
+    for name in PARSERS.get(relative_path, ()):
+        if not isinstance(getattr(module, name), FileMemo):
+            setattr(module, name, FileMemo(getattr(module, name)))
+    return module
+
+
+@contextlib.contextmanager
+def as_script(name: str, argv: list[str]) -> Iterator[None]:
+    """Let an argparse `main()` run in-process as if launched from the repo root as `name` with `argv`."""
+    saved_argv, saved_cwd = sys.argv, os.getcwd()
+    sys.argv = [name, *argv]
+    os.chdir(REPO_ROOT)
+    try:
+        yield
+    finally:
+        sys.argv = saved_argv
+        os.chdir(saved_cwd)
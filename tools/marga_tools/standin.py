@@ -0,0 +1,619 @@
+"""In-memory stand-in for the Firestore REST API, for offline load tests.
+
+Implements the subset the tools/ scripts use: list (paged, with field
+masks), get, PATCH with `updateMask` and `currentDocument` preconditions,
+DELETE, `:runQuery`, `:runAggregationQuery` (count, sum, avg), `:commit`,
+`:batchWrite` and `:batchGet`. Any URL prefix
+ending in `/documents` is accepted, so both the Firebase-style
+`/v1/projects/<p>/databases/(default)/documents` path and the Margabase
+`/margabase-api/v1/...` path work.
+
+Responses are gzipped when the client sends `Accept-Encoding: gzip`, and
+gzip request bodies (`Content-Encoding: gzip`) are accepted, as Google's
+front ends do. With `gzip_requests` off (`--refuse-gzip-requests`) they
+are answered 415, like a proxy that does not support them.
+
+Latency, random 503s and 429 throttling are injected from a seeded RNG.
+Given the same request order, a run fails the same way every time.
+
+Point a script at it with the environment overrides read by
+`firestore.parse_firebase_config`:
+
+  python3 -m marga_tools.standin --port 8787 --latency-ms 20 --throttle-rate 0.05 --seed-synthetic 5000 &
+  MARGA_FIRESTORE_BASE_URL=http://127.0.0.1:8787/v1/projects/standin/databases/(default)/documents \\
+    python3 tools/reconcile-employees-single-source.py ...
+"""
+
+from __future__ import annotations
+
+import argparse
+import base64
+import bisect
+import datetime as dt
+import gzip
+import json
+import random
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterable
+
+from marga_tools.firestore import CODE_FAILED_PRECONDITION, CODE_NOT_FOUND, CODE_OK, fs_fields, fs_parse_value
+
+CODE_INVALID_ARGUMENT = 3
+CODE_ALREADY_EXISTS = 6
+RPC_STATUS = {
+    CODE_OK: (200, "OK"),
+    CODE_INVALID_ARGUMENT: (400, "INVALID_ARGUMENT"),
+    CODE_NOT_FOUND: (404, "NOT_FOUND"),
+    CODE_ALREADY_EXISTS: (409, "ALREADY_EXISTS"),
+    CODE_FAILED_PRECONDITION: (400, "FAILED_PRECONDITION"),
+}
+DEFAULT_ROOT = "projects/standin/databases/(default)/documents"
+
+
+class WriteError(Exception):
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+@dataclass
+class Faults:
+    """Injected per request, before it is handled."""
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    max_qps: float = 0.0
+    seed: int = 0
+
+
+def _timestamp(moment: dt.datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _split_path(path: str) -> list[str]:
+    """Split a field path on dots, honouring backtick-quoted segments."""
+    parts: list[str] = []
+    current: list[str] = []
+    quoted = False
+    escaped = False
+    for ch in path:
+        if escaped:
+            current.append(ch)
+            escaped = False
+        elif quoted and ch == "\\":
+            escaped = True
+        elif ch == "`":
+            quoted = not quoted
+        elif ch == "." and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+    parts.append("".join(current))
+    return parts
+
+
+def _get_path(fields: dict[str, Any], parts: list[str]) -> dict[str, Any] | None:
+    value: dict[str, Any] | None = {"mapValue": {"fields": fields}}
+    for part in parts:
+        if value is None or "mapValue" not in value:
+            return None
+        value = (value["mapValue"].get("fields") or {}).get(part)
+    return value
+
+
+def _set_path(fields: dict[str, Any], parts: list[str], value: dict[str, Any] | None) -> None:
+    for part in parts[:-1]:
+        child = fields.get(part)
+        if child is None or "mapValue" not in child:
+            if value is None:
+                return
+            child = fields[part] = {"mapValue": {"fields": {}}}
+        fields = child["mapValue"].setdefault("fields", {})
+    if value is None:
+        fields.pop(parts[-1], None)
+    else:
+        fields[parts[-1]] = value
+
+
+def _project(fields: dict[str, Any], mask: Iterable[str] | None) -> dict[str, Any]:
+    if mask is None:
+        return fields
+    out: dict[str, Any] = {}
+    for path in mask:
+        parts = _split_path(path)
+        value = _get_path(fields, parts)
+        if value is not None:
+            _set_path(out, parts, value)
+    return out
+
+
+class DocumentStore:
+    """Collections of documents kept as Firestore-encoded fields."""
+
+    def __init__(self) -> None:
+        self.collections: dict[str, dict[str, dict[str, Any]]] = {}
+        self._sorted: dict[str, list[str]] = {}
+        self._lock = threading.RLock()
+        self._last = dt.datetime.now(dt.timezone.utc)
+
+    def _tick(self) -> str:
+        now = dt.datetime.now(dt.timezone.utc)
+        # Strictly increasing, so every write gets a distinct updateTime.
+        self._last = max(now, self._last + dt.timedelta(microseconds=1))
+        return _timestamp(self._last)
+
+    def put(self, collection: str, doc_id: str, fields: dict[str, Any], update_time: str | None = None) -> None:
+        """Seed a document without going through the write path."""
+        with self._lock:
+            stamp = update_time or self._tick()
+            docs = self.collections.setdefault(collection, {})
+            if doc_id not in docs:
+                self._sorted.pop(collection, None)
+            docs[doc_id] = {"fields": fields, "createTime": stamp, "updateTime": stamp}
+
+    def get(self, collection: str, doc_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            return self.collections.get(collection, {}).get(doc_id)
+
+    def ids(self, collection: str) -> list[str]:
+        with self._lock:
+            if collection not in self._sorted:
+                self._sorted[collection] = sorted(self.collections.get(collection, {}))
+            return self._sorted[collection]
+
+    def page(self, collection: str, page_size: int, after: str | None) -> tuple[list[tuple[str, dict[str, Any]]], str | None]:
+        with self._lock:
+            ids = self.ids(collection)
+            start = bisect.bisect_right(ids, after) if after is not None else 0
+            chosen = ids[start:start + page_size]
+            docs = self.collections.get(collection, {})
+            more = start + page_size < len(ids)
+            return [(doc_id, docs[doc_id]) for doc_id in chosen], (chosen[-1] if more and chosen else None)
+
+    def check(self, collection: str, doc_id: str, precondition: dict[str, Any] | None) -> None:
+        if not precondition:
+            return
+        current = self.get(collection, doc_id)
+        if "exists" in precondition:
+            if precondition["exists"] and current is None:
+                raise WriteError(CODE_NOT_FOUND, f"No document to update: {collection}/{doc_id}")
+            if not precondition["exists"] and current is not None:
+                raise WriteError(CODE_ALREADY_EXISTS, f"Document already exists: {collection}/{doc_id}")
+        if "updateTime" in precondition:
+            if current is None or current["updateTime"] != precondition["updateTime"]:
+                raise WriteError(CODE_FAILED_PRECONDITION, f"The document has changed: {collection}/{doc_id}")
+
+    def apply(self, write: dict[str, Any], stamp: str | None = None) -> dict[str, Any]:
+        """Apply one REST `Write`; raises WriteError without changing anything on failure."""
+        with self._lock:
+            if "delete" in write:
+                collection, doc_id = parse_name(write["delete"])
+                self.check(collection, doc_id, write.get("currentDocument"))
+                if self.collections.get(collection, {}).pop(doc_id, None) is not None:
+                    self._sorted.pop(collection, None)
+                return {"updateTime": stamp or self._tick()}
+            if "update" not in write:
+                raise WriteError(CODE_INVALID_ARGUMENT, "Only update and delete writes are supported")
+            update = write["update"]
+            collection, doc_id = parse_name(update.get("name", ""))
+            self.check(collection, doc_id, write.get("currentDocument"))
+            new_fields = update.get("fields") or {}
+            current = self.get(collection, doc_id)
+            if "updateMask" in write:
+                merged = json.loads(json.dumps(current["fields"])) if current else {}
+                for path in write["updateMask"].get("fieldPaths") or []:
+                    parts = _split_path(path)
+                    _set_path(merged, parts, _get_path(new_fields, parts))
+                new_fields = merged
+            stamp = stamp or self._tick()
+            docs = self.collections.setdefault(collection, {})
+            if doc_id not in docs:
+                self._sorted.pop(collection, None)
+            docs[doc_id] = {"fields": new_fields, "createTime": current["createTime"] if current else stamp, "updateTime": stamp}
+            return {"updateTime": stamp}
+
+    def commit(self, writes: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """All-or-nothing: preconditions are checked against a snapshot first."""
+        with self._lock:
+            saved = {name: dict(docs) for name, docs in self.collections.items()}
+            stamp = self._tick()
+            try:
+                return [self.apply(write, stamp) for write in writes]
+            except WriteError:
+                self.collections = saved
+                self._sorted.clear()
+                raise
+
+
+def parse_name(name: str) -> tuple[str, str]:
+    """`projects/.../documents/tbl_employee/12` -> (`tbl_employee`, `12`)."""
+    path = name.split("/documents/", 1)[1] if "/documents/" in name else name
+    collection, _, doc_id = path.rpartition("/")
+    if not collection or not doc_id:
+        raise WriteError(CODE_INVALID_ARGUMENT, f"Bad document name: {name}")
+    return collection, doc_id
+
+
+def _decoded_sort_key(value: Any) -> tuple[int, Any]:
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, json.dumps(value, sort_keys=True, default=str))
+
+
+def _matches(fields: dict[str, Any], where: dict[str, Any] | None) -> bool:
+    if not where:
+        return True
+    if "compositeFilter" in where:
+        results = (_matches(fields, child) for child in where["compositeFilter"].get("filters") or [])
+        return any(results) if where["compositeFilter"].get("op") == "OR" else all(results)
+    if "unaryFilter" in where:
+        unary = where["unaryFilter"]
+        raw = _get_path(fields, _split_path(unary["field"]["fieldPath"]))
+        value = fs_parse_value(raw) if raw is not None else None
+        op = unary.get("op")
+        if op == "IS_NULL":
+            return raw is not None and value is None
+        if op == "IS_NOT_NULL":
+            return raw is not None and value is not None
+        return False
+    field_filter = where.get("fieldFilter") or {}
+    raw = _get_path(fields, _split_path(field_filter["field"]["fieldPath"]))
+    if raw is None:
+        return False
+    left = _decoded_sort_key(fs_parse_value(raw))
+    target = fs_parse_value(field_filter.get("value") or {})
+    op = field_filter.get("op")
+    if op in ("IN", "NOT_IN"):
+        found = left in [_decoded_sort_key(item) for item in target or []]
+        return found if op == "IN" else not found
+    if op == "ARRAY_CONTAINS":
+        return isinstance(fs_parse_value(raw), list) and target in fs_parse_value(raw)
+    right = _decoded_sort_key(target)
+    return {
+        "EQUAL": left == right,
+        "NOT_EQUAL": left != right,
+        "LESS_THAN": left < right,
+        "LESS_THAN_OR_EQUAL": left <= right,
+        "GREATER_THAN": left > right,
+        "GREATER_THAN_OR_EQUAL": left >= right,
+    }.get(op, False)
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], store: DocumentStore, faults: Faults, verbose: bool = False) -> None:
+        super().__init__(address, StandinHandler)
+        self.store = store
+        self.faults = faults
+        self.verbose = verbose
+        self.gzip_requests = True
+        self.stats: dict[str, int] = {}
+        self._rng = random.Random(faults.seed)
+        self._rng_lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/{DEFAULT_ROOT}"
+
+    def count(self, key: str) -> None:
+        with self._rng_lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def draw_fault(self) -> tuple[float, int | None]:
+        """(delay seconds, HTTP status to fail with or None) for the next request."""
+        faults = self.faults
+        with self._rng_lock:
+            delay = max(0.0, faults.latency_ms + (self._rng.uniform(-faults.jitter_ms, faults.jitter_ms) if faults.jitter_ms else 0.0)) / 1000
+            status = None
+            if faults.max_qps:
+                now = time.monotonic()
+                if now - self._window_start >= 1.0:
+                    self._window_start, self._window_count = now, 0
+                self._window_count += 1
+                if self._window_count > faults.max_qps:
+                    status = 429
+            roll = self._rng.random()
+            if status is None and roll < faults.throttle_rate:
+                status = 429
+            elif status is None and roll < faults.throttle_rate + faults.error_rate:
+                status = 503
+            return delay, status
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server: StandinServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, payload: Any) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        gzipped = "gzip" in (self.headers.get("Accept-Encoding") or "")
+        if gzipped:
+            body = gzip.compress(body, compresslevel=6)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(f"status {status}")
+
+    def _error(self, code: int, message: str, http_status: int | None = None) -> None:
+        status, name = RPC_STATUS.get(code, (500, "INTERNAL"))
+        self._send(http_status or status, {"error": {"code": http_status or status, "message": message, "status": name}})
+
+    def _body(self) -> dict[str, Any]:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+            self.server.count("gzip request bodies")
+        return json.loads(body or b"{}")
+
+    def _route(self) -> tuple[str, str, str, dict[str, list[str]]] | None:
+        """(document root, relative path, `:verb`, query) or None for paths outside `/documents`."""
+        split = urllib.parse.urlsplit(self.path)
+        path = urllib.parse.unquote(split.path)
+        index = path.find("/documents")
+        if index < 0:
+            return None
+        root = path[:index + len("/documents")]
+        root = root.split("/v1/", 1)[1] if "/v1/" in root else DEFAULT_ROOT
+        rest = path[index + len("/documents"):]
+        verb = ""
+        if rest.startswith(":"):
+            verb, rest = rest[1:], ""
+        elif ":" in rest.rsplit("/", 1)[-1]:
+            rest, verb = rest.rsplit(":", 1)
+        return root, rest.strip("/"), verb, urllib.parse.parse_qs(split.query)
+
+    def _doc(self, root: str, collection: str, doc_id: str, doc: dict[str, Any], mask: Iterable[str] | None = None) -> dict[str, Any]:
+        return {
+            "name": f"{root}/{collection}/{doc_id}",
+            "fields": _project(doc["fields"], mask),
+            "createTime": doc["createTime"],
+            "updateTime": doc["updateTime"],
+        }
+
+    def _handle(self, method: str) -> None:
+        if self.path.startswith("/_standin/stats"):
+            self._send(200, {"stats": dict(self.server.stats), "collections": {name: len(docs) for name, docs in self.server.store.collections.items()}})
+            return
+        delay, fault = self.server.draw_fault()
+        if delay:
+            time.sleep(delay)
+        route = self._route()
+        if route is None:
+            self._error(CODE_NOT_FOUND, f"Unknown path {self.path}")
+            return
+        root, rest, verb, query = route
+        self.server.count(f"{method} {':' + verb if verb else ('document' if '/' in rest else 'collection')}")
+        if self.headers.get("Content-Encoding") == "gzip" and not self.server.gzip_requests:
+            self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            self._send(415, {"error": {"code": 415, "message": "Content-Encoding gzip is not supported", "status": "INVALID_ARGUMENT"}})
+            return
+        if fault is not None:
+            self._body()
+            self._send(fault, {"error": {"code": fault, "message": "injected fault", "status": "RESOURCE_EXHAUSTED" if fault == 429 else "UNAVAILABLE"}})
+            return
+        try:
+            self._dispatch(method, root, rest, verb, query)
+        except WriteError as err:
+            self._error(err.code, str(err))
+        except (KeyError, ValueError, TypeError) as err:
+            self._error(CODE_INVALID_ARGUMENT, f"Bad request: {err}")
+
+    def _dispatch(self, method: str, root: str, rest: str, verb: str, query: dict[str, list[str]]) -> None:
+        store = self.server.store
+        mask = query.get("mask.fieldPaths")
+        now = _timestamp(dt.datetime.now(dt.timezone.utc))
+        if method == "POST" and verb == "runQuery":
+            self._send(200, self._run_query(root, self._body().get("structuredQuery") or {}, now))
+        elif method == "POST" and verb == "runAggregationQuery":
+            self._send(200, self._run_aggregation(self._body().get("structuredAggregationQuery") or {}, now))
+        elif method == "POST" and verb == "batchWrite":
+            writes = self._body().get("writes") or []
+            results, statuses = [], []
+            for write in writes:
+                try:
+                    results.append(store.apply(write))
+                    statuses.append({})
+                except WriteError as err:
+                    results.append({})
+                    statuses.append({"code": err.code, "message": str(err)})
+            self._send(200, {"writeResults": results, "status": statuses})
+        elif method == "POST" and verb == "commit":
+            results = store.commit(self._body().get("writes") or [])
+            self._send(200, {"writeResults": results, "commitTime": results[0]["updateTime"] if results else now})
+        elif method == "POST" and verb == "batchGet":
+            body = self._body()
+            get_mask = (body.get("mask") or {}).get("fieldPaths")
+            out = []
+            for name in body.get("documents") or []:
+                collection, doc_id = parse_name(name)
+                doc = store.get(collection, doc_id)
+                out.append({"found": self._doc(root, collection, doc_id, doc, get_mask), "readTime": now} if doc else {"missing": name, "readTime": now})
+            self._send(200, out)
+        elif verb:
+            self._error(CODE_INVALID_ARGUMENT, f"Unsupported method :{verb}")
+        elif "/" not in rest and method == "GET":
+            page_size = int((query.get("pageSize") or ["300"])[0])
+            token = (query.get("pageToken") or [""])[0]
+            after = base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8") if token else None
+            docs, last = store.page(rest, page_size, after)
+            payload: dict[str, Any] = {"documents": [self._doc(root, rest, doc_id, doc, mask) for doc_id, doc in docs]}
+            if last is not None:
+                payload["nextPageToken"] = base64.urlsafe_b64encode(last.encode("utf-8")).decode("ascii")
+            self._send(200, payload)
+        else:
+            collection, doc_id = parse_name(rest)
+            if method == "GET":
+                doc = store.get(collection, doc_id)
+                if doc is None:
+                    self._error(CODE_NOT_FOUND, f"Document {rest} not found")
+                else:
+                    self._send(200, self._doc(root, collection, doc_id, doc, mask))
+            elif method == "PATCH":
+                body = self._body()
+                write: dict[str, Any] = {"update": {"name": rest, "fields": body.get("fields") or {}}}
+                if "updateMask.fieldPaths" in query:
+                    write["updateMask"] = {"fieldPaths": query["updateMask.fieldPaths"]}
+                write["currentDocument"] = self._query_precondition(query)
+                store.apply(write)
+                self._send(200, self._doc(root, collection, doc_id, store.get(collection, doc_id)))
+            elif method == "DELETE":
+                store.apply({"delete": rest, "currentDocument": self._query_precondition(query)})
+                self._send(200, {})
+            else:
+                self._error(CODE_INVALID_ARGUMENT, f"Unsupported {method}")
+
+    @staticmethod
+    def _query_precondition(query: dict[str, list[str]]) -> dict[str, Any] | None:
+        if "currentDocument.exists" in query:
+            return {"exists": query["currentDocument.exists"][0] == "true"}
+        if "currentDocument.updateTime" in query:
+            return {"updateTime": query["currentDocument.updateTime"][0]}
+        return None
+
+    def _query_docs(self, structured: dict[str, Any]) -> tuple[str, list[tuple[str, dict[str, Any]]]]:
+        store = self.server.store
+        collection = ((structured.get("from") or [{}])[0]).get("collectionId", "")
+        with store._lock:
+            docs = [(doc_id, doc) for doc_id, doc in store.collections.get(collection, {}).items() if _matches(doc["fields"], structured.get("where"))]
+        docs.sort(key=lambda item: item[0])
+        for order in reversed(structured.get("orderBy") or []):
+            parts = _split_path(order["field"]["fieldPath"])
+
+            def key(item: tuple[str, dict[str, Any]]) -> tuple[int, Any]:
+                raw = _get_path(item[1]["fields"], parts)
+                return _decoded_sort_key(fs_parse_value(raw) if raw is not None else None)
+
+            docs.sort(key=key, reverse=order.get("direction") == "DESCENDING")
+        offset = int(structured.get("offset") or 0)
+        limit = structured.get("limit")
+        return collection, docs[offset:offset + int(limit)] if limit is not None else docs[offset:]
+
+    def _run_query(self, root: str, structured: dict[str, Any], now: str) -> list[dict[str, Any]]:
+        collection, docs = self._query_docs(structured)
+        select = structured.get("select")
+        mask = [field["fieldPath"] for field in select.get("fields") or []] if select is not None else None
+        rows = [{"document": self._doc(root, collection, doc_id, doc, mask), "readTime": now} for doc_id, doc in docs]
+        return rows or [{"readTime": now}]
+
+    def _run_aggregation(self, aggregation_query: dict[str, Any], now: str) -> list[dict[str, Any]]:
+        _, docs = self._query_docs(aggregation_query.get("structuredQuery") or {})
+        out: dict[str, Any] = {}
+        for index, aggregation in enumerate(aggregation_query.get("aggregations") or []):
+            alias = aggregation.get("alias") or f"field_{index + 1}"
+            if "count" in aggregation:
+                out[alias] = {"integerValue": str(len(docs))}
+                continue
+            kind = "sum" if "sum" in aggregation else "avg"
+            parts = _split_path(aggregation[kind]["field"]["fieldPath"])
+            values = [fs_parse_value(raw) for raw in (_get_path(doc["fields"], parts) for _, doc in docs) if raw is not None]
+            numbers = [value for value in values if isinstance(value, (int, float)) and not isinstance(value, bool)]
+            total = sum(numbers)
+            if kind == "avg":
+                out[alias] = {"doubleValue": total / len(numbers)} if numbers else {"nullValue": None}
+            elif isinstance(total, int) and -(2 ** 63) <= total < 2 ** 63:
+                out[alias] = {"integerValue": str(total)}
+            else:
+                # Like Firestore: any double, or int64 overflow, makes the sum a double.
+                out[alias] = {"doubleValue": float(total)}
+        return [{"result": {"aggregateFields": out}, "readTime": now}]
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        self._handle("POST")
+
+    def do_PATCH(self) -> None:
+        self._handle("PATCH")
+
+    def do_DELETE(self) -> None:
+        self._handle("DELETE")
+
+
+def start_server(store: DocumentStore | None = None, faults: Faults | None = None, host: str = "127.0.0.1", port: int = 0, verbose: bool = False) -> StandinServer:
+    """Serve on a background thread; port 0 picks a free one. Call `shutdown()` when done."""
+    server = StandinServer((host, port), store or DocumentStore(), faults or Faults(), verbose)
+    threading.Thread(target=server.serve_forever, name="firestore-standin", daemon=True).start()
+    return server
+
+
+def seed_synthetic(store: DocumentStore, employees: int, seed: int = 0) -> None:
+    from marga_tools.synthetic import synthetic_employees
+
+    for employee in synthetic_employees(employees, seed):
+        store.put("tbl_employee", str(employee["id"]), fs_fields(employee))
+
+
+def seed_backup(store: DocumentStore, path: str) -> None:
+    from marga_tools.backup import is_manifest, iter_backup, iter_manifest_documents
+
+    entries = iter_manifest_documents(path) if is_manifest(path) else iter_backup(path)
+    for entry in entries:
+        store.put(entry["collection"], entry["id"], entry["fields"], entry.get("updateTime"))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run an in-memory Firestore REST stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform +/- jitter on the added latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failed with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests failed with 429")
+    parser.add_argument("--max-qps", type=float, default=0.0, help="Answer 429 past this many requests per second (0 = unlimited)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the fault RNG")
+    parser.add_argument("--seed-backup", action="append", default=[], help="Preload documents from a backup or backup-store manifest (repeatable)")
+    parser.add_argument("--seed-synthetic", type=int, default=0, help="Preload this many synthetic tbl_employee docs")
+    parser.add_argument("--refuse-gzip-requests", action="store_true", help="Answer gzip request bodies with 415, like a proxy that does not support them")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    store = DocumentStore()
+    for path in args.seed_backup:
+        seed_backup(store, path)
+    if args.seed_synthetic:
+        seed_synthetic(store, args.seed_synthetic, args.seed)
+    faults = Faults(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate, args.max_qps, args.seed)
+    server = StandinServer((args.host, args.port), store, faults, args.verbose)
+    server.gzip_requests = not args.refuse_gzip_requests
+    print(f"Firestore stand-in on {server.base_url} ({sum(len(docs) for docs in store.collections.values())} docs loaded)")
+    print(f"  MARGA_FIRESTORE_BASE_URL='{server.base_url}' MARGA_FIRESTORE_API_KEY=standin")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
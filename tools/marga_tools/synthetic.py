@@ -0,0 +1,393 @@
+"""Synthetic inputs shaped like the production exports, for benchmarks.
+
+Nothing here reads real data. Generators are seeded, so the same size and
+seed always produce byte-identical files and benchmark runs stay comparable.
+
+- `write_mysql_dump`: a mysqldump-style file with `tbl_employee` and
+  `tbl_branchinfo` (CREATE TABLE blocks, extended INSERTs, escaped strings, NULLs)
+- `write_final_users_xlsx`: the "Final Marga Users" roster
+- `write_payroll_workbook`: the payroll sheet (title row 1, headers row 2, data from row 3)
+
+Usage (from tools/):
+  python3 -m marga_tools.synthetic /tmp/marga-synthetic --employees 5000 --branches 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import zipfile
+from pathlib import Path
+from typing import Any, Iterable
+from xml.sax.saxutils import escape
+
+FIRST_NAMES = [
+    "Juan", "Maria", "Jose", "Ana", "Mark", "John", "Michael", "Grace", "Ramon", "Liza",
+    "Paolo", "Kristine", "Angelo", "Joy", "Ricardo", "Carmela", "Renato", "Shiela", "Noel", "Marivic",
+]
+LAST_NAMES = [
+    "Santos", "Reyes", "Cruz", "Bautista", "Ocampo", "Garcia", "Mendoza", "Torres", "Dela Cruz", "Villanueva",
+    "Castillo", "Ramos", "Aquino", "Navarro", "Salazar", "Pineda", "Domingo", "Lopez", "O'Brien", "Peña",
+]
+POSITIONS = [
+    "Technician", "Field Technician Team Leader", "Messenger", "Driver", "Billing Staff", "Cashier",
+    "Collection Officer", "CSR", "Sales Executive", "HR Assistant", "Admin Manager", "Refiller", "Purchasing",
+]
+CITIES = ["Makati", "Pasig", "Quezon City", "Manila", "Taguig", "Mandaluyong", "Parañaque", "Caloocan"]
+# Strings that exercise the dump escaping rules: quotes, backslashes,
+# newlines, commas and parentheses inside values.
+AWKWARD_TEXT = [
+    "c/o Mr. O'Neil", "Bldg 3, Unit (2F)", "line one\nline two", "path C:\\scan\\in", 'He said "ok"', "tab\there",
+]
+
+EMPLOYEE_COLUMNS = [
+    ("id", "int NOT NULL AUTO_INCREMENT"),
+    ("firstname", "varchar(64) DEFAULT NULL"),
+    ("middlename", "varchar(64) DEFAULT NULL"),
+    ("lastname", "varchar(64) DEFAULT NULL"),
+    ("nickname", "varchar(64) DEFAULT NULL"),
+    ("email", "varchar(128) DEFAULT NULL"),
+    ("contact_number", "varchar(32) DEFAULT NULL"),
+    ("position", "varchar(64) DEFAULT NULL"),
+    ("estatus", "int DEFAULT '1'"),
+    ("mstatus", "int DEFAULT '1'"),
+    ("date_hired", "date DEFAULT NULL"),
+    ("branch_id", "int DEFAULT NULL"),
+    ("rate", "decimal(10,2) DEFAULT NULL"),
+    ("remarks", "text"),
+]
+# Same column order as the production tbl_branchinfo.
+BRANCH_COLUMNS = [
+    ("id", "int NOT NULL AUTO_INCREMENT"),
+    ("company_id", "int DEFAULT NULL"),
+    ("branchname", "varchar(255) DEFAULT NULL"),
+    ("street", "varchar(255) DEFAULT NULL"),
+    ("bldg", "varchar(255) DEFAULT NULL"),
+    ("floor", "varchar(64) DEFAULT NULL"),
+    ("landmark", "varchar(255) DEFAULT NULL"),
+    ("room", "varchar(64) DEFAULT NULL"),
+    ("brgy", "varchar(128) DEFAULT NULL"),
+    ("city", "varchar(128) DEFAULT NULL"),
+    ("area_id", "int DEFAULT NULL"),
+    ("email", "varchar(128) DEFAULT NULL"),
+    ("latitude", "decimal(10,7) DEFAULT NULL"),
+    ("longitude", "decimal(10,7) DEFAULT NULL"),
+    ("intrvl", "int DEFAULT NULL"),
+    ("no_netcon_spoilage", "int DEFAULT '0'"),
+    ("inactive", "int DEFAULT '0'"),
+    ("earliest", "varchar(16) DEFAULT NULL"),
+    ("address_type", "int DEFAULT NULL"),
+    ("code", "varchar(32) DEFAULT NULL"),
+    ("isurgent", "int DEFAULT '0'"),
+    ("signatory", "varchar(128) DEFAULT NULL"),
+    ("designation", "varchar(128) DEFAULT NULL"),
+    ("branch_address", "text"),
+    ("city_id", "int DEFAULT NULL"),
+]
+
+
+def sql_literal(value: Any) -> str:
+    """Render a value the way mysqldump writes it inside VALUES (...)."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    text = str(value)
+    for raw, escaped in (("\\", "\\\\"), ("'", "\\'"), ('"', '\\"'), ("\n", "\\n"), ("\r", "\\r"), ("\t", "\\t"), ("\0", "\\0")):
+        text = text.replace(raw, escaped)
+    return f"'{text}'"
+
+
+def synthetic_employees(count: int, seed: int = 0) -> list[dict[str, Any]]:
+    rng = random.Random(seed)
+    employees = []
+    for emp_id in range(1, count + 1):
+        first = rng.choice(FIRST_NAMES)
+        last = rng.choice(LAST_NAMES)
+        employees.append({
+            "id": emp_id,
+            "firstname": first,
+            "middlename": rng.choice(LAST_NAMES) if rng.random() < 0.7 else None,
+            "lastname": last,
+            "nickname": first[:4] if rng.random() < 0.6 else None,
+            "email": f"{first}.{last}{emp_id}@marga.example".lower().replace(" ", "").replace("'", "") if rng.random() < 0.85 else None,
+            "contact_number": f"09{rng.randrange(10**9):09d}",
+            "position": rng.choice(POSITIONS),
+            "estatus": 1 if rng.random() < 0.8 else 0,
+            "mstatus": 1,
+            "date_hired": f"20{rng.randrange(5, 26):02d}-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}",
+            "branch_id": rng.randrange(1, 500),
+            "rate": round(rng.uniform(9000, 45000), 2),
+            "remarks": rng.choice(AWKWARD_TEXT) if rng.random() < 0.2 else None,
+        })
+    return employees
+
+
+def synthetic_branches(count: int, seed: int = 0, first_id: int = 1) -> list[dict[str, Any]]:
+    rng = random.Random(seed + 1)
+    branches = []
+    for branch_id in range(first_id, first_id + count):
+        city = rng.choice(CITIES)
+        branches.append({
+            "id": branch_id,
+            "company_id": rng.randrange(1, 2000),
+            "branchname": f"{rng.choice(LAST_NAMES)} Trading - {city} Branch {branch_id}",
+            "street": f"{rng.randrange(1, 999)} {rng.choice(LAST_NAMES)} St.",
+            "bldg": rng.choice(AWKWARD_TEXT) if rng.random() < 0.1 else f"Tower {rng.randrange(1, 9)}",
+            "floor": f"{rng.randrange(1, 40)}F",
+            "landmark": None if rng.random() < 0.5 else "near the church",
+            "room": None if rng.random() < 0.6 else f"Rm {rng.randrange(100, 999)}",
+            "brgy": f"Brgy. {rng.randrange(1, 200)}",
+            "city": city,
+            "area_id": rng.randrange(1, 30),
+            "email": None if rng.random() < 0.4 else f"branch{branch_id}@client.example",
+            "latitude": round(rng.uniform(14.35, 14.80), 7),
+            "longitude": round(rng.uniform(120.90, 121.15), 7),
+            "intrvl": rng.choice([30, 60, 90]),
+            "no_netcon_spoilage": 0,
+            "inactive": 1 if rng.random() < 0.15 else 0,
+            "earliest": "08:00",
+            "address_type": rng.randrange(0, 3),
+            "code": f"BR{branch_id:06d}",
+            "isurgent": 0,
+            "signatory": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "designation": rng.choice(["Office Manager", "Admin Officer", "Owner"]),
+            "branch_address": f"{rng.randrange(1, 999)} {rng.choice(LAST_NAMES)} St., {city}",
+            "city_id": CITIES.index(city) + 1,
+        })
+    return branches
+
+
+def _table_sql(name: str, columns: list[tuple[str, str]], rows: Iterable[dict[str, Any]], rows_per_insert: int) -> Iterable[str]:
+    yield f"--\n-- Table structure for table `{name}`\n--\n\n"
+    yield f"DROP TABLE IF EXISTS `{name}`;\n"
+    yield f"CREATE TABLE `{name}` (\n"
+    for column, definition in columns:
+        yield f"  `{column}` {definition},\n"
+    yield "  PRIMARY KEY (`id`)\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;\n\n"
+    yield f"LOCK TABLES `{name}` WRITE;\n"
+    batch: list[str] = []
+    names = [column for column, _ in columns]
+    for row in rows:
+        batch.append("(" + ",".join(sql_literal(row.get(column)) for column in names) + ")")
+        if len(batch) >= rows_per_insert:
+            yield f"INSERT INTO `{name}` VALUES {','.join(batch)};\n"
+            batch = []
+    if batch:
+        yield f"INSERT INTO `{name}` VALUES {','.join(batch)};\n"
+    yield "UNLOCK TABLES;\n\n"
+
+
+def write_mysql_dump(
+    path: str | Path,
+    employees: int = 1000,
+    branches: int = 5000,
+    seed: int = 0,
+    rows_per_insert: int = 500,
+    first_branch_id: int = 1,
+) -> dict[str, int]:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", encoding="utf-8") as fh:
+        fh.write("-- MySQL dump 10.13  Distrib 8.0.36, for Linux (x86_64)\n--\n-- Host: localhost    Database: marga\n\n")
+        fh.write("/*!40101 SET NAMES utf8mb4 */;\n\n")
+        fh.writelines(_table_sql("tbl_branchinfo", BRANCH_COLUMNS, synthetic_branches(branches, seed, first_branch_id), rows_per_insert))
+        fh.writelines(_table_sql("tbl_employee", EMPLOYEE_COLUMNS, synthetic_employees(employees, seed), rows_per_insert))
+        fh.write("-- Dump completed\n")
+    return {"tbl_employee": employees, "tbl_branchinfo": branches, "bytes": path.stat().st_size}
+
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def write_xlsx(path: str | Path, rows: list[list[Any]], sheet_name: str = "Sheet1") -> None:
+    """Write a single-sheet workbook with shared strings, as Excel saves it.
+
+    `None` becomes an empty cell element rather than a missing one, so readers
+    that index cells by position and readers that use the `r` reference agree.
+    """
+    strings: dict[str, int] = {}
+    sheet_rows = []
+    for row_number, row in enumerate(rows, start=1):
+        cells = []
+        for col, value in enumerate(row):
+            ref = f"{_column_letter(col)}{row_number}"
+            if value is None:
+                cells.append(f'<c r="{ref}"/>')
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                cells.append(f'<c r="{ref}"><v>{value!r}</v></c>')
+            else:
+                index = strings.setdefault(str(value), len(strings))
+                cells.append(f'<c r="{ref}" t="s"><v>{index}</v></c>')
+        sheet_rows.append(f'<row r="{row_number}">{"".join(cells)}</row>')
+
+    main_ns = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    rel_ns = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    parts = {
+        "[Content_Types].xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            "</Types>"
+        ),
+        "_rels/.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{rel_ns}/officeDocument" Target="xl/workbook.xml"/>'
+            "</Relationships>"
+        ),
+        "xl/workbook.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<workbook xmlns="{main_ns}" xmlns:r="{rel_ns}">'
+            f'<sheets><sheet name="{escape(sheet_name)}" sheetId="1" r:id="rId1"/></sheets>'
+            "</workbook>"
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{rel_ns}/worksheet" Target="worksheets/sheet1.xml"/>'
+            f'<Relationship Id="rId2" Type="{rel_ns}/sharedStrings" Target="sharedStrings.xml"/>'
+            f'<Relationship Id="rId3" Type="{rel_ns}/styles" Target="styles.xml"/>'
+            "</Relationships>"
+        ),
+        "xl/styles.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<styleSheet xmlns="{main_ns}">'
+            '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+            '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+            '<borders count="1"><border/></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs>'
+            "</styleSheet>"
+        ),
+        "xl/sharedStrings.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<sst xmlns="{main_ns}" count="{len(strings)}" uniqueCount="{len(strings)}">'
+            + "".join(f'<si><t xml:space="preserve">{escape(text)}</t></si>' for text in strings)
+            + "</sst>"
+        ),
+        "xl/worksheets/sheet1.xml": (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f'<worksheet xmlns="{main_ns}" xmlns:r="{rel_ns}"><sheetData>'
+            + "".join(sheet_rows)
+            + "</sheetData></worksheet>"
+        ),
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, content in parts.items():
+            # A fixed entry timestamp, so the same rows give the same bytes on every run.
+            zf.writestr(zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0)), content, compress_type=zipfile.ZIP_DEFLATED)
+
+
+def write_final_users_xlsx(path: str | Path, employees: list[dict[str, Any]], rows: int, seed: int = 0, match_rate: float = 0.9) -> None:
+    """Roster rows drawn from `employees`; about 1 - match_rate of them match nobody."""
+    rng = random.Random(seed + 2)
+    sheet: list[list[Any]] = [
+        ["Final Marga Users", None, None, None, None, None, None, None],
+        ["Employee_Id", "Nickname", "Firstname", "Lastname", "Password", "Contact_Number", "Position", "Email"],
+    ]
+    for index in range(rows):
+        if employees and rng.random() < match_rate:
+            employee = employees[rng.randrange(len(employees))]
+            emp_id: Any = employee["id"] if rng.random() < 0.8 else None
+            first, last, nick = employee["firstname"], employee["lastname"], employee.get("nickname")
+            email = employee.get("email") or ""
+        else:
+            emp_id = 900000 + index
+            first, last, nick = rng.choice(FIRST_NAMES), f"Newhire{index}", None
+            email = f"newhire{index}@marga.example"
+        password: Any = rng.randrange(1000, 999999) if rng.random() < 0.5 else f"Marga{rng.randrange(100, 999)}!"
+        sheet.append([emp_id, nick, first, last, password, f"09{rng.randrange(10**9):09d}", rng.choice(POSITIONS), email.upper() if rng.random() < 0.1 else email])
+    write_xlsx(path, sheet, "Final Users")
+
+
+PAYROLL_HEADERS = [
+    "No.", "", "Employee", "SEMIMRATE", "Daily Rate", "Allowance", "SSS", "Mandatory SSS Provident Fund", "PHIC", "HDMF",
+    "Nontax Allowance", "Withholding Tax", "Tax Refund", "SSS Loan", "Coop Loan", "Bank Loan", "Cash Adv", "Pagibig Loan",
+    "T-Shirt", "Tax Adjustment", "Adjustment",
+]
+
+
+def write_payroll_workbook(path: str | Path, employees: list[dict[str, Any]], rows: int = 58, seed: int = 0) -> None:
+    """Payroll sheet: title in row 1, headers in row 2, one employee per row from row 3.
+
+    The importer reads rows 3-60 only, matching the real workbook, so rows past
+    that are written but ignored.
+    """
+    rng = random.Random(seed + 3)
+    sheet: list[list[Any]] = [["MARGA payroll - synthetic period"], PAYROLL_HEADERS]
+    for index in range(rows):
+        employee = employees[index % len(employees)] if employees else {"firstname": "Juan", "lastname": f"Cruz{index}"}
+        semi_monthly = round(rng.uniform(6000, 30000), 2)
+        sheet.append([
+            index + 1,
+            index + 1,
+            f"{employee['lastname']}, {employee['firstname']}",
+            semi_monthly,
+            round(semi_monthly * 2 / 26, 2),
+            rng.choice([0, 500, 1000]),
+            round(rng.uniform(200, 900), 2),
+            None if rng.random() < 0.7 else 250,
+            round(rng.uniform(100, 500), 2),
+            100,
+            None,
+            round(rng.uniform(0, 2000), 2),
+            None,
+            rng.choice([0, 0, 750]),
+            rng.choice([0, 500]),
+            0,
+            rng.choice([0, 0, 1000]),
+            0,
+            None if rng.random() < 0.9 else 350,
+            None,
+            None,
+        ])
+    write_xlsx(path, sheet, "Payroll")
+
+
+def write_fixtures(out_dir: str | Path, employees: int, branches: int, roster: int, payroll_rows: int = 58, seed: int = 0) -> dict[str, Path]:
+    """Write a matching dump, roster and payroll workbook into `out_dir`."""
+    out_dir = Path(out_dir)
+    paths = {
+        "dump": out_dir / f"dump-{employees}e-{branches}b-s{seed}.sql",
+        "final_users": out_dir / f"final-users-{roster}-s{seed}.xlsx",
+        "payroll": out_dir / f"payroll-{payroll_rows}-s{seed}.xlsx",
+    }
+    people = synthetic_employees(employees, seed)
+    write_mysql_dump(paths["dump"], employees=employees, branches=branches, seed=seed)
+    write_final_users_xlsx(paths["final_users"], people, roster, seed=seed)
+    write_payroll_workbook(paths["payroll"], people, payroll_rows, seed=seed)
+    return paths
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Write synthetic dumps and workbooks for benchmarking")
+    parser.add_argument("out_dir")
+    parser.add_argument("--employees", type=int, default=1000)
+    parser.add_argument("--branches", type=int, default=5000)
+    parser.add_argument("--roster", type=int, default=800, help="Final Marga Users rows")
+    parser.add_argument("--payroll-rows", type=int, default=58)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for name, path in write_fixtures(args.out_dir, args.employees, args.branches, args.roster, args.payroll_rows, args.seed).items():
+        print(f"{name}: {path} ({path.stat().st_size} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
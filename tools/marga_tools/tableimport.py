@@ -0,0 +1,247 @@
+"""Import dump tables into Firestore, one collection per table, from a config file.
+
+Each table is one line of `tools/dump-tables.json`:
+
+  {"table": "tbl_branchinfo"}
+  {"table": "tbl_area", "collection": "tbl_area", "id": "id", "exclude": ["password"], "dates": "timestamp"}
+
+`collection` defaults to the table name and `id` to the single-column
+primary key. `fields` keeps only the listed columns, `exclude` drops
+columns, and `dates` is "text" (the dump's own text, as the JS mirror
+writes it) or "timestamp" (Firestore timestamps).
+
+Rows are decoded by column type (`mysqldump.iter_typed_rows`) and streamed
+into the batched `BulkWriter`, or into a `--plan` for
+apply-firestore-plan.py. One pass over the dump covers every table. Each
+document is stamped with its sync hash. Documents whose stored stamp
+already matches (read with a field mask first) are not written again,
+which also makes an interrupted import cheap to re-run.
+
+The stamp read is priced before it starts (marga_tools.cost), and
+`--max-reads` refuses a run that would exceed it. `--max-writes` writes
+only the highest-ranked documents: new ones first, then changed ones, by
+table and id. A later run picks up the rest, since written docs then match
+their stamps. Predicted and actual reads and writes are printed at the end.
+
+  python3 -m marga_tools.tableimport --dump Dump20260218.sql
+  python3 -m marga_tools.tableimport --dump Dump20260218.sql --table tbl_branchinfo --plan /tmp/branches.plan.ndjson
+"""
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+from marga_tools import firestore
+from marga_tools.changeset import PlanWriter
+from marga_tools.cost import Cost, check_reads, encoded_bytes, predict_reads, spent
+from marga_tools.firestore import BulkWriter, parse_firebase_config
+from marga_tools.metrics import METRICS
+from marga_tools.mysqldump import DATE_MODES, iter_typed_rows
+from marga_tools.synchash import fetch_stamps, is_current, stamp
+
+DEFAULT_CONFIG = Path(__file__).resolve().parents[1] / "dump-tables.json"
+
+
+@dataclass
+class TableConfig:
+    table: str
+    collection: str = ""
+    id: str = ""
+    fields: list[str] | None = None
+    exclude: list[str] = field(default_factory=list)
+    dates: str = "text"
+
+    def __post_init__(self) -> None:
+        self.collection = self.collection or self.table
+        if self.dates not in DATE_MODES:
+            raise ValueError(f"{self.table}: dates must be one of {', '.join(DATE_MODES)}, not {self.dates!r}")
+
+    def document(self, row: dict[str, Any]) -> dict[str, Any]:
+        if self.fields is not None:
+            row = {name: row.get(name) for name in self.fields}
+        for name in self.exclude:
+            row.pop(name, None)
+        return row
+
+
+def load_config(path: str | Path) -> list[TableConfig]:
+    with open(path, "r", encoding="utf-8") as fh:
+        entries = json.load(fh)
+    if not isinstance(entries, list):
+        raise ValueError(f"{path}: expected a JSON list of table entries")
+    configs = []
+    for entry in entries:
+        try:
+            configs.append(TableConfig(**entry))
+        except TypeError as err:
+            raise ValueError(f"{path}: bad table entry {entry!r}: {err}") from err
+    return configs
+
+
+@dataclass
+class TableStats:
+    rows: int = 0
+    written: int = 0
+    in_sync: int = 0
+    no_id: int = 0
+    deferred: int = 0
+
+
+def import_tables(
+    dump: str | Path,
+    configs: Iterable[TableConfig],
+    write: Any,
+    stamps: dict[str, dict[str, dict[str, Any]]] | None = None,
+    max_writes: int | None = None,
+) -> dict[str, TableStats]:
+    """Stream every configured table through `write(collection, doc_id, fields)`.
+
+    `stamps` maps collection -> doc id -> stored stamp (see `fetch_stamps`);
+    documents already carrying their stamp are skipped. Without it every row
+    is written. With `max_writes`, only that many top-ranked documents are
+    written (held in memory until the dump is read); the rest are counted
+    as deferred.
+    """
+    by_table = {config.table: config for config in configs}
+    stats = {table: TableStats() for table in by_table}
+    candidates = _candidates(dump, by_table, stats, stamps)
+    if max_writes is not None:
+        candidates = iter(heapq.nsmallest(max(0, max_writes), candidates, key=lambda candidate: candidate[0]))
+    for _, table, collection, doc_id, doc in candidates:
+        write(collection, doc_id, doc)
+        stats[table].written += 1
+    for table, table_stats in stats.items():
+        table_stats.deferred = table_stats.rows - table_stats.no_id - table_stats.in_sync - table_stats.written
+    return stats
+
+
+def _candidates(
+    dump: str | Path,
+    by_table: dict[str, TableConfig],
+    stats: dict[str, TableStats],
+    stamps: dict[str, dict[str, dict[str, Any]]] | None,
+) -> Iterator[tuple[tuple[Any, ...], str, str, str, dict[str, Any]]]:
+    """(rank, table, collection, doc id, stamped doc) for each row that needs writing."""
+    source = f"dump:{os.path.basename(str(dump))}"
+    dates = {table: config.dates for table, config in by_table.items()}
+    order = {table: index for index, table in enumerate(by_table)}
+    for schema, row in iter_typed_rows(dump, by_table, dates=dates):
+        config = by_table[schema.name]
+        table_stats = stats[schema.name]
+        table_stats.rows += 1
+        id_column = config.id or _id_column(schema)
+        doc_id = row.get(id_column)
+        if doc_id is None or doc_id == "":
+            table_stats.no_id += 1
+            continue
+        doc = config.document(row)
+        existing = (stamps or {}).get(config.collection, {}).get(str(doc_id))
+        if stamps is not None and is_current(existing, doc):
+            table_stats.in_sync += 1
+            continue
+        # New docs first, then changed ones; by table, then numeric id.
+        key = str(doc_id)
+        rank = (0 if stamps is not None and existing is None else 1, order[schema.name], not key.isdigit(), int(key) if key.isdigit() else 0, key)
+        yield rank, schema.name, config.collection, key, stamp(doc, source)
+
+
+def _id_column(schema: Any) -> str:
+    key = schema.key_columns()
+    if len(key) != 1:
+        raise ValueError(f"{schema.name} has a composite primary key; set \"id\" for it in the table config")
+    return key[0]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import dump tables listed in a config file into Firestore collections")
+    parser.add_argument("--dump", required=True)
+    parser.add_argument("--config", default=str(DEFAULT_CONFIG), help="JSON list of table entries (default: tools/dump-tables.json)")
+    parser.add_argument("--table", action="append", default=None, help="Only import this table (repeatable; tables missing from the config use defaults)")
+    parser.add_argument("--plan", default="", help="Write the changes to this NDJSON plan instead of applying them")
+    parser.add_argument("--force", action="store_true", help="Write every row without reading the collections' sync stamps first")
+    parser.add_argument("--dry-run", action="store_true", help="Decode and count rows, and price the writes, without reading or writing Firestore")
+    parser.add_argument("--max-reads", type=int, default=None, help="Refuse to run if reading the collections' stamps would cost more reads than this, counting the few reads spent pricing it")
+    parser.add_argument("--max-writes", type=int, default=None, help="Write at most this many documents, new ones first")
+    parser.add_argument("--batch-size", type=int, default=200, help="Writes per :batchWrite call (max 500)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent :batchWrite calls")
+    parser.add_argument("--insecure", action="store_true")
+    parser.add_argument("--gzip-requests", action="store_true", help="Gzip large request bodies (Firestore accepts them; some proxies do not)")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings and request metrics here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
+    args = parser.parse_args()
+    firestore.INSECURE_TLS = args.insecure
+    firestore.GZIP_REQUEST_BODIES = args.gzip_requests
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
+
+    try:
+        configs = load_config(args.config)
+    except (OSError, ValueError) as err:
+        print(str(err), file=sys.stderr)
+        return 2
+    if args.table:
+        known = {config.table: config for config in configs}
+        configs = [known.get(table) or TableConfig(table) for table in args.table]
+
+    api_key, base_url = parse_firebase_config("shared/js/firebase-config.js")
+    stamps: dict[str, dict[str, dict[str, Any]]] | None = None
+    predicted = Cost()
+    if not args.dry_run and not args.force:
+        METRICS.start_phase("predict reads")
+        predicted = predict_reads(base_url, api_key, dict.fromkeys(config.collection for config in configs))
+        refused = check_reads(predicted, args.max_reads)
+        if refused:
+            print(refused, file=sys.stderr)
+            return 2
+        METRICS.start_phase("fetch stamps")
+        stamps = {config.collection: fetch_stamps(base_url, api_key, config.collection) for config in configs}
+
+    METRICS.start_phase("import")
+    if args.dry_run:
+        priced = Cost()
+
+        def price(collection: str, doc_id: str, fields: dict[str, Any]) -> None:
+            priced.writes += 1
+            priced.write_bytes += encoded_bytes(fields)
+
+        stats = import_tables(args.dump, configs, price, max_writes=args.max_writes)
+        predicted += priced
+        failures = []
+    elif args.plan:
+        with PlanWriter(args.plan, "tableimport", dump=args.dump, tables=[config.table for config in configs]) as plan:
+            stats = import_tables(args.dump, configs, plan.update, stamps, args.max_writes)
+        print(f"Plan written to {args.plan}: {plan.count} ops, digest {plan.digest[:16]}")
+        failures = []
+    else:
+        with BulkWriter(base_url, api_key, batch_size=args.batch_size, workers=args.workers) as writer:
+            stats = import_tables(args.dump, configs, writer.update, stamps, args.max_writes)
+        failures = writer.failures
+    METRICS.end_phase()
+
+    for table, table_stats in stats.items():
+        print(
+            f"{table}: {table_stats.rows} rows, {table_stats.written} {'to write' if args.dry_run or args.plan else 'written'}, "
+            f"{table_stats.in_sync} already in sync" + (f", {table_stats.no_id} without an id" if table_stats.no_id else "")
+            + (f", {table_stats.deferred} deferred by --max-writes" if table_stats.deferred else ""),
+            file=sys.stderr,
+        )
+    if args.dry_run:
+        print(predicted.line("Predicted writes (stamp reads are priced without --dry-run)"), file=sys.stderr)
+    else:
+        print(predicted.line("Predicted reads"), file=sys.stderr)
+        print(spent().line("Actual"), file=sys.stderr)
+    for failure in failures[:20]:
+        print(f"- {failure.collection}/{failure.doc_id} failed (code {failure.code}): {failure.message}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
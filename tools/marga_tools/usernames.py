@@ -0,0 +1,99 @@
+"""Username allocation for tbl_employee login accounts.
+
+Suffixed names are handed out from a per-base counter instead of probing
+`base2`, `base3`, ... from the start every time, so allocating a roster where
+most people share a first name stays linear.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Any, Iterable
+
+
+def sanitize_username(text: Any) -> str:
+    value = re.sub(r"[^a-z0-9._-]+", "", str(text or "").strip().lower())
+    return value.strip("._-")[:48]
+
+
+def build_username_candidates(record: dict[str, Any], emp_id: int) -> list[str]:
+    out: list[str] = []
+    email = str(record.get("email") or "").strip().lower()
+    if email and "@" in email:
+        out.append(email.split("@", 1)[0])
+    nickname = str(record.get("nickname") or "").strip()
+    if nickname:
+        out.append(nickname)
+    first = str(record.get("firstname") or "").strip()
+    last = str(record.get("lastname") or "").strip()
+    if first and last:
+        out.append(f"{first}.{last}")
+    if first:
+        out.append(first)
+    out.append(f"emp{emp_id}")
+    return out
+
+
+class UsernameAllocator:
+    """Hands out unique usernames, remembering the next free suffix per base."""
+
+    def __init__(self, used: Iterable[str] = ()) -> None:
+        self.used: set[str] = set()
+        self.next_suffix: dict[str, int] = {}
+        for name in used:
+            value = sanitize_username(name)
+            if value:
+                self.used.add(value)
+
+    def __contains__(self, username: str) -> bool:
+        return username in self.used
+
+    def __len__(self) -> int:
+        return len(self.used)
+
+    def reserve(self, username: Any) -> str:
+        value = sanitize_username(username)
+        if value:
+            self.used.add(value)
+        return value
+
+    def release(self, username: Any) -> None:
+        value = sanitize_username(username)
+        if value:
+            self.used.discard(value)
+
+    def claim(self, base: str) -> str:
+        """Return `base`, or `base<N>` with the lowest N the counter has not passed."""
+        if base not in self.used:
+            self.used.add(base)
+            return base
+        suffix = self.next_suffix.get(base, 2)
+        candidate = f"{base}{suffix}"
+        while candidate in self.used:
+            suffix += 1
+            candidate = f"{base}{suffix}"
+        self.next_suffix[base] = suffix + 1
+        self.used.add(candidate)
+        return candidate
+
+    def allocate(self, record: dict[str, Any], emp_id: int, current_username: str = "") -> str:
+        self.release(current_username)
+        for raw in build_username_candidates(record, emp_id):
+            base = sanitize_username(raw)
+            if base:
+                return self.claim(base)
+        return self.claim(f"emp{emp_id}")
+
+    def allocate_many(self, entries: Iterable[tuple[dict[str, Any], int, str]]) -> dict[int, str]:
+        """Allocate a whole roster of `(record, emp_id, current_username)` entries.
+
+        Entries are processed in employee-id order so the same roster always
+        yields the same usernames, whatever order the source file listed them.
+        When an employee appears more than once the last entry wins.
+        """
+        latest: dict[int, tuple[dict[str, Any], str]] = {}
+        for record, emp_id, current in entries:
+            latest[emp_id] = (record, current)
+        for _, current in latest.values():
+            self.release(current)
+        return {emp_id: self.allocate(latest[emp_id][0], emp_id) for emp_id in sorted(latest)}
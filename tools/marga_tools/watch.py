@@ -0,0 +1,413 @@
+"""Watch a drop folder and process each new dump, roster or payroll workbook as it lands.
+
+Files are recognised by name (`*.sql` for dumps, `--roster-pattern`,
+`--payroll-pattern`); a name matching both the roster and the payroll
+patterns is a payroll workbook. A file is picked up once its size and
+mtime have stopped changing for `--settle` seconds, so a half-copied
+download is never read. Each is fingerprinted (SHA-256 of its contents),
+and a fingerprint already processed is skipped, whatever the file is
+called. One only planned is run again under `--apply`. State lives in
+`<folder>/.marga-watch/state.json`, so a restart does not redo anything. A
+file that failed is retried once it changes (or is touched).
+
+Only the pipeline a file feeds is run:
+
+- dump: the configured tables are imported (marga_tools.tableimport), then
+  employees are reconciled against the latest roster, if one was seen;
+- roster: employees are reconciled against the latest dump;
+- payroll workbook: the payroll rate update, with its report written to
+  `<folder>/.marga-watch/reports/`.
+
+Without `--apply` nothing is written to Firestore. Imports and reconciles
+go to plans in `<folder>/.marga-watch/plans/` for apply-firestore-plan.py,
+and the payroll update runs with --dry-run.
+
+The process stays up between files, so each file after the first is cheap.
+Scripts are imported once and the TLS context is shared. Each table's sync
+stamps are fetched once and then kept current from the results of the
+watcher's own writes (`--stamps-ttl` forces a re-read). The parsed dump and
+roster are also kept for the next job that needs the same file
+(marga_tools.scripts.PARSERS).
+tbl_employee itself is always fetched fresh, because the reconcile's write
+preconditions need current update times.
+
+The folder is polled every `--interval` seconds. That is one directory
+listing per tick, and it behaves the same on macOS and Linux.
+
+Usage (from tools/):
+  python3 -m marga_tools.watch ~/Downloads/marga-drop
+  python3 -m marga_tools.watch ~/Downloads/marga-drop --once
+  python3 -m marga_tools.watch ~/Downloads/marga-drop --apply --payroll-cutoff 2026-05-11_to_2026-05-25
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime as dt
+import fnmatch
+import hashlib
+import json
+import os
+import signal
+import sys
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from marga_tools import firestore
+from marga_tools.changeset import PlanWriter
+from marga_tools.cost import spent
+from marga_tools.firestore import BulkWriter, WriteResult, parse_firebase_config
+from marga_tools.metrics import METRICS
+from marga_tools.scripts import REPO_ROOT, as_script, warm_script
+from marga_tools.synchash import fetch_stamps, stamp_fields
+from marga_tools.tableimport import DEFAULT_CONFIG, TableConfig, import_tables, load_config
+
+RECONCILE_SCRIPT = "tools/reconcile-employees-single-source.py"
+PAYROLL_SCRIPT = "scripts/update-employee-payroll-rates-from-xlsx.py"
+STATE_DIR = ".marga-watch"
+# Dumps go first, so a roster dropped together with a dump is reconciled against it.
+KIND_ORDER = ("dump", "roster", "payroll")
+# Name patterns are tried most specific first: `user_payroll_2026.xlsx`
+# matches both `*user*` and `*payroll*`, and is a payroll workbook.
+MATCH_ORDER = ("dump", "payroll", "roster")
+DUMP_PATTERNS = ("*.sql",)
+ROSTER_PATTERNS = ("*user*.xlsx",)
+PAYROLL_PATTERNS = ("*payroll*.xlsx",)
+HASH_CHUNK = 1 << 20
+
+
+def log(message: str) -> None:
+    print(f"[{dt.datetime.now():%H:%M:%S}] {message}", flush=True)
+
+
+def fingerprint(path: str | Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(HASH_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def classify(name: str, patterns: dict[str, tuple[str, ...]]) -> str:
+    """The kind of file `name` is, or "" for one to ignore (dotfiles, Office lock files)."""
+    lowered = name.lower()
+    if lowered.startswith((".", "~$")):
+        return ""
+    for kind in MATCH_ORDER:
+        if any(fnmatch.fnmatch(lowered, pattern.lower()) for pattern in patterns[kind]):
+            return kind
+    return ""
+
+
+class WatchState:
+    """What the watcher has fingerprinted and processed, saved after every change."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        data = json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+        # path -> [size, mtime_ns, fingerprint]
+        self.seen: dict[str, list[Any]] = data.get("seen", {})
+        # fingerprint -> {kind, path, status, applied, detail, at, seconds}
+        self.processed: dict[str, dict[str, Any]] = data.get("processed", {})
+        # kind -> path of the newest file of that kind processed successfully
+        self.latest: dict[str, str] = data.get("latest", {})
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"seen": self.seen, "processed": self.processed, "latest": self.latest}, indent=2) + "\n", encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+@dataclass
+class Job:
+    kind: str
+    path: Path
+    fingerprint: str
+
+
+class Watcher:
+    def __init__(
+        self,
+        folder: str | Path,
+        configs: list[TableConfig],
+        apply: bool = False,
+        patterns: dict[str, tuple[str, ...]] | None = None,
+        settle: float = 5.0,
+        stamps_ttl: float = 3600.0,
+        payroll_cutoff: str = "",
+        batch_size: int = 200,
+        workers: int = 4,
+    ) -> None:
+        self.folder = Path(folder).resolve()
+        self.configs = configs
+        self.apply = apply
+        self.patterns = patterns or {"dump": DUMP_PATTERNS, "roster": ROSTER_PATTERNS, "payroll": PAYROLL_PATTERNS}
+        self.settle = settle
+        self.stamps_ttl = stamps_ttl
+        self.payroll_cutoff = payroll_cutoff
+        self.batch_size = batch_size
+        self.workers = workers
+        self.state_dir = self.folder / STATE_DIR
+        self.state = WatchState(self.state_dir / "state.json")
+        self.stopping = False
+        # path -> (size, mtime_ns, monotonic time it was first seen at that size and mtime)
+        self._settling: dict[str, tuple[int, int, float]] = {}
+        self._stamps: dict[str, dict[str, dict[str, Any]]] = {}
+        self._stamps_read_at: dict[str, float] = {}
+        self._api: tuple[str, str] | None = None
+
+    def api(self) -> tuple[str, str]:
+        """(api key, base URL), read once."""
+        if self._api is None:
+            self._api = parse_firebase_config(str(REPO_ROOT / "shared/js/firebase-config.js"))
+        return self._api
+
+    def output_path(self, subdir: str, job: Job, suffix: str) -> Path:
+        path = self.state_dir / subdir / f"{job.path.stem}-{job.fingerprint[:12]}{suffix}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def _needs_apply(self, digest: str) -> bool:
+        """True for a file processed only as plans when the watcher now applies."""
+        done = self.state.processed.get(digest)
+        return bool(self.apply and done and done["status"] == "ok" and not done.get("applied"))
+
+    def scan(self) -> list[Job]:
+        """Settled files that are new or changed since they were last fingerprinted, in processing order."""
+        now = time.monotonic()
+        ready: list[tuple[str, str, list[int]]] = []
+        listed = set()
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                kind = classify(entry.name, self.patterns)
+                if not kind or not entry.is_file():
+                    continue
+                listed.add(entry.path)
+                stat = entry.stat()
+                size_mtime = [stat.st_size, stat.st_mtime_ns]
+                seen = self.state.seen.get(entry.path)
+                if seen and seen[:2] == size_mtime and not self._needs_apply(seen[2]):
+                    continue
+                settling = self._settling.get(entry.path)
+                if settling is None or list(settling[:2]) != size_mtime:
+                    self._settling[entry.path] = (stat.st_size, stat.st_mtime_ns, now)
+                    continue
+                if now - settling[2] < self.settle:
+                    continue
+                del self._settling[entry.path]
+                ready.append((kind, entry.path, size_mtime))
+        for path in set(self._settling) - listed:
+            del self._settling[path]
+
+        jobs = []
+        for kind, path, size_mtime in sorted(ready, key=lambda item: (KIND_ORDER.index(item[0]), item[2][1], item[1])):
+            digest = fingerprint(path)
+            self.state.seen[path] = [*size_mtime, digest]
+            done = self.state.processed.get(digest)
+            if done and done["status"] == "ok" and not self._needs_apply(digest):
+                log(f"{os.path.basename(path)}: same contents as {os.path.basename(done['path'])}, already processed")
+                continue
+            jobs.append(Job(kind, Path(path), digest))
+        if ready:
+            self.state.save()
+        return jobs
+
+    def process(self, job: Job) -> bool:
+        log(f"{job.path.name}: {job.kind} {job.fingerprint[:12]}")
+        started = time.perf_counter()
+        before = spent()
+        METRICS.start_phase(f"watch {job.kind}")
+        try:
+            detail = getattr(self, f"run_{job.kind}")(job)
+            status = "ok"
+        except (Exception, SystemExit) as err:
+            # A bad file must not stop the watcher; it is retried once it changes.
+            traceback.print_exc()
+            detail = f"{type(err).__name__}: {err}"
+            status = "failed"
+        METRICS.end_phase()
+        seconds = time.perf_counter() - started
+        self.state.processed[job.fingerprint] = {
+            "kind": job.kind,
+            "path": str(job.path),
+            "status": status,
+            "applied": self.apply,
+            "detail": detail,
+            "at": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+            "seconds": round(seconds, 3),
+        }
+        if status == "ok":
+            self.state.latest[job.kind] = str(job.path)
+        self.state.save()
+        log(f"{job.path.name}: {status} in {seconds:.1f}s: {detail}")
+        log(f"{job.path.name}: {(spent() - before).line('Firestore')}")
+        return status == "ok"
+
+    def run_dump(self, job: Job) -> str:
+        parts = [self.import_tables(job)]
+        roster = self.state.latest.get("roster")
+        if roster and os.path.exists(roster):
+            parts.append(self.reconcile(job, job.path, Path(roster)))
+        else:
+            parts.append("no roster seen yet, employees not reconciled")
+        return "; ".join(parts)
+
+    def run_roster(self, job: Job) -> str:
+        dump = self.state.latest.get("dump")
+        if not dump or not os.path.exists(dump):
+            return "no dump seen yet; reconciled when one lands"
+        return self.reconcile(job, Path(dump), job.path)
+
+    def run_payroll(self, job: Job) -> str:
+        module = warm_script(PAYROLL_SCRIPT)
+        report = self.output_path("reports", job, ".json")
+        argv = ["--workbook", str(job.path), "--report", str(report), "--source-label", job.path.name]
+        if self.apply and self.payroll_cutoff:
+            argv += ["--effective-cutoff", self.payroll_cutoff]
+        else:
+            argv.append("--dry-run")
+        with as_script(str(REPO_ROOT / PAYROLL_SCRIPT), argv):
+            module.main()
+        summary = json.loads(report.read_text(encoding="utf-8"))["summary"]
+        note = "" if "--dry-run" not in argv else " (dry run" + ("; --payroll-cutoff is needed to apply)" if self.apply else ")")
+        return f"report {report.name}: " + ", ".join(f"{count} {key}" for key, count in summary.items()) + note
+
+    def stamps(self) -> dict[str, dict[str, dict[str, Any]]]:
+        """The configured collections' sync stamps, re-read when older than `stamps_ttl`."""
+        api_key, base_url = self.api()
+        now = time.monotonic()
+        for collection in dict.fromkeys(config.collection for config in self.configs):
+            if collection not in self._stamps or now - self._stamps_read_at[collection] > self.stamps_ttl:
+                METRICS.start_phase("watch fetch stamps")
+                self._stamps[collection] = fetch_stamps(base_url, api_key, collection)
+                self._stamps_read_at[collection] = now
+        return self._stamps
+
+    def import_tables(self, job: Job) -> str:
+        api_key, base_url = self.api()
+        stamps = self.stamps()
+        METRICS.start_phase("watch import")
+        if not self.apply:
+            plan_path = self.output_path("plans", job, ".tables.plan.ndjson")
+            with PlanWriter(plan_path, "watch", dump=str(job.path), tables=[config.table for config in self.configs]) as plan:
+                stats = import_tables(job.path, self.configs, plan.update, stamps)
+            outcome = f"plan {plan_path.name} ({plan.count} ops)"
+        else:
+            kept = stamp_fields()
+
+            def remember(result: WriteResult) -> None:
+                # Keeps the cache equal to what Firestore now holds; failed docs keep their old stamp and are retried.
+                if result.ok:
+                    stamps[result.collection][result.doc_id] = result.tag
+
+            with BulkWriter(base_url, api_key, batch_size=self.batch_size, workers=self.workers, on_result=remember) as writer:
+                stats = import_tables(
+                    job.path,
+                    self.configs,
+                    lambda collection, doc_id, fields: writer.update(collection, doc_id, fields, tag={key: fields[key] for key in kept if key in fields}),
+                    stamps,
+                )
+            outcome = f"{sum(table.written for table in stats.values()) - len(writer.failures)} written"
+            if writer.failures:
+                outcome += f", {len(writer.failures)} failed"
+        in_sync = sum(table.in_sync for table in stats.values())
+        return f"tables: {outcome}, {in_sync} already in sync"
+
+    def reconcile(self, job: Job, dump: Path, roster: Path) -> str:
+        module = warm_script(RECONCILE_SCRIPT)
+        # One journal per dump and roster pair: reconcile refuses to resume a journal written for other inputs.
+        pair = hashlib.sha256(f"{dump}\0{roster}".encode("utf-8")).hexdigest()[:8]
+        argv = ["--dump", str(dump), "--xlsx", str(roster), "--journal", str(self.output_path("journals", job, f".{pair}.reconcile.ndjson")), "--resume"]
+        plan_path = None
+        if not self.apply:
+            plan_path = self.output_path("plans", job, ".employees.plan.ndjson")
+            argv += ["--plan", str(plan_path)]
+        with as_script(str(REPO_ROOT / RECONCILE_SCRIPT), argv):
+            code = module.main()
+        if code:
+            raise RuntimeError(f"reconcile exited {code}")
+        return f"employees: plan {plan_path.name}" if plan_path else "employees reconciled"
+
+    def run(self, interval: float, once: bool = False) -> int:
+        """Process files until stopped; with `once`, until nothing in the folder is left to settle."""
+        log(f"Watching {self.folder} ({'applying' if self.apply else 'plans only'}; state in {self.state_dir})")
+        failed = 0
+        while not self.stopping:
+            for job in self.scan():
+                if self.stopping:
+                    break
+                failed += not self.process(job)
+            if once and not self._settling:
+                break
+            time.sleep(interval)
+        return 1 if once and failed else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Watch a drop folder and process new dumps, rosters and payroll workbooks")
+    parser.add_argument("folder")
+    parser.add_argument("--apply", action="store_true", help="Write to Firestore instead of leaving plans and dry-run reports")
+    parser.add_argument("--once", action="store_true", help="Process what is in the folder now, then exit")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between folder scans")
+    parser.add_argument("--settle", type=float, default=5.0, help="Seconds a file's size and mtime must hold still before it is read")
+    parser.add_argument("--config", default=str(DEFAULT_CONFIG), help="Table config for dump imports (see marga_tools.tableimport)")
+    parser.add_argument("--roster-pattern", action="append", default=None, help=f"Filename pattern for user rosters (repeatable; default {ROSTER_PATTERNS[0]})")
+    parser.add_argument("--payroll-pattern", action="append", default=None, help=f"Filename pattern for payroll workbooks (repeatable; default {PAYROLL_PATTERNS[0]})")
+    parser.add_argument("--stamps-ttl", type=float, default=3600.0, help="Seconds before cached sync stamps are re-read from Firestore")
+    parser.add_argument("--payroll-cutoff", default="", help="Effective cutoff stamped on payroll rates; payroll stays a dry run without it")
+    parser.add_argument("--batch-size", type=int, default=200, help="Writes per :batchWrite call (max 500)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent :batchWrite calls")
+    parser.add_argument("--insecure", action="store_true")
+    parser.add_argument("--gzip-requests", action="store_true", help="Gzip large request bodies (Firestore accepts them; some proxies do not)")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings and request metrics here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
+    args = parser.parse_args()
+    firestore.INSECURE_TLS = args.insecure
+    firestore.GZIP_REQUEST_BODIES = args.gzip_requests
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
+
+    if not os.path.isdir(args.folder):
+        print(f"{args.folder} is not a directory", file=sys.stderr)
+        return 2
+    try:
+        configs = load_config(args.config)
+    except (OSError, ValueError) as err:
+        print(str(err), file=sys.stderr)
+        return 2
+    patterns = {
+        "dump": DUMP_PATTERNS,
+        "roster": tuple(args.roster_pattern or ROSTER_PATTERNS),
+        "payroll": tuple(args.payroll_pattern or PAYROLL_PATTERNS),
+    }
+    watcher = Watcher(
+        args.folder,
+        configs,
+        apply=args.apply,
+        patterns=patterns,
+        settle=args.settle,
+        stamps_ttl=args.stamps_ttl,
+        payroll_cutoff=args.payroll_cutoff,
+        batch_size=args.batch_size,
+        workers=args.workers,
+    )
+
+    def stop(signum: int, frame: Any) -> None:
+        # Finish the file in hand; its journal and plan stay consistent.
+        log("Stopping after the current file")
+        watcher.stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        return watcher.run(args.interval, once=args.once)
+    except KeyboardInterrupt:
+        return 130
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -7,28 +7,41 @@ This script:
 3. Marks every existing tbl_employee record inactive by default.
 4. Updates or creates the Excel-listed users in tbl_employee with Excel names/passwords.
 5. Deletes every document in marga_users.
+
+The fetches are priced first; `--max-reads` refuses a run that would
+exceed it. `--max-writes` caps the writes and deletes applied, ranked as
+in marga_tools.cost; every doc is then hashed before the first write, and
+a re-run picks up the deferred ones. Predicted and actual Firestore reads,
+writes and deletes are printed.
 """
 
 from __future__ import annotations
 
 import argparse
-import base64
+import contextlib
 import datetime as dt
-import hashlib
-import json
 import os
 import re
-import secrets
-import ssl
+import sys
 import urllib.error
-import urllib.parse
-import urllib.request
 import xml.etree.ElementTree as ET
 import zipfile
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable, Iterator
+
+from marga_tools import firestore
+from marga_tools.backup import BackupStore, BackupWriter, StoreRun
+from marga_tools.changeset import PlanWriter, precondition_for
+from marga_tools.cost import Cost, check_reads, encoded_bytes, predict_reads, spent, select_ops
+from marga_tools.firestore import delete_document, fetch_collection, fs_fields, parse_firebase_config, set_document
+from marga_tools.journal import JournalMismatch, RunJournal, content_hash
+from marga_tools.metrics import METRICS
+from marga_tools.optimistic import OptimisticWriter
+from marga_tools.passwords import PASSWORD_HASH_FIELDS, rehash_password
+from marga_tools.pipeline import Pipeline
+from marga_tools.synchash import is_current, stamp as stamp_sync
+from marga_tools.usernames import UsernameAllocator
 
-INSECURE_TLS = False
 XML_NS = {
     "a": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
     "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
@@ -46,177 +59,41 @@ BASE_ROLE_DEFAULTS = {
     "viewer": ["customers", "reports"],
 }
 
+# Set on every run, so left out of the sync hash; a skipped doc keeps its old values.
+VOLATILE_FIELDS = ("marga_updated_at", "marga_role_updated_at", "marga_password_updated_at")
 
-def request_json(url: str, method: str = "GET", payload: dict[str, Any] | None = None) -> Any:
-    data = None
-    headers = {}
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
-        headers["Content-Type"] = "application/json"
-    req = urllib.request.Request(url, data=data, headers=headers, method=method)
-    ctx = ssl._create_unverified_context() if INSECURE_TLS else None
-    with urllib.request.urlopen(req, timeout=60, context=ctx) as resp:
-        raw = resp.read().decode("utf-8")
-        return json.loads(raw) if raw else {}
-
-
-def request_empty(url: str, method: str) -> None:
-    req = urllib.request.Request(url, method=method)
-    ctx = ssl._create_unverified_context() if INSECURE_TLS else None
-    with urllib.request.urlopen(req, timeout=60, context=ctx):
-        return
-
-
-def parse_firebase_config(path: str) -> tuple[str, str]:
-    text = Path(path).read_text(encoding="utf-8")
-    api_key = re.search(r"apiKey:\s*'([^']+)'", text)
-    base_url = re.search(r"baseUrl:\s*'([^']+)'", text)
-    if not api_key or not base_url:
-        raise RuntimeError("Unable to parse shared/js/firebase-config.js")
-    return api_key.group(1), base_url.group(1)
-
-
-def fs_parse_value(value: dict[str, Any]) -> Any:
-    if "stringValue" in value:
-        return value["stringValue"]
-    if "integerValue" in value:
-        return int(value["integerValue"])
-    if "doubleValue" in value:
-        return float(value["doubleValue"])
-    if "booleanValue" in value:
-        return bool(value["booleanValue"])
-    if "timestampValue" in value:
-        return value["timestampValue"]
-    if "arrayValue" in value:
-        return [fs_parse_value(item) for item in value.get("arrayValue", {}).get("values", [])]
-    if "mapValue" in value:
-        return {key: fs_parse_value(item) for key, item in value.get("mapValue", {}).get("fields", {}).items()}
-    return None
-
-
-def fs_parse_doc(doc: dict[str, Any]) -> dict[str, Any]:
-    out = {key: fs_parse_value(value) for key, value in (doc.get("fields") or {}).items()}
-    out["_docId"] = doc.get("name", "").split("/")[-1]
-    return out
-
-
-def fs_field(value: Any) -> dict[str, Any]:
-    if value is None:
-        return {"nullValue": None}
-    if isinstance(value, bool):
-        return {"booleanValue": value}
-    if isinstance(value, int):
-        return {"integerValue": str(value)}
-    if isinstance(value, float):
-        return {"doubleValue": value}
-    if isinstance(value, list):
-        return {"arrayValue": {"values": [fs_field(item) for item in value]}}
-    if isinstance(value, dict):
-        return {"mapValue": {"fields": {key: fs_field(item) for key, item in value.items()}}}
-    return {"stringValue": str(value)}
-
-
-def fetch_collection(base_url: str, api_key: str, collection: str, page_size: int = 1000) -> list[dict[str, Any]]:
-    docs: list[dict[str, Any]] = []
-    token = ""
-    while True:
-        query = urllib.parse.urlencode({"pageSize": str(page_size), "key": api_key, **({"pageToken": token} if token else {})})
-        payload = request_json(f"{base_url}/{collection}?{query}")
-        docs.extend(fs_parse_doc(doc) for doc in payload.get("documents") or [])
-        token = payload.get("nextPageToken") or ""
-        if not token:
-            break
-    return docs
-
-
-def set_document(base_url: str, api_key: str, collection: str, doc_id: str, fields: dict[str, Any]) -> None:
-    url = f"{base_url}/{collection}/{urllib.parse.quote(str(doc_id), safe='')}?key={api_key}"
-    request_json(url, method="PATCH", payload={"fields": {key: fs_field(value) for key, value in fields.items()}})
 
-
-def delete_document(base_url: str, api_key: str, collection: str, doc_id: str) -> None:
-    url = f"{base_url}/{collection}/{urllib.parse.quote(str(doc_id), safe='')}?key={api_key}"
-    request_empty(url, method="DELETE")
+def retired_user_fields(doc_id: str, stamp: str, doc: dict[str, Any]) -> dict[str, Any]:
+    retained_name = str(doc.get("name") or f"{str(doc.get('firstname') or '').strip()} {str(doc.get('lastname') or '').strip()}").strip()
+    return {
+        **doc,
+        "email": "",
+        "username": f"retired-{doc_id}",
+        "name": retained_name,
+        "role": "",
+        "roles": [],
+        "allowed_modules": [],
+        "allowed_modules_configured": False,
+        "password": "",
+        "password_hash": "",
+        "password_salt": "",
+        "password_iterations": 0,
+        "active": False,
+        "marga_active": False,
+        "marga_account_active": False,
+        "marga_retired": True,
+        "marga_retired_at": stamp,
+    }
 
 
 def retire_legacy_user(base_url: str, api_key: str, doc_id: str, stamp: str, doc: dict[str, Any]) -> None:
-    retained_name = str(doc.get("name") or f"{str(doc.get('firstname') or '').strip()} {str(doc.get('lastname') or '').strip()}").strip()
-    set_document(
-        base_url,
-        api_key,
-        "marga_users",
-        doc_id,
-        {
-            **doc,
-            "email": "",
-            "username": f"retired-{doc_id}",
-            "name": retained_name,
-            "role": "",
-            "roles": [],
-            "allowed_modules": [],
-            "allowed_modules_configured": False,
-            "password": "",
-            "password_hash": "",
-            "password_salt": "",
-            "password_iterations": 0,
-            "active": False,
-            "marga_active": False,
-            "marga_account_active": False,
-            "marga_retired": True,
-            "marga_retired_at": stamp,
-        },
-    )
+    set_document(base_url, api_key, "marga_users", doc_id, retired_user_fields(doc_id, stamp, doc))
 
 
 def normalize_key(text: Any) -> str:
     return re.sub(r"[^a-z0-9]+", "", str(text or "").strip().lower())
 
 
-def sanitize_username(text: Any) -> str:
-    value = re.sub(r"[^a-z0-9._-]+", "", str(text or "").strip().lower())
-    return value.strip("._-")[:48]
-
-
-def build_username_candidates(record: dict[str, Any], emp_id: int) -> list[str]:
-    out: list[str] = []
-    email = str(record.get("email") or "").strip().lower()
-    if email and "@" in email:
-        out.append(email.split("@", 1)[0])
-    nickname = str(record.get("nickname") or "").strip()
-    if nickname:
-        out.append(nickname)
-    first = str(record.get("firstname") or "").strip()
-    last = str(record.get("lastname") or "").strip()
-    if first and last:
-        out.append(f"{first}.{last}")
-    if first:
-        out.append(first)
-    out.append(f"emp{emp_id}")
-    return out
-
-
-def pick_username(record: dict[str, Any], emp_id: int, used_usernames: set[str], current_username: str = "") -> str:
-    current = sanitize_username(current_username)
-    if current:
-        used_usernames.discard(current)
-
-    for raw in build_username_candidates(record, emp_id):
-        base = sanitize_username(raw)
-        if not base:
-            continue
-        candidate = base
-        suffix = 2
-        while candidate in used_usernames:
-            candidate = f"{base}{suffix}"
-            suffix += 1
-        used_usernames.add(candidate)
-        return candidate
-
-    fallback = f"emp{emp_id}"
-    used_usernames.add(fallback)
-    return fallback
-
-
 def map_position_to_role(position: str) -> str:
     value = str(position or "").strip().lower()
     if "admin" in value or "manager" in value:
@@ -236,18 +113,6 @@ def map_position_to_role(position: str) -> str:
     return "viewer"
 
 
-def hash_password(password: str) -> dict[str, Any]:
-    salt = secrets.token_bytes(16)
-    iterations = 120000
-    derived = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations, dklen=32)
-    return {
-        "password_hash": base64.b64encode(derived).decode("ascii"),
-        "password_salt": base64.b64encode(salt).decode("ascii"),
-        "password_iterations": iterations,
-        "password_algo": "PBKDF2-SHA256",
-    }
-
-
 def parse_xlsx(path: str) -> list[dict[str, Any]]:
     with zipfile.ZipFile(path) as zf:
         shared_strings: list[str] = []
@@ -333,38 +198,81 @@ def match_employee_id(record: dict[str, Any], by_email: dict[str, list[int]], ma
     return candidates[0] if candidates else None
 
 
-def write_backup(backup_dir: Path, stamp: str, tbl_employee: list[dict[str, Any]], marga_users: list[dict[str, Any]]) -> Path:
-    backup_dir.mkdir(parents=True, exist_ok=True)
-    backup_path = backup_dir / f"firebase-user-migration-backup-{stamp}.json"
-    backup_path.write_text(
-        json.dumps(
-            {
-                "created_at": stamp,
-                "tbl_employee": tbl_employee,
-                "marga_users": marga_users,
-            },
-            ensure_ascii=True,
-            indent=2,
-        ),
-        encoding="utf-8",
-    )
-    return backup_path
+def backup_file_path(backup_dir: Path, stamp: str, compression: str) -> Path:
+    return backup_dir / f"firebase-user-migration-backup-{stamp}.ndjson.{compression}"
 
 
 def main() -> int:
-    global INSECURE_TLS
-
     parser = argparse.ArgumentParser(description="Promote final users into tbl_employee and delete marga_users")
     parser.add_argument("--xlsx", default="/Users/mike/Downloads/Copy of Final Marga Users.xlsx")
     parser.add_argument("--backup-dir", default="/tmp/marga-firebase-backups")
+    parser.add_argument("--backup-mode", choices=("store", "file"), default="store", help="store: deduplicated <backup-dir>/store shared across runs; file: one full NDJSON file per run")
+    parser.add_argument("--backup-compression", choices=("gz", "zst"), default="gz", help="Compression for --backup-mode file (zst needs the zstandard package)")
+    parser.add_argument("--journal", default="", help="Write journal path (default: <backup-dir>/promote-final-users-journal.ndjson)")
+    parser.add_argument("--resume", action="store_true", help="Skip writes already recorded in the journal of an interrupted run")
+    parser.add_argument("--plan", default="", help="Write the computed changes to this NDJSON plan instead of applying them")
     parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--max-reads", type=int, default=None, help="Refuse to run if fetching the collections would cost more reads than this, counting the few reads spent pricing it")
+    parser.add_argument("--max-writes", type=int, default=None, help="Write or delete at most this many docs, highest-ranked first; re-run to apply the rest")
     parser.add_argument("--insecure", action="store_true")
+    parser.add_argument("--hash-workers", type=int, default=os.cpu_count() or 1, help="Threads hashing passwords while writes are in flight")
+    parser.add_argument("--write-workers", type=int, default=4, help="Concurrent document writes")
+    parser.add_argument("--gzip-requests", action="store_true", help="Gzip large request bodies (Firestore accepts them; some proxies do not)")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings and request metrics here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
     args = parser.parse_args()
-    INSECURE_TLS = args.insecure
+    firestore.INSECURE_TLS = args.insecure
+    firestore.GZIP_REQUEST_BODIES = args.gzip_requests
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
+    journal_path = Path(args.journal or Path(args.backup_dir) / "promote-final-users-journal.ndjson")
 
     api_key, base_url = parse_firebase_config("shared/js/firebase-config.js")
-    existing_docs = fetch_collection(base_url, api_key, "tbl_employee", 1000)
-    legacy_docs = fetch_collection(base_url, api_key, "marga_users", 1000)
+    # Priced before the journal and backup are opened, so a refused run leaves nothing behind.
+    METRICS.start_phase("predict reads")
+    predicted = predict_reads(base_url, api_key, ["tbl_employee", "marga_users", "marga_role_permissions", "tbl_empos"])
+    print(predicted.line("Predicted reads"), flush=True)
+    refused = check_reads(predicted, args.max_reads)
+    if refused:
+        print(refused, flush=True)
+        return 2
+    stamp = dt.datetime.now(dt.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    journal: RunJournal | None = None
+    if not args.dry_run and not args.plan:
+        try:
+            journal = RunJournal(journal_path, meta={"stamp": stamp, "xlsx": args.xlsx}, resume=args.resume, inputs=("xlsx",))
+        except JournalMismatch as err:
+            print(err, file=sys.stderr)
+            return 2
+        if journal.rotated:
+            print(f"Moved the previous journal to {journal.rotated}", flush=True)
+        # Reuse the interrupted run's stamp so recomputed docs hash the same.
+        stamp = journal.meta.get("stamp") or stamp
+
+    # The original backup holds the pre-migration state; a resumed run keeps it.
+    resumed_backup = journal.meta.get("backup", "") if journal and journal.resumed else ""
+    backup: BackupWriter | StoreRun | None = None
+    if not resumed_backup:
+        if args.backup_mode == "store":
+            backup = BackupStore(Path(args.backup_dir) / "store").open_run(stamp, created_at=stamp, xlsx=args.xlsx)
+        else:
+            backup = BackupWriter(backup_file_path(Path(args.backup_dir), stamp, args.backup_compression), created_at=stamp)
+    employee_times: dict[str, str] = {}
+    legacy_times: dict[str, str] = {}
+    METRICS.start_phase("fetch+backup")
+    # A fetch that fails leaves the backup unfinished: a file backup is kept
+    # as *.partial.ndjson.* with no end record, a store run is discarded.
+    with backup or contextlib.nullcontext():
+        existing_docs = fetch_collection(base_url, api_key, "tbl_employee", 1000, update_times=employee_times, on_raw=backup.sink("tbl_employee") if backup else None)
+        legacy_docs = fetch_collection(base_url, api_key, "marga_users", 1000, update_times=legacy_times, on_raw=backup.sink("marga_users") if backup else None)
+    backup_path = backup.path if backup else Path(resumed_backup)
+    if backup and journal:
+        journal.set_meta(backup=str(backup_path))
+    if isinstance(backup, StoreRun):
+        print(f"Backup store: {backup.new_objects} new doc versions, {backup.reused_objects} unchanged since earlier runs", flush=True)
+
+    METRICS.start_phase("fetch lookups")
     role_modules = BASE_ROLE_DEFAULTS.copy()
     for doc in fetch_collection(base_url, api_key, "marga_role_permissions", 200):
         role = str(doc.get("role") or doc.get("_docId") or "").strip().lower()
@@ -378,23 +286,26 @@ def main() -> int:
         if label:
             positions_by_name[normalize_key(label)] = doc
 
+    METRICS.start_phase("parse xlsx")
     final_rows = parse_xlsx(args.xlsx)
-    stamp = dt.datetime.now(dt.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
-    backup_path = write_backup(Path(args.backup_dir), stamp, existing_docs, legacy_docs)
 
+    METRICS.start_phase("match")
     docs_by_id: dict[int, dict[str, Any]] = {}
     by_email: dict[str, list[int]] = {}
-    used_usernames: set[str] = set()
+    usernames = UsernameAllocator()
+    roster: list[tuple[dict[str, Any], int, str]] = []
 
     def index_doc(doc_id: int, doc: dict[str, Any]) -> None:
         email = str(doc.get("email") or doc.get("marga_login_email") or "").strip().lower()
         if email:
             by_email.setdefault(email, []).append(doc_id)
 
+    existing_by_id: dict[int, dict[str, Any]] = {}
     for doc in existing_docs:
         raw_id = doc.get("id")
         if not isinstance(raw_id, int):
             continue
+        existing_by_id[raw_id] = doc
         merged = dict(doc)
         merged["id"] = raw_id
         merged["marga_active"] = False
@@ -402,14 +313,13 @@ def main() -> int:
         merged["marga_updated_at"] = stamp
         docs_by_id[raw_id] = merged
         index_doc(raw_id, merged)
-        username = sanitize_username(merged.get("username"))
-        if username:
-            used_usernames.add(username)
+        usernames.reserve(merged.get("username"))
 
     next_id = max(docs_by_id.keys() or [0]) + 1
     matched_ids: set[int] = set()
     created_ids: list[int] = []
     unmatched_rows: list[dict[str, Any]] = []
+    pending_passwords: dict[int, str] = {}
     activated = 0
 
     for record in final_rows:
@@ -451,12 +361,12 @@ def main() -> int:
         if record["email"]:
             employee["email"] = record["email"]
             employee["marga_login_email"] = record["email"]
-        employee["username"] = pick_username(record, employee_id, used_usernames, str(employee.get("username") or ""))
+        roster.append((record, employee_id, str(employee.get("username") or "")))
 
         if record["has_password"]:
             employee["password"] = record["password"]
-            employee.update(hash_password(record["password"]))
             employee["marga_password_updated_at"] = stamp
+            pending_passwords[employee_id] = record["password"]
         else:
             unmatched_rows.append({"row": record["row"], "name": full_name, "reason": "missing password in xlsx"})
 
@@ -466,6 +376,9 @@ def main() -> int:
         if created:
             created_ids.append(employee_id)
 
+    for employee_id, username in usernames.allocate_many(roster).items():
+        docs_by_id[employee_id]["username"] = username
+
     active_count = sum(1 for doc in docs_by_id.values() if doc.get("marga_active") is True)
     inactive_count = len(docs_by_id) - active_count
     print(f"Backup written to: {backup_path}", flush=True)
@@ -481,31 +394,161 @@ def main() -> int:
         for row in unmatched_rows:
             print(f"- row {row['row']}: {row['name']} ({row['reason']})", flush=True)
 
-    if args.dry_run:
+    sync_source = f"promote-final-users-to-tbl-employee:{os.path.basename(args.xlsx)}"
+
+    def finish_employee(employee_id: int, employee: dict[str, Any], existing: dict[str, Any] | None = None) -> dict[str, Any] | None:
+        """Hash the password and stamp the doc; None when Firestore already has exactly this."""
+        existing = existing if existing is not None else existing_by_id.get(employee_id)
+        if employee_id in pending_passwords:
+            with METRICS.timer("hash_password"):
+                employee.update(rehash_password(pending_passwords[employee_id], existing))
+        if is_current(existing, employee, exclude=VOLATILE_FIELDS):
+            return None
+        return stamp_sync(employee, sync_source, exclude=VOLATILE_FIELDS)
+
+    # Retired docs already had their DELETE refused; retiring them again changes nothing.
+    legacy_docs = [doc for doc in legacy_docs if doc.get("marga_retired") is not True]
+
+    if args.plan and not args.dry_run:
+        METRICS.start_phase("plan")
+        current = 0
+        planned = Cost()
+        with PlanWriter(args.plan, "promote-final-users-to-tbl-employee", xlsx=args.xlsx, stamp=stamp, backup=str(backup_path)) as plan:
+            for employee_id in sorted(docs_by_id):
+                employee = finish_employee(employee_id, docs_by_id[employee_id])
+                if employee is None:
+                    current += 1
+                    continue
+                plan.update("tbl_employee", employee_id, employee, precondition=precondition_for(employee_times, employee_id, expect_new=str(employee_id) not in employee_times))
+                planned += Cost(writes=1, write_bytes=encoded_bytes(employee))
+            for doc in legacy_docs:
+                doc_id = str(doc.get("_docId") or "")
+                plan.delete("marga_users", doc_id, precondition=precondition_for(legacy_times, doc_id), fallback_fields=retired_user_fields(doc_id, stamp, doc))
+                planned += Cost(deletes=1)
+        print(f"Plan written to {args.plan}: {plan.count} ops, digest {plan.digest[:16]} ({current} tbl_employee docs already in sync)", flush=True)
+        print(planned.line("Predicted writes"), flush=True)
+        print(spent().line("Actual"), flush=True)
         return 0
 
-    for index, employee_id in enumerate(sorted(docs_by_id), start=1):
-        set_document(base_url, api_key, "tbl_employee", str(employee_id), docs_by_id[employee_id])
-        if index % 25 == 0 or index == len(docs_by_id):
-            print(f"Wrote {index}/{len(docs_by_id)} tbl_employee docs...", flush=True)
+    if args.dry_run or journal is None:
+        return 0
+
+    if journal.resumed:
+        print(f"Resuming from journal {journal_path}: {journal.count('tbl_employee')} tbl_employee and {journal.count('marga_users')} marga_users writes already applied.", flush=True)
 
+    skipped = 0
     retired_count = 0
-    for index, doc in enumerate(legacy_docs, start=1):
-        doc_id = str(doc.get("_docId") or "")
+    in_sync: list[int] = []
+    already_applied: list[int] = []
+    # Writes carry the fetched updateTime, so app edits made since the fetch
+    # surface as conflicts instead of being overwritten.
+    writer = OptimisticWriter(base_url, api_key, "tbl_employee", employee_times, existing_by_id)
+
+    def written_hash(employee: dict[str, Any]) -> str:
+        # The journal hash covers the doc exactly as written (sync stamp
+        # included), less the password hash, whose salt may be new.
+        return content_hash(employee, exclude=PASSWORD_HASH_FIELDS)
+
+    # Hashing, writing and journaling overlap; the journal is only written
+    # from the pipeline sink (this thread).
+    def hash_one(employee_id: int) -> tuple[int, dict[str, Any], str] | None:
+        employee = finish_employee(employee_id, docs_by_id[employee_id])
+        if employee is None:
+            in_sync.append(employee_id)
+            return None
+        digest = written_hash(employee)
+        if journal.is_applied("tbl_employee", employee_id, digest):
+            already_applied.append(employee_id)
+            return None
+        return employee_id, employee, digest
+
+    def write_one(item: tuple[int, dict[str, Any], str]) -> tuple[int, dict[str, Any], str] | None:
+        return item if writer.write(item[0], item[1]) else None
+
+    def record_employee(item: tuple[int, dict[str, Any], str]) -> None:
+        nonlocal employees_done
+        journal.record("tbl_employee", item[0], item[2])
+        employees_done += 1
+        if employees_done % 25 == 0:
+            print(f"Wrote {employees_done} tbl_employee docs...", flush=True)
+
+    def pending_legacy() -> Iterator[tuple[str, dict[str, Any]]]:
+        nonlocal skipped
+        for doc in legacy_docs:
+            doc_id = str(doc.get("_docId") or "")
+            if journal.is_applied("marga_users", doc_id):
+                skipped += 1
+                continue
+            yield doc_id, doc
+
+    def delete_one(item: tuple[str, dict[str, Any]]) -> tuple[str, str]:
+        doc_id, doc = item
         try:
             delete_document(base_url, api_key, "marga_users", doc_id)
         except urllib.error.HTTPError as err:
             if err.code != 403:
                 raise
             retire_legacy_user(base_url, api_key, doc_id, stamp, doc)
+            return doc_id, "retired"
+        return doc_id, "deleted"
+
+    def record_legacy(item: tuple[str, str]) -> None:
+        nonlocal legacy_done, retired_count
+        doc_id, action = item
+        journal.record("marga_users", doc_id, action)
+        legacy_done += 1
+        if action == "retired":
             retired_count += 1
-        if index % 10 == 0 or index == len(legacy_docs):
-            print(f"Deleted {index}/{len(legacy_docs)} marga_users docs...", flush=True)
-
+        if legacy_done % 10 == 0:
+            print(f"Deleted {legacy_done} marga_users docs...", flush=True)
+
+    def employee_op(item: tuple[int, dict[str, Any], str]) -> dict[str, Any]:
+        employee_id, employee, _ = item
+        return {"op": "update", "collection": "tbl_employee", "id": str(employee_id), "fields": fs_fields(employee), "precondition": precondition_for(employee_times, employee_id, expect_new=str(employee_id) not in employee_times)}
+
+    employees_done = legacy_done = 0
+    deferred = Cost()
+    with journal:
+        employees: Iterable[Any] = sorted(docs_by_id)
+        legacy: Iterable[tuple[str, dict[str, Any]]] = pending_legacy()
+        if args.max_writes is not None:
+            # The budget is ranked over the writes actually needed, so every
+            # doc is hashed before the first one is written.
+            METRICS.start_phase("hash tbl_employee")
+            hashed: list[tuple[int, dict[str, Any], str]] = []
+            Pipeline(employees, name="hash tbl_employee").stage("hash", hash_one, workers=args.hash_workers).run(hashed.append)
+            legacy = list(legacy)
+            ops = [employee_op(item) for item in hashed] + [{"op": "delete", "collection": "marga_users", "id": doc_id} for doc_id, _ in legacy]
+            selected, _, deferred = select_ops(ops, args.max_writes)
+            employees = sorted((item for index, item in enumerate(hashed) if index in selected), key=lambda item: item[0])
+            legacy = [item for index, item in enumerate(legacy, len(hashed)) if index in selected]
+            if deferred.operations:
+                print(f"--max-writes {args.max_writes}: deferring {deferred.operations} lower-ranked writes and deletes; re-run to apply them", flush=True)
+        METRICS.start_phase("write tbl_employee")
+        pipeline = Pipeline(employees, name="write tbl_employee")
+        if args.max_writes is None:
+            pipeline.stage("hash", hash_one, workers=args.hash_workers)
+        pipeline.stage("write", write_one, workers=args.write_workers)
+        pipeline.run(record_employee)
+        METRICS.start_phase("retry conflicts")
+        conflicts = writer.retry(finish_employee, on_written=lambda employee_id, employee: record_employee((employee_id, employee, written_hash(employee))))
+
+        METRICS.start_phase("delete marga_users")
+        Pipeline(legacy, name="delete marga_users").stage("delete", delete_one, workers=args.write_workers).run(record_legacy)
+
+    skipped += len(already_applied)
+    if skipped:
+        print(f"Skipped {skipped} writes already recorded in {journal_path}.", flush=True)
     if retired_count:
         print(f"Retired {retired_count} marga_users docs because Firestore DELETE is forbidden.", flush=True)
-    print(f"Wrote {len(docs_by_id)} tbl_employee docs and processed {len(legacy_docs)} marga_users docs.", flush=True)
-    return 0
+    print(f"Wrote {employees_done} tbl_employee docs ({len(in_sync)} already in sync) and processed {legacy_done} marga_users docs" + (f"; {deferred.operations} deferred by --max-writes" if deferred.operations else "") + ".", flush=True)
+    print(f"tbl_employee conflicts: {conflicts.summary()}", flush=True)
+    print(spent().line("Actual"), flush=True)
+    for doc_id, fields in list(conflicts.overridden.items())[:20]:
+        print(f"- tbl_employee/{doc_id}: app edits to {', '.join(fields)} overridden", flush=True)
+    for doc_id in conflicts.unresolved[:20]:
+        print(f"- tbl_employee/{doc_id}: still changing; re-run to pick it up", flush=True)
+    return 1 if conflicts.unresolved else 0
 
 
 if __name__ == "__main__":
@@ -5,26 +5,37 @@ Steps:
 1) Restore full tbl_employee rows from SQL dump.
 2) Mark active/inactive based on Final Marga Users file.
 3) Write login fields (email/password hash/role/modules) on tbl_employee docs.
+
+The fetch is priced first; `--max-reads` refuses a run that would exceed
+it. `--max-writes` caps the docs written, ranked as in marga_tools.cost;
+every doc is then hashed before the first write, and a re-run picks up the
+deferred ones. Predicted and actual Firestore reads and writes are printed.
 """
 
 from __future__ import annotations
 
 import argparse
-import base64
 import datetime as dt
-import hashlib
-import json
 import os
 import re
-import secrets
-import ssl
-import urllib.parse
-import urllib.request
-from typing import Any
+import sys
+from pathlib import Path
+from typing import Any, Iterable
 
 import openpyxl
 
-INSECURE_TLS = False
+from marga_tools import firestore
+from marga_tools.changeset import PlanWriter, precondition_for
+from marga_tools.cost import Cost, check_reads, encoded_bytes, predict_reads, select_ops, spent
+from marga_tools.firestore import fetch_collection, fs_fields, parse_firebase_config
+from marga_tools.journal import JournalMismatch, RunJournal, content_hash
+from marga_tools.metrics import METRICS
+from marga_tools.mysqldump import extract_table
+from marga_tools.optimistic import OptimisticWriter
+from marga_tools.passwords import PASSWORD_HASH_FIELDS, rehash_password
+from marga_tools.pipeline import Pipeline
+from marga_tools.synchash import is_current, stamp
+from marga_tools.usernames import UsernameAllocator
 
 BASE_ROLE_DEFAULTS = {
     "admin": ["customers", "ai-product-consultant", "billing", "apd", "collections", "service", "inventory", "hr", "reports", "settings", "sync", "field", "purchasing", "pettycash", "sales"],
@@ -39,183 +50,16 @@ BASE_ROLE_DEFAULTS = {
     "viewer": ["customers", "reports"],
 }
 
-
-def request_json(url: str, method: str = "GET", payload: dict[str, Any] | None = None) -> Any:
-    data = None
-    headers = {}
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
-        headers["Content-Type"] = "application/json"
-    req = urllib.request.Request(url, data=data, headers=headers, method=method)
-    ctx = ssl._create_unverified_context() if INSECURE_TLS else None
-    with urllib.request.urlopen(req, timeout=60, context=ctx) as resp:
-        raw = resp.read().decode("utf-8")
-        return json.loads(raw) if raw else {}
-
-
-def parse_firebase_config(path: str) -> tuple[str, str]:
-    text = open(path, "r", encoding="utf-8").read()
-    api_key = re.search(r"apiKey:\s*'([^']+)'", text)
-    base_url = re.search(r"baseUrl:\s*'([^']+)'", text)
-    if not api_key or not base_url:
-        raise RuntimeError("Unable to parse shared/js/firebase-config.js")
-    return api_key.group(1), base_url.group(1)
-
-
-def fs_parse_value(v: dict[str, Any]) -> Any:
-    if "stringValue" in v:
-        return v["stringValue"]
-    if "integerValue" in v:
-        return int(v["integerValue"])
-    if "doubleValue" in v:
-        return float(v["doubleValue"])
-    if "booleanValue" in v:
-        return bool(v["booleanValue"])
-    if "timestampValue" in v:
-        return v["timestampValue"]
-    if "arrayValue" in v:
-        return [fs_parse_value(x) for x in v.get("arrayValue", {}).get("values", [])]
-    if "mapValue" in v:
-        return {k: fs_parse_value(x) for k, x in v.get("mapValue", {}).get("fields", {}).items()}
-    return None
-
-
-def fs_parse_doc(doc: dict[str, Any]) -> dict[str, Any]:
-    out = {k: fs_parse_value(v) for k, v in (doc.get("fields") or {}).items()}
-    out["_docId"] = doc.get("name", "").split("/")[-1]
-    return out
-
-
-def fs_field(value: Any) -> dict[str, Any]:
-    if value is None:
-        return {"nullValue": None}
-    if isinstance(value, bool):
-        return {"booleanValue": value}
-    if isinstance(value, int):
-        return {"integerValue": str(value)}
-    if isinstance(value, float):
-        return {"doubleValue": value}
-    if isinstance(value, list):
-        return {"arrayValue": {"values": [fs_field(x) for x in value]}}
-    if isinstance(value, dict):
-        return {"mapValue": {"fields": {k: fs_field(v) for k, v in value.items()}}}
-    return {"stringValue": str(value)}
-
-
-def fetch_collection(base_url: str, api_key: str, collection: str, page_size: int = 1000) -> list[dict[str, Any]]:
-    docs: list[dict[str, Any]] = []
-    token = ""
-    while True:
-        q = urllib.parse.urlencode({"pageSize": str(page_size), "key": api_key, **({"pageToken": token} if token else {})})
-        payload = request_json(f"{base_url}/{collection}?{q}")
-        batch = payload.get("documents") or []
-        docs.extend(fs_parse_doc(d) for d in batch)
-        token = payload.get("nextPageToken") or ""
-        if not token:
-            break
-    return docs
-
-
-def set_document(base_url: str, api_key: str, collection: str, doc_id: str, fields: dict[str, Any]) -> None:
-    url = f"{base_url}/{collection}/{urllib.parse.quote(str(doc_id), safe='')}?key={api_key}"
-    payload = {"fields": {k: fs_field(v) for k, v in fields.items()}}
-    request_json(url, method="PATCH", payload=payload)
-
-
-def parse_mysql_string(raw: str) -> str:
-    s = raw[1:-1]
-    s = s.replace("\\\\", "\\")
-    s = s.replace("\\'", "'")
-    s = s.replace("\\r", "\r").replace("\\n", "\n").replace("\\t", "\t")
-    return s
-
-
-def sql_token_to_value(token: str) -> Any:
-    t = token.strip()
-    if t.upper() == "NULL":
-        return None
-    if len(t) >= 2 and t[0] == "'" and t[-1] == "'":
-        return parse_mysql_string(t)
-    if re.fullmatch(r"-?\d+", t):
-        return int(t)
-    if re.fullmatch(r"-?\d+\.\d+", t):
-        return float(t)
-    return t
-
-
-def parse_insert_values(values: str) -> list[list[Any]]:
-    rows: list[list[Any]] = []
-    row: list[Any] = []
-    token: list[str] = []
-    in_row = False
-    in_str = False
-    esc = False
-
-    for ch in values:
-        if in_str:
-            token.append(ch)
-            if esc:
-                esc = False
-            elif ch == "\\":
-                esc = True
-            elif ch == "'":
-                in_str = False
-            continue
-
-        if ch == "'":
-            in_str = True
-            token.append(ch)
-            continue
-        if ch == "(":
-            in_row = True
-            row = []
-            token = []
-            continue
-        if ch == ")" and in_row:
-            row.append(sql_token_to_value("".join(token)))
-            rows.append(row)
-            row = []
-            token = []
-            in_row = False
-            continue
-        if ch == "," and in_row:
-            row.append(sql_token_to_value("".join(token)))
-            token = []
-            continue
-        if ch == ";" and not in_row:
-            break
-        if in_row:
-            token.append(ch)
-    return rows
+# Set on every run, so left out of the sync hash; a skipped doc keeps its old values.
+VOLATILE_FIELDS = ("marga_updated_at", "marga_password_updated_at")
 
 
 def extract_tbl_employee_from_dump(dump_path: str) -> tuple[list[str], list[dict[str, Any]]]:
-    columns: list[str] = []
-    rows: list[dict[str, Any]] = []
-    in_create = False
-    prefix = "INSERT INTO `tbl_employee` VALUES "
-
-    with open(dump_path, "r", encoding="utf-8", errors="ignore") as f:
-        for line in f:
-            if line.startswith("CREATE TABLE `tbl_employee`"):
-                in_create = True
-                continue
-            if in_create:
-                s = line.strip()
-                if s.startswith("`"):
-                    columns.append(s.split("`")[1])
-                    continue
-                if s.startswith(") ENGINE="):
-                    in_create = False
-                    continue
-            if line.startswith(prefix):
-                value_rows = parse_insert_values(line[len(prefix):])
-                for values in value_rows:
-                    record = {columns[i]: values[i] if i < len(values) else None for i in range(len(columns))}
-                    record["id"] = int(record["id"])
-                    rows.append(record)
+    columns, rows = extract_table(dump_path, "tbl_employee")
     if not columns or not rows:
         raise RuntimeError("Failed to parse tbl_employee from dump")
+    for record in rows:
+        record["id"] = int(record["id"])
     return columns, rows
 
 
@@ -223,51 +67,6 @@ def normalize_key(text: Any) -> str:
     return re.sub(r"[^a-z0-9]+", "", str(text or "").strip().lower())
 
 
-def sanitize_username(text: Any) -> str:
-    value = re.sub(r"[^a-z0-9._-]+", "", str(text or "").strip().lower())
-    return value.strip("._-")[:48]
-
-
-def build_username_candidates(rec: dict[str, Any], emp_id: int) -> list[str]:
-    out: list[str] = []
-    email = str(rec.get("email") or "").strip().lower()
-    if email and "@" in email:
-        out.append(email.split("@", 1)[0])
-    nick = str(rec.get("nickname") or "").strip()
-    if nick:
-        out.append(nick)
-    first = str(rec.get("firstname") or "").strip()
-    last = str(rec.get("lastname") or "").strip()
-    if first and last:
-        out.append(f"{first}.{last}")
-    if first:
-        out.append(first)
-    out.append(f"emp{emp_id}")
-    return out
-
-
-def pick_username(rec: dict[str, Any], emp_id: int, used_usernames: set[str], current_username: str = "") -> str:
-    current = sanitize_username(current_username)
-    if current:
-        used_usernames.discard(current)
-
-    for raw in build_username_candidates(rec, emp_id):
-        base = sanitize_username(raw)
-        if not base:
-            continue
-        candidate = base
-        i = 2
-        while candidate in used_usernames:
-            candidate = f"{base}{i}"
-            i += 1
-        used_usernames.add(candidate)
-        return candidate
-
-    fallback = f"emp{emp_id}"
-    used_usernames.add(fallback)
-    return fallback
-
-
 def map_position_to_role(position: str) -> str:
     p = str(position or "").strip().lower()
     if "admin" in p or "manager" in p:
@@ -334,31 +133,44 @@ def parse_final_users_xlsx(path: str) -> list[dict[str, Any]]:
     return out
 
 
-def hash_password(password: str) -> dict[str, Any]:
-    salt = secrets.token_bytes(16)
-    iterations = 120000
-    derived = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations, dklen=32)
-    return {
-        "password_hash": base64.b64encode(derived).decode("ascii"),
-        "password_salt": base64.b64encode(salt).decode("ascii"),
-        "password_iterations": iterations,
-        "password_algo": "PBKDF2-SHA256",
-    }
-
-
 def main() -> int:
-    global INSECURE_TLS
     parser = argparse.ArgumentParser(description="Reconcile tbl_employee as single source")
     parser.add_argument("--dump", default="/Users/mike/Downloads/Dump20260218.sql")
     parser.add_argument("--xlsx", default="/Users/mike/Downloads/Final Marga Users (1).xlsx")
+    parser.add_argument("--output-dir", default="/tmp/marga-firebase-backups", help="Where run state such as the write journal goes")
+    parser.add_argument("--journal", default="", help="Write journal path (default: <output-dir>/reconcile-employees-journal.ndjson)")
+    parser.add_argument("--resume", action="store_true", help="Skip writes already recorded in the journal of an interrupted run")
+    parser.add_argument("--plan", default="", help="Write the computed changes to this NDJSON plan instead of applying them")
     parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--max-reads", type=int, default=None, help="Refuse to run if fetching the collections would cost more reads than this, counting the few reads spent pricing it")
+    parser.add_argument("--max-writes", type=int, default=None, help="Write at most this many docs, highest-ranked first; re-run to apply the rest")
     parser.add_argument("--insecure", action="store_true")
+    parser.add_argument("--hash-workers", type=int, default=os.cpu_count() or 1, help="Threads hashing passwords while writes are in flight")
+    parser.add_argument("--write-workers", type=int, default=4, help="Concurrent document writes")
+    parser.add_argument("--gzip-requests", action="store_true", help="Gzip large request bodies (Firestore accepts them; some proxies do not)")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings and request metrics here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
     args = parser.parse_args()
-    INSECURE_TLS = args.insecure
+    firestore.INSECURE_TLS = args.insecure
+    firestore.GZIP_REQUEST_BODIES = args.gzip_requests
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
+    journal_path = Path(args.journal or Path(args.output_dir) / "reconcile-employees-journal.ndjson")
 
     api_key, base_url = parse_firebase_config("shared/js/firebase-config.js")
+    METRICS.start_phase("parse dump")
     _, dump_rows = extract_tbl_employee_from_dump(args.dump)
-    existing_docs = fetch_collection(base_url, api_key, "tbl_employee", 1000)
+    METRICS.start_phase("predict reads")
+    predicted = predict_reads(base_url, api_key, ["tbl_employee", "marga_role_permissions"])
+    print(predicted.line("Predicted reads"))
+    refused = check_reads(predicted, args.max_reads)
+    if refused:
+        print(refused)
+        return 2
+    METRICS.start_phase("fetch")
+    update_times: dict[str, str] = {}
+    existing_docs = fetch_collection(base_url, api_key, "tbl_employee", 1000, update_times=update_times)
     existing_by_id = {int(d["id"]): d for d in existing_docs if isinstance(d.get("id"), int)}
     role_modules = BASE_ROLE_DEFAULTS.copy()
     for doc in fetch_collection(base_url, api_key, "marga_role_permissions", 200):
@@ -366,6 +178,7 @@ def main() -> int:
         if role in role_modules:
             role_modules[role] = [str(x).strip().lower() for x in (doc.get("allowed_modules") or []) if str(x).strip()]
 
+    METRICS.start_phase("merge")
     docs_by_id: dict[int, dict[str, Any]] = {}
     for row in dump_rows:
         rid = int(row["id"])
@@ -403,7 +216,9 @@ def main() -> int:
         merged["allowed_modules_configured"] = False
         docs_by_id[rid] = merged
 
+    METRICS.start_phase("parse xlsx")
     final_rows = parse_final_users_xlsx(args.xlsx)
+    METRICS.start_phase("match")
     by_first_last: dict[str, list[int]] = {}
     by_nick_last: dict[str, list[int]] = {}
     for rid, employee in docs_by_id.items():
@@ -415,12 +230,21 @@ def main() -> int:
     matched = 0
     unmatched: list[dict[str, Any]] = []
     now = dt.datetime.now(dt.timezone.utc).isoformat()
+    journal: RunJournal | None = None
+    if not args.dry_run and not args.plan:
+        try:
+            journal = RunJournal(journal_path, meta={"stamp": now, "dump": args.dump, "xlsx": args.xlsx}, resume=args.resume, inputs=("dump", "xlsx"))
+        except JournalMismatch as err:
+            print(err, file=sys.stderr)
+            return 2
+        if journal.rotated:
+            print(f"Moved the previous journal to {journal.rotated}", flush=True)
+        # Reuse the interrupted run's stamp so recomputed docs hash the same.
+        now = journal.meta.get("stamp") or now
+    pending_passwords: dict[int, str] = {}
     matched_ids: set[int] = set()
-    used_usernames: set[str] = set()
-    for employee in docs_by_id.values():
-        existing_username = sanitize_username(employee.get("username"))
-        if existing_username:
-            used_usernames.add(existing_username)
+    usernames = UsernameAllocator(employee.get("username") for employee in docs_by_id.values())
+    roster: list[tuple[dict[str, Any], int, str]] = []
 
     for rec in final_rows:
         candidates: list[int] = []
@@ -454,16 +278,17 @@ def main() -> int:
         if rec["email_valid"]:
             emp["email"] = rec["email"]
             emp["marga_login_email"] = rec["email"]
-        username = pick_username(rec, emp_id, used_usernames, str(emp.get("username") or ""))
-        if username:
-            emp["username"] = username
+        roster.append((rec, emp_id, str(emp.get("username") or "")))
         if rec["has_password"]:
-            emp.update(hash_password(rec["password"]))
+            pending_passwords[emp_id] = rec["password"]
             emp["marga_password_updated_at"] = now
 
         matched += 1
         matched_ids.add(emp_id)
 
+    for emp_id, username in usernames.allocate_many(roster).items():
+        docs_by_id[emp_id]["username"] = username
+
     active_count = sum(1 for d in docs_by_id.values() if d.get("marga_active") is True)
     inactive_count = len(docs_by_id) - active_count
     print(f"Dump employees: {len(dump_rows)}")
@@ -475,13 +300,99 @@ def main() -> int:
         for row in unmatched[:10]:
             print(f"- row {row['row']}: {row['name']} ({row['reason']})")
 
-    if args.dry_run:
+    sync_source = f"reconcile-employees-single-source:{os.path.basename(args.dump)}"
+
+    def finish_doc(rid: int, doc: dict[str, Any], existing: dict[str, Any] | None = None) -> dict[str, Any] | None:
+        """Hash the password and stamp the doc; None when Firestore already has exactly this."""
+        existing = existing if existing is not None else existing_by_id.get(rid)
+        if rid in pending_passwords:
+            with METRICS.timer("hash_password"):
+                doc.update(rehash_password(pending_passwords[rid], existing))
+        if is_current(existing, doc, exclude=VOLATILE_FIELDS):
+            return None
+        return stamp(doc, sync_source, exclude=VOLATILE_FIELDS)
+
+    if args.plan and not args.dry_run:
+        METRICS.start_phase("plan")
+        current = 0
+        planned = Cost()
+        with PlanWriter(args.plan, "reconcile-employees-single-source", dump=args.dump, xlsx=args.xlsx, stamp=now) as plan:
+            for rid in sorted(docs_by_id):
+                doc = finish_doc(rid, docs_by_id[rid])
+                if doc is None:
+                    current += 1
+                    continue
+                plan.update("tbl_employee", rid, doc, precondition=precondition_for(update_times, rid, expect_new=str(rid) not in update_times))
+                planned += Cost(writes=1, write_bytes=encoded_bytes(doc))
+        print(f"Plan written to {args.plan}: {plan.count} ops, digest {plan.digest[:16]} ({current} docs already in sync)")
+        print(planned.line("Predicted writes"))
+        print(spent().line("Actual"))
+        return 0
+
+    if args.dry_run or journal is None:
         return 0
 
-    for rid in sorted(docs_by_id):
-        set_document(base_url, api_key, "tbl_employee", str(rid), docs_by_id[rid])
-    print(f"Wrote {len(docs_by_id)} employee docs to tbl_employee")
-    return 0
+    if journal.resumed:
+        print(f"Resuming from journal {journal_path}: {journal.count('tbl_employee')} docs already written")
+    METRICS.start_phase("write")
+    skipped: list[int] = []
+    in_sync: list[int] = []
+    # Writes carry the fetched updateTime, so app edits made since the fetch
+    # surface as conflicts instead of being overwritten.
+    writer = OptimisticWriter(base_url, api_key, "tbl_employee", update_times, existing_by_id)
+
+    def written_hash(doc: dict[str, Any]) -> str:
+        # The journal hash covers the doc exactly as written (sync stamp
+        # included), less the password hash, whose salt may be new.
+        return content_hash(doc, exclude=PASSWORD_HASH_FIELDS)
+
+    def hash_one(rid: int) -> tuple[int, dict[str, Any], str] | None:
+        doc = finish_doc(rid, docs_by_id[rid])
+        if doc is None:
+            in_sync.append(rid)
+            return None
+        digest = written_hash(doc)
+        if journal.is_applied("tbl_employee", rid, digest):
+            skipped.append(rid)
+            return None
+        return rid, doc, digest
+
+    def write_one(item: tuple[int, dict[str, Any], str]) -> tuple[int, dict[str, Any], str] | None:
+        return item if writer.write(item[0], item[1]) else None
+
+    def doc_op(item: tuple[int, dict[str, Any], str]) -> dict[str, Any]:
+        rid, doc, _ = item
+        return {"op": "update", "collection": "tbl_employee", "id": str(rid), "fields": fs_fields(doc), "precondition": precondition_for(update_times, rid, expect_new=str(rid) not in update_times)}
+
+    deferred = Cost()
+    with journal:
+        pending: Iterable[Any] = sorted(docs_by_id)
+        if args.max_writes is not None:
+            # The budget is ranked over the writes actually needed, so every
+            # doc is hashed before the first one is written.
+            METRICS.start_phase("hash")
+            hashed: list[tuple[int, dict[str, Any], str]] = []
+            Pipeline(pending, name="hash tbl_employee").stage("hash", hash_one, workers=args.hash_workers).run(hashed.append)
+            selected, _, deferred = select_ops([doc_op(item) for item in hashed], args.max_writes)
+            pending = sorted((item for index, item in enumerate(hashed) if index in selected), key=lambda item: item[0])
+            if deferred.operations:
+                print(f"--max-writes {args.max_writes}: deferring {deferred.operations} lower-ranked writes; re-run to apply them")
+            METRICS.start_phase("write")
+        pipeline = Pipeline(pending, name="write tbl_employee")
+        if args.max_writes is None:
+            pipeline.stage("hash", hash_one, workers=args.hash_workers)
+        pipeline.stage("write", write_one, workers=args.write_workers)
+        written = pipeline.run(lambda item: journal.record("tbl_employee", item[0], item[2]))
+        METRICS.start_phase("retry conflicts")
+        conflicts = writer.retry(finish_doc, on_written=lambda rid, doc: journal.record("tbl_employee", rid, written_hash(doc)))
+    print(f"Wrote {written + len(conflicts.rewritten)} employee docs to tbl_employee ({len(skipped)} already applied, {len(in_sync)} already in sync" + (f", {deferred.operations} deferred by --max-writes" if deferred.operations else "") + ")")
+    print(f"Conflicts: {conflicts.summary()}")
+    print(spent().line("Actual"))
+    for doc_id, fields in list(conflicts.overridden.items())[:20]:
+        print(f"- tbl_employee/{doc_id}: app edits to {', '.join(fields)} overridden")
+    for doc_id in conflicts.unresolved[:20]:
+        print(f"- tbl_employee/{doc_id}: still changing; re-run to pick it up")
+    return 1 if conflicts.unresolved else 0
 
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Restore documents from a streamed backup or a backup-store manifest.
+
+Each backed-up document is written back in full (no update mask), replacing
+whatever the document holds now. Documents created after the backup are left
+alone. The backup is read through first, and one without the end record of
+a finished run (a fetch that failed part-way) is refused.
+
+Usage:
+  python3 tools/restore-firestore-backup.py /tmp/marga-firebase-backups/firebase-user-migration-backup-<stamp>.ndjson.gz
+  python3 tools/restore-firestore-backup.py /tmp/marga-firebase-backups/store/manifests/<stamp>.ndjson.gz
+  python3 tools/restore-firestore-backup.py <backup> --collection marga_users --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+
+from marga_tools import firestore
+from marga_tools.backup import BackupError, is_manifest, iter_backup, iter_manifest_documents, verify_backup
+from marga_tools.firestore import BulkWriter, parse_firebase_config
+from marga_tools.metrics import METRICS
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Restore a Firestore backup written by the tools/ scripts")
+    parser.add_argument("backup", help="Backup .ndjson.gz / .ndjson.zst, a backup-store manifest, or a legacy .json backup")
+    parser.add_argument("--collection", action="append", default=[], help="Only restore this collection (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent writes, and concurrent pack reads for manifests")
+    parser.add_argument("--dry-run", action="store_true", help="Count what would be restored without writing")
+    parser.add_argument("--insecure", action="store_true")
+    parser.add_argument("--gzip-requests", action="store_true", help="Gzip large request bodies (Firestore accepts them; some proxies do not)")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings and request metrics here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
+    args = parser.parse_args()
+    firestore.INSECURE_TLS = args.insecure
+    firestore.GZIP_REQUEST_BODIES = args.gzip_requests
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
+
+    METRICS.start_phase("verify")
+    try:
+        verify_backup(args.backup)
+    except BackupError as err:
+        print(f"Refusing to restore: {err}", file=sys.stderr)
+        return 2
+
+    only = set(args.collection)
+    entries = iter_manifest_documents(args.backup, workers=args.workers) if is_manifest(args.backup) else iter_backup(args.backup)
+    counts: dict[str, int] = {}
+    if args.dry_run:
+        for entry in entries:
+            if not only or entry["collection"] in only:
+                counts[entry["collection"]] = counts.get(entry["collection"], 0) + 1
+        for collection, count in sorted(counts.items()):
+            print(f"- {collection}: {count} docs")
+        return 0
+
+    api_key, base_url = parse_firebase_config("shared/js/firebase-config.js")
+    METRICS.start_phase("restore")
+    with BulkWriter(base_url, api_key, batch_size=args.batch_size, workers=args.workers) as writer:
+        for entry in entries:
+            if only and entry["collection"] not in only:
+                continue
+            writer.update(entry["collection"], entry["id"], entry["fields"], encoded=True)
+            counts[entry["collection"]] = counts.get(entry["collection"], 0) + 1
+    for collection, count in sorted(counts.items()):
+        print(f"- {collection}: {count} docs")
+    print(f"Restored {writer.written} docs, {len(writer.failures)} failed.")
+    for failure in writer.failures[:20]:
+        print(f"- {failure.collection}/{failure.doc_id} failed (code {failure.code}): {failure.message}")
+    return 1 if writer.failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
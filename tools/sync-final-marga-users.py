@@ -1,32 +1,39 @@
 #!/usr/bin/env python3
 """Sync Final Marga Users XLSX to Firestore marga_users collection.
 
+The reads are priced first; `--max-reads` refuses a run that would exceed
+it. `--max-writes` caps the docs written, ranked as in marga_tools.cost;
+every password is then hashed before the first write, and a re-run picks
+up the deferred ones.
+
 Usage:
   python3 tools/sync-final-marga-users.py "/Users/mike/Downloads/Final Marga Users (1).xlsx"
   python3 tools/sync-final-marga-users.py "/path/file.xlsx" --dry-run
+  python3 tools/sync-final-marga-users.py "/path/file.xlsx" --max-reads 2000 --max-writes 500
 """
 
 from __future__ import annotations
 
 import argparse
-import base64
 import datetime as dt
-import hashlib
-import json
 import os
 import re
-import secrets
-import ssl
 import sys
 import urllib.error
 import urllib.parse
-import urllib.request
-from typing import Any
+from typing import Any, Iterable
 
 import openpyxl
 
-INSECURE_TLS = False
-
+from marga_tools import firestore
+from marga_tools.changeset import PlanWriter
+from marga_tools.codec import decode_document as parse_fs_doc, encode_value
+from marga_tools.cost import Cost, check_reads, predict_reads, select_ops, spent
+from marga_tools.firestore import READS_COUNTER, WRITES_COUNTER, error_message, parse_firebase_config
+from marga_tools.metrics import METRICS
+from marga_tools.passwords import PASSWORD_HASH_FIELDS, rehash_password
+from marga_tools.pipeline import Pipeline
+from marga_tools.synchash import fetch_stamps, is_current, stamp
 
 BASE_ROLE_DEFAULTS = {
     "admin": ["customers", "ai-product-consultant", "billing", "apd", "collections", "service", "inventory", "hr", "reports", "settings", "sync", "field", "purchasing", "pettycash", "sales"],
@@ -41,79 +48,19 @@ BASE_ROLE_DEFAULTS = {
     "viewer": ["customers", "reports"],
 }
 
-
-def parse_firebase_config(path: str) -> tuple[str, str]:
-    text = open(path, "r", encoding="utf-8").read()
-    api_key_match = re.search(r"apiKey:\s*'([^']+)'", text)
-    base_url_match = re.search(r"baseUrl:\s*'([^']+)'", text)
-    if not api_key_match or not base_url_match:
-        raise RuntimeError("Could not parse apiKey/baseUrl from shared/js/firebase-config.js")
-    return api_key_match.group(1), base_url_match.group(1)
+# Set on every run, so left out of the sync hash; a skipped doc keeps its old values.
+VOLATILE_FIELDS = ("imported_at", "updated_at")
 
 
 def request_json(url: str, method: str = "GET", payload: dict[str, Any] | None = None) -> dict[str, Any] | list[Any]:
-    data = None
-    headers = {}
-    if payload is not None:
-        data = json.dumps(payload).encode("utf-8")
-        headers["Content-Type"] = "application/json"
-    req = urllib.request.Request(url, data=data, headers=headers, method=method)
-    context = ssl._create_unverified_context() if INSECURE_TLS else None
     try:
-        with urllib.request.urlopen(req, timeout=60, context=context) as resp:
-            raw = resp.read().decode("utf-8")
-            return json.loads(raw) if raw else {}
+        return firestore.request_json(url, method=method, payload=payload)
     except urllib.error.HTTPError as exc:
-        raw = exc.read().decode("utf-8", errors="replace")
-        try:
-            parsed = json.loads(raw)
-        except Exception:
-            parsed = {"error": {"message": raw}}
-        message = parsed.get("error", {}).get("message", str(exc))
-        raise RuntimeError(message) from exc
-
-
-def parse_fs_value(value: dict[str, Any]) -> Any:
-    if "stringValue" in value:
-        return value["stringValue"]
-    if "integerValue" in value:
-        return int(value["integerValue"])
-    if "doubleValue" in value:
-        return float(value["doubleValue"])
-    if "booleanValue" in value:
-        return bool(value["booleanValue"])
-    if "timestampValue" in value:
-        return value["timestampValue"]
-    if "arrayValue" in value:
-        return [parse_fs_value(v) for v in value.get("arrayValue", {}).get("values", [])]
-    if "mapValue" in value:
-        return {k: parse_fs_value(v) for k, v in value.get("mapValue", {}).get("fields", {}).items()}
-    return None
-
-
-def parse_fs_doc(doc: dict[str, Any]) -> dict[str, Any]:
-    fields = doc.get("fields", {})
-    out = {k: parse_fs_value(v) for k, v in fields.items()}
-    name = doc.get("name", "")
-    if name:
-        out["_docId"] = name.split("/")[-1]
-    return out
+        raise RuntimeError(error_message(exc)) from exc
 
 
 def to_fs_field(value: Any) -> dict[str, Any]:
-    if value is None:
-        return {"nullValue": None}
-    if isinstance(value, bool):
-        return {"booleanValue": value}
-    if isinstance(value, int):
-        return {"integerValue": str(value)}
-    if isinstance(value, float):
-        if value.is_integer():
-            return {"integerValue": str(int(value))}
-        return {"doubleValue": value}
-    if isinstance(value, list):
-        return {"arrayValue": {"values": [to_fs_field(v) for v in value]}}
-    return {"stringValue": str(value)}
+    return encode_value(value, coerce_integral_floats=True)
 
 
 def run_query(base_url: str, api_key: str, structured_query: dict[str, Any]) -> list[dict[str, Any]]:
@@ -126,6 +73,7 @@ def run_query(base_url: str, api_key: str, structured_query: dict[str, Any]) ->
         doc = row.get("document")
         if doc:
             docs.append(doc)
+    METRICS.count(READS_COUNTER, max(1, len(docs)))
     return docs
 
 
@@ -134,6 +82,7 @@ def set_document(base_url: str, api_key: str, collection: str, doc_id: str, fiel
     encoded = urllib.parse.quote(doc_id, safe="")
     url = f"{base_url}/{collection}/{encoded}?key={api_key}"
     request_json(url, method="PATCH", payload={"fields": fs_fields})
+    METRICS.count(WRITES_COUNTER)
 
 
 def normalize_header(value: Any) -> str:
@@ -289,77 +238,153 @@ def build_records(xlsx_path: str, role_modules: dict[str, list[str]]) -> tuple[l
     return records, skipped
 
 
-def hash_password(password: str) -> dict[str, Any]:
-    pwd = str(password or "")
-    salt = secrets.token_bytes(16)
-    iterations = 120000
-    derived = hashlib.pbkdf2_hmac("sha256", pwd.encode("utf-8"), salt, iterations, dklen=32)
-    return {
-        "password_hash": base64.b64encode(derived).decode("ascii"),
-        "password_salt": base64.b64encode(salt).decode("ascii"),
-        "password_iterations": iterations,
-        "password_algo": "PBKDF2-SHA256",
+def build_user_fields(rec: dict[str, Any], source_file: str, now: str, existing: dict[str, Any] | None = None) -> dict[str, Any]:
+    fields = {
+        "email": rec["email"],
+        "username": rec["email"],
+        "name": rec["name"],
+        "role": rec["role"],
+        "active": True,
+        "staff_id": rec["staff_id"],
+        "allowed_modules": rec["allowed_modules"],
+        "allowed_modules_configured": False,
+        "nickname": rec["nickname"],
+        "firstname": rec["firstname"],
+        "lastname": rec["lastname"],
+        "position": rec["position"],
+        "contact_number": rec["contact_number"],
+        "source_file": source_file,
+        "source_row": rec["row_number"],
+        "imported_at": now,
+        "updated_at": now,
     }
+    fields.update(rehash_password(rec["password"], existing))
+    return fields
 
 
 def main() -> int:
-    global INSECURE_TLS
     parser = argparse.ArgumentParser(description="Sync Final Marga Users XLSX to Firestore")
     parser.add_argument("xlsx_path", help="Path to Final Marga Users xlsx")
     parser.add_argument("--dry-run", action="store_true", help="Do not write to Firestore")
     parser.add_argument("--insecure", action="store_true", help="Disable TLS certificate verification for this run")
+    parser.add_argument("--hash-workers", type=int, default=os.cpu_count() or 1, help="Threads hashing passwords while writes are in flight")
+    parser.add_argument("--write-workers", type=int, default=4, help="Concurrent document writes")
+    parser.add_argument("--gzip-requests", action="store_true", help="Gzip large request bodies (Firestore accepts them; some proxies do not)")
+    parser.add_argument("--plan", default="", help="Write the computed changes to this NDJSON plan instead of applying them")
+    parser.add_argument("--max-reads", type=int, default=None, help="Refuse to run if reading the collections would cost more reads than this, counting the few reads spent pricing it")
+    parser.add_argument("--max-writes", type=int, default=None, help="Write at most this many docs, highest-ranked first; re-run to apply the rest")
+    parser.add_argument("--metrics-json", default="", help="Write phase timings and request metrics here at exit")
+    parser.add_argument("--profile-memory", action="store_true", help="Track peak memory, top allocation sites and object counts per phase (slow)")
     args = parser.parse_args()
-    INSECURE_TLS = bool(args.insecure)
+    firestore.INSECURE_TLS = bool(args.insecure)
+    firestore.GZIP_REQUEST_BODIES = args.gzip_requests
+    METRICS.write_at_exit(args.metrics_json)
+    if args.profile_memory:
+        METRICS.profile_memory()
 
     if not os.path.exists(args.xlsx_path):
         print(f"File not found: {args.xlsx_path}", file=sys.stderr)
         return 2
 
     api_key, base_url = parse_firebase_config("shared/js/firebase-config.js")
+    METRICS.start_phase("predict reads")
+    predicted = predict_reads(base_url, api_key, ["marga_role_permissions"] + ([] if args.dry_run else ["marga_users"]))
+    print(predicted.line("Predicted reads"))
+    refused = check_reads(predicted, args.max_reads)
+    if refused:
+        print(refused)
+        return 2
+    METRICS.start_phase("load role permissions")
     role_modules = load_role_permissions(base_url, api_key)
+    METRICS.start_phase("parse xlsx")
     records, skipped = build_records(args.xlsx_path, role_modules)
+    stamps: dict[str, dict[str, Any]] = {}
+    if not args.dry_run:
+        METRICS.start_phase("fetch stamps")
+        # Read alongside the stamp so an unchanged password re-hashes with its old salt.
+        stamps = fetch_stamps(base_url, api_key, "marga_users", PASSWORD_HASH_FIELDS)
+    METRICS.start_phase("write")
 
     print(f"Detected records: {len(records)}")
     print(f"Initial skipped rows: {len(skipped)}")
 
+    source_file = os.path.basename(args.xlsx_path)
     synced = 0
     failed: list[dict[str, Any]] = []
-    if not args.dry_run:
-        for rec in records:
-            now = dt.datetime.now(dt.timezone.utc).isoformat()
-            fields = {
-                "email": rec["email"],
-                "username": rec["email"],
-                "name": rec["name"],
-                "role": rec["role"],
-                "active": True,
-                "staff_id": rec["staff_id"],
-                "allowed_modules": rec["allowed_modules"],
-                "allowed_modules_configured": False,
-                "nickname": rec["nickname"],
-                "firstname": rec["firstname"],
-                "lastname": rec["lastname"],
-                "position": rec["position"],
-                "contact_number": rec["contact_number"],
-                "source_file": os.path.basename(args.xlsx_path),
-                "source_row": rec["row_number"],
-                "imported_at": now,
-                "updated_at": now,
-            }
-            fields.update(hash_password(rec["password"]))
+    in_sync: list[str] = []
+
+    def build_one(rec: dict[str, Any]) -> tuple[dict[str, Any], dict[str, Any]] | None:
+        """The stamped fields to write for `rec`; None when marga_users already has them."""
+        now = dt.datetime.now(dt.timezone.utc).isoformat()
+        existing = stamps.get(rec["email"])
+        with METRICS.timer("hash_password"):
+            fields = build_user_fields(rec, source_file, now, existing)
+        if is_current(existing, fields, exclude=VOLATILE_FIELDS):
+            in_sync.append(rec["email"])
+            return None
+        return rec, stamp(fields, f"sync-final-marga-users:{source_file}", exclude=VOLATILE_FIELDS)
+
+    deferred = Cost()
+    if args.plan and not args.dry_run:
+        with PlanWriter(args.plan, "sync-final-marga-users", xlsx=args.xlsx_path) as plan:
+            for rec in records:
+                built = build_one(rec)
+                if built is not None:
+                    plan.update("marga_users", rec["email"], {k: to_fs_field(v) for k, v in built[1].items()}, encoded=True)
+        print(f"Plan written to {args.plan}: {plan.count} ops, digest {plan.digest[:16]}")
+        synced = plan.count
+    elif not args.dry_run:
+
+        def write_one(item: tuple[dict[str, Any], dict[str, Any]]) -> tuple[dict[str, Any], str]:
+            rec, fields = item
             try:
                 set_document(base_url, api_key, "marga_users", rec["email"], fields)
-                synced += 1
             except Exception as exc:
-                failed.append({"row": rec["row_number"], "email": rec["email"], "reason": str(exc)})
+                return rec, str(exc)
+            return rec, ""
+
+        def record_one(item: tuple[dict[str, Any], str]) -> None:
+            nonlocal synced
+            rec, error = item
+            if error:
+                failed.append({"row": rec["row_number"], "email": rec["email"], "reason": error})
+            else:
+                synced += 1
+
+        def record_op(item: tuple[dict[str, Any], dict[str, Any]]) -> dict[str, Any]:
+            rec, fields = item
+            return {"op": "update", "collection": "marga_users", "id": rec["email"], "fields": {k: to_fs_field(v) for k, v in fields.items()}, "precondition": None if rec["email"] in stamps else {"exists": False}}
+
+        pending: Iterable[Any] = records
+        if args.max_writes is not None:
+            # The budget is ranked over the writes actually needed, so every
+            # password is hashed before the first doc is written.
+            METRICS.start_phase("hash")
+            hashed: list[tuple[dict[str, Any], dict[str, Any]]] = []
+            Pipeline(records, name="hash marga_users").stage("hash", build_one, workers=args.hash_workers).run(hashed.append)
+            selected, _, deferred = select_ops([record_op(item) for item in hashed], args.max_writes)
+            pending = sorted((item for index, item in enumerate(hashed) if index in selected), key=lambda item: item[0]["row_number"])
+            if deferred.operations:
+                print(f"--max-writes {args.max_writes}: deferring {deferred.operations} lower-ranked writes; re-run to apply them")
+            METRICS.start_phase("write")
+        pipeline = Pipeline(pending, name="write marga_users")
+        if args.max_writes is None:
+            pipeline.stage("hash", build_one, workers=args.hash_workers)
+        pipeline.stage("write", write_one, workers=args.write_workers)
+        pipeline.run(record_one)
     else:
         synced = len(records)
 
     all_skipped = skipped + failed
     print(f"Synced: {synced}")
+    if in_sync:
+        print(f"Already in sync: {len(in_sync)}")
+    if deferred.operations:
+        print(f"Deferred by --max-writes: {deferred.operations}")
     print(f"Skipped/Failed: {len(all_skipped)}")
     for item in all_skipped[:10]:
         print(f"- row {item['row']}: {item['reason']}")
+    print(spent().line("Actual"))
 
     return 0
 
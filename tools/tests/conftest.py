@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+TOOLS = Path(__file__).resolve().parents[1]
+REPO_ROOT = TOOLS.parent
+
+# The scripts run with PYTHONPATH=tools; do the same for the tests.
+sys.path.insert(0, str(TOOLS))
+
+from marga_tools.standin import DocumentStore, start_server  # noqa: E402
+
+
+@pytest.fixture
+def standin():
+    """A local Firestore stand-in: (store, base URL)."""
+    store = DocumentStore()
+    server = start_server(store)
+    yield store, server.base_url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def run_script(standin):
+    """Run a tools/ script from the repo root against the stand-in; returns the CompletedProcess."""
+    _, base_url = standin
+    env = dict(os.environ, MARGA_FIRESTORE_BASE_URL=base_url, PYTHONPATH=str(TOOLS))
+
+    def run(script, *args):
+        return subprocess.run([sys.executable, str(TOOLS / script), *map(str, args)], env=env, cwd=REPO_ROOT, capture_output=True, text=True)
+
+    return run
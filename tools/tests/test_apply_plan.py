@@ -0,0 +1,80 @@
+from marga_tools.changeset import PlanWriter
+from marga_tools.firestore import fs_fields
+
+
+def seed(store):
+    store.put("tbl_employee", "1", fs_fields({"name": "Ana"}))
+    store.put("marga_users", "ana@example.com", fs_fields({"name": "Ana"}))
+
+
+def write_plan(path, precondition=None):
+    with PlanWriter(path, "test") as plan:
+        # Listed first on purpose: the apply still runs the update before it.
+        plan.delete("marga_users", "ana@example.com")
+        plan.update("tbl_employee", "2", {"name": "Ana", "email": "ana@example.com"}, precondition=precondition)
+    return path
+
+
+def test_updates_then_deletes(standin, run_script, tmp_path):
+    store, _ = standin
+    seed(store)
+    result = run_script("apply-firestore-plan.py", write_plan(tmp_path / "plan.ndjson"))
+    assert result.returncode == 0, result.stderr
+    assert store.ids("tbl_employee") == ["1", "2"]
+    assert store.ids("marga_users") == []
+
+
+def test_deletes_are_held_back_when_an_update_fails(standin, run_script, tmp_path):
+    store, _ = standin
+    seed(store)
+    plan = write_plan(tmp_path / "plan.ndjson", precondition={"exists": True})
+    journal = tmp_path / "apply.journal.ndjson"
+    result = run_script("apply-firestore-plan.py", plan, "--journal", journal)
+    assert result.returncode != 0
+    assert "Held back 1 deletes" in result.stdout
+    assert store.ids("marga_users") == ["ana@example.com"]
+
+    # Once the update can land, a resumed apply runs it and then the delete.
+    store.put("tbl_employee", "2", fs_fields({"name": "placeholder"}))
+    result = run_script("apply-firestore-plan.py", plan, "--journal", journal, "--resume")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert store.ids("marga_users") == []
+
+
+def test_deletes_wait_for_updates_deferred_by_max_writes(standin, run_script, tmp_path):
+    store, _ = standin
+    seed(store)
+    plan = write_plan(tmp_path / "plan.ndjson")
+    journal = tmp_path / "apply.journal.ndjson"
+    result = run_script("apply-firestore-plan.py", plan, "--journal", journal, "--max-writes", 1)
+    assert result.returncode == 0, result.stderr
+    assert store.ids("marga_users") == ["ana@example.com"]
+    result = run_script("apply-firestore-plan.py", plan, "--journal", journal, "--resume")
+    assert result.returncode == 0, result.stderr
+    assert store.ids("tbl_employee") == ["1", "2"]
+    assert store.ids("marga_users") == []
+
+
+def test_plan_without_end_record_is_refused(standin, run_script, tmp_path):
+    store, _ = standin
+    seed(store)
+    plan = write_plan(tmp_path / "plan.ndjson")
+    lines = plan.read_text(encoding="utf-8").splitlines(keepends=True)
+    plan.write_text("".join(lines[:-1]), encoding="utf-8")
+    result = run_script("apply-firestore-plan.py", plan)
+    assert result.returncode == 2
+    assert store.ids("marga_users") == ["ana@example.com"]
+    assert store.ids("tbl_employee") == ["1"]
+
+
+def test_resume_with_another_plans_journal_is_refused(standin, run_script, tmp_path):
+    store, _ = standin
+    seed(store)
+    journal = tmp_path / "apply.journal.ndjson"
+    assert run_script("apply-firestore-plan.py", write_plan(tmp_path / "a.ndjson"), "--journal", journal).returncode == 0
+    with PlanWriter(tmp_path / "b.ndjson", "test") as other:
+        other.update("tbl_employee", "3", {"name": "Ben"})
+    result = run_script("apply-firestore-plan.py", tmp_path / "b.ndjson", "--journal", journal, "--resume")
+    assert result.returncode == 2
+    assert "different plan" in result.stderr
+    assert store.ids("tbl_employee") == ["1", "2"]
@@ -0,0 +1,233 @@
+import gzip
+import itertools
+import json
+import threading
+import time
+
+import pytest
+
+from marga_tools.backup import BackupError, BackupStore, BackupWriter, iter_backup, iter_manifest_documents, verify_backup
+from marga_tools.firestore import fs_fields
+from marga_tools.standin import seed_synthetic
+from marga_tools.synthetic import synthetic_employees, write_final_users_xlsx
+
+
+def raw(doc_id, **fields):
+    return {"name": f"projects/p/databases/(default)/documents/tbl_employee/{doc_id}", "updateTime": f"2026-01-01T00:00:0{doc_id}Z", "fields": fs_fields(fields)}
+
+
+def test_file_backup_round_trip(tmp_path):
+    docs = [raw(1, name="Ana"), raw(2, name="Ben")]
+    with BackupWriter(tmp_path / "b.ndjson.gz", created_at="t") as backup:
+        for doc in docs:
+            backup.add("tbl_employee", doc)
+    assert verify_backup(backup.path) == 2
+    assert [(entry["collection"], entry["id"], entry["fields"]) for entry in iter_backup(backup.path)] == [
+        ("tbl_employee", "1", docs[0]["fields"]),
+        ("tbl_employee", "2", docs[1]["fields"]),
+    ]
+
+
+def test_unfinished_file_backup_is_kept_as_partial_and_refused(tmp_path):
+    with pytest.raises(RuntimeError):
+        with BackupWriter(tmp_path / "b.ndjson.gz") as backup:
+            backup.add("tbl_employee", raw(1, name="Ana"))
+            raise RuntimeError("fetch failed")
+    assert backup.path.name == "b.partial.ndjson.gz"
+    assert not (tmp_path / "b.ndjson.gz").exists()
+    with pytest.raises(BackupError, match="no end record"):
+        verify_backup(backup.path)
+
+
+def lines(path):
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh]
+
+
+def test_file_backup_has_a_header_and_an_end_record_with_per_collection_counts(tmp_path):
+    with BackupWriter(tmp_path / "b.ndjson.gz", created_at="t", reason="promote") as backup:
+        backup.add("tbl_employee", raw(1, name="Ana"))
+        sink = backup.sink("marga_users")
+        sink({"name": "projects/p/databases/(default)/documents/marga_users/ana@x", "fields": fs_fields({"name": "Ana"})})
+        sink({"name": "projects/p/databases/(default)/documents/marga_users/ben@x"})
+    header, *entries, end = lines(backup.path)
+    assert header == {"type": "backup", "version": 1, "created_at": "t", "reason": "promote"}
+    assert [(entry["collection"], entry["id"]) for entry in entries] == [("tbl_employee", "1"), ("marga_users", "ana@x"), ("marga_users", "ben@x")]
+    assert entries[2] == {"collection": "marga_users", "id": "ben@x", "updateTime": None, "fields": {}}
+    assert end == {"type": "end", "documents": 3, "counts": {"tbl_employee": 1, "marga_users": 2}}
+    # Closing twice writes one end record.
+    backup.close()
+    assert len(lines(backup.path)) == 5
+
+
+def test_backup_without_an_end_record_fails_after_its_documents(tmp_path):
+    with pytest.raises(RuntimeError):
+        with BackupWriter(tmp_path / "b.ndjson.gz") as backup:
+            backup.add("tbl_employee", raw(1, name="Ana"))
+            backup.add("tbl_employee", raw(2, name="Ben"))
+            raise RuntimeError("fetch failed")
+    entries = iter_backup(backup.path)
+    assert [entry["id"] for entry in itertools.islice(entries, 2)] == ["1", "2"]
+    with pytest.raises(BackupError, match="no end record"):
+        next(entries)
+
+
+def test_truncated_or_short_counted_backups_are_refused(tmp_path):
+    with BackupWriter(tmp_path / "b.ndjson.gz") as backup:
+        for doc_id in range(1, 4):
+            backup.add("tbl_employee", raw(doc_id, name="x" * 1000 * doc_id))
+    data = backup.path.read_bytes()
+    cut = tmp_path / "cut.ndjson.gz"
+    cut.write_bytes(data[: len(data) // 2])
+    with pytest.raises(BackupError, match="truncated or corrupt"):
+        verify_backup(cut)
+
+    header, first, _, third, end = lines(backup.path)
+    short = tmp_path / "short.ndjson.gz"
+    with gzip.open(short, "wt", encoding="utf-8") as fh:
+        fh.writelines(json.dumps(entry) + "\n" for entry in (header, first, third, end))
+    with pytest.raises(BackupError, match="holds 2 documents but its end record says 3"):
+        verify_backup(short)
+
+
+def test_legacy_json_backups_still_read(tmp_path):
+    legacy = tmp_path / "firebase-user-migration-backup-1.json"
+    legacy.write_text(json.dumps({"tbl_employee": [{"_docId": "7", "name": "Ana", "id": 7}], "meta": {"at": "t"}}))
+    assert list(iter_backup(legacy)) == [{"collection": "tbl_employee", "id": "7", "updateTime": None, "fields": fs_fields({"name": "Ana", "id": 7})}]
+    assert verify_backup(legacy) == 1
+
+
+def test_store_runs_share_objects_and_never_reuse_an_id(tmp_path):
+    store = BackupStore(tmp_path / "store")
+    with store.open_run("s") as first:
+        first.add("tbl_employee", raw(1, name="Ana"))
+        first.add("tbl_employee", raw(2, name="Ben"))
+    with BackupStore(tmp_path / "store").open_run("s") as second:
+        second.add("tbl_employee", raw(1, name="Ana"))
+        second.add("tbl_employee", raw(2, name="Benjamin"))
+    assert (first.run_id, second.run_id) == ("s", "s-2")
+    assert (second.new_objects, second.reused_objects) == (1, 1)
+    assert [entry["fields"]["name"]["stringValue"] for entry in sorted(iter_manifest_documents(first.path), key=lambda entry: entry["id"])] == ["Ana", "Ben"]
+    assert [entry["fields"]["name"]["stringValue"] for entry in sorted(iter_manifest_documents(second.path), key=lambda entry: entry["id"])] == ["Ana", "Benjamin"]
+
+
+def test_aborted_store_run_leaves_nothing_behind(tmp_path):
+    store = BackupStore(tmp_path / "store")
+    with pytest.raises(RuntimeError):
+        with store.open_run("s") as run:
+            run.add("tbl_employee", raw(1, name="Ana"))
+            raise RuntimeError("fetch failed")
+    assert not run.path.exists()
+    assert not store.pack_path("s").exists()
+    assert store.pack_of == {} and BackupStore(tmp_path / "store").pack_of == {}
+    with store.open_run("s") as again:
+        again.add("tbl_employee", raw(1, name="Ana"))
+    assert again.new_objects == 1
+    assert verify_backup(again.path) == 1
+
+
+def test_pack_missing_an_indexed_object_is_an_error(tmp_path):
+    store = BackupStore(tmp_path / "store")
+    with store.open_run("s") as run:
+        run.add("tbl_employee", raw(1, name="Ana"))
+        run.add("tbl_employee", raw(2, name="Ben"))
+    pack = store.pack_path("s")
+    with gzip.open(pack, "rt", encoding="utf-8") as fh:
+        first_line = fh.readline()
+    with gzip.open(pack, "wt", encoding="utf-8") as fh:
+        fh.write(first_line)
+    with pytest.raises(BackupError, match="missing 1 indexed objects"):
+        list(iter_manifest_documents(run.path))
+
+
+@pytest.mark.parametrize("workers", [1, 2, 8])
+def test_manifest_documents_span_many_packs(tmp_path, workers):
+    store = BackupStore(tmp_path / "store")
+    # Doc N last changes in run N, so the last run's view spans four packs.
+    for number in range(1, 6):
+        with store.open_run("s") as run:
+            for doc_id in range(1, 5):
+                run.add("tbl_employee", raw(doc_id, name=f"v{min(number, doc_id)}"))
+    assert len(set(store.pack_of.values())) == 4
+    names = {entry["id"]: entry["fields"]["name"]["stringValue"] for entry in iter_manifest_documents(run.path, workers=workers)}
+    assert names == {"1": "v1", "2": "v2", "3": "v3", "4": "v4"}
+
+
+def big_run(tmp_path, docs=200):
+    store = BackupStore(tmp_path / "store")
+    with store.open_run("s") as run:
+        for doc_id in range(docs):
+            run.add("tbl_employee", raw(doc_id, name=f"n{doc_id}"))
+    return run
+
+
+def test_large_pack_streams_through_a_small_buffer(tmp_path):
+    run = big_run(tmp_path)
+    ids = [entry["id"] for entry in iter_manifest_documents(run.path, workers=2, buffer=3)]
+    assert sorted(ids, key=int) == [str(doc_id) for doc_id in range(200)]
+
+
+def test_manifest_reader_stays_a_buffer_ahead_and_stops_with_the_consumer(tmp_path, monkeypatch):
+    run = big_run(tmp_path)
+    read = []
+    original = BackupStore.read_pack
+
+    def counting(self, pack, wanted):
+        for item in original(self, pack, wanted):
+            read.append(item[0])
+            yield item
+
+    monkeypatch.setattr(BackupStore, "read_pack", counting)
+    entries = iter_manifest_documents(run.path, buffer=4)
+    first = [next(entries) for _ in range(10)]
+    assert len(first) == 10
+    time.sleep(0.2)
+    # Ten yielded, four queued, one blocked in put(): nowhere near the 200 in the pack.
+    assert len(read) <= 10 + 4 + 1
+    entries.close()
+    deadline = time.monotonic() + 5
+    while any(thread.name.startswith("pack-reader") for thread in threading.enumerate()):
+        assert time.monotonic() < deadline, "pack readers still running"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def promote_inputs(standin, tmp_path):
+    store, _ = standin
+    seed_synthetic(store, 30)
+    employees = synthetic_employees(30)
+    for employee in employees[:5]:
+        store.put("marga_users", employee["email"] or f"user{employee['id']}", fs_fields({"name": employee["firstname"]}))
+    write_final_users_xlsx(tmp_path / "roster.xlsx", employees, 20)
+    before = {(collection, doc_id): store.get(collection, doc_id)["fields"] for collection in ("tbl_employee", "marga_users") for doc_id in store.ids(collection)}
+    return tmp_path / "roster.xlsx", before
+
+
+def test_promote_backup_restores_the_state_before_the_run(standin, run_script, promote_inputs, tmp_path):
+    store, _ = standin
+    roster, before = promote_inputs
+    result = run_script("promote-final-users-to-tbl-employee.py", "--xlsx", roster, "--backup-dir", tmp_path / "backups")
+    assert result.returncode == 0, result.stdout + result.stderr
+    (manifest,) = (tmp_path / "backups" / "store" / "manifests").iterdir()
+    assert store.ids("marga_users") == []
+
+    # A resumed run keeps the first run's backup of the pre-migration state.
+    result = run_script("promote-final-users-to-tbl-employee.py", "--xlsx", roster, "--backup-dir", tmp_path / "backups", "--resume")
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert list((tmp_path / "backups" / "store" / "manifests").iterdir()) == [manifest]
+
+    result = run_script("restore-firestore-backup.py", manifest)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert {key: store.get(*key)["fields"] for key in before} == before
+
+
+def test_restore_refuses_a_partial_backup(standin, run_script, tmp_path):
+    store, _ = standin
+    with pytest.raises(RuntimeError):
+        with BackupWriter(tmp_path / "b.ndjson.gz") as backup:
+            backup.add("tbl_employee", raw(1, name="Ana"))
+            raise RuntimeError("fetch failed")
+    result = run_script("restore-firestore-backup.py", backup.path)
+    assert result.returncode == 2
+    assert "Refusing to restore" in result.stderr
+    assert store.ids("tbl_employee") == []
@@ -0,0 +1,90 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from marga_tools import benchmarks
+from marga_tools.benchmarks import (
+    bench_bulk_writes,
+    bench_codec,
+    bench_geoindex,
+    bench_import_paths,
+    bench_usernames,
+    colliding_roster,
+    compare_to_baseline,
+    legacy_fs_field,
+    legacy_fs_parse_value,
+    probing_pick_username,
+)
+from marga_tools.codec import encode_documents
+from marga_tools.usernames import UsernameAllocator
+
+TOOLS = Path(__file__).resolve().parents[1]
+
+
+def test_the_baselines_agree_with_what_they_are_compared_to():
+    roster = colliding_roster(60)
+    used: set[str] = set()
+    assert {emp_id: probing_pick_username(record, emp_id, used) for record, emp_id, _ in roster} == UsernameAllocator().allocate_many(roster)
+    for doc in benchmarks.employee_documents(20):
+        legacy = {key: legacy_fs_field(value) for key, value in doc.items()}
+        assert [legacy] == encode_documents([doc])
+        assert {key: legacy_fs_parse_value(value) for key, value in legacy.items()} == doc
+
+
+def test_small_runs_report_every_timing():
+    usernames, = bench_usernames([40])
+    assert usernames["size"] == 40 and usernames["probing_s"] >= 0 and usernames["allocator_us_per_name"] > 0
+    codec, = bench_codec([30], page_size=7, repeat=1)
+    assert codec["fields_per_doc"] == len(benchmarks.employee_documents(1)[0])
+    assert all(codec[key] > 0 for key in ("legacy_encode_s", "codec_encode_s", "legacy_decode_s", "codec_decode_s"))
+    geo, = bench_geoindex([300], queries=20, k=5, km=2.0)
+    # The grid answers exactly what the brute-force scan does.
+    assert geo["matches"] is True
+    assert geo["cells"] > 0
+
+
+def test_import_paths_time_each_step_or_say_why_it_was_skipped():
+    row, = bench_import_paths([40], repeat=1)
+    for step in ("extract_branchinfo_from_sql", "extract_tbl_employee_from_dump", "parse_xlsx", "read_workbook_rows", "match_roster", "match_payroll"):
+        assert f"{step}_s" in row or f"{step}_skipped" in row, step
+    # These need only the standard library.
+    assert row["extract_branchinfo_from_sql_rows"] == 80
+    assert row["parse_xlsx_rows"] == 32
+
+
+def test_bulk_writes_land_every_document_despite_throttling():
+    row, = bench_bulk_writes([120], workers=(1, 4))
+    for count in (1, 4):
+        assert row[f"workers{count}_failed"] == 0
+        assert row[f"workers{count}_docs_per_s"] > 0
+
+
+def test_compare_to_baseline_flags_only_timings_past_the_threshold(capsys):
+    baseline = {"codec": [{"size": 10, "codec_encode_s": 1.0, "codec_decode_s": 1.0, "decode_speedup": 1.0}], "gone": [{"size": 10, "x_s": 1.0}]}
+    current = {
+        "codec": [{"size": 10, "codec_encode_s": 1.2, "codec_decode_s": 1.5, "decode_speedup": 9.0}, {"size": 20, "codec_encode_s": 9.0}],
+        "new": [{"size": 10, "x_s": 5.0}],
+    }
+    regressions = compare_to_baseline(current, baseline, threshold=0.25)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("codec size=10 codec_decode_s: 1.0000s -> 1.5000s (+50%) REGRESSED")
+    assert "codec_encode_s: 1.0000s -> 1.2000s (+20%) ok" in capsys.readouterr().out
+
+
+def test_cli_saves_a_baseline_and_fails_on_a_regression(tmp_path):
+    baseline = tmp_path / "baseline.json"
+
+    def run(*args):
+        return subprocess.run([sys.executable, "-m", "marga_tools.benchmarks", "usernames", "--sizes", "50,100", *args], cwd=TOOLS, capture_output=True, text=True)
+
+    assert run("--save", str(baseline)).returncode == 0
+    saved = json.loads(baseline.read_text())
+    assert [row["size"] for row in saved["benchmarks"]["usernames"]] == [50, 100]
+    # A baseline 1000x faster than anything this machine can do.
+    for row in saved["benchmarks"]["usernames"]:
+        row["allocator_s"] = row["allocator_s"] / 1000 or 1e-9
+    baseline.write_text(json.dumps(saved))
+    result = run("--baseline", str(baseline))
+    assert result.returncode == 1
+    assert "regressed more than 25%" in result.stderr
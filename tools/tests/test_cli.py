@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from marga_tools import firestore
+from marga_tools.cli import COMMANDS, split_chain
+from marga_tools.firestore import BulkWriter, fetch_collection, fs_fields
+from marga_tools.metrics import METRICS
+from marga_tools.synthetic import write_mysql_dump
+
+API_KEY = "local"
+TOOLS = Path(__file__).resolve().parents[1]
+REPO_ROOT = TOOLS.parent
+
+
+def cli(base_url, *args):
+    env = dict(os.environ, MARGA_FIRESTORE_BASE_URL=base_url, PYTHONPATH=str(TOOLS))
+    return subprocess.run([sys.executable, "-m", "marga_tools", *map(str, args)], env=env, cwd=REPO_ROOT, capture_output=True, text=True)
+
+
+def test_split_chain():
+    assert split_chain(["a", "-x", "+", "b", "+", "+", "c", "y"]) == [["a", "-x"], ["b"], ["c", "y"]]
+    assert split_chain(["+"]) == []
+    assert split_chain([]) == []
+
+
+def test_list_unknown_and_missing_commands(standin):
+    _, base_url = standin
+    listed = cli(base_url, "--list")
+    assert listed.returncode == 0
+    assert [line.split()[0] for line in listed.stdout.splitlines()] == list(COMMANDS)
+    for args, message in ((("gaps", "+", "nope"), "unknown command: nope"), ((), "no command given"), (("--bogus", "gaps"), "unknown command: --bogus")):
+        result = cli(base_url, *args)
+        assert result.returncode == 2
+        assert message in result.stderr
+
+
+def test_chained_commands_get_their_own_metrics_and_share_parsed_dumps(standin, tmp_path):
+    store, base_url = standin
+    for branch_id in range(1, 21):
+        store.put("tbl_branchinfo", str(branch_id), fs_fields({"id": branch_id}))
+    dump = tmp_path / "dump.sql"
+    write_mysql_dump(dump, employees=1, branches=50)
+    session, own = tmp_path / "session.json", tmp_path / "first.json"
+
+    result = cli(
+        base_url, "--metrics-json", session,
+        "extract-branches", "--sql", dump, "--output", tmp_path / "missing.json", "--metrics-json", own,
+        "+", "extract-branches", "--sql", dump, "--min-id", 45, "--geo-index", tmp_path / "branches.grid", "--output", tmp_path / "newest.json",
+    )
+    assert result.returncode == 0, result.stderr
+    assert [branch["id"] for branch in json.loads((tmp_path / "missing.json").read_text())] == list(range(21, 51))
+    assert [branch["id"] for branch in json.loads((tmp_path / "newest.json").read_text())] == list(range(46, 51))
+    assert "[extract-branches] exit 0" in result.stderr
+    assert "1 cached reads and parses reused" in result.stderr
+
+    first, second = json.loads(session.read_text())["commands"]
+    assert (first["command"], first["exit"], second["exit"]) == ("extract-branches", 0, 0)
+    # The first command read the collection; the second parsed nothing and read nothing.
+    assert first["request_totals"]["count"] > 0 and "parse_cache_hits" not in first["counters"]
+    assert second["request_totals"]["count"] == 0 and second["counters"]["parse_cache_hits"] == 1
+    assert [phase["phase"] for phase in second["phases"]] == ["extract", "geo index", "write"]
+    # The command's own --metrics-json holds only that command.
+    assert json.loads(own.read_text())["argv"] == first["argv"]
+    assert "--geo-index" not in first["argv"]
+
+
+def test_the_chain_stops_at_the_first_failure(standin, tmp_path):
+    _, base_url = standin
+    dump = tmp_path / "dump.sql"
+    write_mysql_dump(dump, employees=1, branches=5)
+    session = tmp_path / "session.json"
+    result = cli(base_url, "--metrics-json", session, "gaps", "--bogus", "+", "extract-branches", "--sql", dump, "--min-id", 0, "--output", tmp_path / "out.json")
+    assert result.returncode == 2
+    assert "[gaps] exit 2" in result.stderr
+    assert not (tmp_path / "out.json").exists()
+    assert [(row["command"], row["exit"]) for row in json.loads(session.read_text())["commands"]] == [("gaps", 2)]
+
+
+def test_snapshots_replay_a_collection_until_this_process_writes_to_it(standin, monkeypatch):
+    store, base_url = standin
+    for doc_id in range(5):
+        store.put("c", str(doc_id), fs_fields({"n": doc_id}))
+    monkeypatch.setattr(firestore, "SNAPSHOTS", firestore.Snapshots())
+    METRICS.reset()
+
+    first = fetch_collection(base_url, API_KEY, "c")
+    first[0]["n"] = "edited by the reader"
+    store.put("c", "9", fs_fields({"n": 9}))
+    # Replayed: the app's new document is not seen, and neither is the reader's edit.
+    assert fetch_collection(base_url, API_KEY, "c") == [{"_docId": str(n), "n": n} for n in range(5)]
+    assert METRICS.counters["snapshot_hits"] == 1
+
+    with BulkWriter(base_url, API_KEY) as writer:
+        writer.update("c", "10", {"n": 10})
+    assert len(fetch_collection(base_url, API_KEY, "c")) == 7
+    assert METRICS.counters["snapshot_hits"] == 1
+    METRICS.reset()
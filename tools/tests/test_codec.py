@@ -0,0 +1,201 @@
+import datetime as dt
+import enum
+import math
+from collections import OrderedDict
+
+import pytest
+
+from marga_tools.codec import (
+    GeoPoint,
+    Reference,
+    Timestamp,
+    decode_document,
+    decode_documents,
+    decode_fields,
+    decode_value,
+    encode_documents,
+    encode_fields,
+    encode_value,
+)
+
+
+class Shift(enum.IntEnum):
+    DAY = 1
+    NIGHT = 2
+
+
+class Code(str):
+    pass
+
+
+ROUND_TRIPS = [
+    None,
+    True,
+    False,
+    0,
+    -7,
+    2**62,
+    1.5,
+    -0.25,
+    "",
+    "Jose Rizal",
+    b"\x00\xffmarga",
+    [1, "two", None, [3.5]],
+    [],
+    {"a": 1, "b": {"c": [True, {"d": "x"}]}},
+    {},
+    Timestamp("2024-05-01T08:30:00.123456Z"),
+    Reference("projects/p/databases/(default)/documents/marga_users/7"),
+    GeoPoint(14.5995, 120.9842),
+]
+
+
+@pytest.mark.parametrize("value", ROUND_TRIPS, ids=repr)
+def test_value_round_trip(value):
+    decoded = decode_value(encode_value(value))
+    assert decoded == value
+    assert type(decoded) is type(value)
+
+
+@pytest.mark.parametrize("value", ROUND_TRIPS, ids=repr)
+def test_fields_round_trip_agrees_with_value(value):
+    fields = encode_fields({"v": value, "n": 1})
+    assert fields["v"] == encode_value(value)
+    assert decode_fields(fields) == {"v": value, "n": 1}
+
+
+def test_wire_kinds():
+    assert encode_value(None) == {"nullValue": None}
+    assert encode_value(True) == {"booleanValue": True}
+    assert encode_value(7) == {"integerValue": "7"}
+    assert encode_value(1.5) == {"doubleValue": 1.5}
+    assert encode_value("x") == {"stringValue": "x"}
+    assert encode_value(b"hi") == {"bytesValue": "aGk="}
+    assert encode_value((1, "a")) == {"arrayValue": {"values": [{"integerValue": "1"}, {"stringValue": "a"}]}}
+    assert encode_value({1: "a"}) == {"mapValue": {"fields": {"1": {"stringValue": "a"}}}}
+    assert encode_value(GeoPoint(1.0, 2.0)) == {"geoPointValue": {"latitude": 1.0, "longitude": 2.0}}
+    assert encode_value(Reference("projects/p/x")) == {"referenceValue": "projects/p/x"}
+
+
+def test_datetimes_encode_as_utc_timestamps():
+    manila = dt.timezone(dt.timedelta(hours=8))
+    encoded = encode_value(dt.datetime(2024, 5, 1, 16, 30, tzinfo=manila))
+    assert encoded == {"timestampValue": "2024-05-01T08:30:00.000000Z"}
+    decoded = decode_value(encoded)
+    assert isinstance(decoded, Timestamp)
+    assert decoded == "2024-05-01T08:30:00.000000Z"
+
+
+def test_dates_encode_as_strings():
+    assert encode_value(dt.date(2024, 5, 1)) == {"stringValue": "2024-05-01"}
+
+
+def test_tuples_decode_as_lists():
+    assert decode_value(encode_value((1, 2))) == [1, 2]
+
+
+def test_integer_doubles_decode_as_floats():
+    assert decode_value({"doubleValue": 5}) == 5.0
+    assert type(decode_value({"doubleValue": 5})) is float
+    assert decode_fields({"x": {"doubleValue": 5}})["x"] == 5.0
+
+
+@pytest.mark.parametrize("value, wire", [(math.inf, "Infinity"), (-math.inf, "-Infinity")])
+def test_infinite_doubles_round_trip(value, wire):
+    assert encode_value(value) == {"doubleValue": wire}
+    assert encode_fields({"x": value}) == {"x": {"doubleValue": wire}}
+    assert decode_value({"doubleValue": wire}) == value
+    assert decode_fields({"x": {"doubleValue": wire}}) == {"x": value}
+
+
+def test_nan_round_trips():
+    assert encode_value(math.nan) == {"doubleValue": "NaN"}
+    assert encode_fields({"x": math.nan}) == {"x": {"doubleValue": "NaN"}}
+    assert math.isnan(decode_value({"doubleValue": "NaN"}))
+    assert math.isnan(decode_fields({"x": {"doubleValue": "NaN"}})["x"])
+
+
+def test_coercion_writes_integral_floats_as_integers_and_non_finite_as_null():
+    values = {"a": 3.0, "b": 2.5, "c": math.nan, "d": -math.inf, "e": 4}
+    expected = {
+        "a": {"integerValue": "3"},
+        "b": {"doubleValue": 2.5},
+        "c": {"nullValue": None},
+        "d": {"nullValue": None},
+        "e": {"integerValue": "4"},
+    }
+    assert encode_fields(values, coerce_integral_floats=True) == expected
+    assert {key: encode_value(value, True) for key, value in values.items()} == expected
+    # Without coercion the same floats stay doubles.
+    assert encode_fields({"a": 3.0}) == {"a": {"doubleValue": 3.0}}
+
+
+def test_subclasses_encode_as_their_base_type():
+    assert encode_value(Shift.NIGHT) == {"integerValue": "2"}
+    assert encode_fields({"s": Shift.DAY}) == {"s": {"integerValue": "1"}}
+    assert encode_value(Code("A1")) == {"stringValue": "A1"}
+    assert encode_value(OrderedDict(b=1, a=2)) == {
+        "mapValue": {"fields": {"b": {"integerValue": "1"}, "a": {"integerValue": "2"}}}
+    }
+    # bool is an int subclass but has its own kind.
+    assert encode_fields({"t": True}) == {"t": {"booleanValue": True}}
+    assert decode_fields(encode_fields({"s": Shift.NIGHT, "c": Code("A1")})) == {"s": 2, "c": "A1"}
+
+
+def test_unknown_types_encode_as_strings():
+    assert encode_value(dt.time(8, 30)) == {"stringValue": "08:30:00"}
+
+
+MALFORMED = [
+    {"stringValue": "x", "integerValue": "1"},
+    {},
+    {"unheardOfValue": 1},
+    {"integerValue": "twelve"},
+    {"integerValue": None},
+    {"doubleValue": "fast"},
+    {"bytesValue": "not base64!"},
+    {"arrayValue": "nope"},
+    "stringValue",
+    None,
+]
+
+
+@pytest.mark.parametrize("value", MALFORMED, ids=repr)
+def test_malformed_values_decode_to_none_in_both_paths(value):
+    assert decode_value(value) is None
+    assert decode_fields({"bad": value, "ok": {"integerValue": "1"}}) == {"bad": None, "ok": 1}
+
+
+def test_malformed_array_items_decode_to_none():
+    raw = {"arrayValue": {"values": [{"integerValue": "1"}, {"stringValue": "a", "nullValue": None}, {}]}}
+    assert decode_value(raw) == [1, None, None]
+    assert decode_fields({"xs": raw}) == {"xs": [1, None, None]}
+
+
+def test_malformed_nested_values_decode_to_none_in_place():
+    raw = {"mapValue": {"fields": {"a": "bare", "b": {"booleanValue": True}}}}
+    assert decode_value(raw) == {"a": None, "b": True}
+    assert decode_fields({"m": raw}) == {"m": {"a": None, "b": True}}
+
+
+def test_empty_containers():
+    assert decode_value({"arrayValue": {}}) == []
+    assert decode_value({"mapValue": {}}) == {}
+    assert decode_fields(None) == {}
+    assert decode_fields({}) == {}
+
+
+def test_decode_document_adds_doc_id():
+    doc = {"name": "projects/p/databases/(default)/documents/marga_users/42", "fields": encode_fields({"a": 1})}
+    assert decode_document(doc) == {"a": 1, "_docId": "42"}
+    assert decode_document({}) == {"_docId": ""}
+
+
+def test_batch_helpers_match_single_document_helpers():
+    docs = [{"id": index, "name": f"e{index}", "rate": index / 2, "tags": ["a", index]} for index in range(50)]
+    encoded = encode_documents(docs)
+    assert encoded == [encode_fields(doc) for doc in docs]
+    wrapped = [{"name": f"x/{index}", "fields": fields} for index, fields in enumerate(encoded)]
+    decoded = decode_documents(wrapped)
+    assert [{k: v for k, v in doc.items() if k != "_docId"} for doc in decoded] == docs
+    assert [doc["_docId"] for doc in decoded] == [str(index) for index in range(50)]
@@ -0,0 +1,130 @@
+from marga_tools.cost import Cost, check_reads, encoded_bytes, op_cost, op_rank, plan_cost, predict_reads, select_ops
+from marga_tools.firestore import fs_fields
+from marga_tools.synthetic import write_xlsx
+
+API_KEY = "local"
+
+
+def update(doc_id, collection="tbl_employee", new=False, **fields):
+    return {"op": "update", "collection": collection, "id": str(doc_id), "fields": fs_fields(fields or {"n": 1}), "precondition": {"exists": False} if new else None}
+
+
+def delete(doc_id, collection="marga_users"):
+    return {"op": "delete", "collection": collection, "id": str(doc_id)}
+
+
+def test_rank_creates_then_updates_then_deletes_by_collection_and_numeric_id():
+    ops = [delete("b@x"), update(10), update(9, new=True), update(2), delete("a@x"), update("abc"), update(1, collection="marga_users"), update(100, new=True)]
+    ranked = sorted(ops, key=op_rank)
+    assert [(op["op"], op["collection"], op["id"]) for op in ranked] == [
+        ("update", "tbl_employee", "9"),
+        ("update", "tbl_employee", "100"),
+        ("update", "marga_users", "1"),
+        ("update", "tbl_employee", "2"),
+        ("update", "tbl_employee", "10"),
+        ("update", "tbl_employee", "abc"),
+        ("delete", "marga_users", "a@x"),
+        ("delete", "marga_users", "b@x"),
+    ]
+
+
+def test_op_cost_and_plan_cost():
+    op = update(1, name="Ana")
+    assert op_cost(op) == Cost(writes=1, write_bytes=encoded_bytes(op["fields"], encoded=True))
+    assert encoded_bytes({"name": "Ana"}) == len('{"name":{"stringValue":"Ana"}}')
+    assert op_cost(delete("a@x")) == Cost(deletes=1)
+    total = plan_cost([op, update(2, name="Ana"), delete("a@x")])
+    assert (total.writes, total.deletes, total.operations) == (2, 1, 3)
+    assert total.write_bytes == 2 * op_cost(op).write_bytes
+
+
+def test_select_ops_without_a_budget_keeps_everything():
+    ops = [update(1), delete("a@x")]
+    selected, kept, deferred = select_ops(ops, None)
+    assert selected is None
+    assert kept == plan_cost(ops)
+    assert deferred == Cost()
+
+
+def test_select_ops_keeps_the_highest_ranked_within_the_budget():
+    ops = [delete("a@x"), update(5), update(7, new=True), update(3)]
+    selected, kept, deferred = select_ops(ops, 2)
+    # Creates first, then updates by numeric id: 7 (new), then 3.
+    assert selected == {2, 3}
+    assert (kept.operations, deferred.operations, deferred.deletes) == (2, 2, 1)
+    assert kept + deferred == plan_cost(ops)
+
+
+def test_select_ops_is_deterministic_and_skipped_ops_take_no_budget():
+    ops = [update(index) for index in range(10, 0, -1)]
+    first = select_ops(ops, 3)[0]
+    assert first == select_ops(list(ops), 3)[0] == {9, 8, 7}
+    applied = {"1", "2"}
+    selected, kept, deferred = select_ops(ops, 3, skip=lambda op: op["id"] in applied)
+    assert selected == {7, 6, 5}
+    assert (kept.operations, deferred.operations) == (3, 5)
+
+
+def test_select_ops_zero_budget():
+    selected, kept, deferred = select_ops([update(1), delete("a@x")], 0)
+    assert selected == set()
+    assert kept == Cost()
+    assert deferred.operations == 2
+
+
+def test_cost_arithmetic_and_free_tier_share():
+    cost = Cost(reads=5000, writes=100, deletes=4000)
+    assert cost + Cost(reads=1) - Cost(writes=100) == Cost(reads=5001, deletes=4000)
+    assert cost.free_tier_share() == 0.2
+    assert cost.to_dict()["free_tier_share"] == 0.2
+    assert "5000 reads, 100 writes, 4000 deletes" in cost.line("Predicted")
+
+
+def test_predict_reads_counts_documents_and_pricing_queries(standin):
+    store, base_url = standin
+    # Same-size docs, so the sample's average is exact.
+    for index in range(10, 35):
+        store.put("tbl_employee", str(index), fs_fields({"id": index, "name": "x" * 10}))
+    predicted = predict_reads(base_url, API_KEY, ["tbl_employee", "empty"], sample=5)
+    # 25 docs + 1 for listing an empty collection, plus the pricing queries:
+    # two COUNTs (1 read each) and a 5-doc sample page.
+    assert predicted.reads == 25 + 1 + 2 + 5
+    assert predicted.read_bytes == 25 * encoded_bytes({"id": 10, "name": "x" * 10})
+
+
+def test_check_reads():
+    assert check_reads(Cost(reads=100), None) == ""
+    assert check_reads(Cost(reads=100), 100) == ""
+    assert check_reads(Cost(reads=101), 100).startswith("Predicted 101 reads exceed --max-reads 100")
+
+
+def roster(path, rows):
+    write_xlsx(path, [["Employee_Id", "Nickname", "Firstname", "Lastname", "Password", "Contact_Number", "Position", "Email"], *rows])
+    return path
+
+
+def test_promote_max_writes_defers_the_lowest_ranked(standin, run_script, tmp_path):
+    store, _ = standin
+    store.put("tbl_employee", "1", fs_fields({"id": 1, "firstname": "Ana", "lastname": "Cruz", "email": "ana@marga.example"}))
+    store.put("tbl_employee", "2", fs_fields({"id": 2, "firstname": "Ben", "lastname": "Reyes", "email": "ben@marga.example"}))
+    store.put("marga_users", "ana@marga.example", fs_fields({"name": "Ana"}))
+    xlsx = roster(tmp_path / "final.xlsx", [
+        [1, None, "Ana", "Cruz", "pw-ana", "0917", "Billing", "ana@marga.example"],
+        [None, None, "Cy", "Santos", "pw-cy", "0918", "Technician", "cy@marga.example"],
+    ])
+    args = ("--xlsx", xlsx, "--backup-dir", tmp_path / "backups", "--hash-workers", 1)
+
+    result = run_script("promote-final-users-to-tbl-employee.py", *args, "--max-writes", 2)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "deferring 2 lower-ranked writes and deletes" in result.stdout
+    # The new doc and the lowest existing id go first; doc 2 and the delete wait.
+    assert "_sync_hash" in store.get("tbl_employee", "3")["fields"]
+    assert "_sync_hash" in store.get("tbl_employee", "1")["fields"]
+    assert "_sync_hash" not in store.get("tbl_employee", "2")["fields"]
+    assert store.ids("marga_users") == ["ana@marga.example"]
+
+    result = run_script("promote-final-users-to-tbl-employee.py", *args)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "_sync_hash" in store.get("tbl_employee", "2")["fields"]
+    assert store.ids("marga_users") == []
+    assert "Wrote 1 tbl_employee docs (2 already in sync)" in result.stdout
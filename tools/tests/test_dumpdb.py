@@ -0,0 +1,101 @@
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+
+from marga_tools.dumpdb import load_dump, run_query
+from marga_tools.synthetic import synthetic_employees, write_mysql_dump
+
+TOOLS = Path(__file__).resolve().parents[1]
+
+COMPANIES = (
+    "CREATE TABLE `tbl_companylist` (\n"
+    "  `id` int NOT NULL,\n"
+    "  `companyname` varchar(255) DEFAULT NULL,\n"
+    "  PRIMARY KEY (`id`)\n"
+    ") ENGINE=InnoDB;\n"
+    "INSERT INTO `tbl_companylist` VALUES (1,'Acme'),(2,'Globex');\n"
+    "CREATE TABLE `tbl_branchinfo` (\n"
+    "  `id` int NOT NULL,\n"
+    "  `company_id` int DEFAULT NULL,\n"
+    "  `branchname` varchar(255) DEFAULT NULL,\n"
+    "  PRIMARY KEY (`id`)\n"
+    ") ENGINE=InnoDB;\n"
+    "INSERT INTO `tbl_branchinfo` VALUES (10,1,'Acme Makati'),(11,3,'Orphan Pasig'),(12,NULL,'No company');\n"
+    "CREATE TABLE `tbl_employee` (\n"
+    "  `id` int NOT NULL,\n"
+    "  `firstname` varchar(64) DEFAULT NULL,\n"
+    "  `lastname` varchar(64) DEFAULT NULL,\n"
+    "  PRIMARY KEY (`id`)\n"
+    ") ENGINE=InnoDB;\n"
+    "INSERT INTO `tbl_employee` VALUES (1,'Ana','Cruz'),(2,' ana ','CRUZ'),(3,'Ben','Reyes');\n"
+)
+
+
+def indexes(db, table):
+    with sqlite3.connect(db) as conn:
+        return {row[1] for row in conn.execute(f"PRAGMA index_list({table})")}
+
+
+def test_load_keeps_the_dump_types_and_indexes_keys(tmp_path):
+    dump = tmp_path / "dump.sql"
+    write_mysql_dump(dump, employees=300, branches=120, rows_per_insert=40)
+    db = tmp_path / "marga.sqlite"
+    counts = load_dump(dump, db, indexes={"tbl_employee": ["email", "not_a_column"]}, commit_rows=100)
+    assert counts == {"tbl_branchinfo": 120, "tbl_employee": 300}
+
+    columns, rows = run_query(db, "SELECT id, firstname, rate, remarks, typeof(id), typeof(rate), typeof(date_hired) FROM tbl_employee ORDER BY id")
+    assert columns[:4] == ["id", "firstname", "rate", "remarks"]
+    expected = synthetic_employees(300)
+    assert [(row[0], row[1], row[2], row[3]) for row in rows] == [(e["id"], e["firstname"], e["rate"], e["remarks"]) for e in expected]
+    assert {row[4:] for row in rows} == {("integer", "real", "text")}
+
+    assert indexes(db, "tbl_employee") >= {"ix_tbl_employee_id", "ix_tbl_employee_branch_id", "ix_tbl_employee_email"}
+    assert indexes(db, "tbl_branchinfo") >= {"ix_tbl_branchinfo_id", "ix_tbl_branchinfo_company_id", "ix_tbl_branchinfo_area_id"}
+    _, tables = run_query(db, "tables")
+    assert [(name, count, loaded_from) for name, count, loaded_from, _ in tables] == [("tbl_branchinfo", 120, str(dump)), ("tbl_employee", 300, str(dump))]
+
+
+def test_reloading_some_tables_replaces_only_those(tmp_path):
+    db = tmp_path / "marga.sqlite"
+    dump = tmp_path / "companies.sql"
+    dump.write_text(COMPANIES, encoding="utf-8")
+    assert load_dump(dump, db) == {"tbl_companylist": 2, "tbl_branchinfo": 3, "tbl_employee": 3}
+    with sqlite3.connect(db) as conn:
+        conn.execute("INSERT INTO tbl_employee VALUES (99, 'Stray', 'Row')")
+        conn.execute("CREATE TABLE notes (text TEXT)")
+    assert load_dump(dump, db, tables=["tbl_employee"]) == {"tbl_employee": 3}
+    assert run_query(db, "SELECT max(id) FROM tbl_employee")[1] == [(3,)]
+    assert run_query(db, "SELECT count(*) FROM tbl_companylist")[1] == [(2,)]
+    assert run_query(db, "SELECT count(*) FROM notes")[1] == [(0,)]
+
+
+def test_named_diagnostics(tmp_path):
+    db = tmp_path / "marga.sqlite"
+    dump = tmp_path / "companies.sql"
+    dump.write_text(COMPANIES, encoding="utf-8")
+    load_dump(dump, db)
+    columns, rows = run_query(db, "branches-without-company")
+    assert columns == ["id", "branchname", "company_id"]
+    assert rows == [(11, "Orphan Pasig", 3), (12, "No company", None)]
+    assert run_query(db, "duplicate-employee-names")[1] == [("ana cruz", 2, "1,2")]
+
+
+def test_command_line_loads_and_prints_tsv(tmp_path):
+    db = tmp_path / "marga.sqlite"
+    dump = tmp_path / "companies.sql"
+    dump.write_text(COMPANIES, encoding="utf-8")
+
+    def run(*args):
+        return subprocess.run([sys.executable, "-m", "marga_tools.dumpdb", *map(str, args)], cwd=TOOLS, capture_output=True, text=True)
+
+    result = run(dump, "--db", db, "--table", "tbl_companylist", "--query", "SELECT id, companyname FROM tbl_companylist ORDER BY id")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == "id\tcompanyname\n1\tAcme\n2\tGlobex\n"
+    assert "Loaded 2 rows from 1 tables" in result.stderr
+
+    result = run("--db", db, "--query", "SELECT * FROM tbl_branchinfo")
+    assert result.returncode == 2
+    assert "no such table" in result.stderr
+    assert run(dump, "--db", db, "--index", "no-dot").returncode == 2
+    assert run("--db", db).returncode == 2
@@ -0,0 +1,55 @@
+import io
+import json
+
+import pytest
+
+from marga_tools.dumpdiff import iter_diff, write_diff
+
+SCHEMA = """CREATE TABLE `tbl_branchinfo` (
+  `id` int(11) NOT NULL AUTO_INCREMENT,
+  `branchname` varchar(100) DEFAULT NULL,
+  `city` varchar(100) DEFAULT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+"""
+
+
+def write_dump(path, rows):
+    values = ",".join(f"({id},'{name}','{city}')" for id, name, city in rows)
+    path.write_text(SCHEMA + f"INSERT INTO `tbl_branchinfo` VALUES {values};\n", encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def dumps(tmp_path):
+    old = write_dump(tmp_path / "old.sql", [(1, "Main", "Manila"), (2, "North", "Baguio"), (3, "South", "Davao"), (4, "East", "Tacloban")])
+    new = write_dump(tmp_path / "new.sql", [(1, "Main", "Manila"), (2, "North", "La Trinidad"), (4, "East", "Tacloban"), (5, "West", "Iloilo")])
+    return old, new
+
+
+@pytest.mark.parametrize("partitions", [1, 3, 8])
+def test_diff_finds_every_change(dumps, partitions):
+    ops = {(entry["op"], entry["key"]) for entry in iter_diff(*dumps, partitions=partitions)}
+    assert ops == {("unchanged", 1), ("update", 2), ("delete", 3), ("unchanged", 4), ("insert", 5)}
+
+
+def test_update_lists_changed_columns(dumps):
+    (update,) = [entry for entry in iter_diff(*dumps, partitions=2) if entry["op"] == "update"]
+    assert update["changed"] == ["city"]
+    assert update["row"]["city"] == "La Trinidad"
+
+
+def test_write_diff_output(dumps):
+    out = io.StringIO()
+    counts = write_diff(*dumps, out, partitions=2)
+    expected = {"unchanged": 2, "update": 1, "delete": 1, "insert": 1}
+    assert counts == {"tbl_branchinfo": expected}
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert lines[0]["type"] == "dumpdiff"
+    assert lines[-1] == {"type": "end", "counts": {"tbl_branchinfo": expected}}
+    assert sorted(entry["op"] for entry in lines[1:-1]) == ["delete", "insert", "update"]
+
+
+def test_identical_dumps_have_no_changes(dumps):
+    old, _ = dumps
+    assert {entry["op"] for entry in iter_diff(old, old, partitions=4)} == {"unchanged"}
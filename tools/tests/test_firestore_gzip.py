@@ -0,0 +1,98 @@
+import email.message
+import gzip
+import io
+import urllib.error
+
+import pytest
+
+from marga_tools import firestore
+from marga_tools.firestore import document_url, error_message, fs_fields, request_json
+from marga_tools.metrics import METRICS
+from marga_tools.standin import DocumentStore, start_server
+
+API_KEY = "local"
+# Comfortably past GZIP_MIN_BYTES once encoded.
+BIG = {"fields": fs_fields({"note": "repetitive " * 2000, "n": 1})}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(firestore, "_backoff", lambda attempt: None)
+    monkeypatch.setattr(firestore, "GZIP_REQUEST_BODIES", True)
+    store = DocumentStore()
+    store.put("c", "1", BIG["fields"])
+    server = start_server(store)
+    METRICS.reset()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_gzip_both_ways(server):
+    url = document_url(server.base_url, API_KEY, "c", "2")
+    assert request_json(url, "PATCH", BIG)["fields"] == BIG["fields"]
+    assert server.stats["gzip request bodies"] == 1
+    assert request_json(document_url(server.base_url, API_KEY, "c", "1"))["fields"] == BIG["fields"]
+    totals = METRICS.totals()
+    # Both bodies went compressed on the wire.
+    assert totals.bytes_out < totals.body_bytes_out / 10
+    assert totals.bytes_in < totals.body_bytes_in / 10
+    assert firestore.GZIP_REQUEST_BODIES
+
+
+def test_plain_responses_when_gzip_is_not_accepted(server, monkeypatch):
+    monkeypatch.setattr(firestore, "ACCEPT_GZIP", False)
+    assert request_json(document_url(server.base_url, API_KEY, "c", "1"))["fields"] == BIG["fields"]
+    totals = METRICS.totals()
+    assert totals.bytes_in == totals.body_bytes_in
+
+
+def test_refused_gzip_body_is_resent_plain_and_gzip_stays_off(server):
+    server.gzip_requests = False
+    url = document_url(server.base_url, API_KEY, "c", "2")
+    assert request_json(url, "PATCH", BIG)["fields"] == BIG["fields"]
+    assert server.stats["status 415"] == 1
+    assert "gzip request bodies" not in server.stats
+    assert not firestore.GZIP_REQUEST_BODIES
+    # Later requests go plain straight away.
+    request_json(document_url(server.base_url, API_KEY, "c", "3"), "PATCH", BIG)
+    assert server.stats["status 415"] == 1
+    assert server.store.ids("c") == ["1", "2", "3"]
+
+
+def test_small_bodies_are_not_gzipped(server):
+    request_json(document_url(server.base_url, API_KEY, "c", "2"), "PATCH", {"fields": fs_fields({"n": 1})})
+    assert "gzip request bodies" not in server.stats
+
+
+@pytest.mark.parametrize("accept_gzip", [True, False])
+def test_error_message_reads_gzipped_and_plain_error_bodies(server, monkeypatch, accept_gzip):
+    monkeypatch.setattr(firestore, "ACCEPT_GZIP", accept_gzip)
+    url = document_url(server.base_url, API_KEY, "c", "1") + "&currentDocument.exists=false"
+    with pytest.raises(urllib.error.HTTPError) as caught:
+        request_json(url, "PATCH", {"fields": fs_fields({"n": 2})})
+    assert (caught.value.headers.get("Content-Encoding") == "gzip") is accept_gzip
+    assert error_message(caught.value) == server_message(server, "c", "1")
+
+
+def server_message(server, collection, doc_id):
+    """What the stand-in says when an exists=false precondition fails."""
+    try:
+        server.store.check(collection, doc_id, {"exists": False})
+    except Exception as err:
+        return str(err)
+    raise AssertionError("precondition unexpectedly held")
+
+
+def http_error(body, gzipped=False):
+    headers = email.message.Message()
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return urllib.error.HTTPError("http://x/c/1", 502, "Bad Gateway", headers, io.BytesIO(body))
+
+
+def test_error_message_falls_back_to_the_body_text_and_then_the_error():
+    assert error_message(http_error(gzip.compress(b"upstream down"), gzipped=True)) == "upstream down"
+    assert error_message(http_error(b'{"error": {"code": 502}}')) == "HTTP Error 502: Bad Gateway"
+    assert error_message(http_error(b"")) == "HTTP Error 502: Bad Gateway"
+    assert error_message(http_error(gzip.compress(b"upstream down")[:5], gzipped=True)) == "HTTP Error 502: Bad Gateway"
@@ -0,0 +1,167 @@
+import gzip
+import io
+import json
+
+import pytest
+
+from marga_tools import firestore
+from marga_tools.firestore import GunzipReader, PageStream, fs_fields, iter_collection, stream_documents
+
+API_KEY = "local"
+
+DOCS = [
+    {"name": "projects/p/databases/(default)/documents/c/1", "fields": {"n": {"integerValue": "1"}, "s": {"stringValue": "Niño ☃"}}},
+    {"name": "projects/p/databases/(default)/documents/c/2", "fields": {"n": {"doubleValue": 2.5e-3}, "xs": {"arrayValue": {"values": [{"nullValue": None}]}}}},
+    {"name": "projects/p/databases/(default)/documents/c/3", "fields": {}},
+]
+PAGE = json.dumps({"documents": DOCS, "nextPageToken": "tok", "readTime": "2024-05-01T00:00:00Z"}, ensure_ascii=False, indent=1).encode("utf-8")
+
+
+def reader(data, sizes=None):
+    """`read(n)` over `data`, returning at most `sizes[i]` bytes on the i-th call."""
+    stream = io.BytesIO(data)
+    calls = iter(sizes or ())
+
+    def read(size):
+        return stream.read(min(size, next(calls, size)))
+
+    return read
+
+
+def parse(read, **kwargs):
+    stream = PageStream(read, **kwargs)
+    return list(stream), stream
+
+
+def test_page_stream_yields_documents_and_collects_meta():
+    docs, stream = parse(reader(PAGE))
+    assert docs == DOCS
+    assert stream.meta == {"nextPageToken": "tok", "readTime": "2024-05-01T00:00:00Z"}
+    assert stream.bytes_read == len(PAGE)
+
+
+def test_page_stream_survives_a_split_at_every_byte_boundary():
+    for cut in range(1, len(PAGE)):
+        docs, stream = parse(reader(PAGE, [cut]), chunk_size=len(PAGE))
+        assert docs == DOCS, cut
+        assert stream.meta["nextPageToken"] == "tok", cut
+
+
+def test_page_stream_with_one_byte_reads():
+    docs, stream = parse(reader(PAGE), chunk_size=1)
+    assert docs == DOCS
+    assert stream.meta["nextPageToken"] == "tok"
+
+
+def test_page_stream_number_at_chunk_edge_is_not_cut_short():
+    page = b'{"documents": [12345, 67890]}'
+    for chunk_size in range(1, len(page)):
+        assert parse(reader(page), chunk_size=chunk_size)[0] == [12345, 67890]
+
+
+@pytest.mark.parametrize("page, meta", [(b"{}", {}), (b' { "documents" : [ ] } ', {}), (b'{"nextPageToken": ""}', {"nextPageToken": ""})])
+def test_page_stream_empty_pages(page, meta):
+    docs, stream = parse(reader(page), chunk_size=2)
+    assert docs == []
+    assert stream.meta == meta
+
+
+def test_page_stream_other_key():
+    page = b'{"results": [{"document": {"name": "a"}}, {"readTime": "x"}]}'
+    assert parse(reader(page), key="results")[0] == [{"document": {"name": "a"}}, {"readTime": "x"}]
+
+
+@pytest.mark.parametrize("cut", [1, 20, len(PAGE) // 2, len(PAGE) - 1])
+def test_truncated_page_raises_json_decode_error(cut):
+    with pytest.raises(json.JSONDecodeError):
+        parse(reader(PAGE[:cut]), chunk_size=7)
+
+
+@pytest.mark.parametrize("page", [b'[1, 2]', b'{"documents": [1 2]}', b'{"documents": [1], 2}'])
+def test_malformed_page_raises_json_decode_error(page):
+    with pytest.raises(json.JSONDecodeError):
+        parse(reader(page))
+
+
+def test_gunzip_reader_over_split_reads():
+    wire = gzip.compress(PAGE)
+    for cut in (1, 10, len(wire) // 2, len(wire) - 1):
+        gunzip = GunzipReader(reader(wire, [cut]))
+        docs, stream = parse(gunzip.read, chunk_size=64)
+        assert docs == DOCS
+        assert stream.meta["nextPageToken"] == "tok"
+        # The page ends at its closing brace; the gzip trailer may be left unread.
+        assert len(wire) - 8 <= gunzip.wire_bytes <= len(wire)
+        assert stream.bytes_read == len(PAGE)
+
+
+def test_gunzip_reader_one_byte_at_a_time():
+    wire = gzip.compress(PAGE)
+    gunzip = GunzipReader(reader(wire))
+    assert parse(gunzip.read, chunk_size=1)[0] == DOCS
+
+
+class FakeResponse:
+    def __init__(self, body, gzipped=False, fail_after=None):
+        self.headers = {"Content-Encoding": "gzip"} if gzipped else {}
+        self._body = io.BytesIO(gzip.compress(body) if gzipped else body)
+        self._fail_after = fail_after
+
+    def read(self, size=-1):
+        if self._fail_after is not None and self._body.tell() >= self._fail_after:
+            raise ConnectionResetError("peer went away")
+        if self._fail_after is not None:
+            size = min(size, self._fail_after - self._body.tell())
+        return self._body.read(size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def fake_urlopen(monkeypatch):
+    """Serve queued FakeResponses to firestore's urlopen; returns the queue."""
+    responses = []
+    monkeypatch.setattr(firestore, "_backoff", lambda attempt: None)
+    monkeypatch.setattr(firestore.urllib.request, "urlopen", lambda request, timeout, context: responses.pop(0))
+    return responses
+
+
+@pytest.mark.parametrize("gzipped", [False, True])
+def test_reconnect_mid_page_neither_duplicates_nor_drops(fake_urlopen, gzipped):
+    # Cut inside the second document, after the first has been yielded.
+    cut = len(gzip.compress(PAGE)) // 2 if gzipped else PAGE.index(b"/c/2")
+    fake_urlopen.extend([FakeResponse(PAGE, gzipped, fail_after=cut), FakeResponse(PAGE, gzipped)])
+    meta = {}
+    assert list(stream_documents("http://fake/c", meta)) == DOCS
+    assert meta["nextPageToken"] == "tok"
+    assert fake_urlopen == []
+
+
+def test_reconnect_after_every_document(fake_urlopen):
+    cuts = [PAGE.index(b"/c/2"), PAGE.index(b"/c/3"), len(PAGE) - 5]
+    fake_urlopen.extend([FakeResponse(PAGE, fail_after=cut) for cut in cuts] + [FakeResponse(PAGE)])
+    meta = {}
+    assert list(stream_documents("http://fake/c", meta)) == DOCS
+    assert meta == {"nextPageToken": "tok", "readTime": "2024-05-01T00:00:00Z"}
+
+
+def test_truncated_response_is_not_retried(fake_urlopen):
+    fake_urlopen.extend([FakeResponse(PAGE[:-10]), FakeResponse(PAGE)])
+    with pytest.raises(json.JSONDecodeError):
+        list(stream_documents("http://fake/c", {}))
+
+
+def test_iter_collection_pages_through_the_standin(standin, monkeypatch):
+    store, base_url = standin
+    for index in range(25):
+        store.put("c", f"{index:03d}", fs_fields({"n": index, "label": "x" * index}))
+    for accept_gzip in (True, False):
+        monkeypatch.setattr(firestore, "ACCEPT_GZIP", accept_gzip)
+        update_times = {}
+        docs = list(iter_collection(base_url, API_KEY, "c", page_size=7, update_times=update_times))
+        assert [doc["n"] for doc in docs] == list(range(25))
+        assert [doc["_docId"] for doc in docs] == sorted(update_times)
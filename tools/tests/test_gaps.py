@@ -0,0 +1,77 @@
+import random
+from array import array
+
+import pytest
+
+from marga_tools import gaps
+from marga_tools.gaps import IdSet, compare, compare_numbers, in_ranges, range_count, to_ranges
+
+
+def expected(left, right):
+    return to_ranges(sorted(set(left) - set(right))), to_ranges(sorted(set(right) - set(left)))
+
+
+@pytest.fixture(params=["bitmap", "merge"])
+def path(request, monkeypatch):
+    """Run compare_numbers down one path, and check it took that path."""
+    taken = []
+    if request.param == "merge":
+        monkeypatch.setattr(gaps, "BITMAP_MIN_BITS", 0)
+        monkeypatch.setattr(gaps, "BITMAP_BITS_PER_ID", 0)
+    for name in ("_bitmap", "_merge_ranges"):
+        original = getattr(gaps, name)
+        monkeypatch.setattr(gaps, name, lambda *args, _name=name, _original=original: taken.append(_name) or _original(*args))
+    yield request.param
+    wanted, other = ("_bitmap", "_merge_ranges") if request.param == "bitmap" else ("_merge_ranges", "_bitmap")
+    assert wanted in taken and other not in taken
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_compare_numbers_matches_sets(path, seed):
+    rng = random.Random(seed)
+    left = array("q", (rng.randrange(-50, 2000) for _ in range(600)))
+    right = array("q", (rng.randrange(0, 2100) for _ in range(600)))
+    assert compare_numbers(left, right) == expected(left, right)
+
+
+def test_compare_numbers_ranges(path):
+    left = array("q", [*range(1, 11), 20, 21, 30])
+    right = array("q", [*range(3, 9), 21, 22, 22, 40])
+    assert compare_numbers(left, right) == ([[1, 2], [9, 10], [20, 20], [30, 30]], [[22, 22], [40, 40]])
+
+
+def test_compare_numbers_one_side_empty(path):
+    assert compare_numbers(array("q", [5, 6, 7]), array("q")) == ([[5, 7]], [])
+
+
+def test_compare_numbers_both_empty():
+    assert compare_numbers(array("q"), array("q")) == ([], [])
+
+
+def test_sparse_ids_fall_back_to_merge(monkeypatch):
+    merged = []
+    original = gaps._merge_ranges
+    monkeypatch.setattr(gaps, "_merge_ranges", lambda *args: merged.append(True) or original(*args))
+    left = array("q", [1, 2, 10**12])
+    right = array("q", [2, 10**12 + 1])
+    assert compare_numbers(left, right) == ([[1, 1], [10**12, 10**12]], [[10**12 + 1, 10**12 + 1]])
+    assert merged
+
+
+def test_idset_splits_canonical_numbers():
+    ids = IdSet([12, "13", "014", "abc", True])
+    assert sorted(ids.numbers) == [12, 13]
+    assert ids.other == {"014", "abc", "True"}
+
+
+def test_compare_report():
+    report = compare("tbl_branchinfo", "tbl_branchinfo", IdSet([1, 2, 3, "x"]), IdSet(["2", "y"]))
+    assert (report.missing, report.extra) == ([[1, 1], [3, 3]], [])
+    assert (report.missing_other, report.extra_other) == (["x"], ["y"])
+
+
+def test_range_helpers():
+    ranges = [[1, 3], [7, 7]]
+    assert range_count(ranges) == 4
+    contains = in_ranges(ranges)
+    assert [value for value in range(10) if contains(value)] == [1, 2, 3, 7]
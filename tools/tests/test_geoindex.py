@@ -0,0 +1,112 @@
+import random
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from marga_tools.geoindex import GridIndex, KM_PER_DEGREE, branch_points, haversine_km, haversine_many, valid_coordinates
+from marga_tools.synthetic import synthetic_branches, write_mysql_dump
+
+TOOLS = Path(__file__).resolve().parents[1]
+
+
+def scattered(count, seed=0, lat=(14.35, 14.80), lon=(120.90, 121.15)):
+    rng = random.Random(seed)
+    return [(point_id, rng.uniform(*lat), rng.uniform(*lon)) for point_id in range(1, count + 1)]
+
+
+def brute_nearest(index, lat, lon, k, exclude=None):
+    return sorted(hit for hit in index.brute_force(lat, lon) if hit[1] != exclude)[:k]
+
+
+def test_haversine():
+    assert haversine_km(14.5, 121.0, 14.5, 121.0) == 0
+    assert haversine_km(0, 0, 1, 0) == pytest.approx(KM_PER_DEGREE)
+    # One degree of longitude shrinks with latitude.
+    assert haversine_km(60, 10, 60, 11) == pytest.approx(KM_PER_DEGREE / 2, rel=1e-3)
+    assert list(haversine_many(0, 0, [1, 0], [0, 1])) == pytest.approx([KM_PER_DEGREE, KM_PER_DEGREE])
+
+
+def test_invalid_coordinates_are_skipped():
+    assert not valid_coordinates(0, 0)
+    assert not valid_coordinates(None, 121.0)
+    assert not valid_coordinates("14.5", 121.0)
+    assert not valid_coordinates(91, 0)
+    index = GridIndex.build([(1, 14.5, 121.0), (2, 0, 0), (3, None, None), (4, 14.6, 181)])
+    assert list(index.ids) == [1]
+    assert list(branch_points([{"id": 5, "latitude": 1.0, "longitude": 2.0}, {"id": "x", "latitude": 1.0, "longitude": 2.0}])) == [(5, 1.0, 2.0)]
+
+
+@pytest.mark.parametrize("cell_deg", [None, 0.001, 0.05, 2.0])
+def test_queries_match_a_brute_force_scan(cell_deg):
+    points = scattered(2000)
+    # A dense cluster, so cells are uneven.
+    points += [(3000 + n, 14.55 + n * 1e-5, 121.02 + n * 1e-5) for n in range(50)]
+    index = GridIndex.build(points, cell_deg)
+    rng = random.Random(1)
+    probes = [(lat, lon) for _, lat, lon in points[::157]] + [(rng.uniform(14.0, 15.2), rng.uniform(120.5, 121.6)) for _ in range(20)]
+    for lat, lon in probes:
+        every = sorted(index.brute_force(lat, lon))
+        for k in (1, 7, 60):
+            assert index.nearest(lat, lon, k) == every[:k]
+        for km in (0.2, 3.0, 40.0):
+            assert index.within(lat, lon, km) == [hit for hit in every if hit[0] <= km]
+
+
+def test_queries_across_the_equator_and_prime_meridian():
+    index = GridIndex.build(scattered(500, lat=(-1.0, 1.0), lon=(-1.0, 1.0)))
+    for lat, lon in ((0.001, -0.001), (-0.7, 0.9), (5.0, -5.0)):
+        assert index.nearest(lat, lon, 5) == brute_nearest(index, lat, lon, 5)
+        assert index.within(lat, lon, 30) == sorted(hit for hit in index.brute_force(lat, lon) if hit[0] <= 30)
+
+
+def test_nearest_edge_cases():
+    index = GridIndex.build(scattered(30))
+    lat, lon = index.lats[0], index.lons[0]
+    own = index.ids[0]
+    assert index.nearest(lat, lon, 1) == [(0.0, own)]
+    assert own not in [point_id for _, point_id in index.nearest(lat, lon, 3, exclude=own)]
+    assert index.nearest(lat, lon, 3, exclude=own) == brute_nearest(index, lat, lon, 3, exclude=own)
+    assert len(index.nearest(lat, lon, 100)) == 30
+    assert index.nearest(lat, lon, 0) == []
+    assert index.within(40.0, 10.0, 5) == []
+    empty = GridIndex.build([])
+    assert (len(empty), empty.nearest(14.5, 121.0, 3), empty.within(14.5, 121.0, 5)) == (0, [], [])
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = GridIndex.build(scattered(300))
+    path = tmp_path / "branches.grid"
+    index.save(path)
+    loaded = GridIndex.load(path)
+    assert loaded.cell_deg == index.cell_deg
+    for name in ("ids", "lats", "lons", "keys", "starts"):
+        assert getattr(loaded, name) == getattr(index, name)
+    assert loaded.nearest(14.6, 121.0, 5) == index.nearest(14.6, 121.0, 5)
+    assert path.stat().st_size < 24 * 300 + 16 * len(index.keys) + 100
+    (tmp_path / "bad.grid").write_bytes(b"not a grid\n")
+    with pytest.raises(ValueError, match="not a grid index"):
+        GridIndex.load(tmp_path / "bad.grid")
+
+
+def test_command_line_builds_and_queries(tmp_path):
+    dump = tmp_path / "dump.sql"
+    write_mysql_dump(dump, employees=1, branches=400)
+    grid = tmp_path / "branches.grid"
+
+    def run(*args):
+        return subprocess.run([sys.executable, "-m", "marga_tools.geoindex", *map(str, args)], cwd=TOOLS, capture_output=True, text=True)
+
+    result = run("--dump", dump, "-o", grid)
+    assert result.returncode == 0, result.stderr
+    assert "Indexed 400 branches" in result.stderr
+
+    branches = synthetic_branches(400)
+    index = GridIndex.build(branch_points(branches))
+    result = run("--index", grid, "--near", 7, "-k", 3)
+    assert [int(line.split("\t")[0]) for line in result.stdout.splitlines()] == [point_id for _, point_id in index.nearest(branches[6]["latitude"], branches[6]["longitude"], 3, exclude=7)]
+    result = run("--index", grid, "--lat", 14.55, "--lon", 121.02, "--km", 1.5)
+    assert len(result.stdout.splitlines()) == len(index.within(14.55, 121.02, 1.5))
+    assert run("--index", grid, "--lat", 14.55).returncode == 2
+    assert run().returncode == 2
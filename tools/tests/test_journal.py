@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from marga_tools.journal import JournalMismatch, RunJournal, content_hash, rotate
+
+META = {"stamp": "2024-05-01T00:00:00Z", "dump": "dump.sql", "xlsx": "final.xlsx"}
+
+
+def lines(path):
+    entries = []
+    for line in path.read_text().splitlines():
+        try:
+            entries.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return entries
+
+
+def test_content_hash_is_stable_order_independent_and_honours_exclude():
+    fields = {"id": 7, "name": "Ana", "updated_at": "t1"}
+    assert content_hash(fields) == content_hash({"updated_at": "t1", "name": "Ana", "id": 7})
+    assert len(content_hash(fields)) == 32
+    assert content_hash(fields) != content_hash({**fields, "name": "Ana Cruz"})
+    assert content_hash(fields, exclude=("updated_at",)) == content_hash({**fields, "updated_at": "t2"}, exclude=("updated_at",))
+    assert content_hash(fields) != content_hash({**fields, "updated_at": "t2"})
+
+
+def test_resume_after_a_partial_run(tmp_path):
+    path = tmp_path / "run.journal.ndjson"
+    with RunJournal(path, meta=META, inputs=("dump", "xlsx")) as journal:
+        assert not journal.resumed
+        journal.record("tbl_employee", 1, "h1")
+        journal.record("tbl_employee", 2, "h2")
+        journal.set_meta(backup="/backups/run-1")
+    # A crash mid-write leaves a torn last line.
+    with path.open("a") as fh:
+        fh.write('{"phase": "tbl_employee", "id": "3", "ha')
+
+    journal = RunJournal(path, meta={**META, "stamp": "later"}, resume=True, inputs=("dump", "xlsx"))
+    assert journal.resumed
+    # The original run's meta wins, so recomputed docs hash the same.
+    assert journal.meta["stamp"] == META["stamp"]
+    assert journal.meta["backup"] == "/backups/run-1"
+    assert journal.is_applied("tbl_employee", 1) and journal.is_applied("tbl_employee", "2", "h2")
+    assert not journal.is_applied("tbl_employee", 2, "changed")
+    assert not journal.is_applied("tbl_employee", 3)
+    assert not journal.is_applied("marga_users", 1)
+    journal.record("tbl_employee", 3, "h3")
+    journal.close()
+
+    resumed = RunJournal(path, meta=META, resume=True, inputs=("dump",))
+    assert resumed.count("tbl_employee") == 3
+    assert resumed.is_applied("tbl_employee", 3, "h3")
+    resumed.close()
+    # The torn line was terminated, so the next record is on a line of its own.
+    assert [entry.get("id") for entry in lines(path) if "phase" in entry][-1] == "3"
+
+
+def test_resume_with_changed_inputs_is_refused(tmp_path):
+    path = tmp_path / "run.journal.ndjson"
+    with RunJournal(path, meta=META, inputs=("dump", "xlsx")) as journal:
+        journal.record("tbl_employee", 1, "h1")
+    before = path.read_bytes()
+    with pytest.raises(JournalMismatch, match="xlsx"):
+        RunJournal(path, meta={**META, "xlsx": "other.xlsx"}, resume=True, inputs=("dump", "xlsx"))
+    assert path.read_bytes() == before
+
+
+def test_resume_without_a_journal_starts_fresh(tmp_path):
+    path = tmp_path / "nested" / "run.journal.ndjson"
+    with RunJournal(path, meta=META, resume=True, inputs=("dump",)) as journal:
+        assert not journal.resumed
+        assert journal.rotated is None
+    assert lines(path) == [{"type": "run", **META}]
+
+
+def test_a_fresh_run_rotates_the_old_journal(tmp_path):
+    path = tmp_path / "run.journal.ndjson"
+    for run in range(3):
+        with RunJournal(path, meta={**META, "stamp": f"run-{run}"}) as journal:
+            journal.record("tbl_employee", run, "h")
+    assert lines(path)[0]["stamp"] == "run-2"
+    assert lines(tmp_path / "run.journal.ndjson.1")[0]["stamp"] == "run-0"
+    assert lines(tmp_path / "run.journal.ndjson.2")[0]["stamp"] == "run-1"
+    assert journal.rotated == tmp_path / "run.journal.ndjson.2"
+
+
+def test_rotate_leaves_missing_and_empty_files(tmp_path):
+    path = tmp_path / "run.journal.ndjson"
+    assert rotate(path) is None
+    path.write_text("")
+    assert rotate(path) is None
+    assert path.exists()
@@ -0,0 +1,183 @@
+import json
+import subprocess
+import sys
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+from marga_tools.metrics import LATENCY_BUCKETS_MS, Metrics, MemoryProfiler, RequestStats, collection_from_url, compression_summary
+
+URL = "http://localhost/v1/projects/p/databases/(default)/documents/tbl_employee/1?key=local"
+
+
+def stats_with(*elapsed_ms):
+    stats = RequestStats()
+    for ms in elapsed_ms:
+        stats.add(ms, 0, 0, True, 0, 0, 0)
+    return stats
+
+
+def test_latencies_land_in_the_first_bucket_at_or_above_them():
+    stats = stats_with(0.5, 5, 5.1, 10, 30000, 30001)
+    histogram = stats.to_dict()["histogram_ms"]
+    assert histogram["<=5"] == 2
+    assert histogram["<=10"] == 2
+    assert histogram["<=30000"] == 1
+    assert histogram[f">{LATENCY_BUCKETS_MS[-1]}"] == 1
+    assert sum(histogram.values()) == stats.count == 6
+
+
+def test_percentiles_are_bucket_upper_bounds():
+    stats = stats_with(*[3] * 50, *[40] * 45, *[700] * 5)
+    assert stats.quantile(0.5) == 5.0
+    assert stats.quantile(0.51) == 50.0
+    assert stats.quantile(0.95) == 50.0
+    assert stats.quantile(0.96) == 1000.0
+    assert stats.to_dict()["p95_ms"] == 50.0
+
+
+def test_percentiles_past_the_last_bound_report_the_maximum():
+    stats = stats_with(1, 45000, 60000)
+    assert stats.quantile(0.95) == 60000.0
+    assert RequestStats().quantile(0.5) is None
+    assert RequestStats().to_dict()["mean_ms"] is None
+
+
+def test_requests_are_grouped_by_method_and_collection():
+    metrics = Metrics()
+    metrics.record_request("get", URL, 0.002, 100, 0, True)
+    metrics.record_request("GET", URL.replace("/1?", "/2?"), 0.004, 300, 0, False, retries=2)
+    metrics.record_request("POST", "http://localhost/v1/projects/p/databases/(default)/documents:batchWrite", 0.001, 10, 50, True)
+    requests = metrics.summary()["requests"]
+    assert set(requests) == {"GET tbl_employee", "POST :batchWrite"}
+    assert (requests["GET tbl_employee"]["count"], requests["GET tbl_employee"]["errors"], requests["GET tbl_employee"]["retries"]) == (2, 1, 2)
+    assert metrics.totals().bytes_in == 410
+    assert collection_from_url("http://localhost/v1/projects/p/databases/(default)/documents/marga%20users:runQuery") == "marga users"
+
+
+def test_nested_phases_record_their_paths_innermost_first():
+    metrics = Metrics()
+    with metrics.phase("restore"):
+        with metrics.phase("read"):
+            pass
+        with metrics.phase("write"):
+            with metrics.phase("batch"):
+                pass
+    assert [phase["phase"] for phase in metrics.phases] == ["restore/read", "restore/write/batch", "restore/write", "restore"]
+    outer = metrics.phases[-1]
+    assert all(phase["start_s"] >= outer["start_s"] and phase["seconds"] <= outer["seconds"] for phase in metrics.phases)
+
+
+def test_sequential_phases_close_each_other_and_the_summary_closes_the_last():
+    metrics = Metrics()
+    metrics.start_phase("fetch")
+    with metrics.phase("parse"):
+        pass
+    metrics.start_phase("write")
+    metrics.start_phase("write")
+    summary = metrics.summary()
+    # A block phase inside an open sequential one is not nested under it.
+    assert [phase["phase"] for phase in summary["phases"]] == ["parse", "fetch", "write", "write"]
+
+
+@pytest.fixture
+def profiler():
+    was_tracing = tracemalloc.is_tracing()
+    profiler = MemoryProfiler(top=5)
+    yield profiler
+    if not was_tracing:
+        tracemalloc.stop()
+
+
+def test_memory_profiler_folds_a_nested_peak_into_the_enclosing_phase(profiler):
+    profiler.phase_started("outer")
+    kept = bytearray(2_000_000)
+    profiler.phase_started("outer/inner")
+    spike = bytearray(5_000_000)
+    del spike
+    profiler.phase_ended("outer/inner")
+    profiler.phase_ended("outer")
+    inner, outer = profiler.phases
+    assert (inner["phase"], outer["phase"]) == ("outer/inner", "outer")
+    # Traced memory is absolute, so the inner peak counts what the outer phase still holds.
+    assert inner["traced_peak_bytes"] >= 7_000_000
+    # The inner phase reset the traced peak, but the outer phase still saw it.
+    assert outer["traced_peak_bytes"] >= inner["traced_peak_bytes"]
+    assert outer["traced_current_bytes"] >= 2_000_000
+    assert outer["top_growth"][0]["size_diff_bytes"] >= 2_000_000
+    assert "test_metrics.py" in outer["top_growth"][0]["site"]
+    assert len(outer["top_sites"]) <= 5 and outer["object_counts"]
+    assert profiler.report_lines()[0].startswith(f"outer/inner: peak traced {inner['traced_peak_bytes'] / 1e6:.1f} MB")
+    del kept
+
+
+def test_memory_section_follows_the_phases(profiler):
+    metrics = Metrics()
+    metrics.memory = profiler
+    with metrics.phase("load"):
+        data = [bytes(1000) for _ in range(1000)]
+    del data
+    memory = metrics.summary()["memory"]
+    assert [entry["phase"] for entry in memory["phases"]] == ["load"]
+    assert memory["phases"][0]["traced_peak_bytes"] >= 1_000_000
+
+
+def totals(body_in, wire_in, body_out=0, wire_out=0, total_ms=1000.0):
+    stats = RequestStats()
+    stats.body_bytes_in, stats.bytes_in, stats.body_bytes_out, stats.bytes_out, stats.total_ms = body_in, wire_in, body_out, wire_out, total_ms
+    return stats
+
+
+def test_compression_summary():
+    assert compression_summary(totals(100, 100), {}) is None
+    # 1000 bytes on the wire in 1 s; 9000 saved is 9 s, less 0.5 s of gzip CPU.
+    summary = compression_summary(totals(8000, 800, 2000, 200), {"gzip_compress_s": 0.2, "gzip_decompress_s": 0.3})
+    assert summary == {"ratio_in": 10.0, "ratio_out": 10.0, "bytes_saved": 9000, "gzip_cpu_s": 0.5, "est_time_saved_s": 8.5}
+    assert compression_summary(totals(100, 10, total_ms=0), {})["est_time_saved_s"] is None
+    assert compression_summary(totals(0, 0, 100, 10), {})["ratio_in"] is None
+
+
+def test_summary_includes_compression_only_when_something_was_compressed():
+    metrics = Metrics()
+    metrics.record_request("GET", URL, 0.01, 100, 0, True)
+    assert "compression" not in metrics.summary()
+    metrics.record_request("GET", URL, 0.01, 100, 0, True, body_in=1000)
+    assert metrics.summary()["compression"]["ratio_in"] == 5.5
+
+
+def test_finish_run_writes_each_requested_summary_once(tmp_path):
+    metrics = Metrics()
+    metrics.write_at_exit(tmp_path / "a" / "metrics.json")
+    metrics.write_at_exit(tmp_path / "b.json")
+    metrics.write_at_exit(None)
+    metrics.count("docs", 3)
+    with metrics.phase("fetch"):
+        pass
+    metrics.extra["promoted"] = 2
+    metrics.finish_run()
+    metrics.count("docs", 100)
+    metrics.finish_run()
+    first = json.loads((tmp_path / "a" / "metrics.json").read_text())
+    assert first == json.loads((tmp_path / "b.json").read_text())
+    assert first["counters"] == {"docs": 3}
+    assert [phase["phase"] for phase in first["phases"]] == ["fetch"]
+    assert first["promoted"] == 2
+    assert set(first) >= {"script", "argv", "wall_s", "requests", "request_totals"}
+
+
+def test_write_at_exit_writes_the_summary_when_the_run_fails(tmp_path):
+    path = tmp_path / "metrics.json"
+    script = (
+        "import sys\n"
+        "from marga_tools.metrics import METRICS\n"
+        f"METRICS.write_at_exit({str(path)!r})\n"
+        "METRICS.start_phase('fetch')\n"
+        "METRICS.count('docs', 4)\n"
+        "raise SystemExit('fetch failed')\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=Path(__file__).resolve().parent.parent, capture_output=True, text=True)
+    assert result.returncode == 1
+    summary = json.loads(path.read_text())
+    assert summary["counters"] == {"docs": 4}
+    assert [phase["phase"] for phase in summary["phases"]] == ["fetch"]
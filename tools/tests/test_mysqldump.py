@@ -0,0 +1,48 @@
+import pytest
+
+from marga_tools.mysqldump import iter_rows, iter_typed_rows, parse_insert_values, parse_mysql_string
+
+
+@pytest.mark.parametrize(
+    ("literal", "text"),
+    [
+        (r"'plain'", "plain"),
+        (r"'O\'Neil'", "O'Neil"),
+        (r"'He said \"ok\"'", 'He said "ok"'),
+        (r"'one\ntwo\r\n'", "one\ntwo\r\n"),
+        (r"'tab\there'", "tab\there"),
+        (r"'nul\0'", "nul\0"),
+        # An escaped backslash followed by n is not a newline.
+        (r"'C:\\new\\table'", "C:\\new\\table"),
+        (r"'\\\''", "\\'"),
+        (r"'100\% \_x'", "100\\% \\_x"),
+    ],
+)
+def test_parse_mysql_string_undoes_each_escape_once(literal, text):
+    assert parse_mysql_string(literal) == text
+
+
+def test_insert_values_split_on_delimiters_outside_quotes():
+    values = r"(1,'a, (b)','it\'s',NULL,2.50),(2,'',  'x\\',-3,1e3)"
+    assert parse_insert_values(values) == [[1, "a, (b)", "it's", None, 2.5], [2, "", "x\\", -3, "1e3"]]
+
+
+def test_rows_are_read_by_declared_column_type(tmp_path):
+    path = tmp_path / "dump.sql"
+    path.write_text(
+        "CREATE TABLE `t` (\n"
+        "  `id` int NOT NULL,\n"
+        "  `code` varchar(8) DEFAULT NULL,\n"
+        "  `rate` decimal(10,2) DEFAULT NULL,\n"
+        "  PRIMARY KEY (`id`)\n"
+        ") ENGINE=InnoDB;\n"
+        "INSERT INTO `t` VALUES (1,'007',12.50),(2,'say \\\"hi\\\"',NULL),(3,'x');\n",
+        encoding="utf-8",
+    )
+    assert [row for _, row in iter_typed_rows(path)] == [
+        {"id": 1, "code": "007", "rate": 12.5},
+        {"id": 2, "code": 'say "hi"', "rate": None},
+        {"id": 3, "code": "x", "rate": None},
+    ]
+    # Untyped rows guess from each token: quoted stays text, 12.50 is a float.
+    assert [(row["code"], row["rate"]) for _, row in iter_rows(path)] == [("007", 12.5), ('say "hi"', None), ("x", None)]
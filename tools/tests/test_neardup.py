@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+from marga_tools.neardup import _Clusters, find_duplicates, normalize, shingles, signature, similarity
+
+
+def branch(id, name, street, city="Quezon City", company_id=1):
+    return {"id": id, "company_id": company_id, "branchname": name, "street": street, "bldg": "", "brgy": "", "city": city}
+
+
+def test_normalize_folds_accents_punctuation_and_abbreviations():
+    assert normalize("Sto. Niño Bldg., 5th St.") == normalize("sto nino building 5th street")
+    assert normalize(None) == ""
+
+
+def test_identical_sets_have_identical_signatures():
+    hashes = shingles("mercury drug cubao")
+    assert signature(hashes, 256) == signature(set(hashes), 256)
+    assert signature(set(), 256) is None
+
+
+def test_signature_similarity_tracks_jaccard():
+    rng = random.Random(1)
+    base = [rng.getrandbits(64) for _ in range(400)]
+    left, right = set(base[:300]), set(base[100:])
+    jaccard = len(left & right) / len(left | right)
+    assert similarity(signature(left, 1024), signature(right, 1024)) == pytest.approx(jaccard, abs=0.06)
+
+
+def test_signature_needs_a_power_of_two():
+    with pytest.raises(ValueError):
+        find_duplicates([branch(1, "a", "b")], bands=3, rows=3)
+
+
+def test_near_duplicates_are_clustered():
+    records = [
+        branch(1, "Mercury Drug Cubao", "123 Aurora Blvd."),
+        branch(2, "Mercury Drug - Cubao", "123 Aurora Boulevard", company_id=2),
+        branch(3, "MERCURY DRUG CUBAO", "123 aurora blvd"),
+        branch(4, "Jollibee Makati Ave", "8 Makati Avenue", city="Makati"),
+        branch(5, "SM Megamall", "EDSA cor Julia Vargas", city="Mandaluyong"),
+    ]
+    report = find_duplicates(records)
+    assert [[member["id"] for member in cluster["branches"]] for cluster in report["clusters"]] == [[1, 2, 3]]
+    (cluster,) = report["clusters"]
+    assert cluster["company_ids"] == [1, 2]
+    assert cluster["min_similarity"] >= report["threshold"]
+
+
+def test_blank_records_are_counted_not_clustered():
+    records = [branch(1, "", ""), branch(2, "", ""), branch(3, "Main", "1 Rizal St")]
+    for record in records[:2]:
+        record["city"] = ""
+    report = find_duplicates(records)
+    assert report["blank_records"] == 2
+    assert report["clusters"] == []
+
+
+def test_oversized_buckets_are_skipped():
+    records = [branch(index, "Same Branch", "1 Same Street") for index in range(6)]
+    report = find_duplicates(records, max_bucket=3)
+    assert report["skipped_buckets"] > 0
+    assert report["clusters"] == []
+
+
+def test_clusters_join_transitively():
+    clusters = _Clusters()
+    clusters.union(4, 2)
+    clusters.union(2, 9)
+    clusters.union(7, 8)
+    clusters.find(5)
+    assert sorted(clusters.groups()) == [[2, 4, 9], [7, 8]]
@@ -0,0 +1,89 @@
+from marga_tools.firestore import fs_fields, fs_parse_doc, iter_collection
+from marga_tools.optimistic import OptimisticWriter, three_way_merge
+
+API_KEY = "local"
+
+
+def test_merge_keeps_their_edits_to_fields_we_left_alone():
+    base = {"name": "Ana", "phone": "1", "city": "Manila"}
+    ours = {"name": "Ana Cruz", "phone": "1", "city": "Manila"}
+    theirs = {"name": "Ana", "phone": "2", "city": "Manila"}
+    assert three_way_merge(base, ours, theirs) == ({"name": "Ana Cruz", "phone": "2", "city": "Manila"}, [])
+
+
+def test_merge_reports_fields_both_sides_changed():
+    merged, clashes = three_way_merge({"name": "Ana", "role": "staff"}, {"name": "Ana Cruz", "role": "staff"}, {"name": "Ana C.", "role": "admin"})
+    assert merged == {"name": "Ana Cruz", "role": "admin"}
+    assert clashes == ["name"]
+
+
+def test_merge_same_change_on_both_sides_is_no_clash():
+    assert three_way_merge({"name": "Ana"}, {"name": "Ana Cruz"}, {"name": "Ana Cruz"}) == ({"name": "Ana Cruz"}, [])
+
+
+def test_merge_deletions_and_additions():
+    base = {"a": 1, "b": 2, "c": 3}
+    ours = {"a": 1, "c": 3, "new": 4}
+    theirs = {"a": 1, "b": 2, "c": 30, "theirs": 5}
+    assert three_way_merge(base, ours, theirs) == ({"a": 1, "c": 30, "theirs": 5, "new": 4}, [])
+
+
+def test_merge_field_we_dropped_but_they_changed_is_kept():
+    merged, clashes = three_way_merge({"a": 1, "b": 2}, {"a": 1}, {"a": 1, "b": 20})
+    assert merged == {"a": 1, "b": 20}
+    assert clashes == []
+
+
+def plain(doc):
+    return {key: value for key, value in doc.items() if key != "_docId"}
+
+
+def fetch(base_url, collection):
+    update_times = {}
+    docs = {doc["_docId"]: plain(doc) for doc in iter_collection(base_url, API_KEY, collection, update_times=update_times)}
+    return docs, update_times
+
+
+def stored(store, collection, doc_id):
+    doc = store.get(collection, doc_id)
+    return None if doc is None else plain(fs_parse_doc({"name": f"{collection}/{doc_id}", "fields": doc["fields"]}))
+
+
+def test_conflicting_writes_are_merged_and_retried(standin):
+    store, base_url = standin
+    for doc_id in ("1", "2", "3", "4"):
+        store.put("tbl_employee", doc_id, fs_fields({"name": f"emp {doc_id}", "phone": "0"}))
+    bases, update_times = fetch(base_url, "tbl_employee")
+    writer = OptimisticWriter(base_url, API_KEY, "tbl_employee", update_times, bases)
+
+    # The app edits 2 and 3 and deletes 4 while the script computes.
+    store.put("tbl_employee", "2", fs_fields({"name": "emp 2", "phone": "222"}))
+    store.put("tbl_employee", "3", fs_fields({"name": "app name", "phone": "0"}))
+    store.apply({"delete": "projects/standin/databases/(default)/documents/tbl_employee/4"})
+
+    results = {doc_id: writer.write(doc_id, {**bases[doc_id], "name": f"script {doc_id}"}) for doc_id in ("1", "2", "3", "4")}
+    results["5"] = writer.write("5", {"name": "script 5", "phone": "5"})
+    assert results == {"1": True, "2": False, "3": False, "4": False, "5": True}
+
+    written = {}
+    report = writer.retry(lambda doc_id, merged, current: plain(merged), on_written=written.__setitem__)
+    assert report.conflicts == 3
+    assert sorted(report.rewritten) == ["2", "3"]
+    assert report.deleted == ["4"]
+    assert report.overridden == {"3": ["name"]}
+    assert stored(store, "tbl_employee", "2") == {"name": "script 2", "phone": "222"}
+    assert stored(store, "tbl_employee", "3") == {"name": "script 3", "phone": "0"}
+    assert stored(store, "tbl_employee", "4") is None
+    assert written["2"] == {"name": "script 2", "phone": "222"}
+
+
+def test_finish_returning_none_counts_as_already_current(standin):
+    store, base_url = standin
+    store.put("tbl_employee", "1", fs_fields({"name": "a"}))
+    bases, update_times = fetch(base_url, "tbl_employee")
+    writer = OptimisticWriter(base_url, API_KEY, "tbl_employee", update_times, bases)
+    store.put("tbl_employee", "1", fs_fields({"name": "b"}))
+    assert not writer.write("1", {"name": "b"})
+    report = writer.retry(lambda doc_id, merged, current: None if plain(merged) == plain(current) else plain(merged))
+    assert report.already_current == ["1"]
+    assert report.rewritten == []
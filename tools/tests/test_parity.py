@@ -0,0 +1,85 @@
+from array import array
+
+from marga_tools.firestore import fs_fields
+from marga_tools.parity import DumpSide, ParityChecker
+from marga_tools.synchash import SYNC_HASH_FIELD, stamp, sync_hash
+
+API_KEY = "local"
+COLUMNS = ["id", "name", "branch"]
+
+
+def row(doc_id):
+    return {"id": doc_id, "name": f"name {doc_id}", "branch": doc_id % 7}
+
+
+def dump_side(ids):
+    rows = [row(doc_id) for doc_id in ids]
+    return DumpSide(array("q", ids), array("q", (sync_hash(item) for item in rows)), COLUMNS)
+
+
+def put(store, fields, doc_id=None):
+    store.put("tbl_branchinfo", str(fields.get("id") if doc_id is None else doc_id), fs_fields(fields))
+
+
+def checker(base_url, dump, **kwargs):
+    return ParityChecker(base_url, API_KEY, "tbl_branchinfo", dump, drill_rows=20, **kwargs)
+
+
+def seeded(store, ids):
+    for doc_id in ids:
+        put(store, stamp(row(doc_id), "test"))
+
+
+def test_in_sync_collection_costs_only_aggregations(standin):
+    store, base_url = standin
+    seeded(store, range(1, 1001))
+    report = checker(base_url, dump_side(list(range(1, 1001)))).run("tbl_branchinfo", buckets=8)
+    assert report.in_sync
+    assert (report.firestore_docs, report.unranged_docs) == (1000, 0)
+    # 8 buckets, the two spans outside the dump's ids, and the whole-collection COUNT.
+    assert report.aggregations == 8 + 2 + 1
+    assert (report.drilled_ranges, report.fetched_docs) == (0, 0)
+
+
+def test_drills_only_into_the_ranges_that_differ(standin):
+    store, base_url = standin
+    seeded(store, range(1, 1001))
+    put(store, stamp({**row(500), "name": "renamed"}, "test"))
+    del store.collections["tbl_branchinfo"]["700"]
+    put(store, {**row(850), SYNC_HASH_FIELD: None})
+    # Beyond the dump's id span on both sides.
+    seeded(store, [0, 5000])
+    # No numeric id: no range sees these, only the whole-collection COUNT.
+    put(store, {"id": "B-12", "name": "text id"}, "B-12")
+    put(store, {"name": "no id"}, "orphan")
+
+    report = checker(base_url, dump_side(list(range(1, 1001)))).run("tbl_branchinfo", buckets=8)
+    assert not report.in_sync
+    assert (report.different, report.missing, report.unstamped) == ([500], [700], [850])
+    assert sorted(report.extra) == [0, 5000]
+    assert report.firestore_docs == 1000 - 1 + 2 + 2
+    assert report.unranged_docs == 2
+    # Only a few small ranges around the three changed ids were read.
+    assert report.fetched_docs < 100
+    summary = report.to_dict()
+    assert (summary["missing"], summary["extra"], summary["unranged_docs"]) == ([[700, 700]], [[0, 0], [5000, 5000]], 2)
+
+
+def test_verify_fields_recomputes_hashes_instead_of_trusting_stamps(standin):
+    store, base_url = standin
+    seeded(store, range(1, 51))
+    # Edited after stamping: the stamp still matches the dump.
+    put(store, {**stamp(row(20), "test"), "name": "edited"})
+    dump = dump_side(list(range(1, 51)))
+    assert checker(base_url, dump).run("tbl_branchinfo", buckets=4).in_sync
+    report = checker(base_url, dump, verify_fields=True).run("tbl_branchinfo", buckets=4)
+    assert report.different == [20]
+    assert report.fetched_docs == 50
+
+
+def test_empty_dump_reports_every_document_as_extra(standin):
+    store, base_url = standin
+    seeded(store, [3, 4])
+    report = checker(base_url, dump_side([])).run("tbl_branchinfo")
+    assert sorted(report.extra) == [3, 4]
+    assert (report.firestore_docs, report.unranged_docs) == (2, 0)
@@ -0,0 +1,57 @@
+import base64
+
+from marga_tools.passwords import PASSWORD_ALGO, PASSWORD_ITERATIONS, hash_password, rehash_password, stored_salt
+from marga_tools.synchash import is_current, stamp
+
+
+def test_hash_password_is_stable_for_a_given_salt():
+    salt = bytes(range(16))
+    first = hash_password("secret", salt)
+    assert first == hash_password("secret", salt)
+    assert first["password_salt"] == base64.b64encode(salt).decode("ascii")
+    assert (first["password_iterations"], first["password_algo"]) == (PASSWORD_ITERATIONS, PASSWORD_ALGO)
+    assert hash_password("other", salt)["password_hash"] != first["password_hash"]
+
+
+def test_hash_password_without_a_salt_draws_a_fresh_one():
+    assert hash_password("secret")["password_salt"] != hash_password("secret")["password_salt"]
+
+
+def test_stored_salt_requires_the_same_algorithm_and_iterations():
+    doc = hash_password("secret")
+    assert stored_salt(doc) == base64.b64decode(doc["password_salt"])
+    assert stored_salt({**doc, "password_iterations": PASSWORD_ITERATIONS - 1}) is None
+    assert stored_salt({**doc, "password_algo": "md5"}) is None
+    assert stored_salt({**doc, "password_salt": "not base64!"}) is None
+    assert stored_salt({**doc, "password_salt": base64.b64encode(b"short").decode()}) is None
+    assert stored_salt(None) is None
+    assert stored_salt({}) is None
+
+
+def test_unchanged_password_keeps_its_salt():
+    doc = {"email": "ana@marga.example", **hash_password("secret")}
+    assert rehash_password("secret", doc) == {key: doc[key] for key in ("password_hash", "password_salt", "password_iterations", "password_algo")}
+
+
+def test_changed_password_rotates_the_salt():
+    doc = hash_password("secret")
+    fields = rehash_password("new secret", doc)
+    assert fields["password_salt"] != doc["password_salt"]
+    assert fields != hash_password("new secret", stored_salt(doc))
+
+
+def test_salt_without_a_matching_hash_is_not_reused():
+    doc = hash_password("secret")
+    for tampered in ({**doc, "password_hash": ""}, {key: value for key, value in doc.items() if key != "password_hash"}):
+        assert rehash_password("secret", tampered)["password_salt"] != doc["password_salt"]
+
+
+def test_new_documents_get_a_fresh_salt():
+    assert rehash_password("secret", None)["password_salt"] != rehash_password("secret", None)["password_salt"]
+
+
+def test_unchanged_password_keeps_the_sync_hash():
+    doc = {"id": 7, **hash_password("secret")}
+    stamped = stamp(dict(doc), "test")
+    assert is_current(stamped, {"id": 7, **rehash_password("secret", stamped)})
+    assert not is_current(stamped, {"id": 7, **rehash_password("changed", stamped)})
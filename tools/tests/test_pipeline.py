@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from marga_tools.pipeline import Pipeline
+
+
+class Boom(RuntimeError):
+    pass
+
+
+def finishes(run, timeout=10.0):
+    """Call `run()` on a thread; fail instead of hanging if it deadlocks. Returns (result, error)."""
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = run()
+        except BaseException as err:
+            outcome["error"] = err
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "pipeline did not finish"
+    return outcome.get("result"), outcome.get("error")
+
+
+def no_pipeline_threads_left(name):
+    deadline = time.monotonic() + 5
+    while any(thread.name.startswith(f"{name}-") for thread in threading.enumerate()):
+        assert time.monotonic() < deadline, "pipeline threads still running"
+        time.sleep(0.01)
+
+
+def test_single_worker_stages_keep_order():
+    seen = []
+    result, error = finishes(lambda: Pipeline(range(500), maxsize=4).stage("double", lambda x: 2 * x).stage("inc", lambda x: x + 1).run(seen.append))
+    assert error is None
+    assert result == 500
+    assert seen == [2 * x + 1 for x in range(500)]
+
+
+def test_multi_worker_stages_deliver_everything():
+    seen = []
+    result, error = finishes(lambda: Pipeline(range(300), maxsize=2).stage("square", lambda x: x * x, workers=4).stage("keep", lambda x: x, workers=3).run(seen.append))
+    assert error is None
+    assert result == 300
+    assert sorted(seen) == [x * x for x in range(300)]
+
+
+def test_none_drops_the_item():
+    seen = []
+    finishes(lambda: Pipeline(range(20)).stage("odd", lambda x: x if x % 2 else None, workers=2).run(seen.append))
+    assert sorted(seen) == list(range(1, 20, 2))
+
+
+def test_no_stages_and_no_sink():
+    assert finishes(lambda: Pipeline(range(7)).run())[0] == 7
+    assert finishes(lambda: Pipeline([]).stage("noop", lambda x: x).run())[0] == 0
+
+
+def failing_at(target):
+    def func(x):
+        if x == target:
+            raise Boom(f"stage failed on {x}")
+        return x
+
+    return func
+
+
+@pytest.mark.parametrize("failing", ["first", "middle", "last"])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_stage_error_reaches_the_caller_without_deadlock(failing, workers):
+    stages = {name: (lambda x: x) for name in ("first", "middle", "last")}
+    stages[failing] = failing_at(50)
+    pipeline = Pipeline(range(10_000), maxsize=2, name=f"fail-{failing}-{workers}")
+    for name, func in stages.items():
+        pipeline.stage(name, func, workers=workers)
+    _, error = finishes(pipeline.run)
+    assert isinstance(error, Boom)
+    assert str(error) == "stage failed on 50"
+    no_pipeline_threads_left(f"fail-{failing}-{workers}")
+
+
+def test_source_error_reaches_the_caller():
+    def source():
+        yield from range(10)
+        raise Boom("source failed")
+
+    _, error = finishes(Pipeline(source(), maxsize=1, name="source-fail").stage("keep", lambda x: x).run)
+    assert isinstance(error, Boom)
+    no_pipeline_threads_left("source-fail")
+
+
+def test_consumer_stopping_early_joins_cleanly():
+    produced = []
+
+    def source():
+        for x in range(100_000):
+            produced.append(x)
+            yield x
+
+    def sink(item):
+        if item == 10:
+            raise Boom("enough")
+
+    _, error = finishes(lambda: Pipeline(source(), maxsize=2, name="early").stage("keep", lambda x: x, workers=2).run(sink))
+    assert isinstance(error, Boom)
+    # Bounded queues keep the source from running far ahead of the sink.
+    assert len(produced) < 100
+    no_pipeline_threads_left("early")
+
+
+def test_first_error_wins():
+    def slow_fail(x):
+        if x == 0:
+            time.sleep(0.2)
+            raise Boom("late")
+        return x
+
+    def fast_fail(x):
+        if x == 1:
+            raise Boom("early")
+        return x
+
+    _, error = finishes(Pipeline(range(5), name="first-error").stage("slow", slow_fail, workers=2).stage("fast", fast_fail).run)
+    assert str(error) == "early"
+    no_pipeline_threads_left("first-error")
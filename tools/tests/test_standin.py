@@ -0,0 +1,217 @@
+import json
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from marga_tools import firestore
+from marga_tools.firestore import BulkWriter, fs_fields, iter_collection, run_aggregation, run_query
+from marga_tools.standin import DocumentStore, Faults, WriteError, seed_synthetic, start_server
+
+API_KEY = "local"
+TOOLS = Path(__file__).resolve().parents[1]
+
+
+def send(url, method="GET", payload=None):
+    """(HTTP status, decoded JSON body), without the client's retries."""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as err:
+        return err.code, json.loads(err.read() or b"null")
+
+
+def name(base_url, collection, doc_id):
+    return f"{base_url.split('/v1/', 1)[1]}/{collection}/{doc_id}"
+
+
+def update(base_url, collection, doc_id, **fields):
+    return {"update": {"name": name(base_url, collection, doc_id), "fields": fs_fields(fields)}}
+
+
+def test_get_patch_and_delete_with_preconditions(standin):
+    store, base_url = standin
+    url = f"{base_url}/tbl_employee/1?key={API_KEY}"
+    assert send(url)[0] == 404
+    status, created = send(url + "&currentDocument.exists=false", "PATCH", {"fields": fs_fields({"name": "Ana", "rate": 1.5})})
+    assert status == 200 and created["fields"]["name"] == {"stringValue": "Ana"}
+    status, body = send(url + "&currentDocument.exists=false", "PATCH", {"fields": {}})
+    assert (status, body["error"]["status"]) == (409, "ALREADY_EXISTS")
+
+    # updateMask touches only the listed fields; a listed field missing from the body is removed.
+    status, masked = send(url + "&updateMask.fieldPaths=name&updateMask.fieldPaths=gone", "PATCH", {"fields": fs_fields({"name": "Ana Cruz", "rate": 9.0})})
+    assert status == 200
+    assert masked["fields"] == fs_fields({"name": "Ana Cruz", "rate": 1.5})
+    assert masked["updateTime"] > created["updateTime"] and masked["createTime"] == created["createTime"]
+
+    stale = f"{url}&currentDocument.updateTime={created['updateTime']}"
+    assert send(stale, "DELETE")[1]["error"]["status"] == "FAILED_PRECONDITION"
+    assert send(f"{url}&currentDocument.updateTime={masked['updateTime']}", "DELETE")[0] == 200
+    assert store.get("tbl_employee", "1") is None
+    assert send(url + "&currentDocument.exists=true", "DELETE")[1]["error"]["status"] == "NOT_FOUND"
+
+
+def test_listing_pages_in_id_order_with_a_field_mask(standin):
+    store, base_url = standin
+    for doc_id in ("b", "a", "d", "c", "e"):
+        store.put("c", doc_id, fs_fields({"id": doc_id, "big": "x" * 50}))
+    status, first = send(f"{base_url}/c?key={API_KEY}&pageSize=2&mask.fieldPaths=id")
+    assert status == 200
+    assert [doc["name"].rsplit("/", 1)[1] for doc in first["documents"]] == ["a", "b"]
+    assert first["documents"][0]["fields"] == {"id": {"stringValue": "a"}}
+    # A document added behind the cursor is not repeated; one ahead of it is seen.
+    store.put("c", "aa", fs_fields({"id": "aa"}))
+    store.put("c", "cc", fs_fields({"id": "cc"}))
+    ids = [doc["_docId"] for doc in iter_collection(base_url, API_KEY, "c", page_size=2)]
+    assert ids == ["a", "aa", "b", "c", "cc", "d", "e"]
+    _, last = send(f"{base_url}/c?key={API_KEY}&pageSize=10")
+    assert "nextPageToken" not in last
+
+
+def test_queries_filter_order_and_limit(standin):
+    store, base_url = standin
+    for doc_id in range(1, 11):
+        # Zero-padded, since results come back in document-name order.
+        store.put("t", f"{doc_id:02d}", fs_fields({"n": doc_id, "tags": ["even" if doc_id % 2 == 0 else "odd"], "branch": None if doc_id == 3 else doc_id % 3}))
+
+    def ids(where=None, **query):
+        docs = run_query(base_url, API_KEY, {"from": [{"collectionId": "t"}], **({"where": where} if where else {}), **query})
+        return [doc["n"] for doc in docs]
+
+    def field(path, op, value):
+        return {"fieldFilter": {"field": {"fieldPath": path}, "op": op, "value": fs_fields({"v": value})["v"]}}
+
+    assert ids(field("n", "GREATER_THAN_OR_EQUAL", 8)) == [8, 9, 10]
+    assert ids({"compositeFilter": {"op": "AND", "filters": [field("n", "GREATER_THAN", 2), field("n", "LESS_THAN", 5)]}}) == [3, 4]
+    assert ids({"compositeFilter": {"op": "OR", "filters": [field("n", "EQUAL", 1), field("n", "EQUAL", 10)]}}) == [1, 10]
+    assert ids(field("n", "IN", [2, 4, 99])) == [2, 4]
+    assert ids(field("tags", "ARRAY_CONTAINS", "even")) == [2, 4, 6, 8, 10]
+    assert ids({"unaryFilter": {"field": {"fieldPath": "branch"}, "op": "IS_NULL"}}) == [3]
+    assert ids(orderBy=[{"field": {"fieldPath": "n"}, "direction": "DESCENDING"}], offset=1, limit=3) == [9, 8, 7]
+    assert ids(field("missing", "EQUAL", 1)) == []
+
+
+def test_aggregations_count_sum_and_avg(standin):
+    store, base_url = standin
+    for doc_id, value in enumerate([1, 2, 3.5, "text", None]):
+        store.put("t", str(doc_id), fs_fields({"v": value, "big": 2 ** 62}))
+    query = {"from": [{"collectionId": "t"}]}
+    values = run_aggregation(base_url, API_KEY, query, [{"alias": "n", "count": {}}, {"alias": "s", "sum": {"field": {"fieldPath": "v"}}}, {"alias": "a", "avg": {"field": {"fieldPath": "v"}}}])
+    # Only numbers count towards sum and avg; a double makes the sum a double.
+    assert values == {"n": 5, "s": 6.5, "a": 6.5 / 3}
+    # int64 overflow turns the sum into a double too, like Firestore.
+    assert run_aggregation(base_url, API_KEY, query, [{"alias": "s", "sum": {"field": {"fieldPath": "big"}}}])["s"] == float(5 * 2 ** 62)
+    assert run_aggregation(base_url, API_KEY, {"from": [{"collectionId": "none"}]}, [{"alias": "a", "avg": {"field": {"fieldPath": "v"}}}]) == {"a": None}
+
+
+def test_commit_is_all_or_nothing_and_batch_write_is_not(standin):
+    store, base_url = standin
+    store.put("c", "1", fs_fields({"v": 1}))
+    writes = [update(base_url, "c", "2", v=2), {**update(base_url, "c", "1", v=9), "currentDocument": {"exists": False}}]
+    status, body = send(f"{base_url}:commit?key={API_KEY}", "POST", {"writes": writes})
+    assert (status, body["error"]["status"]) == (409, "ALREADY_EXISTS")
+    assert store.ids("c") == ["1"]
+
+    status, body = send(f"{base_url}:batchWrite?key={API_KEY}", "POST", {"writes": writes})
+    assert status == 200
+    assert body["status"][0] == {} and body["status"][1]["code"] == 6
+    assert store.ids("c") == ["1", "2"]
+    assert store.get("c", "1")["fields"] == fs_fields({"v": 1})
+
+    status, body = send(f"{base_url}:commit?key={API_KEY}", "POST", {"writes": [update(base_url, "c", "3", v=3), {"delete": name(base_url, "c", "2")}]})
+    assert status == 200
+    # One commit, one timestamp.
+    assert body["writeResults"][0]["updateTime"] == body["writeResults"][1]["updateTime"] == body["commitTime"]
+    assert store.ids("c") == ["1", "3"]
+
+
+def test_batch_get_reports_missing_documents_and_applies_the_mask(standin):
+    store, base_url = standin
+    store.put("c", "1", fs_fields({"a": 1, "b": 2}))
+    status, rows = send(f"{base_url}:batchGet?key={API_KEY}", "POST", {"documents": [name(base_url, "c", "1"), name(base_url, "c", "2")], "mask": {"fieldPaths": ["a"]}})
+    assert status == 200
+    assert rows[0]["found"]["fields"] == {"a": {"integerValue": "1"}}
+    assert rows[1]["missing"] == name(base_url, "c", "2")
+
+
+def test_store_rejects_unsupported_writes_and_bad_names():
+    store = DocumentStore()
+    with pytest.raises(WriteError):
+        store.apply({"transform": {}})
+    with pytest.raises(WriteError):
+        store.apply({"update": {"name": "no-collection", "fields": {}}})
+
+
+def test_injected_faults_are_seeded():
+    def statuses(seed):
+        server = start_server(DocumentStore(), Faults(error_rate=0.3, throttle_rate=0.2, seed=seed))
+        try:
+            return [server.draw_fault()[1] for _ in range(200)]
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    first = statuses(1)
+    assert first == statuses(1) != statuses(2)
+    assert {429, 503, None} == set(first)
+    assert 0.35 < first.count(None) / len(first) < 0.65
+
+
+def test_bulk_writer_gets_through_throttling_and_errors(monkeypatch):
+    monkeypatch.setattr(firestore, "_backoff", lambda attempt: None)
+    store = DocumentStore()
+    server = start_server(store, Faults(latency_ms=1, jitter_ms=1, error_rate=0.1, throttle_rate=0.1, seed=3))
+    try:
+        with BulkWriter(server.base_url, API_KEY, batch_size=10, workers=4) as writer:
+            for doc_id in range(100):
+                writer.update("t", str(doc_id), {"n": doc_id})
+        assert writer.failures == []
+        assert len(store.ids("t")) == 100
+        assert server.stats.get("status 429", 0) and server.stats.get("status 503", 0)
+        _, stats = send(server.base_url.split("/v1/", 1)[0] + "/_standin/stats")
+        assert stats["collections"] == {"t": 100}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_max_qps_throttles_past_the_rate():
+    server = start_server(DocumentStore(), Faults(max_qps=5))
+    try:
+        statuses = [server.draw_fault()[1] for _ in range(8)]
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert statuses == [None] * 5 + [429] * 3
+
+
+def test_seed_synthetic_and_the_command_line(tmp_path):
+    store = DocumentStore()
+    seed_synthetic(store, 25)
+    assert len(store.ids("tbl_employee")) == 25
+
+    process = subprocess.Popen(
+        [sys.executable, "-m", "marga_tools.standin", "--port", "0", "--seed-synthetic", "30"],
+        cwd=TOOLS, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    try:
+        banner = process.stdout.readline()
+        assert "(30 docs loaded)" in banner
+        base_url = banner.split(" on ", 1)[1].split(" ", 1)[0]
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                assert len(list(iter_collection(base_url, API_KEY, "tbl_employee"))) == 30
+                break
+            except OSError:
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
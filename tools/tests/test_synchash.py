@@ -0,0 +1,37 @@
+from marga_tools.synchash import SYNC_HASH_BITS, is_current, stamp, sync_hash
+
+
+def test_sync_hash_is_stable_and_field_order_independent():
+    fields = {"id": 7, "name": "Ana", "modules": ["billing", "reports"], "nested": {"b": 1, "a": 2}}
+    reordered = {"nested": {"a": 2, "b": 1}, "modules": ["billing", "reports"], "name": "Ana", "id": 7}
+    assert sync_hash(fields) == sync_hash(reordered) == sync_hash(dict(fields))
+    assert 0 <= sync_hash(fields) < 2**SYNC_HASH_BITS
+    # List order is data, not layout.
+    assert sync_hash({**fields, "modules": ["reports", "billing"]}) != sync_hash(fields)
+
+
+def test_sync_hash_normalises_nulls_integral_floats_and_bookkeeping():
+    fields = {"id": 7, "rate": 3}
+    assert sync_hash({"id": 7.0, "rate": 3, "note": None}) == sync_hash(fields)
+    assert sync_hash({**fields, "_docId": "7", "_sync_hash": 1, "_sync_source": "x"}) == sync_hash(fields)
+    assert sync_hash({**fields, "rate": 3.5}) != sync_hash(fields)
+
+
+def test_sync_hash_excludes_volatile_fields():
+    before = {"id": 7, "name": "Ana", "updated_at": "2024-01-01"}
+    after = {**before, "updated_at": "2024-06-01"}
+    assert sync_hash(before) != sync_hash(after)
+    assert sync_hash(before, exclude=("updated_at",)) == sync_hash(after, exclude=("updated_at",))
+
+
+def test_stamp_and_is_current():
+    volatile = ("updated_at",)
+    written = stamp({"id": 7, "name": "Ana", "updated_at": "t1"}, "test", exclude=volatile)
+    assert written["_sync_source"] == "test"
+    assert is_current(written, {"id": 7, "name": "Ana", "updated_at": "t2"}, exclude=volatile)
+    assert not is_current(written, {"id": 7, "name": "Ana Cruz", "updated_at": "t2"}, exclude=volatile)
+    assert not is_current(None, {"id": 7})
+    scoped = stamp({"id": 7}, "patch", scope="login")
+    assert "_sync_login_hash" in scoped and "_sync_hash" not in scoped
+    assert is_current(scoped, {"id": 7}, scope="login")
+    assert not is_current(scoped, {"id": 7})
@@ -0,0 +1,87 @@
+import zipfile
+
+from marga_tools.mysqldump import iter_typed_rows, parse_insert_values
+from marga_tools.scripts import load_script
+from marga_tools.synthetic import (
+    AWKWARD_TEXT,
+    BRANCH_COLUMNS,
+    EMPLOYEE_COLUMNS,
+    sql_literal,
+    synthetic_branches,
+    synthetic_employees,
+    write_final_users_xlsx,
+    write_fixtures,
+    write_mysql_dump,
+    write_payroll_workbook,
+    write_xlsx,
+)
+
+
+def test_generators_are_seeded():
+    assert synthetic_employees(50) == synthetic_employees(50)
+    assert synthetic_employees(50, seed=1) != synthetic_employees(50)
+    assert synthetic_employees(10) == synthetic_employees(50)[:10]
+    assert [branch["id"] for branch in synthetic_branches(3, first_id=100)] == [100, 101, 102]
+    assert all(set(employee) == {name for name, _ in EMPLOYEE_COLUMNS} for employee in synthetic_employees(20))
+    assert all(set(branch) == {name for name, _ in BRANCH_COLUMNS} for branch in synthetic_branches(20))
+
+
+def test_fixtures_are_byte_identical_for_the_same_seed(tmp_path):
+    first = write_fixtures(tmp_path / "a", employees=40, branches=60, roster=30, payroll_rows=10)
+    second = write_fixtures(tmp_path / "b", employees=40, branches=60, roster=30, payroll_rows=10)
+    for name, path in first.items():
+        assert path.read_bytes() == second[name].read_bytes(), name
+    other = write_fixtures(tmp_path / "c", employees=40, branches=60, roster=30, payroll_rows=10, seed=1)
+    assert other["dump"].read_bytes() != first["dump"].read_bytes()
+
+
+def test_sql_literal_escapes_like_mysqldump():
+    for text in AWKWARD_TEXT:
+        assert parse_insert_values(f"({sql_literal(text)},{sql_literal(None)},{sql_literal(True)},{sql_literal(2.5)})") == [[text, None, 1, 2.5]]
+
+
+def test_dump_parses_back_to_the_generated_rows(tmp_path):
+    path = tmp_path / "dump.sql"
+    counts = write_mysql_dump(path, employees=120, branches=70, rows_per_insert=25, first_branch_id=500)
+    assert (counts["tbl_employee"], counts["tbl_branchinfo"], counts["bytes"]) == (120, 70, path.stat().st_size)
+    employees = [row for _, row in iter_typed_rows(path, ["tbl_employee"])]
+    assert employees == synthetic_employees(120)
+    # Awkward strings survive escaping.
+    assert {employee["remarks"] for employee in employees} - {None} <= set(AWKWARD_TEXT)
+    branches = [row for _, row in iter_typed_rows(path, ["tbl_branchinfo"])]
+    assert [branch["id"] for branch in branches] == list(range(500, 570))
+    assert branches == synthetic_branches(70, first_id=500)
+
+
+def test_xlsx_cells_read_back_by_position_and_reference(tmp_path):
+    path = tmp_path / "sheet.xlsx"
+    write_xlsx(path, [["a", None, 3], [None, "b & <c>", 2.5]], "Data")
+    with zipfile.ZipFile(path) as zf:
+        sheet = zf.read("xl/worksheets/sheet1.xml").decode()
+        assert 'name="Data"' in zf.read("xl/workbook.xml").decode()
+        assert "b &amp; &lt;c&gt;" in zf.read("xl/sharedStrings.xml").decode()
+        assert {info.date_time for info in zf.infolist()} == {(1980, 1, 1, 0, 0, 0)}
+    assert '<c r="B1"/>' in sheet and '<c r="C1"><v>3</v></c>' in sheet and '<c r="C2"><v>2.5</v></c>' in sheet
+
+
+def test_final_users_roster_parses_with_the_promote_reader(tmp_path):
+    employees = synthetic_employees(200)
+    path = tmp_path / "final.xlsx"
+    write_final_users_xlsx(path, employees, rows=100, match_rate=0.5)
+    roster = load_script("tools/promote-final-users-to-tbl-employee.py").parse_xlsx(str(path))
+    assert len(roster) == 100
+    known = {employee["lastname"] for employee in employees}
+    matched = [record for record in roster if record["lastname"] in known]
+    # About half the rows name a generated employee; the rest are new hires.
+    assert 30 < len(matched) < 70
+    assert all(record["lastname"].startswith("Newhire") for record in roster if record not in matched)
+
+
+def test_payroll_workbook_layout(tmp_path):
+    path = tmp_path / "payroll.xlsx"
+    write_payroll_workbook(path, synthetic_employees(5), rows=12)
+    with zipfile.ZipFile(path) as zf:
+        sheet = zf.read("xl/worksheets/sheet1.xml").decode()
+    # Title row, header row, then one row per employee (cycling through them).
+    assert sheet.count("<row ") == 14
+    assert '<row r="3"><c r="A3"><v>1</v></c>' in sheet
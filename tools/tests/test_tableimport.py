@@ -0,0 +1,86 @@
+import pytest
+
+from marga_tools.synchash import SYNC_HASH_FIELD
+from marga_tools.tableimport import TableConfig, import_tables
+
+DUMP = """CREATE TABLE `tbl_area` (
+  `id` int(11) NOT NULL,
+  `name` varchar(50) DEFAULT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+INSERT INTO `tbl_area` VALUES (1,'North'),(2,'South'),(3,'East');
+CREATE TABLE `tbl_branchinfo` (
+  `id` int(11) NOT NULL,
+  `branchname` varchar(50) DEFAULT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=latin1;
+INSERT INTO `tbl_branchinfo` VALUES (10,'Main'),(9,'Annex'),(11,'Depot');
+"""
+
+
+@pytest.fixture
+def dump(tmp_path):
+    path = tmp_path / "dump.sql"
+    path.write_text(DUMP, encoding="utf-8")
+    return path
+
+
+def configs():
+    return [TableConfig("tbl_area"), TableConfig("tbl_branchinfo")]
+
+
+def run(dump, stamps=None, max_writes=None):
+    written = []
+    stats = import_tables(dump, configs(), lambda collection, doc_id, fields: written.append((collection, doc_id, fields)), stamps, max_writes)
+    return written, stats
+
+
+def stamps_of(written):
+    stamps = {}
+    for collection, doc_id, fields in written:
+        stamps.setdefault(collection, {})[doc_id] = {SYNC_HASH_FIELD: fields[SYNC_HASH_FIELD]}
+    return stamps
+
+
+def test_without_stamps_every_row_is_written(dump):
+    written, stats = run(dump)
+    assert len(written) == 6
+    assert all(SYNC_HASH_FIELD in fields for _, _, fields in written)
+    assert stats["tbl_area"].written == 3 and stats["tbl_branchinfo"].written == 3
+
+
+def test_docs_matching_their_stamp_are_skipped(dump):
+    first, _ = run(dump)
+    stamps = stamps_of(first)
+    stamps["tbl_area"]["2"][SYNC_HASH_FIELD] += 1
+    written, stats = run(dump, stamps)
+    assert [(collection, doc_id) for collection, doc_id, _ in written] == [("tbl_area", "2")]
+    assert stats["tbl_area"].in_sync == 2 and stats["tbl_branchinfo"].in_sync == 3
+
+
+def test_max_writes_ranks_new_before_changed_then_table_and_id(dump):
+    first, _ = run(dump)
+    stamps = stamps_of(first)
+    del stamps["tbl_branchinfo"]["11"]
+    del stamps["tbl_area"]["3"]
+    stamps["tbl_area"]["1"][SYNC_HASH_FIELD] += 1
+    stamps["tbl_branchinfo"]["9"][SYNC_HASH_FIELD] += 1
+    written, stats = run(dump, stamps, max_writes=3)
+    assert [(collection, doc_id) for collection, doc_id, _ in written] == [("tbl_area", "3"), ("tbl_branchinfo", "11"), ("tbl_area", "1")]
+    assert stats["tbl_branchinfo"].deferred == 1 and stats["tbl_area"].deferred == 0
+
+
+def test_max_writes_without_stamps_orders_by_table_then_numeric_id(dump):
+    written, stats = run(dump, max_writes=4)
+    assert [(collection, doc_id) for collection, doc_id, _ in written] == [("tbl_area", "1"), ("tbl_area", "2"), ("tbl_area", "3"), ("tbl_branchinfo", "9")]
+    assert stats["tbl_branchinfo"].deferred == 2
+
+
+def test_a_rerun_picks_up_the_deferred_docs(dump):
+    stamps = {"tbl_area": {}, "tbl_branchinfo": {}}
+    first, _ = run(dump, stamps, max_writes=4)
+    for collection, doc_id, fields in first:
+        stamps[collection][doc_id] = {SYNC_HASH_FIELD: fields[SYNC_HASH_FIELD]}
+    second, stats = run(dump, stamps, max_writes=4)
+    assert [(collection, doc_id) for collection, doc_id, _ in second] == [("tbl_branchinfo", "10"), ("tbl_branchinfo", "11")]
+    assert sum(table.deferred for table in stats.values()) == 0
@@ -0,0 +1,43 @@
+from marga_tools.usernames import UsernameAllocator
+
+
+def test_claim_suffixes_collisions_in_order():
+    allocator = UsernameAllocator()
+    assert [allocator.claim("ana") for _ in range(4)] == ["ana", "ana2", "ana3", "ana4"]
+
+
+def test_claim_skips_names_already_used():
+    allocator = UsernameAllocator(["Ana", "ana2", "ana4"])
+    assert allocator.claim("ana") == "ana3"
+    assert allocator.claim("ana") == "ana5"
+
+
+def test_released_name_is_free_again():
+    allocator = UsernameAllocator(["ana"])
+    allocator.release("ana")
+    assert allocator.claim("ana") == "ana"
+
+
+def test_allocate_falls_back_through_candidates():
+    allocator = UsernameAllocator()
+    record = {"firstname": "Ana", "lastname": "Cruz"}
+    assert allocator.allocate(record, 7) == "ana.cruz"
+    assert allocator.allocate(record, 8) == "ana.cruz2"
+    assert allocator.allocate({}, 9) == "emp9"
+
+
+def test_allocate_keeps_own_current_username():
+    allocator = UsernameAllocator(["ana.cruz"])
+    assert allocator.allocate({"firstname": "Ana", "lastname": "Cruz"}, 7, current_username="ana.cruz") == "ana.cruz"
+
+
+def test_allocate_many_is_independent_of_input_order():
+    entries = [({"firstname": "Ana"}, emp_id, "") for emp_id in (3, 1, 2)]
+    assert UsernameAllocator().allocate_many(entries) == {1: "ana", 2: "ana2", 3: "ana3"}
+    assert UsernameAllocator().allocate_many(reversed(entries)) == {1: "ana", 2: "ana2", 3: "ana3"}
+
+
+def test_allocate_many_releases_current_names_first():
+    allocator = UsernameAllocator(["ana", "ana2"])
+    entries = [({"firstname": "Ana"}, 2, "ana2"), ({"firstname": "Ana"}, 1, "ana")]
+    assert allocator.allocate_many(entries) == {1: "ana", 2: "ana2"}
@@ -0,0 +1,151 @@
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+from marga_tools.synthetic import write_mysql_dump
+from marga_tools.tableimport import TableConfig
+from marga_tools.watch import DUMP_PATTERNS, PAYROLL_PATTERNS, ROSTER_PATTERNS, Watcher, WatchState, classify
+
+PATTERNS = {"dump": DUMP_PATTERNS, "roster": ROSTER_PATTERNS, "payroll": PAYROLL_PATTERNS}
+
+
+@pytest.mark.parametrize(
+    ("name", "kind"),
+    [
+        ("Dump20260218.sql", "dump"),
+        ("DUMP.SQL", "dump"),
+        ("Final Marga Users.xlsx", "roster"),
+        ("payroll-may.xlsx", "payroll"),
+        # Matches both the roster and payroll patterns: payroll wins.
+        ("user_payroll_2026.xlsx", "payroll"),
+        ("~$Final Marga Users.xlsx", ""),
+        (".user-backup.xlsx", ""),
+        ("users.csv", ""),
+        ("notes.txt", ""),
+    ],
+)
+def test_classify(name, kind):
+    assert classify(name, PATTERNS) == kind
+
+
+def test_classify_with_custom_patterns():
+    patterns = {**PATTERNS, "roster": ("roster-*.xlsx",), "payroll": ("*sahod*",)}
+    assert classify("roster-june.xlsx", patterns) == "roster"
+    assert classify("final users.xlsx", patterns) == ""
+    assert classify("Sahod June.xlsx", patterns) == "payroll"
+
+
+class Recording(Watcher):
+    """A watcher whose pipelines only record what they were given."""
+
+    def __init__(self, *args, fail=(), **kwargs):
+        super().__init__(*args, configs=[], settle=0, **kwargs)
+        self.ran = []
+        self.fail = set(fail)
+
+    def _run(self, job):
+        self.ran.append((job.kind, job.path.name))
+        if job.path.name in self.fail:
+            raise RuntimeError(f"cannot read {job.path.name}")
+        return "done"
+
+    run_dump = run_roster = run_payroll = _run
+
+
+def drop(folder, name, text):
+    path = folder / name
+    path.write_text(text, encoding="utf-8")
+    return path
+
+
+def test_settled_files_run_dumps_first_and_ignore_the_rest(tmp_path):
+    drop(tmp_path, "Final Users.xlsx", "roster")
+    drop(tmp_path, "payroll-june.xlsx", "payroll")
+    drop(tmp_path, "dump.sql", "dump")
+    drop(tmp_path, "readme.txt", "ignored")
+    (tmp_path / "nested.sql").mkdir()
+    watcher = Recording(tmp_path)
+    # The first scan only notes sizes; the files have not been seen holding still yet.
+    assert watcher.scan() == []
+    assert watcher.run(interval=0, once=True) == 0
+    assert watcher.ran == [("dump", "dump.sql"), ("roster", "Final Users.xlsx"), ("payroll", "payroll-june.xlsx")]
+    assert {kind: Path(path).name for kind, path in watcher.state.latest.items()} == {"dump": "dump.sql", "roster": "Final Users.xlsx", "payroll": "payroll-june.xlsx"}
+
+
+def test_a_file_still_being_written_waits_to_settle(tmp_path):
+    path = drop(tmp_path, "dump.sql", "part")
+    watcher = Recording(tmp_path)
+    watcher.settle = 60
+    watcher.scan()
+    assert watcher.scan() == []
+    path.write_text("part and more", encoding="utf-8")
+    watcher.settle = 0
+    assert watcher.scan() == []
+    assert [job.path.name for job in watcher.scan()] == ["dump.sql"]
+
+
+def test_same_contents_under_another_name_are_skipped_and_state_survives_a_restart(tmp_path):
+    drop(tmp_path, "dump.sql", "dump one")
+    first = Recording(tmp_path)
+    first.run(interval=0, once=True)
+    shutil.copy(tmp_path / "dump.sql", tmp_path / "dump copy.sql")
+
+    restarted = Recording(tmp_path)
+    restarted.run(interval=0, once=True)
+    assert restarted.ran == []
+    assert len(WatchState(tmp_path / ".marga-watch" / "state.json").seen) == 2
+
+    drop(tmp_path, "dump copy.sql", "dump two")
+    restarted.run(interval=0, once=True)
+    assert restarted.ran == [("dump", "dump copy.sql")]
+
+
+def test_a_failed_file_is_retried_once_it_changes(tmp_path):
+    path = drop(tmp_path, "dump.sql", "bad")
+    watcher = Recording(tmp_path, fail={"dump.sql"})
+    assert watcher.run(interval=0, once=True) == 1
+    [entry] = watcher.state.processed.values()
+    assert (entry["status"], entry["detail"]) == ("failed", "RuntimeError: cannot read dump.sql")
+    assert "dump" not in watcher.state.latest
+
+    watcher.run(interval=0, once=True)
+    assert watcher.ran == [("dump", "dump.sql")]
+    watcher.fail.clear()
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert watcher.run(interval=0, once=True) == 0
+    assert watcher.ran == [("dump", "dump.sql")] * 2
+
+
+def test_planned_files_are_run_again_when_the_watcher_applies(tmp_path):
+    drop(tmp_path, "dump.sql", "dump")
+    Recording(tmp_path).run(interval=0, once=True)
+    applying = Recording(tmp_path, apply=True)
+    applying.run(interval=0, once=True)
+    assert applying.ran == [("dump", "dump.sql")]
+    again = Recording(tmp_path, apply=True)
+    again.run(interval=0, once=True)
+    assert again.ran == []
+
+
+def test_dump_is_planned_then_applied_against_the_standin(standin, tmp_path, monkeypatch):
+    store, base_url = standin
+    monkeypatch.setenv("MARGA_FIRESTORE_BASE_URL", base_url)
+    write_mysql_dump(tmp_path / "dump.sql", employees=5, branches=30)
+    configs = [TableConfig(table="tbl_branchinfo")]
+
+    planning = Watcher(tmp_path, configs, settle=0)
+    assert planning.run(interval=0, once=True) == 0
+    [plan] = (tmp_path / ".marga-watch" / "plans").iterdir()
+    assert plan.name.endswith(".tables.plan.ndjson")
+    assert store.ids("tbl_branchinfo") == []
+    [entry] = planning.state.processed.values()
+    assert "30 ops" in entry["detail"] and "no roster seen yet" in entry["detail"]
+
+    applying = Watcher(tmp_path, configs, apply=True, settle=0)
+    assert applying.run(interval=0, once=True) == 0
+    assert len(store.ids("tbl_branchinfo")) == 30
+    [entry] = applying.state.processed.values()
+    assert entry["applied"] and "30 written" in entry["detail"]